@@ -0,0 +1,46 @@
+import numpy
+import os
+import threading
+from voxel.acquisition.affinity import Placement, format_cpu_list, numa_nodes, parse_cpu_list
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+from voxel.writers.tiff import Writer
+
+if __name__ == '__main__':
+
+    assert parse_cpu_list('0-3,8, 10-11') == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpu_list([0, '2-3']) == [0, 2, 3]
+    assert format_cpu_list([0, 1, 2, 3, 8, 10, 11]) == '0-3,8,10-11'
+
+    nodes = numa_nodes()
+    print(f'numa nodes: { {node: format_cpu_list(cpus) for node, cpus in nodes.items()} }')
+    last_node = list(nodes)[-1]
+    placement = Placement({'camera_0': {'numa_node': last_node, 'grab_cpus': nodes[last_node][0]}})
+
+    # shared buffers are allocated on the node of the camera
+    ring_buffer = SharedRingBuffer((16, 512, 512), dtype='uint16', slot_count=3)
+    placement.place_buffer('camera_0', ring_buffer)
+
+    # the grab thread is pinned from within the thread
+    grab_thread = threading.Thread(target=placement.pin_grab_thread, args=('camera_0',))
+    grab_thread.start()
+    grab_thread.join()
+
+    # the writer process and its compression threads are pinned on start
+    writer = Writer('.')
+    writer.row_count_px = 512
+    writer.column_count_px = 512
+    writer.frame_count_px = 16
+    writer.data_type = 'uint16'
+    writer.cpu_affinity = placement.cpus('camera_0')
+    writer.prepare()
+    writer_cpus = os.sched_getaffinity(writer._service.pid) if hasattr(os, 'sched_getaffinity') else None
+
+    report = placement.report({'camera_0': {'writer': writer._service.pid}})
+    writer.close()
+    ring_buffer.close_and_unlink()
+
+    assert report['camera_0']['grab thread'] == format_cpu_list([nodes[last_node][0]])
+    assert report['camera_0']['cpus'] == format_cpu_list(nodes[last_node])
+    if writer_cpus is not None:
+        assert sorted(writer_cpus) == nodes[last_node], 'writer process was not pinned'
+    print(f'placement: {report}')
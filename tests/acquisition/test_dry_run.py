@@ -0,0 +1,70 @@
+import logging
+import time
+from types import SimpleNamespace
+from voxel.acquisition.dry_run import DryRun, volume
+from voxel.devices.camera.simulated import Camera
+from voxel.devices.filterwheel.simulated import FilterWheel
+from voxel.devices.lasers.simulated import SimulatedLaser
+from voxel.devices.stage.simulated import Stage
+from voxel.writers.tiff import Writer
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    camera = Camera(id='0')
+    camera.width_px = 2048
+    camera.height_px = 2048
+    camera.exposure_time_ms = 10
+    x_stage = Stage(hardware_axis='x', instrument_axis='x')
+    y_stage = Stage(hardware_axis='y', instrument_axis='y')
+    z_stage = Stage(hardware_axis='z', instrument_axis='z')
+    instrument = SimpleNamespace(
+        cameras={'camera': camera},
+        tiling_stages={'x axis stage': x_stage, 'y axis stage': y_stage},
+        scanning_stages={'z axis stage': z_stage},
+        filter_wheels={'filter wheel': FilterWheel(id='0', filters={'BP488': 0, 'BP561': 1})},
+        lasers={'488nm': SimulatedLaser(id='488'), '561nm': SimulatedLaser(id='561')},
+        channels={'488': {'lasers': ['488nm'], 'filters': ['BP488']},
+                  '561': {'lasers': ['561nm'], 'filters': ['BP561']}},
+        master_device={'name': 'camera', 'type': 'camera'})
+
+    writer = Writer('.')
+    writer.data_type = 'uint16'
+    frame_size_mb = 2048*2048*2/1024**2
+    # 2 x 3 tiles of 2000 frames in 2 channels, 16 GB per tile
+    tiles = [{'position_mm': {'x': column*1.0, 'y': row*1.0, 'z': 0.0}, 'channel': channel, 'steps': 2000}
+             for channel in ('488', '561') for row in range(2) for column in range(3)]
+    acquisition = SimpleNamespace(instrument=instrument, writers={'camera': {'tiff': writer}}, transfers=dict(),
+                                  config={'acquisition': {'tiles': tiles}},
+                                  _frame_size_mb=lambda camera_id, writer_id: frame_size_mb)
+    drive = volume('.')
+
+    start_time = time.perf_counter()
+    report = DryRun(acquisition, write_speed_mb_s={drive: 500}, free_bytes={drive: 2**50}).run()
+    real_time_s = time.perf_counter() - start_time
+
+    imaging_s = len(tiles)*2000*camera.frame_time_ms/1000
+    assert report['duration_s'] > imaging_s, 'imaging time is missing'
+    # 1 s moves between tiles, 1 filter and laser switch
+    assert report['duration_s'] < imaging_s + len(tiles)*2 + 5, 'unexpected overhead'
+    assert real_time_s < report['duration_s']/10, 'dry run slept in real time'
+    assert report['bytes_per_drive'][drive] == int(2000*frame_size_mb*1024**2)*len(tiles)
+    # 8 MB frames at ~19 fps need ~170 MB/s
+    assert not report['slow_drives_mb_s'], 'drive should keep up'
+    # peak RAM is itemized as by check_system_memory, including the camera buffer
+    assert 'camera camera buffer' in report['peak_ram_items']
+    assert report['peak_ram_items']['camera chunk ring'] == 4*writer.chunk_count_px*2048*2048*2
+    assert report['peak_ram_bytes'] == sum(report['peak_ram_items'].values())
+    print(f"{report['duration_s']:.1f} [s] simulated in {real_time_s:.2f} [s]")
+
+    # a slow drive is reported and drains after each tile
+    report = DryRun(acquisition, write_speed_mb_s={drive: 100}, free_bytes={drive: 2**50}).run()
+    assert drive in report['slow_drives_mb_s'], 'slow drive was not reported'
+
+    # tiles wait when the disk is full and there are no transfers
+    try:
+        DryRun(acquisition, free_bytes={drive: 20*1024**3}).run()
+        raise AssertionError('full disk was not detected')
+    except RuntimeError as e:
+        print(e)
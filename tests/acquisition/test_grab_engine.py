@@ -0,0 +1,193 @@
+import logging
+import numpy
+import shutil
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from voxel.acquisition.grab_engine import GrabEngine
+from voxel.readers import tiff
+from voxel.writers import tiff as tiff_writer
+
+
+class TriggeredCamera:
+    """Frames at a fixed rate, as from a camera on a shared trigger. Each
+    frame is filled with its frame index."""
+
+    def __init__(self, shape: tuple, frame_time_s: float, fail_after: int = None):
+        self.shape = shape
+        self.frame_time_s = frame_time_s
+        self.fail_after = fail_after
+        self.frame = 0
+
+    def grab_frame(self):
+        if self.fail_after is not None and self.frame >= self.fail_after:
+            raise TimeoutError('no trigger')
+        time.sleep(self.frame_time_s)
+        self.frame += 1
+        return numpy.full(self.shape, self.frame - 1, dtype='uint16')
+
+
+class SlowConsumer:
+    """Chunk consumer that holds every chunk for a while, like a writer
+    falling behind."""
+
+    def __init__(self, chunk_count_px: int, shape: tuple, hold_time_s: float):
+        self.chunk_count_px = chunk_count_px
+        self.row_count_px, self.column_count_px = shape
+        self.data_type = 'uint16'
+        self.hold_time_s = hold_time_s
+        self.done_reading = threading.Event()
+        self.done_reading.set()
+
+    def submit_chunk(self, shm_name: str):
+        self.done_reading.clear()
+        threading.Timer(self.hold_time_s, self.done_reading.set).start()
+
+
+class RecordingConsumer(SlowConsumer):
+    """Chunk consumer that keeps a copy of every chunk it is handed."""
+
+    def __init__(self, chunk_count_px: int, shape: tuple):
+        super().__init__(chunk_count_px, shape, hold_time_s=0)
+        self.chunks = list()
+        self.aborted = False
+
+    def submit_chunk(self, shm_name: str):
+        shm = SharedMemory(shm_name)
+        shape = (self.chunk_count_px, self.row_count_px, self.column_count_px)
+        self.chunks.append(numpy.ndarray(shape, dtype=self.data_type, buffer=shm.buf).copy())
+        shm.close()
+
+    def abort(self):
+        self.aborted = True
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    num_frames = 192
+    img_shape = (256, 256)
+    frame_time_s = 0.005
+    output_dir = Path('grab_engine_test')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir()
+
+    cameras = {'camera 0': TriggeredCamera(img_shape, frame_time_s), 'camera 1': TriggeredCamera(img_shape, frame_time_s)}
+    writers = dict()
+    for camera_id in cameras:
+        writer = tiff_writer.Writer(output_dir)
+        writer.acquisition_name = '.'
+        writer.filename = f'{camera_id.replace(" ", "_")}.tiff'
+        writer.data_type = 'uint16'
+        writer.frame_count_px = num_frames
+        writer.row_count_px = img_shape[0]
+        writer.column_count_px = img_shape[1]
+        writer.channel = '488'
+        writers[camera_id] = writer
+    chunk_count_px = writers['camera 0'].chunk_count_px
+    # camera 1 has a consumer that holds chunks for 3 chunk periods
+    slow_consumer = SlowConsumer(chunk_count_px, img_shape, hold_time_s=3 * chunk_count_px * frame_time_s)
+    consumers = {'camera 0': [writers['camera 0']], 'camera 1': [writers['camera 1'], slow_consumer]}
+
+    engine = GrabEngine(cameras, consumers, ring_depth=2)
+    # rings are created before the writer processes are started
+    engine.prepare()
+    for writer in writers.values():
+        writer.prepare()
+        writer.start()
+
+    grab_times_s = dict()
+
+    def timed_grab(camera_id, grab):
+        def timed():
+            frame = grab()
+            grab_times_s[camera_id] = time.perf_counter() - start_time
+            return frame
+        return timed
+    for camera_id in cameras:
+        cameras[camera_id].grab_frame = timed_grab(camera_id, cameras[camera_id].grab_frame)
+
+    start_time = time.perf_counter()
+    frame_counts = engine.acquire(num_frames)
+    engine.wait_to_finish()
+    for writer in writers.values():
+        writer.wait_to_finish()
+    print(f'frame counts {frame_counts}, last frame grabbed after {grab_times_s} [s]')
+    assert frame_counts == {'camera 0': num_frames, 'camera 1': num_frames}
+    counts = engine.check_frame_counts(num_frames)
+    assert all(count['dropped'] == 0 for count in counts.values())
+    # the slow consumer stalls camera 1 but not camera 0
+    assert grab_times_s['camera 0'] < grab_times_s['camera 1'], 'camera 0 was stalled by camera 1'
+
+    for camera_id, writer in writers.items():
+        with tiff.Reader(output_dir / writer.filename) as frames:
+            assert numpy.array_equal(frames[:, 0, 0], numpy.arange(num_frames)), f'{camera_id} frames differ'
+
+    engine.close()
+    for writer in writers.values():
+        writer.close()
+
+    # a camera that stops triggering stops the tile and fails the frame count check
+    cameras = {'camera 0': TriggeredCamera(img_shape, frame_time_s),
+               'camera 1': TriggeredCamera(img_shape, frame_time_s, fail_after=100)}
+    engine = GrabEngine(cameras, {camera_id: [SlowConsumer(chunk_count_px, img_shape, hold_time_s=0)]
+                                  for camera_id in cameras})
+    engine.prepare()
+    try:
+        engine.acquire(num_frames)
+        raise AssertionError('failed grab did not raise')
+    except RuntimeError as e:
+        print(e)
+    try:
+        engine.check_frame_counts(num_frames)
+        raise AssertionError('frame count check did not raise')
+    except RuntimeError as e:
+        print(e)
+    engine.wait_to_finish()
+    engine.close()
+
+    # after a camera failure the partial chunk has no stale frames and the writers are closable
+    cameras = {'camera 0': TriggeredCamera(img_shape, frame_time_s), 'camera 1': TriggeredCamera(img_shape, frame_time_s)}
+    recorder = RecordingConsumer(chunk_count_px, img_shape)
+    engine = GrabEngine(cameras, {'camera 0': [writers['camera 0']], 'camera 1': [writers['camera 1'], recorder]},
+                        ring_depth=2)
+    engine.prepare()
+    for writer in writers.values():
+        writer.filename = writer.filename.replace('.tiff', '_full.tiff')
+        writer.prepare()
+        writer.start()
+    # a full tile leaves frames in every slot of the ring
+    engine.acquire(num_frames)
+    engine.wait_to_finish()
+    for writer in writers.values():
+        writer.wait_to_finish()
+    fail_after = 100
+    cameras['camera 1'].fail_after = cameras['camera 1'].frame + fail_after
+    for writer in writers.values():
+        writer.filename = writer.filename.replace('_full.tiff', '_failed.tiff')
+        writer.prepare()
+        writer.start()
+    try:
+        engine.acquire(num_frames)
+        raise AssertionError('failed grab did not raise')
+    except RuntimeError as e:
+        print(e)
+    engine.wait_to_finish()
+    assert recorder.aborted, 'consumer was not aborted'
+    partial_frames = fail_after % chunk_count_px
+    assert numpy.all(recorder.chunks[-1][partial_frames:] == 0), 'partial chunk has stale frames'
+    assert numpy.array_equal(recorder.chunks[-1][:partial_frames, 0, 0],
+                             num_frames + fail_after - partial_frames + numpy.arange(partial_frames))
+    for writer in writers.values():
+        try:
+            writer.wait_to_finish()
+            raise AssertionError('aborted tile did not raise')
+        except RuntimeError as e:
+            print(e)
+    start_time = time.perf_counter()
+    for writer in writers.values():
+        writer.close()
+    assert time.perf_counter() - start_time < 10, 'closing the writers blocked'
+    engine.close()
+    shutil.rmtree(output_dir)
@@ -0,0 +1,113 @@
+import logging
+import shutil
+import tempfile
+from types import SimpleNamespace
+from voxel.acquisition.memory_budget import MemoryPlanner
+from voxel.processes.cpu.max_projection import MaxProjection
+from voxel.routines.background_collection import BackgroundCollection
+from voxel.writers import tiff, zarr
+
+
+class BufferedCamera:
+    """Frame size and driver buffer of a camera, as the egrabber, dcam and
+    pco drivers report them."""
+
+    def __init__(self, width_px: int, height_px: int):
+        self.width_px = width_px
+        self.height_px = height_px
+        self._buffer_size_mb = 2400
+
+    @property
+    def buffer_size_mb(self):
+        return self._buffer_size_mb
+
+    @buffer_size_mb.setter
+    def buffer_size_mb(self, buffer_size_mb: float):
+        self._buffer_size_mb = buffer_size_mb
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = tempfile.mkdtemp()
+    frame_bytes = 2048 * 2048 * 2
+
+    # camera 0 writes tiff and projects, camera 1 writes a zarr pyramid
+    tiff_writer = tiff.Writer(path)
+    zarr_writer = zarr.Writer(path)
+    zarr_writer.row_count_px = 2048
+    zarr_writer.column_count_px = 2048
+    projection = MaxProjection(path)
+    projection.frame_count_px = 1000
+    projection.row_count_px = 2048
+    projection.column_count_px = 2048
+    projection.data_type = 'uint16'
+    projection.x_projection_count_px = 256
+    background = BackgroundCollection(path)
+    background.frame_count_px = 10
+    background.data_type = 'uint16'
+    acquisition = SimpleNamespace(
+        instrument=SimpleNamespace(cameras={'camera 0': BufferedCamera(2048, 2048),
+                                            'camera 1': BufferedCamera(2048, 2048)}),
+        writers={'camera 0': {'tiff': tiff_writer}, 'camera 1': {'zarr': zarr_writer}},
+        processes={'camera 0': {'mip': projection}},
+        routines={'camera 1': {'background': background}},
+        config={'acquisition': {'tiles': [{'steps': 1000}]}})
+
+    # the tiff camera can use any chunk count, the zarr chunk count is fixed
+    planner = MemoryPlanner(acquisition, free_bytes=64 * 1024 ** 3)
+    assert planner.chunk_candidates('camera 0')[0] == 256
+    assert planner.chunk_candidates('camera 1') == [64]
+    items = planner.items({'camera 0': 64, 'camera 1': 64}, 3, {'camera 0': 2400, 'camera 1': 2400})
+    assert items['camera 0 camera buffer'] == 2400e6
+    assert items['camera 0 chunk ring'] == 3 * 64 * frame_bytes
+    assert items['camera 0 tiff chunk'] == 64 * frame_bytes
+    assert items['camera 1 zarr pyramid'] > 64 * frame_bytes / 8
+    # 1000 frames of 2048 rows for 9 x projection slabs
+    assert items['camera 0 mip projections'] == 1000 * 2048 * 9 * 2
+    assert items['camera 1 background stack'] == 2 * 10 * frame_bytes + 2048 * 2048 * 8
+
+    # without a plan, the settings of the writers and cameras are in effect
+    assert planner.settings() == {'chunk_count_px': {'camera 0': 64, 'camera 1': 64}, 'ring_depth': 4,
+                                  'buffer_size_mb': {'camera 0': 2400, 'camera 1': 2400}}
+
+    # camera buffers and chunk rings are kept across tiles, the rest is allocated per tile
+    tile_items = planner.tile_items()
+    assert 'camera 0 mip projections' in tile_items and 'camera 1 zarr pyramid' in tile_items
+    assert not any(name.endswith(('camera buffer', 'chunk ring')) for name in tile_items)
+
+    # plenty of RAM, largest chunks, ring and buffers
+    plan = planner.plan()
+    assert plan['chunk_count_px'] == {'camera 0': 256, 'camera 1': 64}
+    assert plan['ring_depth'] == 4
+    assert plan['buffer_size_mb'] == {'camera 0': 2400, 'camera 1': 2400}
+    assert plan['total_bytes'] <= plan['budget_bytes']
+    # the applied plan is in effect, e.g. for the dry run
+    acquisition.memory_plan = plan
+    assert planner.settings()['chunk_count_px'] == plan['chunk_count_px']
+    acquisition.memory_plan = None
+
+    # little RAM, smaller buffers and shallower rings, then smaller chunks
+    for free_gb in (16, 8, 4):
+        small_plan = MemoryPlanner(acquisition, free_bytes=free_gb * 1024 ** 3).plan()
+        assert small_plan['total_bytes'] <= small_plan['budget_bytes']
+        print(f"{free_gb} [GB]: chunk count {small_plan['chunk_count_px']}, ring depth {small_plan['ring_depth']}, "
+              f"buffers {small_plan['buffer_size_mb']} [MB]")
+        assert small_plan['total_bytes'] < plan['total_bytes']
+
+    # not even the smallest settings fit
+    try:
+        MemoryPlanner(acquisition, free_bytes=1024 ** 3).plan()
+        raise AssertionError('plan did not raise')
+    except MemoryError as e:
+        print(e)
+
+    # chunk counts go to the tiff writer and projection, buffer sizes to the cameras
+    planner.apply(small_plan)
+    assert tiff_writer.chunk_count_px == small_plan['chunk_count_px']['camera 0']
+    assert projection.chunk_count_px == small_plan['chunk_count_px']['camera 0']
+    assert zarr_writer.chunk_count_px == 64
+    assert acquisition.instrument.cameras['camera 1'].buffer_size_mb == small_plan['buffer_size_mb']['camera 1']
+    for writer in (tiff_writer, zarr_writer):
+        writer.close()
+    shutil.rmtree(path)
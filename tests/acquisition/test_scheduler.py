@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from voxel.acquisition.scheduler import TileScheduler
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    tiles = [{'tile_number': tile_number} for tile_number in range(6)]
+
+    # disk holds 3 tiles, drained tiles free their space once transferred
+    disk_tiles = set()
+    disk_lock = threading.Lock()
+
+    def setup(tile):
+        time.sleep(0.2)
+
+    def acquire(tile):
+        with disk_lock:
+            assert len(disk_tiles) < 3, 'tile acquired without disk space'
+            disk_tiles.add(tile['tile_number'])
+        time.sleep(0.3)
+
+    def drain(tile):
+        time.sleep(0.2)
+
+    def transfer(tile):
+        time.sleep(1.0)
+        with disk_lock:
+            disk_tiles.discard(tile['tile_number'])
+
+    def check_resources(tile):
+        with disk_lock:
+            return len(disk_tiles) < 3
+
+    scheduler = TileScheduler(setup, acquire, drain, transfer, check_resources=check_resources)
+    wall_time_s = scheduler.run(tiles)
+    timeline = scheduler.timeline
+
+    def phase(tile_index, name):
+        return next(entry for entry in timeline if entry['tile'] == tile_index and entry['phase'] == name)
+
+    serial_time_s = len(tiles)*(0.2 + 0.3 + 0.2 + 1.0)
+    print(f'wall time {wall_time_s:.1f} [s], serial {serial_time_s:.1f} [s]')
+    assert wall_time_s < 0.75*serial_time_s, 'tiles were not pipelined'
+    for tile_index in range(1, len(tiles)):
+        # next setup overlaps the drain, acquisition waits for it
+        assert phase(tile_index, 'setup')['start_s'] < phase(tile_index - 1, 'drain')['end_s']
+        assert phase(tile_index, 'acquire')['start_s'] >= phase(tile_index - 1, 'drain')['end_s']
+        # transfers run one at a time in tile order
+        assert phase(tile_index, 'transfer')['start_s'] >= phase(tile_index - 1, 'transfer')['end_s']
+    assert not disk_tiles, 'tiles were not transferred'
+    # transfers are slower than acquisition, so tiles wait for disk space
+    assert any(entry['phase'] == 'wait' for entry in timeline), 'tiles did not wait for transfers'
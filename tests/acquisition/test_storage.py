@@ -0,0 +1,60 @@
+import logging
+import os
+import shutil
+import tempfile
+from voxel.acquisition.storage import StorageManager, pyramid_factor, pyramid_levels, volume
+from voxel.writers import bdv, tiff
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = tempfile.mkdtemp()
+    other_path = os.path.join(path, 'other')
+    os.makedirs(other_path)
+
+    # both directories are on the same volume, which is a mount point
+    assert volume(path) == volume(other_path)
+    assert os.path.ismount(volume(path)), f'{volume(path)} is not a mount point'
+    print(f'{path} is on volume {volume(path)}')
+
+    # leave 100 MB of the volume available
+    mb = 1000 ** 2
+    storage = StorageManager(margin_bytes=shutil.disk_usage(path).free - 100 * mb)
+    drive = storage.volume(path)
+    assert storage.decide({path: 40 * mb}) == 'proceed'
+    # paths on the same volume add up
+    assert storage.decide({path: 60 * mb, other_path: 60 * mb}) == 'insufficient'
+
+    # in-flight tiles hold their reservation until written
+    written_mb = [0]
+    storage.reserve('tile 0', path, 40 * mb, written_bytes=lambda: written_mb[0] * mb)
+    storage.reserve('tile 1', other_path, 40 * mb)
+    assert storage.reserved_bytes(drive) == 80 * mb
+    assert storage.decide({path: 40 * mb}) == 'insufficient'
+    # bytes on disk are no longer reserved, they are counted as used by the volume
+    written_mb[0] = 30
+    assert storage.reserved_bytes(drive) == 50 * mb
+    storage.release('tile 0')
+    storage.release('tile 1')
+    assert storage.reserved_bytes(drive) == 0
+
+    # written tiles waiting for transfer will free their bytes
+    storage.reserve('tile 2', path, 90 * mb)
+    storage.expect_freed('tile 0', path, 40 * mb)
+    assert storage.decide({path: 40 * mb}) == 'wait'
+    storage.freed('tile 0')
+    assert storage.decide({path: 40 * mb}) == 'insufficient'
+    storage.release('tile 2')
+    assert storage.decide({path: 40 * mb}) == 'proceed'
+
+    assert pyramid_factor(1) == 1
+    assert abs(pyramid_factor(3) - (1 + 1 / 8 + 1 / 64)) < 1e-12
+
+    # every writer class is named Writer, levels come from the writer itself
+    bdv_writer = bdv.Writer(path)
+    tiff_writer = tiff.Writer(path)
+    assert pyramid_levels(bdv_writer) == len(bdv.SUBSAMP) == 3
+    assert pyramid_levels(tiff_writer) == 1
+    for writer in (bdv_writer, tiff_writer):
+        writer.close()
+    shutil.rmtree(path)
@@ -0,0 +1,49 @@
+import random
+from types import SimpleNamespace
+from voxel.acquisition.tile_planner import TileCostModel, TilePlanner
+from voxel.devices.filterwheel.simulated import FilterWheel
+from voxel.devices.lasers.simulated import SimulatedLaser
+from voxel.devices.stage.simulated import Stage
+
+if __name__ == '__main__':
+
+    x_stage = Stage(hardware_axis='x', instrument_axis='x')
+    y_stage = Stage(hardware_axis='y', instrument_axis='y')
+    z_stage = Stage(hardware_axis='z', instrument_axis='z')
+    x_stage.speed_mm_s = 2.0
+    y_stage.speed_mm_s = 2.0
+    z_stage.speed_mm_s = 1.0
+    instrument = SimpleNamespace(
+        tiling_stages={'x axis stage': x_stage, 'y axis stage': y_stage},
+        scanning_stages={'z axis stage': z_stage},
+        filter_wheels={'filter wheel': FilterWheel(id='0', filters={'BP488': 0, 'BP561': 1, 'BP639': 2})},
+        lasers={'488nm': SimulatedLaser(id='488'), '561nm': SimulatedLaser(id='561'), '639nm': SimulatedLaser(id='639')},
+        channels={'488': {'lasers': ['488nm'], 'filters': ['BP488']},
+                  '561': {'lasers': ['561nm'], 'filters': ['BP561']},
+                  '639': {'lasers': ['639nm'], 'filters': ['BP639']}})
+    cost_model = TileCostModel.from_instrument(instrument, acquisition_rate_hz=100)
+
+    # 6 x 5 grid in 3 channels, shuffled as tiles often are in acquisition yamls
+    tiles = [{'position_mm': {'x': column*1.5, 'y': row*1.2, 'z': 0.0}, 'channel': channel, 'steps': 1000}
+             for row in range(5) for column in range(6) for channel in ('488', '561', '639')]
+    random.seed(1)
+    random.shuffle(tiles)
+
+    for ordering in ('file', 'serpentine', 'nearest_neighbour'):
+        for grouping in ('channel', 'position', 'auto'):
+            planner = TilePlanner(cost_model, ordering=ordering, grouping=grouping)
+            planned = planner.plan(tiles)
+            assert sorted(map(id, planned)) == sorted(map(id, tiles)), 'tiles were lost or duplicated'
+            print(f'{ordering}, {grouping}: predicted {planner.predicted_time_s:.1f} [s], '
+                  f'file order {planner.file_order_time_s:.1f} [s]')
+            if ordering != 'file':
+                assert planner.predicted_time_s < planner.file_order_time_s, 'plan is not faster than file order'
+
+    # serpentine by channel: every channel once, rows along the shorter y steps
+    planner = TilePlanner(cost_model, ordering='serpentine', grouping='channel')
+    planned = planner.plan(tiles)
+    channel_switches = sum(a['channel'] != b['channel'] for a, b in zip(planned[:-1], planned[1:]))
+    assert channel_switches == 2, f'{channel_switches} channel switches'
+    imaging_time_s = len(tiles)*1000/100
+    travel_time_s = 3*(6*4*1.2 + 5*1.5)/2.0
+    assert abs(planner.predicted_time_s - imaging_time_s - travel_time_s - 2*(0.1 + 2*0.5)) < 1e-6
@@ -0,0 +1,30 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from voxel.acquisition.write_benchmark import SHORT_CHUNK_BYTES, WriteBenchmark
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = tempfile.mkdtemp()
+
+    # two writers with 64 frame chunks of 512x512 uint16 frames, compressed 2x
+    chunk_bytes = 64 * 512 * 512 * 2 // 2
+    start_time = time.perf_counter()
+    result = WriteBenchmark(path, [chunk_bytes, chunk_bytes], direct=True, short=True).run(duration_s=2.0)
+    elapsed_s = time.perf_counter() - start_time
+    print(result)
+    assert elapsed_s < 10, f'short benchmark took {elapsed_s:.1f} [s]'
+    assert result['Writers'] == 2
+    assert result['Chunks written'] >= 2
+    assert result['Rate [MB/s]'] > 0
+    assert 0 < result['Latency p50 [s]'] <= result['Latency p99 [s]']
+    # test files are removed
+    assert not os.listdir(path)
+
+    # chunks of large frames are clipped in short mode
+    benchmark = WriteBenchmark(path, [64 * 14192 * 10640 * 2], short=True)
+    assert benchmark.chunk_bytes == [SHORT_CHUNK_BYTES]
+    shutil.rmtree(path)
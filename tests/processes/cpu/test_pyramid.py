@@ -0,0 +1,63 @@
+import numpy
+import time
+from math import ceil
+
+from voxel.processes.cpu.pyramid import Pyramid
+
+
+def reference_level(stack: numpy.array, factors: tuple, method: str):
+    """Downsample a stack in one pass. The stack is padded to whole blocks
+    with nan, so edge blocks are reduced over the voxels they contain, and
+    reduced as a reshaped view."""
+    padded_shape = [ceil(size/factor)*factor for size, factor in zip(stack.shape, factors)]
+    padded = numpy.full(padded_shape, numpy.nan)
+    padded[:stack.shape[0], :stack.shape[1], :stack.shape[2]] = stack
+    blocks = padded.reshape(padded_shape[0]//factors[0], factors[0],
+                            padded_shape[1]//factors[1], factors[1],
+                            padded_shape[2]//factors[2], factors[2])
+    if method == 'max':
+        level = numpy.nanmax(blocks, axis=(1, 3, 5))
+    else:
+        # integer means are rounded half up
+        level = numpy.floor(numpy.nanmean(blocks, axis=(1, 3, 5)) + 0.5)
+    return level.astype(stack.dtype)
+
+
+# incremental pyramid built from chunks that do not line up with an odd z
+# factor must match a single pass numpy reference, including the partial
+# z blocks reduced by flush() at the end of the stack
+factors = ((3, 2, 2), (2, 3, 3))
+stack = numpy.random.randint(0, 65535, (152, 61, 47), dtype='uint16')
+for method in ['mean', 'max']:
+    reference = list()
+    level = stack
+    for level_factors in factors:
+        level = reference_level(level, level_factors, method)
+        reference.append(level)
+    for chunk_size in [64, 7]:
+        pyramid = Pyramid(factors=factors, method=method)
+        levels = [list() for _ in factors]
+        for z in range(0, stack.shape[0], chunk_size):
+            for level, (z_start, planes) in enumerate(pyramid.push(stack[z:z+chunk_size])):
+                assert z_start == sum(level_planes.shape[0] for level_planes in levels[level])
+                levels[level].append(planes)
+        for level, (z_start, planes) in enumerate(pyramid.flush()):
+            # every level ends on a partial z block
+            assert planes.shape[0] == 1, f'{method} level {level+1} flushed {planes.shape[0]} planes'
+            levels[level].append(planes)
+        pyramid.close()
+        for level, level_planes in enumerate(levels):
+            level_planes = numpy.concatenate(level_planes)
+            assert numpy.array_equal(level_planes, reference[level]), \
+                f'{method} level {level+1} of {chunk_size} plane chunks does not match'
+            print(f'{method} level {level+1} of {chunk_size} plane chunks size: {level_planes.shape}')
+
+image = numpy.zeros((64, 2048, 2048), dtype='uint16')
+print(f'original chunk size: {image.shape}')
+start_time = time.time()
+pyramid = Pyramid(factors=((2, 2, 2), (2, 2, 2), (2, 2, 2)), method='mean')
+levels = pyramid.push(image)
+end_time = time.time()
+run_time = end_time - start_time
+print(f'downsampled chunk sizes: {[planes.shape for z_start, planes in levels]}')
+print(f'run time = {run_time} [sec]')
@@ -0,0 +1,78 @@
+import numpy
+import h5py
+import tifffile
+import tensorstore
+from pathlib import Path
+from time import perf_counter, sleep
+from voxel.readers import bdv, imaris, tiff, zarr
+from voxel.readers.chunk_cache import ChunkCache
+
+if __name__ == '__main__':
+
+    num_frames = 70
+    stack = numpy.random.randint(0, 4096, (num_frames, 300, 500), dtype='uint16')
+    output_dir = Path('readers_test')
+    output_dir.mkdir(exist_ok=True)
+
+    tifffile.imwrite(output_dir / 'stack.tiff', stack)
+    with h5py.File(output_dir / 'stack.h5', 'w') as f:
+        # bdv stores uint16 as int16
+        f.create_dataset('t00000/s00/0/cells', data=stack.view('int16'), chunks=(16, 128, 128))
+    with h5py.File(output_dir / 'stack.ims', 'w') as f:
+        # imaris pads the data to whole blocks and stores sizes as characters
+        padded = numpy.zeros((80, 320, 512), dtype='uint16')
+        padded[:num_frames, :300, :500] = stack
+        channel = f.create_group('DataSet/ResolutionLevel 0/TimePoint 0/Channel 0')
+        channel.create_dataset('Data', data=padded, chunks=(16, 64, 64))
+        for axis, size in zip('ZYX', stack.shape):
+            channel.attrs[f'ImageSize{axis}'] = numpy.array(list(str(size)), dtype='S1')
+    array = tensorstore.open({'driver': 'zarr3',
+                              'kvstore': {'driver': 'file', 'path': str(output_dir / 'stack.zarr' / '0')},
+                              'metadata': {'shape': stack.shape, 'data_type': 'uint16',
+                                           'chunk_grid': {'name': 'regular',
+                                                          'configuration': {'chunk_shape': [32, 384, 512]}},
+                                           'codecs': [{'name': 'sharding_indexed',
+                                                       'configuration': {'chunk_shape': [16, 128, 128]}}]}},
+                             create=True, delete_existing=True).result()
+    array.write(stack).result()
+
+    keys = [numpy.s_[:], numpy.s_[5], numpy.s_[-1, 10:200, 77], numpy.s_[10:60:7, ::3, 490:],
+            numpy.s_[::-5, 299, ::-1], numpy.s_[..., 42], numpy.s_[20:20]]
+    readers = {'tiff': lambda: tiff.Reader(output_dir / 'stack.tiff'),
+               'bdv': lambda: bdv.Reader(output_dir / 'stack.h5'),
+               'imaris': lambda: imaris.Reader(output_dir / 'stack.ims'),
+               'zarr': lambda: zarr.Reader(output_dir / 'stack.zarr')}
+    for name, open_reader in readers.items():
+        with open_reader() as reader:
+            assert reader.shape == stack.shape and reader.dtype == stack.dtype, f'{name} shape or dtype'
+            for key in keys:
+                assert numpy.array_equal(reader[key], stack[key]), f'{name} {key} does not match'
+        print(f'{name} reader matches, chunk shape {reader.chunk_shape}')
+
+    # chunks are shared between readers of the same array
+    cache = ChunkCache(64*1024**2)
+    with bdv.Reader(output_dir / 'stack.h5', cache=cache, prefetch_read_count=0) as reader:
+        reader[0:16, 0:128, 0:128]
+    with bdv.Reader(output_dir / 'stack.h5', cache=cache, prefetch_read_count=0) as reader:
+        hit_count = cache.hit_count
+        reader[0:16, 0:128, 0:128]
+        assert cache.hit_count == hit_count + 1, 'second reader did not hit the cache'
+
+    # the cache stays within its size
+    cache = ChunkCache(4*300*500*2)
+    with tiff.Reader(output_dir / 'stack.tiff', cache=cache, prefetch_read_count=0) as reader:
+        reader[:]
+    assert cache.nbytes <= cache.max_nbytes, 'cache exceeds its size'
+    print(f'cache holds {cache.nbytes/1e6:.1f} of {cache.max_nbytes/1e6:.1f} [MB]')
+
+    # sequential scans decode the next chunks in the background
+    cache = ChunkCache()
+    with zarr.Reader(output_dir / 'stack.zarr', cache=cache) as reader:
+        reader[0:16]
+        sleep(0.5)
+        assert all(((reader._key, (1, y, x)) in cache) for y in range(3) for x in range(4)), 'chunks not prefetched'
+        start_time = perf_counter()
+        for z_start in range(0, num_frames, 16):
+            assert numpy.array_equal(reader[z_start:z_start + 16], stack[z_start:z_start + 16])
+        print(f'sequential zarr scan in {perf_counter() - start_time:.3f} [s], '
+              f'{cache.hit_count} cache hits, {cache.miss_count} misses')
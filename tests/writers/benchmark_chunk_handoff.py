@@ -0,0 +1,82 @@
+import numpy
+import time
+import psutil
+from multiprocessing import Process, Event, Pipe, Value
+
+# Compare the original sleep-polling chunk handoff of the writers against the
+# blocking pipe handoff. Reports the CPU used by an idle writer process waiting
+# for data and the latency from handing off a chunk to the writer seeing it.
+
+IDLE_TIME_S = 2.0
+HANDOFF_COUNT = 200
+
+
+def polling_writer(done_reading: Event, sent_time: Value, latencies, handoff_count: int):
+    for handoff in range(handoff_count + 1):
+        while done_reading.is_set():
+            time.sleep(0.001)
+        received_time = time.perf_counter()
+        if handoff > 0:
+            latencies.send(received_time - sent_time.value)
+        done_reading.set()
+
+
+def pipe_writer(chunk_receiver, done_reading: Event, latencies, handoff_count: int):
+    for handoff in range(handoff_count + 1):
+        sent_time = chunk_receiver.recv()
+        received_time = time.perf_counter()
+        if handoff > 0:
+            latencies.send(received_time - sent_time)
+        done_reading.set()
+
+
+def report(name: str, process: Process, latency_receiver, handoff: callable, done_reading: Event):
+    process.start()
+    ps_process = psutil.Process(process.pid)
+    # first handoff releases the writer from startup
+    handoff()
+    done_reading.wait()
+    cpu_start = sum(ps_process.cpu_times()[:2])
+    time.sleep(IDLE_TIME_S)
+    idle_cpu_percent = 100 * (sum(ps_process.cpu_times()[:2]) - cpu_start) / IDLE_TIME_S
+    latencies = []
+    for handoff_index in range(HANDOFF_COUNT):
+        done_reading.wait()
+        # mimic the time between chunks
+        time.sleep(0.005)
+        handoff()
+        latencies.append(latency_receiver.recv())
+    process.join()
+    latencies_us = numpy.array(latencies) * 1e6
+    print(f'{name}: idle cpu = {idle_cpu_percent:.1f} [%], '
+          f'handoff latency p50 = {numpy.percentile(latencies_us, 50):.0f} [us], '
+          f'p99 = {numpy.percentile(latencies_us, 99):.0f} [us]')
+
+
+if __name__ == '__main__':
+
+    # original sleep-polling handoff
+    done_reading = Event()
+    done_reading.set()
+    sent_time = Value('d', 0.0)
+    latency_receiver, latency_sender = Pipe(duplex=False)
+    process = Process(target=polling_writer, args=(done_reading, sent_time, latency_sender, HANDOFF_COUNT))
+
+    def polling_handoff():
+        sent_time.value = time.perf_counter()
+        done_reading.clear()
+
+    report('polling', process, latency_receiver, polling_handoff, done_reading)
+
+    # blocking pipe handoff
+    done_reading = Event()
+    done_reading.set()
+    chunk_receiver, chunk_sender = Pipe(duplex=False)
+    latency_receiver, latency_sender = Pipe(duplex=False)
+    process = Process(target=pipe_writer, args=(chunk_receiver, done_reading, latency_sender, HANDOFF_COUNT))
+
+    def pipe_handoff():
+        done_reading.clear()
+        chunk_sender.send(time.perf_counter())
+
+    report('pipe', process, latency_receiver, pipe_handoff, done_reading)
@@ -16,7 +16,7 @@ if __name__ == '__main__':
     config_path = this_dir / Path("test_bdv.yaml")
     config = YAML().load(Path(config_path))
 
-    chunk_size_frames = 128
+    chunk_size_frames = 64
     num_frames = 256
     num_tiles = 1
 
@@ -31,6 +31,7 @@ if __name__ == '__main__':
     stack_writer_worker.compression = config['writer']['compression']
     stack_writer_worker.data_type = config['writer']['data_type']
     stack_writer_worker.channel = '488'
+    stack_writer_worker.acquisition_name = '.'
     frame_index = 0
     tile_index = 0
 
@@ -90,8 +91,7 @@ if __name__ == '__main__':
             # Dispatch either a full chunk of frames or the last chunk,
             # which may not be a multiple of the chunk size.
             if chunk_index == chunk_size_frames - 1 or stack_index == last_frame_index:
-                while not stack_writer_worker.done_reading.is_set():
-                    time.sleep(0.001)
+                stack_writer_worker.done_reading.wait()
                 # Dispatch chunk to each StackWriter compression process.
                 # Toggle double buffer to continue writing images.
                 # To read the new data, the StackWriter needs the name of
@@ -102,9 +102,7 @@ if __name__ == '__main__':
                 with chunk_lock:
                     img_buffer.toggle_buffers()
                     if config['writer']['path'] is not None:
-                        stack_writer_worker.shm_name = \
-                            img_buffer.read_buf_mem_name
-                        stack_writer_worker.done_reading.clear()
+                        stack_writer_worker.submit_chunk(img_buffer.read_buf_mem_name)
 
         stack_writer_worker.wait_to_finish()
 
@@ -0,0 +1,67 @@
+import h5py
+import logging
+import numpy
+import shutil
+import tempfile
+from pathlib import Path
+from xml.etree import ElementTree as ET
+from voxel.writers.bdv_writer import npy2bdv
+
+
+def write_view(writer, tile, channel, value):
+    """Append a virtual stack view filled with value."""
+    shape = (8, 64, 64)
+    writer.append_view(stack=None, virtual_stack_dim=shape, tile=tile, channel=channel,
+                       voxel_size_xyz=(0.5, 0.5, 1.0), voxel_units='um')
+    writer.append_substack(numpy.full(shape, value, dtype='uint16'), z_start=0, tile=tile, channel=channel)
+    writer.add_affine(numpy.hstack([numpy.eye(3), [[tile], [0], [0]]]), name_affine='shift',
+                      tile=tile, channel=channel)
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = Path(tempfile.mkdtemp())
+    filename = str(path / 'tiles.h5')
+    subsamp = ((1, 1, 1), (2, 2, 2))
+    blockdim = ((4, 32, 32),)
+
+    # first session writes two tiles
+    writer = npy2bdv.BdvWriter(filename, subsamp=subsamp, blockdim=blockdim, dynamic_setups=True)
+    write_view(writer, tile=0, channel=0, value=100)
+    write_view(writer, tile=1, channel=0, value=200)
+    writer.write_xml()
+    writer.close()
+
+    # a restarted writer appends a third tile and a second channel of tile 0
+    writer = npy2bdv.BdvWriter(filename, subsamp=subsamp, blockdim=blockdim, dynamic_setups=True)
+    assert writer.setup_table == {(0, 0, 0, 0): 0, (0, 0, 1, 0): 1}
+    write_view(writer, tile=2, channel=0, value=300)
+    write_view(writer, tile=0, channel=1, value=400)
+    assert writer.setup_table[(0, 0, 2, 0)] == 2 and writer.setup_table[(0, 1, 0, 0)] == 3
+    writer.write_xml()
+    writer.close()
+
+    # earlier tiles keep their data and stay listed in the XML
+    with h5py.File(filename, 'r') as f:
+        for isetup, value in enumerate((100, 200, 300, 400)):
+            assert numpy.all(f[f't00000/s{isetup:02d}/0/cells'][:] == value), f'setup {isetup} was overwritten'
+    root = ET.parse(str(path / 'tiles.xml')).getroot()
+    setups = {int(vs.find('id').text): (int(vs.find('attributes/tile').text), int(vs.find('attributes/channel').text))
+              for vs in root.findall('./SequenceDescription/ViewSetups/ViewSetup')}
+    assert setups == {0: (0, 0), 1: (1, 0), 2: (2, 0), 3: (0, 1)}, setups
+    registrations = root.findall('./ViewRegistrations/ViewRegistration')
+    assert len(registrations) == 4
+    for vreg in registrations:
+        names = [vt.find('Name').text for vt in vreg.findall('ViewTransform')]
+        assert names == ['shift', 'calibration'], names
+    assert not root.findall('./SequenceDescription/MissingViews/MissingView')
+
+    # a file with setups but without its XML can not be appended to
+    (path / 'tiles.xml').unlink()
+    try:
+        npy2bdv.BdvWriter(filename, subsamp=subsamp, blockdim=blockdim, dynamic_setups=True)
+        raise AssertionError('appending without XML did not raise')
+    except ValueError as e:
+        print(e)
+    shutil.rmtree(path)
@@ -0,0 +1,48 @@
+import numpy
+import tifffile
+from pathlib import Path
+from voxel.readers import bdv, zarr
+from voxel.writers import bdv as bdv_writer, zarr as zarr_writer
+from voxel.writers.blank_blocks import find_blank_blocks
+from voxel.writers.convert import write_stack
+
+if __name__ == '__main__':
+
+    num_frames = 128
+    output_dir = Path('blank_blocks_test')
+    output_dir.mkdir(exist_ok=True)
+
+    # dim background with a bright sample in one corner
+    stack = numpy.random.randint(90, 110, (num_frames, 1024, 1024), dtype='uint16')
+    stack[:64, :300, :300] += 1000
+    background = numpy.full((1024, 1024), 100, dtype='uint16')
+    tifffile.imwrite(output_dir / 'background.tiff', background)
+
+    blank = find_blank_blocks(stack, (4, 256, 256), 150)
+    assert blank.sum() == blank.size - 16*4, 'wrong blank blocks'
+
+    for name, module, reader in (('zarr', zarr_writer, zarr.Reader), ('bdv', bdv_writer, bdv.Reader)):
+        sizes = dict()
+        for blank_threshold in (None, 20):
+            writer = module.Writer(output_dir)
+            writer.acquisition_name = '.'
+            writer.filename = f'{name}_{blank_threshold}'
+            writer.data_type = 'uint16'
+            writer.frame_count_px = num_frames
+            writer.row_count_px = 1024
+            writer.column_count_px = 1024
+            writer.channel = '488'
+            writer.compression = 'gzip' if name == 'bdv' else 'zstd'
+            writer.blank_threshold = blank_threshold
+            writer.blank_background_path = output_dir / 'background.tiff'
+            write_stack(writer, stack)
+            state = writer.signal_write_state
+            writer.close()
+            sizes[blank_threshold] = state['Bytes out [MB]']
+            print(f"{name} blank threshold {blank_threshold}: {state['Bytes out [MB]']:.1f} [MB] written, "
+                  f"{state['Bytes elided [MB]']:.1f} [MB] elided, {state['Write time [s]']:.2f} [s]")
+        path = output_dir / (f'{name}_20.zarr' if name == 'zarr' else f'{name}_20.h5')
+        with reader(path) as frames:
+            assert numpy.array_equal(frames[:64, :300, :300], stack[:64, :300, :300]), 'sample was elided'
+            assert not frames[64:].any(), 'blank blocks were stored'
+        assert sizes[20] < sizes[None]/4, 'blank blocks were not elided'
@@ -0,0 +1,83 @@
+import numpy
+import shutil
+import tifffile
+import time
+from pathlib import Path
+from voxel.processes.cpu.max_projection import MaxProjection
+from voxel.readers import tiff, zarr
+from voxel.writers import tiff as tiff_writer, zarr as zarr_writer
+from voxel.writers.data_structures.chunk_dispatcher import ChunkDispatcher
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+if __name__ == '__main__':
+
+    num_frames = 128
+    img_shape = (512, 512)
+    output_dir = Path('chunk_dispatcher_test')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir()
+
+    stack = numpy.random.randint(0, 4096, (num_frames, *img_shape), dtype='uint16')
+
+    writers = list()
+    for name, module in (('tiff', tiff_writer), ('zarr', zarr_writer)):
+        writer = module.Writer(output_dir)
+        writer.acquisition_name = '.'
+        writer.filename = f'test.{name}'
+        writer.data_type = 'uint16'
+        writer.frame_count_px = num_frames
+        writer.row_count_px = img_shape[0]
+        writer.column_count_px = img_shape[1]
+        writer.channel = '488'
+        writers.append(writer)
+    # writers read whole chunks of their chunk count
+    chunk_size_frames = writers[0].chunk_count_px
+    assert all(writer.chunk_count_px == chunk_size_frames for writer in writers)
+
+    max_projection = MaxProjection(output_dir)
+    max_projection.acquisition_name = '.'
+    max_projection.filename = 'test'
+    max_projection.data_type = 'uint16'
+    max_projection.frame_count_px = num_frames
+    max_projection.row_count_px = img_shape[0]
+    max_projection.column_count_px = img_shape[1]
+    max_projection.z_projection_count_px = num_frames
+    max_projection.chunk_count_px = chunk_size_frames
+
+    # shared memory is created before the consumer processes are forked
+    ring_buffer = SharedRingBuffer((chunk_size_frames, *img_shape), dtype='uint16', slot_count=3)
+    for writer in writers:
+        writer.prepare()
+        writer.start()
+    # without a shared memory name the projection takes chunks
+    max_projection.prepare()
+    max_projection.start()
+
+    dispatcher = ChunkDispatcher(ring_buffer, [*writers, max_projection])
+
+    start_time = time.time()
+    for frame in stack:
+        ring_buffer.add_image(frame)
+        if ring_buffer.buffer_index == chunk_size_frames - 1:
+            slot_index = dispatcher.publish()
+            print(f'published slot {slot_index} after {time.time() - start_time:.2f} [s], '
+                  f'backlog: {dispatcher.backlog}')
+    dispatcher.wait_to_finish()
+    # every slot is free once all consumers released it
+    assert ring_buffer.occupancy == 1, 'slots were not recycled'
+    print(f'high water mark: {ring_buffer.high_water_mark}/{ring_buffer.slot_count} slots')
+
+    for writer in writers:
+        writer.wait_to_finish()
+        writer.close()
+    max_projection.wait_to_finish()
+    dispatcher.close()
+    ring_buffer.close_and_unlink()
+
+    with tiff.Reader(output_dir / 'test.tiff') as frames:
+        assert numpy.array_equal(frames[:], stack), 'tiff stack differs'
+    with zarr.Reader(output_dir / 'test.zarr') as frames:
+        assert numpy.array_equal(frames[:], stack), 'zarr stack differs'
+    mip = tifffile.imread(output_dir / f'test_max_projection_xy_z_{0:06}_{num_frames:06}.tiff')
+    assert numpy.array_equal(mip, stack.max(axis=0)), 'max projection differs'
+    print('tiff, zarr and max projection match the stack')
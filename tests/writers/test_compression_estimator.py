@@ -0,0 +1,41 @@
+import numpy
+import time
+import zlib
+import imagecodecs
+
+from voxel.writers.compression_estimator import CompressionEstimator, BLOCK_SHAPE_PX
+from voxel.writers.tiff import Writer as TiffWriter
+from voxel.writers.bdv import Writer as BdvWriter
+
+# smooth background with shot noise, similar to a cleared sample
+z, y, x = numpy.mgrid[0:8, 0:2048, 0:2048]
+frames = numpy.random.poisson(100 + 400*numpy.exp(-((y - 1024)**2 + (x - 1024)**2)/500**2)).astype('uint16')
+
+estimator = CompressionEstimator()
+
+tiff_writer = TiffWriter('.')
+tiff_writer.compression = 'zstd'
+tiff_writer.compression_level = 3
+tiff_writer.predictor = 'horizontal'
+bdv_writer = BdvWriter('.')
+bdv_writer.compression = 'gzip'
+
+for writer, compress in [(tiff_writer, lambda frames: imagecodecs.zstd_encode(
+                             imagecodecs.delta_encode(frames, axis=-1), level=3)),
+                         (bdv_writer, lambda frames: zlib.compress(frames, 4))]:
+    start_time = time.time()
+    estimate = estimator.estimate(writer, frames, key=('488', 10.0))
+    run_time = time.time() - start_time
+    # reference ratio from compressing every block of the frames
+    block_z, block_y, block_x = BLOCK_SHAPE_PX
+    ratio = frames.nbytes/sum(len(compress(numpy.ascontiguousarray(frames[:, y:y + block_y, x:x + block_x])))
+                              for y in range(0, frames.shape[1], block_y)
+                              for x in range(0, frames.shape[2], block_x))
+    print(f'{writer.compression}: estimate {estimate["ratio"]:.2f} '
+          f'[{estimate["lower"]:.2f}, {estimate["upper"]:.2f}] in {run_time:.3f} [s], full {ratio:.2f}')
+    assert abs(estimate['ratio'] - ratio)/ratio < 0.1, 'estimate is more than 10% off'
+    assert run_time < 1.0, 'estimate took longer than 1 [s]'
+    # the second estimate for the same channel and exposure is cached
+    assert estimator.estimate(writer, frames, key=('488', 10.0)) is estimate
+
+estimator.close()
@@ -0,0 +1,52 @@
+import numpy
+import json
+import tifffile
+from pathlib import Path
+from voxel.writers.convert import convert, find_stacks, open_stack, PROGRESS_FILENAME
+
+if __name__ == '__main__':
+
+    num_frames = 100
+    num_tiles = 3
+    input_dir = Path('convert_input')
+    output_dir = Path('convert_output')
+    input_dir.mkdir(exist_ok=True)
+
+    # uncompressed tiffs written in chunks like the tiff writer
+    stacks = dict()
+    for tile_index in range(num_tiles):
+        stack = numpy.random.randint(0, 4096, (num_frames, 1024, 1024), dtype='uint16')
+        filepath = input_dir / f'tile_{tile_index}.tiff'
+        with tifffile.TiffWriter(filepath, bigtiff=True) as tiff:
+            for z_start in range(0, num_frames, 64):
+                tiff.write(stack[z_start:z_start + 64],
+                           metadata={'axes': 'ZYX', 'PhysicalSizeX': 0.748, 'PhysicalSizeY': 0.748,
+                                     'PhysicalSizeZ': 1, 'Channel': {'Name': ['488']},
+                                     'Plane': {'PositionX': tile_index, 'PositionY': 0, 'PositionZ': 0}})
+        stacks[f'tile_{tile_index}'] = stack
+
+    # convert to compressed zarr on 2 worker processes
+    converted = convert(sorted(input_dir.glob('*.tiff')), 'zarr', output_dir,
+                        settings={'compression': 'zstd'}, worker_count=2)
+    assert len(converted) == num_tiles
+    for name, stack in stacks.items():
+        zarr_stack = find_stacks(output_dir / f'{name}.zarr')[0]
+        assert numpy.array_equal(open_stack(zarr_stack)[0:num_frames], stack), f'{name} does not match'
+    print(f'converted {len(converted)} tiffs to zarr')
+
+    # an interrupted run only redoes stacks that are not recorded
+    progress_path = output_dir / PROGRESS_FILENAME
+    lines = progress_path.read_text().splitlines()
+    progress_path.write_text('\n'.join(lines[:1]) + '\n')
+    converted = convert(sorted(input_dir.glob('*.tiff')), 'zarr', output_dir,
+                        settings={'compression': 'zstd'}, worker_count=2)
+    assert len(converted) == num_tiles - 1, 'resume converted recorded stacks again'
+    print(f'resumed {len(converted)} stacks')
+
+    # convert the zarr stacks on to bdv
+    converted = convert(sorted(output_dir.glob('*.zarr')), 'bdv', output_dir / 'bdv',
+                        settings={'compression': 'gzip'}, worker_count=2)
+    for name, stack in stacks.items():
+        bdv_stack = find_stacks(output_dir / 'bdv' / f'{name}.h5')[0]
+        assert numpy.array_equal(open_stack(bdv_stack)[0:num_frames], stack), f'{name} does not match'
+    print(f'converted {len(converted)} zarrs to bdv')
@@ -0,0 +1,139 @@
+import h5py
+import numpy
+import math
+import os
+import tifffile
+from pathlib import Path
+from ruamel.yaml import YAML
+from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+from voxel.writers.bdv import Writer as BdvWriter
+from voxel.writers.firehose import Writer, Converter, memmap_stack, stack_keys
+from voxel.writers.tiff import Writer as TiffWriter
+
+if __name__ == '__main__':
+
+    this_dir = Path(__file__).parent.resolve() # directory of this test file.
+    config_path = this_dir / Path("test_firehose.yaml")
+    config = YAML().load(Path(config_path))
+
+    chunk_size_frames = 64
+    num_frames = 150
+    num_tiles = 2
+    channels = ['488', '561']
+
+    stack_writer_worker = Writer(config['writer']['path'])
+    stack_writer_worker.row_count_px = 1024
+    stack_writer_worker.column_count_px = 1000
+    stack_writer_worker.x_voxel_size_um = 0.748
+    stack_writer_worker.y_voxel_size_um = 0.748
+    stack_writer_worker.z_voxel_size_um = 1
+    stack_writer_worker.frame_count_px = num_frames
+    stack_writer_worker.data_type = config['writer']['data_type']
+    stack_writer_worker.direct_io = config['writer']['direct_io']
+    stack_writer_worker.preallocation_gb = config['writer']['preallocation_gb']
+    # all tiles go into a single file
+    stack_writer_worker.filename = 'test'
+
+    mem_shape = (chunk_size_frames,
+                 stack_writer_worker.row_count_px,
+                 stack_writer_worker.column_count_px)
+    img_buffer = SharedDoubleBuffer(mem_shape, dtype=config['writer']['data_type'])
+    stacks = dict()
+
+    for tile_index in range(num_tiles):
+        for channel in channels:
+            stack_writer_worker.channel = channel
+            # move tile over 1 mm
+            stack_writer_worker.x_position_mm = 0 + tile_index*1.000
+            stack_writer_worker.y_position_mm = 0
+            stack_writer_worker.z_position_mm = 0
+            stack_writer_worker.prepare()
+            stack_writer_worker.start()
+
+            stack = numpy.random.randint(low=0, high=4096,
+                                         size=(num_frames, *mem_shape[1:]),
+                                         dtype=config['writer']['data_type'])
+            stacks[((tile_index*1.000, 0, 0), channel)] = stack
+            for stack_index in range(num_frames):
+                img_buffer.add_image(stack[stack_index])
+                # Dispatch either a full chunk of frames or the last chunk,
+                # which may not be a multiple of the chunk size.
+                if stack_index % chunk_size_frames == chunk_size_frames - 1 or stack_index == num_frames - 1:
+                    stack_writer_worker.done_reading.wait()
+                    img_buffer.toggle_buffers()
+                    stack_writer_worker.submit_chunk(img_buffer.read_buf_mem_name)
+            stack_writer_worker.wait_to_finish()
+
+    print(stack_writer_worker.signal_write_state)
+    stack_writer_worker.close()
+    img_buffer.close_and_unlink()
+
+    # memory map every stack back and check it
+    filepath = Path(config['writer']['path'], 'test.raw')
+    assert stack_keys(filepath) == list(stacks), 'stacks are missing from the index'
+    for (tile, channel), stack in stacks.items():
+        assert numpy.array_equal(memmap_stack(filepath, tile, channel), stack), f'{tile} {channel} does not match'
+    print(f'read back {len(stacks)} stacks from {filepath}')
+
+    # convert the first stack to tiff in the background
+    tiff_writer = TiffWriter(config['writer']['path'])
+    tiff_writer.acquisition_name = '.'
+    converter = Converter(tiff_writer)
+    tile, channel = list(stacks)[0]
+    converter.convert(filepath, tile, channel, filename='test_converted')
+    converter.wait_to_finish()
+    converter.close()
+    assert numpy.array_equal(tifffile.imread('test_converted.tiff', key=range(num_frames)), stacks[(tile, channel)])
+    print('converted stack matches')
+
+    # convert a stack that is not a multiple of the chunk size to bdv, the
+    # padded frames of the partial last chunk are zero instead of stale.
+    # bdv pyramid blocks need at least 256 px at the coarsest level.
+    assert num_frames % chunk_size_frames != 0
+    bdv_shape = (num_frames, 1024, 1024)
+    bdv_stack_writer = Writer(config['writer']['path'])
+    bdv_stack_writer.row_count_px, bdv_stack_writer.column_count_px = bdv_shape[1:]
+    bdv_stack_writer.x_voxel_size_um = 0.748
+    bdv_stack_writer.y_voxel_size_um = 0.748
+    bdv_stack_writer.z_voxel_size_um = 1
+    bdv_stack_writer.frame_count_px = num_frames
+    bdv_stack_writer.data_type = config['writer']['data_type']
+    bdv_stack_writer.filename = 'test_bdv'
+    bdv_stack_writer.channel = channels[0]
+    bdv_stack_writer.x_position_mm = bdv_stack_writer.y_position_mm = bdv_stack_writer.z_position_mm = 0
+    bdv_stack_writer.prepare()
+    bdv_stack_writer.start()
+    img_buffer = SharedDoubleBuffer((chunk_size_frames, *bdv_shape[1:]), dtype=config['writer']['data_type'])
+    stack = numpy.random.randint(low=1, high=4096, size=bdv_shape, dtype=config['writer']['data_type'])
+    for stack_index in range(num_frames):
+        img_buffer.add_image(stack[stack_index])
+        if stack_index % chunk_size_frames == chunk_size_frames - 1 or stack_index == num_frames - 1:
+            bdv_stack_writer.done_reading.wait()
+            img_buffer.toggle_buffers()
+            bdv_stack_writer.submit_chunk(img_buffer.read_buf_mem_name)
+    bdv_stack_writer.wait_to_finish()
+    bdv_stack_writer.close()
+    img_buffer.close_and_unlink()
+
+    bdv_writer = BdvWriter(config['writer']['path'])
+    bdv_writer.acquisition_name = '.'
+    converter = Converter(bdv_writer)
+    bdv_filepath = Path(config['writer']['path'], 'test_bdv.raw')
+    converter.convert(bdv_filepath, (0, 0, 0), channels[0], filename='test_converted_bdv')
+    converter.wait_to_finish()
+    converter.close()
+    # the h5 file is closed with the writer process
+    bdv_writer.close()
+    with h5py.File('test_converted_bdv.h5', 'r') as f:
+        frames = f['t00000/s00/0/cells'][:]
+    assert frames.shape[0] > num_frames, 'bdv stack is not padded'
+    assert numpy.array_equal(frames[:num_frames], stack), 'bdv stack does not match'
+    assert not frames[num_frames:].any(), 'bdv padding has stale frames'
+    print('converted bdv stack matches')
+    bdv_stack_writer.delete_files()
+    os.remove('test_converted_bdv.h5')
+    os.remove('test_converted_bdv.xml')
+
+    # remove files
+    stack_writer_worker.delete_files()
+    tiff_writer.delete_files()
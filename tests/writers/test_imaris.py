@@ -34,10 +34,13 @@ if __name__ == '__main__':
         stack_writer_worker.theta_deg = 45
         stack_writer_worker.frame_count_px = num_frames
         stack_writer_worker.compression = config['writer']['compression']
+        stack_writer_worker.block_shape_px = config['writer']['block_shape_px']
+        stack_writer_worker.thread_count = config['writer']['thread_count']
         stack_writer_worker.data_type = config['writer']['data_type']
         stack_writer_worker.path = config['writer']['path']
         stack_writer_worker.color = config['writer']['color']
         stack_writer_worker.channel = '488'
+        stack_writer_worker.acquisition_name = '.'
 
         # move tile over 1 mm
         stack_writer_worker.x_position_mm = 0 + tile_index*1.000
@@ -92,8 +95,7 @@ if __name__ == '__main__':
             # Dispatch either a full chunk of frames or the last chunk,
             # which may not be a multiple of the chunk size.
             if chunk_index == chunk_size_frames - 1 or stack_index == last_frame_index:
-                while not stack_writer_worker.done_reading.is_set():
-                    time.sleep(0.001)
+                stack_writer_worker.done_reading.wait()
                 # Dispatch chunk to each StackWriter compression process.
                 # Toggle double buffer to continue writing images.
                 # To read the new data, the StackWriter needs the name of
@@ -104,9 +106,7 @@ if __name__ == '__main__':
                 with chunk_lock:
                     img_buffer.toggle_buffers()
                     if config['writer']['path'] is not None:
-                        stack_writer_worker.shm_name = \
-                            img_buffer.read_buf_mem_name
-                        stack_writer_worker.done_reading.clear()
+                        stack_writer_worker.submit_chunk(img_buffer.read_buf_mem_name)
 
         stack_writer_worker.wait_to_finish()
 
@@ -0,0 +1,84 @@
+import numpy
+import shutil
+import zlib
+from pathlib import Path
+from time import perf_counter
+from voxel.readers import bdv
+from voxel.writers import bdv as bdv_writer
+from voxel.writers.bdv_writer import npy2bdv
+from voxel.writers.compression_estimator import CompressionEstimator
+from voxel.writers.convert import write_stack
+from voxel.writers.noise_codec import NoiseCodec
+
+if __name__ == '__main__':
+
+    gain = bdv_writer.B3D_GAIN
+    read_noise = bdv_writer.B3D_READ_NOISE
+    num_frames = 128
+    output_dir = Path('noise_codec_test')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir()
+
+    # dim background and a bright sample, with shot and read noise
+    rng = numpy.random.default_rng()
+    electrons = numpy.full((num_frames, 1024, 1024), 50.0)
+    electrons[:, 200:700, 300:800] = 1000
+    noise = numpy.sqrt(electrons + read_noise**2)*gain
+    stack = (rng.poisson(electrons)*gain + rng.normal(0, read_noise*gain, electrons.shape)).clip(0).astype('uint16')
+
+    # the error is a fraction of the noise
+    codec = NoiseCodec(gain=gain, read_noise=read_noise, thread_count=8)
+    blocks = [stack[z:z + 4, y:y + 256, x:x + 256]
+              for z in range(0, num_frames, 4) for y in range(0, 1024, 256) for x in range(0, 1024, 256)]
+    start_time = perf_counter()
+    encoded = codec.encode_blocks(blocks)
+    encode_time = perf_counter() - start_time
+    start_time = perf_counter()
+    decoded = codec.decode_blocks(encoded)
+    decode_time = perf_counter() - start_time
+    ratio = stack.nbytes/sum(len(data) for data in encoded)
+    gzip_ratio = sum(block.nbytes for block in blocks[::16]) / \
+        sum(len(zlib.compress(numpy.ascontiguousarray(block), 4)) for block in blocks[::16])
+    error = numpy.concatenate([(block_decoded.astype(float) - block).ravel()/numpy.sqrt(block.ravel()*gain + (read_noise*gain)**2)
+                               for block, block_decoded in zip(blocks[::16], decoded[::16])])
+    assert numpy.abs(error.mean()) < 0.1 and error.std() < 0.5, 'error is not below the noise'
+    print(f'ratio {ratio:.2f} (gzip {gzip_ratio:.2f}), error {error.std():.2f} sigma, '
+          f'encoding {stack.nbytes/1e6/encode_time:.0f} [MB/s], decoding {stack.nbytes/1e6/decode_time:.0f} [MB/s]')
+    codec.close()
+
+    # bdv views written with the codec decode through the readers
+    writer = bdv_writer.Writer(output_dir)
+    writer.acquisition_name = '.'
+    writer.filename = 'naq'
+    writer.data_type = 'uint16'
+    writer.frame_count_px = num_frames
+    writer.row_count_px = 1024
+    writer.column_count_px = 1024
+    writer.channel = '488'
+    writer.compression = 'naq'
+    write_stack(writer, stack)
+    state = writer.signal_write_state
+    writer.close()
+    print(f"bdv naq: compression ratio {state['Compression ratio']:.2f}, {state['Rate [MB/s]']:.0f} [MB/s]")
+    with bdv.Reader(output_dir / 'naq.h5') as frames:
+        assert numpy.array_equal(frames[:], NoiseCodec(gain=gain, read_noise=read_noise).quantize(stack)), \
+            'bdv view does not decode'
+    with bdv.Reader(output_dir / 'naq.h5', level=1) as frames:
+        assert frames.shape == (num_frames//2, 512, 512) and frames[:].any(), 'pyramid level does not decode'
+
+    # planes that cover chunks partially update the encoded chunks
+    bdv_file = npy2bdv.BdvWriter(str(output_dir / 'partial.h5'), compression='naq',
+                                 compression_opts=NoiseCodec(gain=gain, read_noise=read_noise).filter_options,
+                                 overwrite=True)
+    bdv_file.append_view(stack=None, virtual_stack_dim=(9, 1024, 1024))
+    for z_start, z_end in ((0, 3), (3, 9)):
+        bdv_file.append_substack(stack[z_start:z_end], z_start=z_start)
+    bdv_file.write_xml()
+    bdv_file.close()
+    with bdv.Reader(output_dir / 'partial.h5') as frames:
+        expected = NoiseCodec(gain=gain, read_noise=read_noise).quantize(stack[:9])
+        assert numpy.abs(frames[:].astype(int) - expected).max() <= 0.1*expected.max(), 'partial chunks do not decode'
+
+    # the estimator runs the codec in memory
+    estimate = CompressionEstimator().estimate(writer, stack[:8])
+    print(f"estimated ratio {estimate['ratio']:.2f}")
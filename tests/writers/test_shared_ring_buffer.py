@@ -0,0 +1,108 @@
+import numpy
+import time
+from multiprocessing import Event, Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+
+def slow_consumer(ring_buffer: SharedRingBuffer, chunk_count: int):
+    for chunk in range(chunk_count):
+        slot_index = ring_buffer.acquire_ready()
+        chunk_data = ring_buffer.slot_bufs[slot_index]
+        # first frame of every chunk is tagged with the chunk number
+        assert chunk_data[0, 0, 0] == chunk, f'expected chunk {chunk} but got {chunk_data[0, 0, 0]}'
+        # mimic a slow compressing writer
+        time.sleep(0.2)
+        ring_buffer.release(slot_index)
+
+
+def fan_out_consumer(ring_buffer: SharedRingBuffer, chunk_count: int, connection):
+    """Acquire every chunk published to two consumers and report the
+    chunk numbers read."""
+    chunks = list()
+    for chunk in range(chunk_count):
+        slot_index = ring_buffer.acquire_ready(timeout=5)
+        assert slot_index is not None, f'chunk {chunk} was not acquired'
+        chunks.append(int(ring_buffer.slot_bufs[slot_index][0, 0, 0]))
+        ring_buffer.release(slot_index)
+    connection.send(chunks)
+
+
+def legacy_consumer(shape: tuple, connection, done_reading):
+    """Read chunks by shared memory name like a writer fed from a
+    SharedDoubleBuffer, without releasing them."""
+    while (shm_name := connection.recv()) is not None:
+        shm = SharedMemory(shm_name)
+        chunk_data = numpy.ndarray(shape, dtype='uint16', buffer=shm.buf)
+        connection.send(int(chunk_data[0, 0, 0]))
+        del chunk_data
+        shm.close()
+        done_reading.set()
+
+
+if __name__ == '__main__':
+
+    chunk_size_frames = 16
+    chunk_count = 8
+    img_shape = (512, 512)
+
+    ring_buffer = SharedRingBuffer((chunk_size_frames, *img_shape), dtype='uint16', slot_count=4)
+
+    consumer = Process(target=slow_consumer, args=(ring_buffer, chunk_count))
+    consumer.start()
+
+    start_time = time.time()
+    for chunk in range(chunk_count):
+        for frame in range(chunk_size_frames):
+            image = numpy.full(img_shape, chunk, dtype='uint16')
+            ring_buffer.add_image(image)
+            assert ring_buffer.get_last_image()[0, 0] == chunk
+        ring_buffer.toggle_buffers(consumer_count=1)
+        print(f'published chunk {chunk} after {time.time() - start_time:.2f} [s], '
+              f'occupancy: {ring_buffer.occupancy}/{ring_buffer.slot_count}')
+
+    consumer.join()
+    print(f'high water mark: {ring_buffer.high_water_mark}/{ring_buffer.slot_count} slots')
+    ring_buffer.close_and_unlink()
+    del ring_buffer
+
+    # every slot published to two consumers is acquired by both and freed
+    ring_buffer = SharedRingBuffer((chunk_size_frames, 64, 64), dtype='uint16', slot_count=2)
+    connections = [Pipe() for _ in range(2)]
+    consumers = [Process(target=fan_out_consumer, args=(ring_buffer, chunk_count, consumer_connection))
+                 for _, consumer_connection in connections]
+    for consumer in consumers:
+        consumer.start()
+    for chunk in range(chunk_count):
+        for frame in range(chunk_size_frames):
+            ring_buffer.add_image(numpy.full((64, 64), chunk, dtype='uint16'))
+        ring_buffer.toggle_buffers(timeout=5, consumer_count=2)
+    for (connection, _), consumer in zip(connections, consumers):
+        assert connection.recv() == list(range(chunk_count)), 'consumer missed a chunk'
+        consumer.join()
+    # only the write slot is still in use
+    assert ring_buffer.occupancy == 1, f'{ring_buffer.occupancy} slots leaked'
+    ring_buffer.close_and_unlink()
+
+    # the add_image / toggle_buffers / read_buf_mem_name loop of SharedDoubleBuffer
+    # runs past the slot count without releasing slots
+    chunk_shape = (chunk_size_frames, 64, 64)
+    ring_buffer = SharedRingBuffer(chunk_shape, dtype='uint16', slot_count=2)
+    connection, consumer_connection = Pipe()
+    done_reading = Event()
+    done_reading.set()
+    consumer = Process(target=legacy_consumer, args=(chunk_shape, consumer_connection, done_reading))
+    consumer.start()
+    for chunk in range(4*ring_buffer.slot_count):
+        for frame in range(chunk_size_frames):
+            ring_buffer.add_image(numpy.full(chunk_shape[1:], chunk, dtype='uint16'))
+        done_reading.wait()
+        ring_buffer.toggle_buffers(timeout=5)
+        done_reading.clear()
+        connection.send(ring_buffer.read_buf_mem_name)
+        assert connection.recv() == chunk, f'consumer did not read chunk {chunk}'
+    done_reading.wait()
+    connection.send(None)
+    consumer.join()
+    assert ring_buffer.high_water_mark == ring_buffer.slot_count
+    ring_buffer.close_and_unlink()
@@ -27,8 +27,22 @@ if __name__ == '__main__':
     stack_writer_worker.y_voxel_size_um = 0.748
     stack_writer_worker.z_voxel_size_um = 1
     stack_writer_worker.frame_count_px = num_frames
+    # a level that does not fit the compression type is rejected by prepare()
+    stack_writer_worker.compression_level = 99
+    stack_writer_worker.compression = config['writer']['compression']
+    try:
+        stack_writer_worker.prepare()
+        raise AssertionError(f'compression level 99 was accepted for {stack_writer_worker.compression}')
+    except ValueError as e:
+        print(e)
+    # the level may be set before the compression type
+    stack_writer_worker.compression_level = config['writer']['compression_level']
+    stack_writer_worker.predictor = config['writer']['predictor']
+    stack_writer_worker.tile_shape_px = config['writer']['tile_shape_px']
+    stack_writer_worker.compression_thread_count = config['writer']['compression_thread_count']
     stack_writer_worker.data_type = config['writer']['data_type']
     stack_writer_worker.channel = '488'
+    stack_writer_worker.acquisition_name = '.'
     frame_index = 0
     tile_index = 0
 
@@ -88,8 +102,7 @@ if __name__ == '__main__':
             # Dispatch either a full chunk of frames or the last chunk,
             # which may not be a multiple of the chunk size.
             if chunk_index == chunk_size_frames - 1 or stack_index == last_frame_index:
-                while not stack_writer_worker.done_reading.is_set():
-                    time.sleep(0.001)
+                stack_writer_worker.done_reading.wait()
                 # Dispatch chunk to each StackWriter compression process.
                 # Toggle double buffer to continue writing images.
                 # To read the new data, the StackWriter needs the name of
@@ -100,11 +113,10 @@ if __name__ == '__main__':
                 with chunk_lock:
                     img_buffer.toggle_buffers()
                     if config['writer']['path'] is not None:
-                        stack_writer_worker.shm_name = \
-                            img_buffer.read_buf_mem_name
-                        stack_writer_worker.done_reading.clear()
+                        stack_writer_worker.submit_chunk(img_buffer.read_buf_mem_name)
 
         stack_writer_worker.wait_to_finish()
+        print(stack_writer_worker.signal_write_state)
 
         img_buffer.close_and_unlink()
         del img_buffer
@@ -0,0 +1,74 @@
+import logging
+import numpy
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from voxel.readers import tiff
+from voxel.writers.data_structures.chunk_dispatcher import ChunkDispatcher
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+from voxel.writers.tiff import Writer
+
+
+def write_chunks(dispatcher, ring, num_frames, first_frame):
+    """Fill and publish num_frames frames, each filled with its frame index."""
+    chunk_count_px = ring.shape[0]
+    for frame_index in range(num_frames):
+        ring.add_image(numpy.full(ring.shape[1:], first_frame + frame_index, dtype='uint16'))
+        if ring.buffer_index == chunk_count_px - 1 or frame_index == num_frames - 1:
+            dispatcher.publish()
+    dispatcher.wait_to_finish()
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = Path(tempfile.mkdtemp())
+    num_frames = 256
+    img_shape = (128, 128)
+
+    writer = Writer(path)
+    writer.row_count_px = img_shape[0]
+    writer.column_count_px = img_shape[1]
+    writer.frame_count_px = num_frames
+    writer.data_type = 'uint16'
+    writer.channel = '488'
+    writer.acquisition_name = '.'
+    # rings are created before the writer process is started
+    ring = SharedRingBuffer((writer.chunk_count_px, *img_shape), 'uint16', slot_count=2)
+    dispatcher = ChunkDispatcher(ring, [writer])
+
+    # an aborted tile fails instead of waiting for its remaining chunks
+    writer.filename = 'aborted.tiff'
+    writer.prepare()
+    writer.start()
+    write_chunks(dispatcher, ring, writer.chunk_count_px, 0)
+    writer.abort()
+    try:
+        writer.wait_to_finish()
+        raise AssertionError('aborted tile did not raise')
+    except RuntimeError as e:
+        print(e)
+
+    # the next tile is written in full
+    writer.filename = 'next.tiff'
+    writer.prepare()
+    writer.start()
+    write_chunks(dispatcher, ring, num_frames, 1000)
+    writer.wait_to_finish()
+    with tiff.Reader(path / 'next.tiff') as frames:
+        assert numpy.array_equal(frames[:, 0, 0], 1000 + numpy.arange(num_frames)), 'next tile has stale frames'
+
+    # closing mid-tile does not wait for the missing chunks
+    writer.filename = 'closed.tiff'
+    writer.prepare()
+    writer.start()
+    write_chunks(dispatcher, ring, writer.chunk_count_px, 0)
+    start_time = time.time()
+    writer.close()
+    assert time.time() - start_time < 10, 'closing mid-tile blocked'
+    assert writer._tile_failed.is_set(), 'closed tile did not fail'
+
+    dispatcher.close()
+    ring.close_and_unlink()
+    shutil.rmtree(path)
@@ -0,0 +1,69 @@
+import logging
+import numpy
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from voxel.readers import tiff
+from voxel.writers.data_structures.chunk_dispatcher import ChunkDispatcher
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+from voxel.writers.tiff import Writer
+
+
+def write_tile(writer, dispatcher, ring, num_frames, first_frame):
+    """Fill and publish the chunks of a tile, each frame filled with its
+    frame index."""
+    chunk_count_px = ring.shape[0]
+    for frame_index in range(num_frames):
+        ring.add_image(numpy.full(ring.shape[1:], first_frame + frame_index, dtype='uint16'))
+        if ring.buffer_index == chunk_count_px - 1 or frame_index == num_frames - 1:
+            dispatcher.publish()
+    dispatcher.wait_to_finish()
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+    path = Path(tempfile.mkdtemp())
+    num_frames = 256
+    img_shape = (128, 128)
+
+    writer = Writer(path)
+    writer.row_count_px = img_shape[0]
+    writer.column_count_px = img_shape[1]
+    writer.frame_count_px = num_frames
+    writer.data_type = 'uint16'
+    writer.channel = '488'
+    # rings are created before the writer process is started
+    ring = SharedRingBuffer((writer.chunk_count_px, *img_shape), 'uint16', slot_count=2)
+    dispatcher = ChunkDispatcher(ring, [writer])
+
+    # the acquisition folder does not exist, the tile fails before its first chunk
+    writer.acquisition_name = 'missing'
+    writer.filename = 'failed.tiff'
+    writer.prepare()
+    writer.start()
+    producer = threading.Thread(target=write_tile, args=(writer, dispatcher, ring, num_frames, 0), daemon=True)
+    producer.start()
+    producer.join(timeout=30)
+    assert not producer.is_alive(), 'producer blocked on the failed tile'
+    try:
+        writer.wait_to_finish()
+        raise AssertionError('failed tile did not raise')
+    except RuntimeError as e:
+        print(e)
+
+    # the next tile gets its own chunks, not those of the failed tile
+    writer.acquisition_name = '.'
+    writer.filename = 'next.tiff'
+    writer.prepare()
+    writer.start()
+    write_tile(writer, dispatcher, ring, num_frames, 1000)
+    writer.wait_to_finish()
+    with tiff.Reader(path / 'next.tiff') as frames:
+        assert numpy.array_equal(frames[:, 0, 0], 1000 + numpy.arange(num_frames)), 'next tile has stale frames'
+
+    dispatcher.close()
+    writer.close()
+    ring.close_and_unlink()
+    shutil.rmtree(path)
@@ -8,7 +8,7 @@ from ruamel.yaml import YAML
 from threading import Event, Thread
 from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
 from multiprocessing.shared_memory import SharedMemory
-from voxel.writers.zarr_v3 import Writer
+from voxel.writers.zarr import Writer
 
 if __name__ == '__main__':
 
@@ -16,7 +16,7 @@ if __name__ == '__main__':
     config_path = this_dir / Path("test_zarr_v3.yaml")
     config = YAML().load(Path(config_path))
 
-    chunk_size_frames = 32
+    chunk_size_frames = 64
     num_frames = 256
     num_tiles = 1
 
@@ -32,12 +32,14 @@ if __name__ == '__main__':
         stack_writer_worker.y_voxel_size_um = 0.748
         stack_writer_worker.z_voxel_size_um = 1
         stack_writer_worker.frame_count_px = num_frames
+        stack_writer_worker.zarr_version = config['writer']['zarr_version']
         stack_writer_worker.compression = config['writer']['compression']
         stack_writer_worker.compression_level = config['writer']['compression_level']
         stack_writer_worker.shuffle = config['writer']['shuffle']
         stack_writer_worker.data_type = config['writer']['data_type']
         stack_writer_worker.downsample_method = config['writer']['downsample_method']
         stack_writer_worker.channel = '488'
+        stack_writer_worker.acquisition_name = '.'
         stack_writer_worker.filename = 'test'
 
         # move tile over 1 mm
@@ -93,8 +95,7 @@ if __name__ == '__main__':
             # Dispatch either a full chunk of frames or the last chunk,
             # which may not be a multiple of the chunk size.
             if chunk_index == chunk_size_frames - 1 or stack_index == last_frame_index:
-                while not stack_writer_worker.done_reading.is_set():
-                    time.sleep(0.001)
+                stack_writer_worker.done_reading.wait()
                 # Dispatch chunk to each StackWriter compression process.
                 # Toggle double buffer to continue writing images.
                 # To read the new data, the StackWriter needs the name of
@@ -105,11 +106,13 @@ if __name__ == '__main__':
                 with chunk_lock:
                     img_buffer.toggle_buffers()
                     if config['writer']['path'] is not None:
-                        stack_writer_worker.shm_name = \
-                            img_buffer.read_buf_mem_name
-                        stack_writer_worker.done_reading.clear()
+                        stack_writer_worker.submit_chunk(img_buffer.read_buf_mem_name)
 
         stack_writer_worker.wait_to_finish()
+        # the output is sized once the tile finishes
+        write_state = stack_writer_worker.signal_write_state
+        print(write_state)
+        assert write_state['Tile bytes out [MB]'] > 0
 
         img_buffer.close_and_unlink()
         del img_buffer
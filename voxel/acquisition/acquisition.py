@@ -3,18 +3,25 @@ import time
 import threading
 import logging
 import sys
-import shutil
 import os
-import subprocess
-import platform
 from ruamel.yaml import YAML
 from pathlib import Path
-from psutil import virtual_memory
 from gputools import get_device
+from voxel.acquisition.affinity import Placement
+from voxel.acquisition.dry_run import DryRun
+from voxel.acquisition.grab_engine import RING_DEPTH, GrabEngine
+from voxel.acquisition.memory_budget import MemoryPlanner
+from voxel.acquisition.scheduler import TileScheduler
+from voxel.acquisition.storage import StorageManager, pyramid_factor, pyramid_levels
+from voxel.acquisition.tile_planner import TileCostModel, TilePlanner
+from voxel.acquisition.write_benchmark import DURATION_S, SHORT_DURATION_S, WriteBenchmark
 from voxel.instruments.instrument import Instrument
-from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+from voxel.writers.compression_estimator import CompressionEstimator
 import inflection
 
+# Frames grabbed for estimating compression ratios.
+COMPRESSION_SAMPLE_FRAME_COUNT = 8
+
 
 class Acquisition:
 
@@ -30,12 +37,23 @@ class Acquisition:
         # TODO: Validation of config should check that metadata exists and only one
         self.metadata = self._construct_class(self.config['acquisition']['metadata'])
         self.acquisition_name = None    # initialize acquisition_name that will be populated at start of acquisition
+        # in memory compression ratio estimates, cached per channel and exposure
+        self.compression_estimator = CompressionEstimator()
 
         # initialize operations
         for operation_type, operation_dict in self.config['acquisition']['operations'].items():
             setattr(self, operation_type, dict())
             self._construct_operations(operation_type, operation_dict)
 
+        # cpu and numa node placement of the workers of every camera
+        self.placement = Placement(self.config['acquisition'].get('placement', dict()))
+        self._apply_placement()
+
+        # disk space of the volumes written to, with bytes reserved for in-flight tiles
+        self.storage = StorageManager()
+        # chunk counts, ring depth and camera buffer sizes that fit into RAM, set by check_system_memory
+        self.memory_plan = None
+
     def _load_class(self, driver: str, module: str, kwds: dict = dict()):
         """Load in device based on config. Expecting driver, module, and kwds input"""
         self.log.info(f'loading {driver}.{module}')
@@ -69,6 +87,31 @@ class Acquisition:
                 getattr(self, operation_type)[device_name] = {}
             getattr(self, operation_type)[device_name][operation_name] = operation_object
 
+    def _operations(self):
+        """Yield device name, operation name and operation of every operation."""
+        for device_name, operation_dict in self.config['acquisition']['operations'].items():
+            for op_name, op_specs in operation_dict.items():
+                op_type = inflection.pluralize(op_specs['type'])
+                yield device_name, op_name, getattr(self, op_type)[device_name][op_name]
+
+    def _apply_placement(self):
+        """Pin the writer and process workers of every placed camera."""
+        for device_name, op_name, operation in self._operations():
+            cpus = self.placement.cpus(device_name)
+            if cpus is not None and hasattr(operation, 'cpu_affinity'):
+                operation.cpu_affinity = cpus
+
+    def report_placement(self):
+        """Log and return the effective cpus of the grab threads and running
+        worker processes and the numa nodes of the buffers of every camera."""
+        workers = dict()
+        for device_name, op_name, operation in self._operations():
+            # long lived writer processes and per tile process workers
+            process = getattr(operation, '_service', None) or getattr(operation, 'p', None)
+            if getattr(process, 'pid', None) is not None and process.is_alive():
+                workers.setdefault(device_name, dict())[op_name] = process.pid
+        return self.placement.report(workers)
+
     def _construct_class(self, class_specs: dict):
         """Construct a class object based on dictionary specifications
         :param """
@@ -112,8 +155,119 @@ class Acquisition:
         self.acquisition_name = self.metadata.acquisition_name
         self._set_acquisition_name()
         self._verify_acquisition()
+        if 'tile_planner' in self.config['acquisition']:
+            self.plan_tiles(**self.config['acquisition']['tile_planner'])
         self._create_directories()
 
+    def plan_tiles(self, ordering: str = 'serpentine', grouping: str = 'auto'):
+        """Reorder the tiles of the acquisition to minimize the predicted
+        time of stage moves and channel switches.
+
+        :param ordering: one of tile_planner.ORDERINGS
+        :param grouping: one of tile_planner.GROUPINGS
+        :return: predicted total time in seconds
+        """
+        self.log.info(f'planning tile order')
+        # imaging time is the same in any order, include it where the rate is known
+        master_device_type = self.instrument.master_device['type']
+        acquisition_rate_hz = self._acquisition_rate_hz if master_device_type in ('camera', 'daq') else None
+        cost_model = TileCostModel.from_instrument(self.instrument, acquisition_rate_hz)
+        planner = TilePlanner(cost_model, ordering=ordering, grouping=grouping)
+        self.config['acquisition']['tiles'] = planner.plan(self.config['acquisition']['tiles'])
+        return planner.predicted_time_s
+
+    def schedule_tiles(self, setup, acquire, transfer=None, max_pending_transfers: int = 2):
+        """Acquire all tiles, overlapping the setup of the next tile with
+        the writers draining the current tile and transferring earlier tiles
+        in the background. A tile starts only if the local disks have space
+        for it next to the bytes reserved for tiles still being written and
+        its arrays fit into the available RAM, otherwise it waits for the
+        previous tile to drain and for transfers to free space.
+
+        :param setup: setup(tile), moves stages and configures devices
+        :param acquire: acquire(tile), returns once the last frame is grabbed
+        :param transfer: transfer(tile), starts transfers and waits for them
+        :param max_pending_transfers: tiles waiting for transfer before
+            acquisition waits
+        :return: the scheduler, with the timeline of every tile
+        """
+        placement_reported = list()
+
+        def acquire_tile(tile: dict):
+            self._reserve_tile_storage(tile)
+            acquire(tile)
+            # worker processes and grab threads only run once the first tile started
+            if not placement_reported:
+                self.report_placement()
+                placement_reported.append(True)
+
+        def drain_tile(tile: dict):
+            self._drain_writers(tile)
+            self._release_tile_storage(tile, transferred=transfer is not None)
+
+        def transfer_tile(tile: dict):
+            transfer(tile)
+            self._free_tile_storage(tile)
+
+        scheduler = TileScheduler(setup, acquire_tile, drain_tile, transfer_tile if transfer is not None else None,
+                                  check_resources=self.check_tile_resources,
+                                  max_pending_transfers=max_pending_transfers)
+        scheduler.run(self.config['acquisition']['tiles'])
+        return scheduler
+
+    def dry_run(self, **kwargs):
+        """Simulate the acquisition of all tiles on a virtual clock, with
+        an instrument of simulated devices. Keyword arguments are passed to
+        DryRun, e.g. write_speed_mb_s.
+
+        :return: dict of timeline, duration_s, peak_ram_bytes and bytes_per_drive
+        """
+        return DryRun(self, **kwargs).run()
+
+    def grab_engine(self):
+        """Grab engine with one grab thread per camera, publishing the chunks
+        of every camera to its writers and chunk processes. The ring depth
+        comes from the memory plan once check_system_memory ran."""
+        consumers = {camera_id: [*self.writers.get(camera_id, dict()).values(),
+                                 *getattr(self, 'processes', dict()).get(camera_id, dict()).values()]
+                     for camera_id in self.instrument.cameras}
+        ring_depth = self.memory_plan['ring_depth'] if self.memory_plan is not None else RING_DEPTH
+        return GrabEngine(self.instrument.cameras, consumers, placement=self.placement, ring_depth=ring_depth)
+
+    def _drain_writers(self, tile: dict):
+        """Wait for the writers of every camera to finish the tile."""
+        for camera_id in self.writers:
+            for writer in self.writers[camera_id].values():
+                writer.wait_to_finish()
+
+    def _storage_key(self, tile: dict, camera_id: str, writer_id: str):
+        # tiles are dicts of the acquisition config, alive for the whole acquisition
+        return id(tile), camera_id, writer_id
+
+    def _reserve_tile_storage(self, tile: dict):
+        """Reserve the predicted size of a tile on the volume of every writer.
+        Bytes the writer already wrote for the tile are no longer reserved."""
+        for camera_id in self.instrument.cameras:
+            for writer_id, writer in self.writers[camera_id].items():
+                self.storage.reserve(self._storage_key(tile, camera_id, writer_id), writer.path,
+                                     self._predicted_tile_bytes(camera_id, writer_id, tile),
+                                     written_bytes=lambda writer=writer: writer.signal_write_state['Tile bytes out [MB]']*1e6)
+
+    def _release_tile_storage(self, tile: dict, transferred: bool):
+        """Release the reservations of a written tile. If the tile is
+        transferred, its bytes on disk will be freed by the transfer."""
+        for camera_id in self.instrument.cameras:
+            for writer_id, writer in self.writers[camera_id].items():
+                key = self._storage_key(tile, camera_id, writer_id)
+                self.storage.release(key)
+                if transferred:
+                    self.storage.expect_freed(key, writer.path, writer.signal_write_state['Tile bytes out [MB]']*1e6)
+
+    def _free_tile_storage(self, tile: dict):
+        for camera_id in self.instrument.cameras:
+            for writer_id in self.writers[camera_id]:
+                self.storage.freed(self._storage_key(tile, camera_id, writer_id))
+
     def _create_directories(self):
         """Using the latest metadata derived acquisition_name, correctly set writers and transfer and create
         directories if needed"""
@@ -137,12 +291,9 @@ class Acquisition:
     def _set_acquisition_name(self):
         """Iterate through operations and set acquisition name if it has attr"""
 
-        for device_name, operation_dict in self.config['acquisition']['operations'].items():
-            for op_name, op_specs in operation_dict.items():
-                op_type = inflection.pluralize(op_specs['type'])
-                operation = getattr(self, op_type)[device_name][op_name]
-                if hasattr(operation, 'acquisition_name'):
-                    setattr(operation, 'acquisition_name', self.acquisition_name)
+        for device_name, op_name, operation in self._operations():
+            if hasattr(operation, 'acquisition_name'):
+                setattr(operation, 'acquisition_name', self.acquisition_name)
 
     def _verify_acquisition(self):
 
@@ -166,6 +317,11 @@ class Acquisition:
                 raise ValueError(f'More than one operation for device {device_name} is transferring to the same folder.'
                                  f' This will cause data to be overwritten.')
 
+        # check that placed cameras exist
+        for camera_id in self.placement.camera_ids:
+            if camera_id not in self.instrument.cameras:
+                raise ValueError(f'placement of unknown camera {camera_id}. check yaml files.')
+
         # check tile parameters
         for tile in self.config['acquisition']['tiles']:
             position_axes = list(tile['position_mm'].keys())
@@ -183,339 +339,211 @@ class Acquisition:
         return frame_size_mb
 
     def _pyramid_factor(self, levels: int):
-        pyramid_factor = 0
-        for level in range(levels):
-            pyramid_factor += (1 / (2 ** level)) ** 3
-        return pyramid_factor
+        return pyramid_factor(levels)
+
+    def _predicted_tile_bytes(self, camera_id: str, writer_id: str, tile: dict, estimate: bool = False):
+        """Predicted size on disk of a tile written by a writer. Uses the
+        compression ratio the writer measured on earlier tiles, which includes
+        its pyramid, otherwise the estimated compression ratio and the pyramid
+        factor of the writer.
+
+        :param estimate: estimate the compression ratio by grabbing frames if
+            it is not cached, otherwise assume no compression
+        """
+        camera = self.instrument.cameras[camera_id]
+        writer = self.writers[camera_id][writer_id]
+        raw_bytes = tile['steps'] * self._frame_size_mb(camera_id, writer_id) * 1024 ** 2
+        measured_ratio = writer.signal_write_state['Compression ratio']
+        if measured_ratio:
+            return int(raw_bytes / measured_ratio)
+        if estimate:
+            compression_ratio = self._check_compression_ratio(camera_id, writer_id)
+        elif writer.compression != 'none':
+            cached = self.compression_estimator.cached(writer, (writer.channel, camera.exposure_time_ms))
+            compression_ratio = max(cached['lower'], 1.0) if cached is not None else 1.0
+        else:
+            compression_ratio = 1.0
+        return int(raw_bytes * self._pyramid_factor(pyramid_levels(writer)) / compression_ratio)
+
+    def _sample_frames(self, camera):
+        """A few frames for estimating compression, grabbed with the current
+        exposure time and the trigger turned off. The latest frame of the
+        camera is not reused, it may be of another channel or exposure time."""
+        # store initial trigger mode and turn trigger off
+        initial_trigger = dict(camera.trigger)
+        new_trigger = dict(initial_trigger)
+        new_trigger['mode'] = 'off'
+        camera.trigger = new_trigger
+        camera.prepare()
+        camera.start()
+        frames = numpy.stack([camera.grab_frame() for _ in range(COMPRESSION_SAMPLE_FRAME_COUNT)])
+        camera.stop()
+        # reset the trigger
+        camera.trigger = initial_trigger
+        return frames
 
     def _check_compression_ratio(self, camera_id: str, writer_id: str):
+        """Estimate the compression ratio of a writer by compressing sampled
+        blocks of a few frames in memory. Estimates are cached per channel and
+        exposure time. Returns the lower confidence bound, so write speed
+        checks stay conservative."""
         self.log.info(f'estimating acquisition compression ratio')
         # get the correct camera and writer
         camera = self.instrument.cameras[camera_id]
         writer = self.writers[camera_id][writer_id]
         if writer.compression != 'none':
-            # store initial trigger mode
-            initial_trigger = camera.trigger
-            # turn trigger off
-            new_trigger = initial_trigger
-            new_trigger['mode'] = 'off'
-            camera.trigger = new_trigger
-
-            # prepare the writer
-            writer.row_count_px = camera.height_px
-            writer.column_count_px = camera.width_px
-            writer.frame_count_px = writer.chunk_count_px
-            writer.filename = 'compression_ratio_test'
-
-            chunk_size = writer.chunk_count_px
-            chunk_lock = threading.Lock()
-            img_buffer = SharedDoubleBuffer((chunk_size, camera.height_px, camera.width_px),
-                                            dtype=writer.data_type)
-
-            # set up and start writer and camera
-            writer.prepare()
-            camera.prepare()
-            writer.start()
-            camera.start()
-
-            frame_index = 0
-            for frame_index in range(writer.chunk_count_px):
-                # grab camera frame
-
-                current_frame = camera.grab_frame()
-                # put into image buffer
-                img_buffer.write_buf[frame_index] = current_frame
-                frame_index += 1
-
-            while not writer.done_reading.is_set():
-                time.sleep(0.001)
-
-            with chunk_lock:
-                img_buffer.toggle_buffers()
-                if writer.path is not None:
-                    writer.shm_name = \
-                        img_buffer.read_buf_mem_name
-                    writer.done_reading.clear()
-
-                    # close writer and camera
-            writer.wait_to_finish()
-            camera.stop()
-
-            # reset the trigger
-            camera.trigger = initial_trigger
-
-            # clean up the image buffer
-            img_buffer.close_and_unlink()
-            del img_buffer
-
-            # check the compressed file size
-            filepath = str((writer.path / Path(f"{writer.filename}")).absolute())
-            compressed_file_size_mb = os.stat(filepath).st_size / (1024 ** 2)
-            # calculate the raw file size
-            frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-            # get pyramid factor
-            pyramid_factor = self._pyramid_factor(levels=3)
-            raw_file_size_mb = frame_size_mb * writer.frame_count_px * pyramid_factor
-            # calculate the compression ratio
-            compression_ratio = raw_file_size_mb / compressed_file_size_mb
-            # delete the files
-            writer.delete_files()
+            key = (writer.channel, camera.exposure_time_ms)
+            try:
+                estimate = self.compression_estimator.cached(writer, key)
+                if estimate is None:
+                    estimate = self.compression_estimator.estimate(writer, self._sample_frames(camera), key=key)
+            except ValueError as e:
+                self.log.warning(f'{e} assuming no compression for camera: {camera_id} writer: {writer_id}')
+                return 1.0
+            self.log.info(f"compression ratio for camera: {camera_id} writer: {writer_id} ~ "
+                          f"{estimate['ratio']:.1f} [{estimate['lower']:.1f}, {estimate['upper']:.1f}]")
+            compression_ratio = max(estimate['lower'], 1.0)
         else:
             compression_ratio = 1.0
         self.log.info(f'compression ratio for camera: {camera_id} writer: {writer_id} ~ {compression_ratio:.1f}')
         return compression_ratio
 
     def check_local_acquisition_disk_space(self):
-        """Checks local and ext disk space before scan to see if disk has enough space scan
+        """Checks local disk space before scan to see if the volumes of the writers have enough space for
+        all tiles
         """
         self.log.info(f"checking total local storage directory space")
-        drives = dict()
+        required_bytes = dict()
         for camera_id, camera in self.instrument.cameras.items():
-            data_size_gb = 0
             for writer_id, writer in self.writers[camera_id].items():
-                # if windows
-                if platform.system() == 'Windows':
-                    local_drive = os.path.splitdrive(writer.path)[0]
-                # if unix
-                else:
-                    abs_path = os.path.abspath(writer.path)
-                    # TODO FIX THIS, SYNTAX FOR UNIX DRIVES?
-                    local_drive = '/'
                 for tile in self.config['acquisition']['tiles']:
-                    frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                    frame_count_px = tile['steps']
-                    data_size_gb += frame_count_px * frame_size_mb / 1024
-                drives.setdefault(local_drive, []).append(data_size_gb)
-
-        for drive in drives:
-            required_size_gb = sum(drives[drive])
-            self.log.info(f'required disk space = {required_size_gb:.1f} [GB] on drive {drive}')
-            free_size_gb = shutil.disk_usage(drive).free / 1024 ** 3
-            if data_size_gb >= free_size_gb:
-                self.log.error(f"only {free_size_gb:.1f} available on drive: {drive}")
-                raise ValueError(f"only {free_size_gb:.1f} available on drive: {drive}")
-            else:
-                self.log.info(f'available disk space = {free_size_gb:.1f} [GB] on drive {drive}')
+                    required_bytes[writer.path] = required_bytes.get(writer.path, 0) + \
+                        self._predicted_tile_bytes(camera_id, writer_id, tile, estimate=True)
+        if self.storage.decide(required_bytes) != 'proceed':
+            raise ValueError(f'not enough local disk space for the acquisition.')
 
     def check_external_acquisition_disk_space(self):
-        """Checks local and ext disk space before scan to see if disk has enough space scan
+        """Checks external disk space before scan to see if the volumes of the transfers have enough space
+        for all tiles
         """
         self.log.info(f"checking total external storage directory space")
-        if self.transfers:
-            drives = dict()
-            for camera_id, camera in self.instrument.cameras.items():
-                for transfer_id, transfer in self.transfers[camera_id].items():
-                    for writer_id, writer in self.writers[camera_id].items():
-                        data_size_gb = 0
-                        # if windows
-                        if platform.system() == 'Windows':
-                            external_drive = os.path.splitdrive(transfer.external_path)[0]
-                        # if unix
-                        else:
-                            abs_path = os.path.abspath(transfer.external_path)
-                            # TODO FIX THIS, SYNTAX FOR UNIX DRIVES?
-                            external_drive = '/'
-                        for tile in self.config['acquisition']['tiles']:
-                            frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                            frame_count_px = tile['steps']
-                            data_size_gb += frame_count_px * frame_size_mb / 1024
-                        drives.setdefault(external_drive, []).append(data_size_gb)
-            for drive in drives:
-                required_size_gb = sum(drives[drive])
-                self.log.info(f'required disk space = {required_size_gb:.1f} [GB] on drive {drive}')
-                free_size_gb = shutil.disk_usage(drive).free / 1024 ** 3
-                if data_size_gb >= free_size_gb:
-                    self.log.error(f"only {free_size_gb:.1f} available on drive: {drive}")
-                    raise ValueError(f"only {free_size_gb:.1f} available on drive: {drive}")
-                else:
-                    self.log.info(f'available disk space = {free_size_gb:.1f} [GB] on drive {drive}')
+        if getattr(self, 'transfers', None):
+            required_bytes = self._external_bytes(self.config['acquisition']['tiles'], estimate=True)
+            if self.storage.decide(required_bytes) != 'proceed':
+                raise ValueError(f'not enough external disk space for the acquisition.')
         else:
             raise ValueError(f'no transfers configured. check yaml files.')
 
     def check_local_tile_disk_space(self, tile: dict):
-        """Checks local and ext disk space before scan to see if disk has enough space scan
+        """Checks local disk space for the next tile, next to the bytes reserved for tiles still being
+        written. Returns True if the tile fits, False if it fits once pending transfers free space
         """
         self.log.info(f"checking local storage directory space for next tile")
-        drives = dict()
+        required_bytes = dict()
         for camera_id, camera in self.instrument.cameras.items():
             for writer_id, writer in self.writers[camera_id].items():
-                data_size_gb = 0
-                # if windows
-                if platform.system() == 'Windows':
-                    local_drive = os.path.splitdrive(writer.path)[0]
-                # if unix
-                else:
-                    abs_path = os.path.abspath(self.writer.path)
-                    local_drive = '/'
-
-                frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                frame_count_px = tile['steps']
-                data_size_gb += frame_count_px * frame_size_mb / 1024
-
-                drives.setdefault(local_drive, []).append(data_size_gb)
-
-        for drive in drives:
-            required_size_gb = sum(drives[drive])
-            self.log.info(f'required disk space = {required_size_gb:.1f} [GB] on drive {drive}')
-            free_size_gb = shutil.disk_usage(drive).free / 1024 ** 3
-            if data_size_gb >= free_size_gb:
-                self.log.error(f"only {free_size_gb:.1f} available on drive: {drive}")
-                return False  # not enough local disk space
-            else:
-                self.log.info(f'available disk space = {free_size_gb:.1f} [GB] on drive {drive}')
-                return True  # enough local disk space
+                required_bytes[writer.path] = required_bytes.get(writer.path, 0) + \
+                    self._predicted_tile_bytes(camera_id, writer_id, tile)
+        decision = self.storage.decide(required_bytes)
+        if decision == 'insufficient':
+            raise ValueError(f'not enough local disk space for tile, even after pending transfers.')
+        return decision == 'proceed'
+
+    def check_tile_memory(self, tile: dict):
+        """Checks available RAM for the next tile. Camera buffers and chunk rings are kept across tiles and
+        budgeted by check_system_memory, the arrays allocated for every tile, i.e. writer chunks, pyramid
+        temporaries, projections and routine stacks, must fit into the available RAM. Returns True if they fit
+        """
+        self.log.info(f"checking available system memory for next tile")
+        planner = MemoryPlanner(self, tiles=[tile])
+        required_bytes = sum(planner.tile_items().values())
+        self.log.info(f'required RAM for tile = {required_bytes / 1024 ** 3:.1f} [GB], '
+                      f'available RAM = {planner.budget_bytes / 1024 ** 3:.1f} [GB]')
+        return required_bytes <= planner.budget_bytes
+
+    def check_tile_resources(self, tile: dict):
+        """Checks local disk space and RAM for the next tile. Returns True if the tile can start
+        """
+        return self.check_local_tile_disk_space(tile) and self.check_tile_memory(tile)
 
     def check_external_tile_disk_space(self, tile: dict):
-        """Checks local and ext disk space before scan to see if disk has enough space scan
+        """Checks external disk space for the next tile
         """
         self.log.info(f"checking external storage directory space for next tile")
-        if self.transfers:
-            drives = dict()
-            for camera_id, camera in self.instrument.cameras.items():
-                data_size_gb = 0
-                # if windows
-                if platform.system() == 'Windows':
-                    external_drive = os.path.splitdrive(self.transfers[camera_id].external_path)[0]
-                # if unix
-                else:
-                    abs_path = os.path.abspath(self.transfers[camera_id].external_path)
-                    # TODO FIX THIS
-                    external_drive = '/'
-                frame_size_mb = self._frame_size_mb(camera_id)
-                frame_count_px = tile['steps']
-                data_size_gb += frame_count_px * frame_size_mb / 1024
-                drives.setdefault(external_drive, []).append(data_size_gb)
-            for drive in drives:
-                required_size_gb = sum(drives[drive])
-                self.log.info(f'required disk space = {required_size_gb:.1f} [GB] on drive {drive}')
-                free_size_gb = shutil.disk_usage(drive).free / 1024 ** 3
-                if data_size_gb >= free_size_gb:
-                    self.log.error(f"only {free_size_gb:.1f} available on drive: {drive}")
-                    raise ValueError(f"only {free_size_gb:.1f} available on drive: {drive}")
-                else:
-                    self.log.info(f'available disk space = {free_size_gb:.1f} [GB] on drive {drive}')
+        if getattr(self, 'transfers', None):
+            if self.storage.decide(self._external_bytes([tile])) != 'proceed':
+                raise ValueError(f'not enough external disk space for tile.')
         else:
             raise ValueError(f'no transfers configured. check yaml files.')
 
-    def check_write_speed(self, size='16Gb', bs='1M', direct=1, numjobs=1,
-                          iodepth=1, runtime=0):
-        """Check local read/write speeds to make sure it can keep up with acquisition
-
-        :param size: Size of test file
-        :param bs: Block size in bytes used for I/O units
-        :param direct: Specifying buffered (0) or unbuffered (1) operation
-        :param numjobs: Number of clones of this job. Each clone of job is spawned as an independent thread or process
-        :param ioengine: Defines how the job issues I/O to the file
-        :param iodepth: Number of I/O units to keep in flight against the file.
-        :param runtime: Limit runtime. The test will run until it completes the configured I/O workload or until it has
-                        run for this specified amount of time, whichever occurs first
+    def _external_bytes(self, tiles: list, estimate: bool = False):
+        """Predicted bytes of tiles on the external path of every transfer."""
+        required_bytes = dict()
+        for camera_id, camera in self.instrument.cameras.items():
+            for transfer_id, transfer in self.transfers.get(camera_id, dict()).items():
+                for writer_id, writer in self.writers[camera_id].items():
+                    for tile in tiles:
+                        required_bytes[transfer.external_path] = required_bytes.get(transfer.external_path, 0) + \
+                            self._predicted_tile_bytes(camera_id, writer_id, tile, estimate=estimate)
+        return required_bytes
+
+    def check_write_speed(self, short: bool = True, direct: bool = True):
+        """Check local and external write speeds to make sure they can keep up with acquisition. Every volume
+        is benchmarked with one thread per writer or transfer writing to it, each writing chunks of its
+        configured size
+
+        :param short: benchmark all volumes in SHORT_DURATION_S, otherwise DURATION_S per volume
+        :param direct: write unbuffered (O_DIRECT), otherwise sync every chunk
+        :return: dict of volume to benchmark result
         """
         self.log.info(f"checking write speed to local and external directories")
-        # windows ioengine
-        if platform.system() == 'Windows':
-            ioengine = 'windowsaio'
-        # unix ioengine
-        else:
-            ioengine = 'posixaio'
-
-        drives = dict()
-        camera_speed_mb_s = dict()
-
+        volumes = dict()
+        acquisition_rate_hz = self._acquisition_rate_hz
         # loop over cameras and see where they are acquiring data
         for camera_id, camera in self.instrument.cameras.items():
             for writer_id, writer in self.writers[camera_id].items():
-                # check the compression ratio for this camera
-                compression_ratio = self._check_compression_ratio(camera_id, writer_id)
-                # grab the frame size and acquisition rate
-                frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                acquisition_rate_hz = self._acquisition_rate_hz
-                local_path = writer.path
-                # strip drive letters from paths so that we can combine
-                # cameras acquiring to the same drives
-                if platform.system() == 'Windows':
-                    local_drive_letter = os.path.splitdrive(local_path)[0]
-                # if unix
-                else:
-                    # TODO FIX THIS -> what is syntax for unix drives?
-                    local_abs_path = os.path.abspath(local_path)
-                    local_drive_letter = '/'
-                # add into drives dictionary append to list if same drive letter
-                drives.setdefault(local_drive_letter, []).append(local_path)
-                camera_speed_mb_s.setdefault(local_drive_letter, []).append(
-                    acquisition_rate_hz * frame_size_mb / compression_ratio)
-                if self.transfers:
-                    for transfer_id, transfer in self.transfers[camera_id].items():
-                        external_path = transfer.external_path
-                        # strip drive letters from paths so that we can combine
-                        # cameras acquiring to the same drives
-                        if platform.system() == 'Windows':
-                            external_drive_letter = os.path.splitdrive(local_path)[0]
-                        # if unix
-                        else:
-                            # TODO FIX THIS -> what is syntax for unix drives?
-                            external_abs_path = os.path.abspath(local_path)
-                            external_drive_letter = '/'
-                        # add into drives dictionary append to list if same drive letter
-                        drives.setdefault(external_drive_letter, []).append(external_path)
-                        camera_speed_mb_s.setdefault(external_drive_letter, []).append(
-                            acquisition_rate_hz * frame_size_mb)
-
-        for drive in drives:
-            # if more than one stream on this drive, just test the first directory location
-            local_path = drives[drive][0]
-            test_filename = Path(f'{local_path}/iotest')
-            f = open(test_filename, 'a')  # Create empty file to check reading/writing speed
-            f.close()
-            try:
-                output = subprocess.check_output(
-                    fr'fio --name=test --filename={test_filename} --size={size} --rw=write --bs={bs} '
-                    fr'--direct={direct} --numjobs={numjobs} --ioengine={ioengine} --iodepth={iodepth} '
-                    fr'--runtime={runtime} --startdelay=0 --thread --group_reporting', shell=True)
-                out = str(output)
-                # Converting MiB to MB = (10**6/2**20)
-                write_speed_mb_s = round(
-                    float(out[out.find('BW=') + len('BW='):out.find('MiB/s')]) / (10 ** 6 / 2 ** 20))
-
-                total_speed_mb_s = sum(camera_speed_mb_s[drive])
-                # check if drive write speed exceeds the sum of all cameras streaming to this drive
-                if write_speed_mb_s < total_speed_mb_s:
-                    self.log.warning(f'write speed too slow on drive {drive}')
-                    raise ValueError(f'write speed too slow on drive {drive}')
-
-                self.log.info(f'available write speed = {write_speed_mb_s:.1f} [MB/sec] to directory {drive}')
-                self.log.info(f'required write speed = {total_speed_mb_s:.1f} [MB/sec] to directory {drive}')
-
-            except subprocess.CalledProcessError:
-                self.log.warning('fios not installed on computer. Cannot verify read/write speed')
-            finally:
-                # Delete test file
-                os.remove(test_filename)
+                # size of a chunk on disk, with the compression ratio and pyramid of this writer
+                chunk_bytes = self._predicted_tile_bytes(camera_id, writer_id, {'steps': writer.chunk_count_px},
+                                                         estimate=True)
+                speed_mb_s = acquisition_rate_hz * chunk_bytes / writer.chunk_count_px / 1e6
+                paths = [writer.path] + [transfer.external_path for transfer in
+                                         getattr(self, 'transfers', dict()).get(camera_id, dict()).values()]
+                # combine cameras acquiring and transferring to the same volumes
+                for path in paths:
+                    drive = volumes.setdefault(self.storage.volume(path),
+                                               {'path': path, 'chunk_bytes': [], 'speed_mb_s': []})
+                    drive['chunk_bytes'].append(chunk_bytes)
+                    drive['speed_mb_s'].append(speed_mb_s)
+
+        duration_s = SHORT_DURATION_S / len(volumes) if short else DURATION_S
+        results = dict()
+        for drive, streams in volumes.items():
+            benchmark = WriteBenchmark(streams['path'], streams['chunk_bytes'], direct=direct, short=short)
+            results[drive] = benchmark.run(duration_s)
+            write_speed_mb_s = results[drive]['Rate [MB/s]']
+            total_speed_mb_s = sum(streams['speed_mb_s'])
+            self.log.info(f'available write speed = {write_speed_mb_s:.1f} [MB/sec] to volume {drive}, '
+                          f'chunk latency p99 = {results[drive]["Latency p99 [s]"]:.2f} [s]')
+            self.log.info(f'required write speed = {total_speed_mb_s:.1f} [MB/sec] to volume {drive}')
+            # check if drive write speed exceeds the sum of all cameras streaming to this drive
+            if write_speed_mb_s < total_speed_mb_s:
+                self.log.warning(f'write speed too slow on volume {drive}')
+                raise ValueError(f'write speed too slow on volume {drive}')
+        return results
 
     def check_system_memory(self):
-        """Make sure this machine can image under the specified configuration.
+        """Make sure this machine can image under the specified configuration. Builds an itemized budget of
+        camera buffers, chunk rings, writer chunks, pyramids, projections and routine stacks, and applies the
+        largest chunk count, ring depth and camera buffer sizes that fit into the available RAM.
 
-        :param channel_count: the number of channels we want to image with.
-        :param mem_chunk: the number of images to hold in one chunk for
-            compression
+        :return: the memory plan, also kept as memory_plan
         :raises MemoryError:
         """
         self.log.info(f"checking available system memory")
-        # Calculate double buffer size for all channels.
-        memory_gb = 0
-        for camera_id, camera in self.instrument.cameras.items():
-            for writer_id, writer in self.writers[camera_id].items():
-                chunk_count_px = writer.chunk_count_px
-                # factor of 2 for concurrent chunks being written/read
-                frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                memory_gb += 2 * chunk_count_px * frame_size_mb / 1024
-
-        free_memory_gb = virtual_memory()[1] / 1024 ** 3
-
-        self.log.info(f'required RAM = {memory_gb:.1f} [GB]')
-        self.log.info(f'available RAM = {free_memory_gb:.1f} [GB]')
-
-        if free_memory_gb < memory_gb:
-            raise MemoryError('system does not have enough memory to run')
+        planner = MemoryPlanner(self)
+        self.memory_plan = planner.plan()
+        planner.apply(self.memory_plan)
+        return self.memory_plan
 
     def check_gpu_memory(self):
         # check GPU resources for downscaling
@@ -541,4 +569,8 @@ class Acquisition:
 
     def close(self):
         """Close functionality"""
-        pass
+        # shut down the long lived writer processes
+        for camera_id in self.writers:
+            for writer_id, writer in self.writers[camera_id].items():
+                writer.close()
+        self.compression_estimator.close()
@@ -0,0 +1,290 @@
+import logging
+import os
+import platform
+import psutil
+import re
+import threading
+from pathlib import Path
+
+# Linux sysfs directory listing the NUMA nodes and their cpus.
+NODE_PATH = Path('/sys/devices/system/node')
+# Bytes touched at once when placing memory, one page of every 4 KiB would do.
+TOUCH_BLOCK_BYTES = 64 * 1024 ** 2
+
+PLACEMENT_KEYS = [
+    "numa_node",
+    "cpus",
+    "grab_cpus"
+]
+
+def parse_cpu_list(cpus):
+    """Cpu indices of a cpu list like '0-7,16-23', an int or a list of both.
+
+    :param cpus: cpu list string, cpu index or list of cpu indices and lists
+    :return: sorted list of cpu indices
+    """
+    if isinstance(cpus, int):
+        return [cpus]
+    if isinstance(cpus, (list, tuple, set)):
+        return sorted({cpu for item in cpus for cpu in parse_cpu_list(item)})
+    indices = set()
+    for part in str(cpus).replace(' ', '').split(','):
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', part)
+        if match is None:
+            raise ValueError(f"cpu list {cpus!r} must look like '0-7,16'.")
+        first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+        if last < first:
+            raise ValueError(f"cpu range {part!r} is descending.")
+        indices.update(range(first, last + 1))
+    return sorted(indices)
+
+
+def format_cpu_list(cpus):
+    """Cpu list string like '0-7,16' of cpu indices."""
+    ranges = list()
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f'{first}-{last}' if last > first else f'{first}' for first, last in ranges)
+
+
+def numa_nodes():
+    """Cpus of every NUMA node. Without NUMA information, e.g. on Windows,
+    all cpus form node 0."""
+    nodes = dict()
+    if NODE_PATH.is_dir():
+        for node_path in NODE_PATH.glob('node[0-9]*'):
+            cpulist = (node_path / 'cpulist').read_text().strip()
+            if cpulist:
+                nodes[int(node_path.name[4:])] = parse_cpu_list(cpulist)
+    if not nodes:
+        nodes[0] = list(range(psutil.cpu_count()))
+    return dict(sorted(nodes.items()))
+
+
+def cpu_node(cpu: int):
+    """NUMA node of a cpu."""
+    for node, cpus in numa_nodes().items():
+        if cpu in cpus:
+            return node
+    raise ValueError(f"cpu {cpu} is not on any NUMA node.")
+
+
+def pin_process(cpus: list, pid: int = None):
+    """Pin all threads of a process to cpus. Threads the process starts
+    later inherit the affinity, e.g. compression threads of a writer.
+
+    :param cpus: cpu indices
+    :param pid: process id, defaults to the calling process
+    :return: effective cpus of the process
+    """
+    pid = os.getpid() if pid is None else pid
+    if hasattr(os, 'sched_setaffinity'):
+        # Linux pins single threads, so pin every thread of the process
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            try:
+                os.sched_setaffinity(int(tid), cpus)
+            except ProcessLookupError:
+                # thread exited meanwhile
+                pass
+        return sorted(os.sched_getaffinity(pid))
+    process = psutil.Process(pid)
+    process.cpu_affinity(list(cpus))
+    return sorted(process.cpu_affinity())
+
+
+def pin_current_thread(cpus: list):
+    """Pin the calling thread to cpus, e.g. a camera grab thread.
+
+    :param cpus: cpu indices
+    :return: effective cpus of the thread
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return sorted(os.sched_getaffinity(0))
+    if platform.system() == 'Windows':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetThreadAffinityMask.restype = ctypes.c_size_t
+        kernel32.SetThreadAffinityMask.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        mask = sum(1 << cpu for cpu in cpus)
+        if not kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), mask):
+            raise OSError(f"setting thread affinity to cpus {format_cpu_list(cpus)} failed.")
+        return sorted(cpus)
+    raise NotImplementedError(f"thread affinity is not supported on {platform.system()}.")
+
+
+def touch_memory(buffer, cpus: list):
+    """Allocate the pages of a buffer on the NUMA node of cpus. Pages are
+    allocated on the node of the thread that first writes them, so the
+    buffer is zeroed from a thread pinned to cpus. Pages that were already
+    written keep their node.
+
+    :param buffer: writable buffer, e.g. the buf of a SharedMemory
+    :param cpus: cpu indices of the node
+    """
+    def zero():
+        pin_current_thread(cpus)
+        view = memoryview(buffer).cast('B')
+        zeros = bytes(min(TOUCH_BLOCK_BYTES, len(view)))
+        for start in range(0, len(view), TOUCH_BLOCK_BYTES):
+            stop = min(start + TOUCH_BLOCK_BYTES, len(view))
+            view[start:stop] = zeros[:stop - start]
+        view.release()
+    thread = threading.Thread(target=zero, name='touch_memory')
+    thread.start()
+    thread.join()
+
+
+def shared_memory_nodes(shm_name: str, pid: int = None):
+    """Pages of a shared memory segment per NUMA node, as mapped by a
+    process. Empty where /proc/<pid>/numa_maps is not available.
+
+    :param shm_name: name of the SharedMemory
+    :param pid: process id, defaults to the calling process
+    :return: dict of node to page count
+    """
+    numa_maps = Path(f'/proc/{os.getpid() if pid is None else pid}/numa_maps')
+    nodes = dict()
+    try:
+        lines = numa_maps.read_text().splitlines()
+    except OSError:
+        return nodes
+    for line in lines:
+        if f'/{shm_name.lstrip("/")} ' in line + ' ':
+            for node, pages in re.findall(r'\bN(\d+)=(\d+)', line):
+                nodes[int(node)] = nodes.get(int(node), 0) + int(pages)
+    return nodes
+
+
+class Placement:
+    """Placement of the acquisition workers of every camera on cpus and
+    NUMA nodes, from the placement section of the acquisition yaml. The
+    grab thread, shared buffers, writer processes with their compression
+    threads and processes of a camera are placed on the same node, so
+    chunks are never read across the socket interconnect.
+
+    .. code-block: yaml
+
+        placement:
+          camera_0:
+            numa_node: 0
+          camera_1:
+            cpus: 16-31
+            grab_cpus: 16
+
+    numa_node places all workers of a camera on the cpus of the node, cpus
+    places them on a core set instead. grab_cpus optionally gives the grab
+    thread cores of its own. Cameras without placement are not pinned.
+    """
+
+    def __init__(self, config: dict = None):
+        """
+
+        :param config: dict of camera id to placement dict
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._nodes = numa_nodes()
+        self._cpus = dict()
+        self._grab_cpus = dict()
+        for camera_id, camera_placement in (config or dict()).items():
+            unknown = set(camera_placement) - set(PLACEMENT_KEYS)
+            if unknown:
+                raise ValueError("placement keys must be one of %r." % PLACEMENT_KEYS)
+            if 'cpus' in camera_placement:
+                cpus = parse_cpu_list(camera_placement['cpus'])
+            elif 'numa_node' in camera_placement:
+                node = camera_placement['numa_node']
+                if node not in self._nodes:
+                    raise ValueError(f"numa node of {camera_id} must be one of {list(self._nodes)}.")
+                cpus = self._nodes[node]
+            else:
+                raise ValueError(f"placement of {camera_id} needs numa_node or cpus.")
+            grab_cpus = parse_cpu_list(camera_placement.get('grab_cpus', cpus))
+            all_cpus = {cpu for node_cpus in self._nodes.values() for cpu in node_cpus}
+            for name, core_set in (('cpus', cpus), ('grab cpus', grab_cpus)):
+                if not core_set or not set(core_set) <= all_cpus:
+                    raise ValueError(f"{name} of {camera_id} must be within {format_cpu_list(all_cpus)}.")
+            self._cpus[camera_id] = cpus
+            self._grab_cpus[camera_id] = grab_cpus
+        # effective placement recorded while pinning
+        self._pinned_grab_threads = dict()
+        self._placed_buffers = dict()
+
+    @property
+    def camera_ids(self):
+        return list(self._cpus)
+
+    def cpus(self, camera_id: str):
+        """Cpus of the writers and processes of a camera, None if not placed."""
+        return self._cpus.get(camera_id)
+
+    def grab_cpus(self, camera_id: str):
+        """Cpus of the grab thread of a camera, None if not placed."""
+        return self._grab_cpus.get(camera_id)
+
+    def numa_node(self, camera_id: str):
+        """NUMA node of the memory of a camera, None if not placed."""
+        if camera_id not in self._cpus:
+            return None
+        return cpu_node(self._cpus[camera_id][0])
+
+    def pin_grab_thread(self, camera_id: str):
+        """Pin the calling grab thread of a camera. Call first thing in the
+        grab thread, before buffers are touched."""
+        grab_cpus = self.grab_cpus(camera_id)
+        if grab_cpus is None:
+            return None
+        effective_cpus = pin_current_thread(grab_cpus)
+        self._pinned_grab_threads[camera_id] = (threading.current_thread().name, effective_cpus)
+        self.log.info(f'pinned grab thread of {camera_id} to cpus {format_cpu_list(effective_cpus)}')
+        return effective_cpus
+
+    def place_buffer(self, camera_id: str, buffer):
+        """Allocate the shared memory of a double or ring buffer on the NUMA
+        node of a camera. Call right after creating the buffer, before any
+        frames are written to it."""
+        cpus = self.cpus(camera_id)
+        if cpus is None:
+            return
+        for mem in buffer.mem_blocks:
+            touch_memory(mem.buf, cpus)
+        self._placed_buffers.setdefault(camera_id, list()).extend(mem.name for mem in buffer.mem_blocks)
+        self.log.info(f'placed {len(buffer.mem_blocks)} buffers of {camera_id} on numa node {self.numa_node(camera_id)}')
+
+    def report(self, workers: dict = dict()):
+        """Effective placement of every camera: the cpus of its grab thread,
+        of its running worker processes and the NUMA nodes its buffer pages
+        are on.
+
+        :param workers: dict of camera id to dict of worker name to process id
+        :return: dict of camera id to placement dict
+        """
+        report = dict()
+        for camera_id in sorted(set(self._cpus) | set(workers), key=str):
+            camera_report = {
+                'numa node': self.numa_node(camera_id),
+                'cpus': format_cpu_list(self._cpus[camera_id]) if camera_id in self._cpus else 'any',
+            }
+            if camera_id in self._pinned_grab_threads:
+                camera_report['grab thread'] = format_cpu_list(self._pinned_grab_threads[camera_id][1])
+            for worker_name, pid in workers.get(camera_id, dict()).items():
+                try:
+                    camera_report[worker_name] = format_cpu_list(psutil.Process(pid).cpu_affinity())
+                except (psutil.Error, AttributeError):
+                    camera_report[worker_name] = 'not running'
+            buffer_nodes = dict()
+            for shm_name in self._placed_buffers.get(camera_id, list()):
+                for node, pages in shared_memory_nodes(shm_name).items():
+                    buffer_nodes[node] = buffer_nodes.get(node, 0) + pages
+            if buffer_nodes:
+                camera_report['buffer pages'] = ', '.join(f'node {node}: {pages}'
+                                                          for node, pages in sorted(buffer_nodes.items()))
+            report[camera_id] = camera_report
+            self.log.info(f'placement of {camera_id}: ' +
+                          ', '.join(f'{key} = {value}' for key, value in camera_report.items()))
+        return report
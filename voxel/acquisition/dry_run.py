@@ -0,0 +1,267 @@
+import logging
+import psutil
+import sys
+import time
+from contextlib import contextmanager
+from voxel.acquisition.memory_budget import MemoryPlanner
+from voxel.acquisition.storage import pyramid_factor, pyramid_levels, volume
+from voxel.acquisition.tile_planner import LASER_SWITCH_TIME_S, TileCostModel
+
+# Sustained write speed of local drives without a measured speed.
+WRITE_SPEED_MB_S = 1000
+# Sustained speed of transfers to external drives without a measured speed.
+TRANSFER_SPEED_MB_S = 200
+# Interval of polling simulated stages for the end of a move.
+STAGE_POLL_S = 0.01
+
+
+class VirtualClock:
+    """Stand-in for the time module of simulated device drivers. Sleeping
+    advances the clock instead of waiting."""
+
+    def __init__(self, start_s: float = 0.0):
+        self._now_s = start_s
+
+    def time(self):
+        return self._now_s
+
+    perf_counter = monotonic = time
+
+    def sleep(self, seconds: float):
+        self._now_s += max(seconds, 0.0)
+
+    def advance_to(self, time_s: float):
+        self._now_s = max(self._now_s, time_s)
+
+    @contextmanager
+    def patch(self, devices: list):
+        """Run the drivers of devices on this clock.
+
+        :param devices: simulated devices, their modules must use the time module
+        """
+        modules = {sys.modules[type(device).__module__] for device in devices}
+        patched = [module for module in modules if getattr(module, 'time', None) is time]
+        for module in patched:
+            module.time = self
+        try:
+            yield self
+        finally:
+            for module in patched:
+                module.time = time
+
+
+class DryRun:
+    """Runs the tile plan of an acquisition against simulated device drivers
+    on a virtual clock. Stage moves and filter switches run through the
+    drivers, imaging takes steps frames of the master device's frame period,
+    writers drain at the write speed of their drive and transfers run at
+    the transfer speed, pipelined as in TileScheduler. Nothing sleeps in
+    real time and no data is written."""
+
+    def __init__(self, acquisition, write_speed_mb_s: dict = dict(), transfer_speed_mb_s: float = TRANSFER_SPEED_MB_S,
+                 compression_ratio: float = 1.0, max_pending_transfers: int = 2, free_bytes: dict = None):
+        """
+
+        :param acquisition: acquisition with an instrument of simulated devices
+        :param write_speed_mb_s: dict of drive to sustained write speed
+        :param transfer_speed_mb_s: sustained transfer speed
+        :param compression_ratio: compression ratio of the writers
+        :param max_pending_transfers: as in TileScheduler
+        :param free_bytes: dict of drive to free bytes, defaults to the free
+            space of the drives now
+
+        .. code-block: python
+
+            report = DryRun(acquisition, write_speed_mb_s={'D:': 2000}).run()
+            report['duration_s'], report['peak_ram_bytes'], report['bytes_per_drive']
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.acquisition = acquisition
+        self.instrument = acquisition.instrument
+        self.write_speed_mb_s = write_speed_mb_s
+        self.transfer_speed_mb_s = transfer_speed_mb_s
+        self.compression_ratio = compression_ratio
+        self.max_pending_transfers = max_pending_transfers
+        self.free_bytes = free_bytes
+        self.clock = VirtualClock()
+
+    def _devices(self):
+        devices = list()
+        for device_type in ('cameras', 'tiling_stages', 'scanning_stages', 'filter_wheels', 'lasers', 'daqs'):
+            devices.extend(getattr(self.instrument, device_type, dict()).values())
+        return devices
+
+    def _check_simulated(self):
+        """Refuse to drive real hardware."""
+        for device in self._devices():
+            if not type(device).__module__.split('.')[-1].startswith('simulated'):
+                raise ValueError(f'dry run needs simulated devices but {type(device).__module__} is not simulated.')
+
+    def _frame_period_s(self, tile: dict):
+        """Frame period of the master device, as in Acquisition."""
+        master_device_name = self.instrument.master_device['name']
+        master_device_type = self.instrument.master_device['type']
+        if master_device_type == 'camera':
+            return self.instrument.cameras[master_device_name].frame_time_ms / 1000
+        if master_device_type == 'scanning stage':
+            speed_mm_s = self.instrument.scanning_stages[master_device_name].speed_mm_s
+            return tile['voxel_size_um'] / 1000 / speed_mm_s
+        if master_device_type == 'daq':
+            master_task = self.instrument.master_device['task']
+            return self.instrument.daqs[master_device_name].task_time_s[master_task]
+        raise ValueError(f'master device type {master_device_type} is not supported.')
+
+    def _setup(self, tile: dict, previous_tile: dict, cost_model: TileCostModel):
+        """Move the simulated stages and switch filters and lasers of a tile."""
+        stages = {stage.instrument_axis: stage for stage_type in ('tiling_stages', 'scanning_stages')
+                  for stage in getattr(self.instrument, stage_type, dict()).values()}
+        # axes move concurrently
+        for axis, position_mm in tile['position_mm'].items():
+            if axis in stages:
+                stages[axis].move_absolute_mm(position_mm, wait=False)
+        while any(stages[axis].is_axis_moving() for axis in tile['position_mm'] if axis in stages):
+            self.clock.sleep(STAGE_POLL_S)
+        channel = self.instrument.channels[tile['channel']]
+        for filter_name in channel.get('filters', []):
+            for wheel in getattr(self.instrument, 'filter_wheels', dict()).values():
+                if filter_name in wheel.filters and wheel.filter != filter_name:
+                    wheel.filter = filter_name
+        previous_lasers = set() if previous_tile is None else \
+            set(self.instrument.channels[previous_tile['channel']].get('lasers', []))
+        for laser_name in previous_lasers ^ set(channel.get('lasers', [])):
+            self.clock.sleep(cost_model.laser_switch_time_s.get(laser_name, LASER_SWITCH_TIME_S))
+
+    def _tile_bytes(self, tile: dict):
+        """Bytes of a tile written by every writer including its pyramid, by
+        local and external drive."""
+        local_bytes = dict()
+        external_bytes = dict()
+        chunk_bytes = dict()
+        for camera_id in self.instrument.cameras:
+            for writer_id, writer in self.acquisition.writers[camera_id].items():
+                frame_bytes = self.acquisition._frame_size_mb(camera_id, writer_id)*1024**2 \
+                    * pyramid_factor(pyramid_levels(writer))
+                nbytes = int(tile['steps']*frame_bytes/self.compression_ratio)
+                drive = volume(writer.path)
+                local_bytes[drive] = local_bytes.get(drive, 0) + nbytes
+                chunk_bytes[drive] = chunk_bytes.get(drive, 0) + writer.chunk_count_px*frame_bytes/self.compression_ratio
+                for transfer in getattr(self.acquisition, 'transfers', dict()).get(camera_id, dict()).values():
+                    external_drive = volume(transfer.external_path)
+                    external_bytes[external_drive] = external_bytes.get(external_drive, 0) + nbytes
+        return local_bytes, external_bytes, chunk_bytes
+
+    def _ram_items(self, tile: dict):
+        """RAM held while a tile is acquired, itemized as by
+        check_system_memory: camera buffers, chunk rings, writer chunks,
+        pyramid temporaries, projections and routine stacks."""
+        planner = MemoryPlanner(self.acquisition, free_bytes=0, tiles=[tile])
+        return planner.items(**planner.settings())
+
+    def run(self, tiles: list = None):
+        """Simulate the acquisition of tiles.
+
+        :param tiles: tile dicts, defaults to the tiles of the acquisition
+        :return: dict of timeline, duration_s, peak_ram_bytes and its
+            items, bytes_per_drive and drives that cannot keep up
+        """
+        self._check_simulated()
+        tiles = self.acquisition.config['acquisition']['tiles'] if tiles is None else tiles
+        cost_model = TileCostModel.from_instrument(self.instrument)
+        has_transfers = any(getattr(self.acquisition, 'transfers', dict()).values())
+        free_bytes = dict(self.free_bytes) if self.free_bytes is not None else None
+        timeline = list()
+        bytes_per_drive = dict()
+        slow_drives = dict()
+        # end time and bytes per drive of tiles on local disk, freed once transferred
+        on_disk = list()
+        acquire_end_s = drain_end_s = transfer_end_s = 0.0
+        previous_tile = None
+        peak_ram_items = dict()
+        start_real_s = time.perf_counter()
+        with self.clock.patch(self._devices()):
+            for tile_index, tile in enumerate(tiles):
+                local_bytes, external_bytes, chunk_bytes = self._tile_bytes(tile)
+                # the buffers of a tile are held from its acquisition until
+                # it is drained, and the tiles share writers and rings, so
+                # the peak is that of the tile with the largest buffers
+                ram_items = self._ram_items(tile)
+                if sum(ram_items.values()) > sum(peak_ram_items.values()):
+                    peak_ram_items = ram_items
+                if free_bytes is None:
+                    free_bytes = {drive: psutil.disk_usage(drive).free for drive in local_bytes}
+                # the instrument is free once the previous tile is acquired
+                self.clock.advance_to(acquire_end_s)
+                setup_start_s = self.clock.time()
+                for camera in self.instrument.cameras.values():
+                    camera.prepare()
+                self._setup(tile, previous_tile, cost_model)
+                setup_end_s = self.clock.time()
+                # writers are free once the previous tile is drained
+                ready_s = acquire_start_s = max(setup_end_s, drain_end_s)
+                # wait for transfers to free disk space and work off the backlog
+                while True:
+                    pending = [entry for entry in on_disk if entry['freed_s'] > acquire_start_s]
+                    used = {drive: sum(entry['bytes'].get(drive, 0) for entry in pending) for drive in local_bytes}
+                    full = any(used[drive] + nbytes > free_bytes.get(drive, 0) for drive, nbytes in local_bytes.items())
+                    transfer_backlog = has_transfers and \
+                        sum(entry['drained_s'] < entry['freed_s'] for entry in pending) >= self.max_pending_transfers
+                    if not full and not transfer_backlog:
+                        break
+                    if not pending or not has_transfers:
+                        raise RuntimeError(f'not enough disk space for tile {tile_index}.')
+                    acquire_start_s = min(entry['freed_s'] for entry in pending)
+                if acquire_start_s > ready_s:
+                    timeline.append({'tile': tile_index, 'phase': 'wait', 'start_s': ready_s, 'end_s': acquire_start_s})
+                imaging_s = tile['steps']*self._frame_period_s(tile)
+                acquire_end_s = acquire_start_s + imaging_s
+                # writers drain the last chunk, or their backlog if the drive is too slow
+                drain_s = 0.0
+                for drive, nbytes in local_bytes.items():
+                    write_speed_mb_s = self.write_speed_mb_s.get(drive, WRITE_SPEED_MB_S)
+                    write_s = nbytes/1e6/write_speed_mb_s
+                    if write_s > imaging_s:
+                        slow_drives[drive] = nbytes/1e6/imaging_s
+                    drain_s = max(drain_s, chunk_bytes[drive]/1e6/write_speed_mb_s, write_s - imaging_s)
+                    bytes_per_drive[drive] = bytes_per_drive.get(drive, 0) + nbytes
+                drain_end_s = acquire_end_s + drain_s
+                freed_s = float('inf')
+                transfer_start_s = None
+                if has_transfers:
+                    transfer_start_s = max(drain_end_s, transfer_end_s)
+                    transfer_end_s = transfer_start_s + sum(external_bytes.values())/1e6/self.transfer_speed_mb_s
+                    freed_s = transfer_end_s
+                    for drive, nbytes in external_bytes.items():
+                        bytes_per_drive[drive] = bytes_per_drive.get(drive, 0) + nbytes
+                on_disk.append({'bytes': local_bytes, 'drained_s': drain_end_s, 'freed_s': freed_s})
+                timeline.extend([
+                    {'tile': tile_index, 'phase': 'setup', 'start_s': setup_start_s, 'end_s': setup_end_s},
+                    {'tile': tile_index, 'phase': 'acquire', 'start_s': acquire_start_s, 'end_s': acquire_end_s},
+                    {'tile': tile_index, 'phase': 'drain', 'start_s': acquire_end_s, 'end_s': drain_end_s}])
+                if has_transfers:
+                    timeline.append({'tile': tile_index, 'phase': 'transfer',
+                                     'start_s': transfer_start_s, 'end_s': transfer_end_s})
+                previous_tile = tile
+        duration_s = max(entry['end_s'] for entry in timeline) if timeline else 0.0
+        report = {
+            'timeline': sorted(timeline, key=lambda entry: (entry['tile'], entry['start_s'])),
+            'duration_s': duration_s,
+            'peak_ram_bytes': sum(peak_ram_items.values()),
+            'peak_ram_items': peak_ram_items,
+            'bytes_per_drive': bytes_per_drive,
+            'slow_drives_mb_s': slow_drives,
+        }
+        self._log_report(report, len(tiles), time.perf_counter() - start_real_s)
+        return report
+
+    def _log_report(self, report: dict, tile_count: int, real_time_s: float):
+        for tile_index in range(tile_count):
+            phases = [entry for entry in report['timeline'] if entry['tile'] == tile_index]
+            self.log.info(f'tile {tile_index}: ' + ', '.join(f"{entry['phase']} {entry['start_s']:.1f}-{entry['end_s']:.1f}"
+                                                             for entry in phases) + ' [s]')
+        self.log.info(f"dry run of {tile_count} tiles: {report['duration_s']/3600:.2f} [h], "
+                      f"peak RAM {report['peak_ram_bytes']/1024**3:.1f} [GB], simulated in {real_time_s:.1f} [s]")
+        for drive, nbytes in report['bytes_per_drive'].items():
+            self.log.info(f'{nbytes/1024**3:.1f} [GB] written to drive {drive}')
+        for drive, required_mb_s in report['slow_drives_mb_s'].items():
+            self.log.warning(f'drive {drive} cannot keep up, {required_mb_s:.0f} [MB/s] required')
@@ -0,0 +1,256 @@
+import logging
+import threading
+import time
+from voxel.acquisition.affinity import Placement
+from voxel.writers.data_structures.chunk_dispatcher import ChunkDispatcher
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+# Chunks in the ring of every camera without a memory plan.
+RING_DEPTH = 4
+
+
+class GrabEngine:
+    """Grabs frames of several cameras concurrently, with one grab thread
+    per camera. Each thread copies frames straight into the shared chunk
+    ring of its camera and publishes full chunks to the camera's writers
+    and processes, so a slow writer of one camera only stalls that camera
+    once its ring is full. At the end of a tile the frame counts of all
+    cameras are checked against each other.
+
+    Consumers follow the writer chunk hand-off of ChunkDispatcher, i.e.
+    they have submit_chunk() and done_reading, and read chunks of the shape
+    (chunk_count_px, row_count_px, column_count_px) of the camera's writers.
+    """
+
+    def __init__(self, cameras: dict, consumers: dict, placement: Placement = None, ring_depth: int = RING_DEPTH):
+        """
+
+        :param cameras: dict of camera id to camera
+        :param consumers: dict of camera id to list of writers and processes
+        :param placement: cpu placement of the grab threads and rings
+        :param ring_depth: chunks in the ring of every camera, >= 2
+
+        .. code-block: python
+
+            engine = GrabEngine(instrument.cameras, {camera_id: [*writers[camera_id].values()]})
+            # rings are created before the writer processes are started
+            engine.prepare()
+            for writer in writers:
+                writer.prepare()
+                writer.start()
+            engine.acquire(frame_count_px)
+            engine.wait_to_finish()
+            engine.check_frame_counts(frame_count_px)
+            engine.close()
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        unknown = set(consumers) - set(cameras)
+        if unknown:
+            raise ValueError(f"consumers of unknown cameras {sorted(unknown)}.")
+        self.cameras = cameras
+        # processes without a chunk count project the latest image instead of chunks
+        self.consumers = {camera_id: [consumer for consumer in camera_consumers
+                                      if hasattr(consumer, 'submit_chunk') and consumer.chunk_count_px is not None]
+                          for camera_id, camera_consumers in consumers.items()}
+        self.placement = placement if placement is not None else Placement()
+        self.ring_depth = ring_depth
+        self._rings = dict()
+        self._dispatchers = dict()
+        self._threads = dict()
+        self._frame_counts = dict()
+        self._grab_times_s = dict()
+        self._errors = dict()
+        self._stop = threading.Event()
+
+    @property
+    def ring_depth(self):
+        return self._ring_depth
+
+    @ring_depth.setter
+    def ring_depth(self, ring_depth: int):
+        if ring_depth < 2:
+            raise ValueError("ring depth must be >= 2.")
+        self.log.info(f'setting ring depth to: {ring_depth}')
+        self._ring_depth = ring_depth
+
+    @property
+    def frame_counts(self):
+        """Frames grabbed by every camera in the last tile."""
+        return dict(self._frame_counts)
+
+    def _chunk_shape(self, camera_id: str):
+        """Chunk shape and data type shared by all consumers of a camera."""
+        consumers = self.consumers[camera_id]
+        shapes = {(consumer.chunk_count_px, consumer.row_count_px, consumer.column_count_px) for consumer in consumers}
+        data_types = {str(consumer.data_type) for consumer in consumers}
+        if len(shapes) != 1 or len(data_types) != 1:
+            raise ValueError(f"consumers of {camera_id} must share one chunk shape and data type "
+                             f"but have {sorted(shapes)} and {sorted(data_types)}.")
+        return shapes.pop(), data_types.pop()
+
+    def prepare(self):
+        """Create the chunk ring and dispatcher of every camera with
+        consumers. Rings are kept across tiles while the chunk shape does not
+        change. Call before starting the consumer processes, so they attach
+        to shared memory created by this process."""
+        for camera_id, consumers in self.consumers.items():
+            if not consumers:
+                continue
+            shape, data_type = self._chunk_shape(camera_id)
+            ring = self._rings.get(camera_id)
+            if ring is not None and ring.shape == shape and ring.dtype == data_type \
+                    and ring.slot_count == self._ring_depth:
+                continue
+            self._close_camera(camera_id)
+            ring = SharedRingBuffer(shape, data_type, slot_count=self._ring_depth)
+            self.placement.place_buffer(camera_id, ring)
+            self._rings[camera_id] = ring
+            self._dispatchers[camera_id] = ChunkDispatcher(ring, consumers)
+            self.log.info(f'{camera_id}: ring of {self._ring_depth} chunks of {shape} {data_type}')
+
+    def start(self, frame_count_px: int):
+        """Start grabbing frame_count_px frames from every camera, each in its
+        own thread.
+
+        :param frame_count_px: frames of the tile
+        """
+        if not self._rings:
+            raise RuntimeError("grab engine is not prepared.")
+        if any(thread.is_alive() for thread in self._threads.values()):
+            raise RuntimeError("grab threads of the previous tile are still running.")
+        self._stop.clear()
+        self._frame_counts = {camera_id: 0 for camera_id in self._rings}
+        self._errors = dict()
+        self._threads = {camera_id: threading.Thread(target=self._grab, args=(camera_id, frame_count_px),
+                                                     name=f'grab_{camera_id}', daemon=True)
+                         for camera_id in self._rings}
+        for thread in self._threads.values():
+            thread.start()
+
+    def _grab(self, camera_id: str, frame_count_px: int):
+        """Grab loop of one camera, runs in its grab thread."""
+        start_time = time.perf_counter()
+        ring = self._rings[camera_id]
+        dispatcher = self._dispatchers[camera_id]
+        try:
+            self.placement.pin_grab_thread(camera_id)
+            camera = self.cameras[camera_id]
+            chunk_count_px = ring.shape[0]
+            # a chunk may still be partially filled by an aborted tile
+            ring.buffer_index = -1
+            for frame_index in range(frame_count_px):
+                if self._stop.is_set():
+                    break
+                ring.add_image(camera.grab_frame())
+                self._frame_counts[camera_id] = frame_index + 1
+                # publish full chunks and the partial last chunk
+                if ring.buffer_index == chunk_count_px - 1 or frame_index == frame_count_px - 1:
+                    self._publish(ring, dispatcher)
+        except Exception as e:
+            self.log.exception(f'{camera_id}: grabbing failed.')
+            self._errors[camera_id] = e
+            # the other cameras would only be stalled by the trigger
+            self._stop.set()
+        finally:
+            if self._frame_counts[camera_id] < frame_count_px:
+                self._abort_tile(camera_id, ring, dispatcher)
+            self._grab_times_s[camera_id] = time.perf_counter() - start_time
+
+    @staticmethod
+    def _publish(ring: SharedRingBuffer, dispatcher: ChunkDispatcher):
+        """Publish the write slot, zeroing the frames of a partial chunk
+        that are left over from an earlier chunk."""
+        ring.write_buf[ring.buffer_index + 1:] = 0
+        dispatcher.publish()
+
+    def _abort_tile(self, camera_id: str, ring: SharedRingBuffer, dispatcher: ChunkDispatcher):
+        """End the tile of a camera that stopped grabbing early. The partly
+        filled chunk is published, then the consumers are aborted so they do
+        not wait for the chunks that never come."""
+        self.log.warning(f'{camera_id}: stopped after {self._frame_counts[camera_id]} frames, aborting tile.')
+        try:
+            if ring.buffer_index >= 0:
+                self._publish(ring, dispatcher)
+            dispatcher.wait_to_finish()
+            for consumer in self.consumers[camera_id]:
+                abort = getattr(consumer, 'abort', None)
+                if abort is not None:
+                    abort()
+        except Exception as e:
+            self.log.exception(f'{camera_id}: aborting tile failed.')
+            self._errors.setdefault(camera_id, e)
+
+    def wait_until_grabbed(self):
+        """Block until every camera grabbed its frames and published its last
+        chunk. Raises the first error of a grab thread."""
+        for thread in self._threads.values():
+            thread.join()
+        for camera_id, error in self._errors.items():
+            raise RuntimeError(f'grabbing from {camera_id} failed.') from error
+
+    def acquire(self, frame_count_px: int):
+        """Grab a tile from every camera.
+
+        :param frame_count_px: frames of the tile
+        :return: frames grabbed by every camera
+        """
+        self.start(frame_count_px)
+        self.wait_until_grabbed()
+        for camera_id, frame_count in self._frame_counts.items():
+            self.log.info(f'{camera_id}: grabbed {frame_count} frames in {self._grab_times_s[camera_id]:.1f} [s], '
+                          f'ring high water mark {self._rings[camera_id].high_water_mark}/{self._ring_depth}')
+            self._rings[camera_id].reset_high_water_mark()
+        return self.frame_counts
+
+    def stop(self):
+        """Stop grabbing after the current frame of every camera."""
+        self._stop.set()
+
+    def wait_to_finish(self):
+        """Block until every consumer is done reading every published chunk."""
+        for dispatcher in self._dispatchers.values():
+            dispatcher.wait_to_finish()
+
+    def check_frame_counts(self, frame_count_px: int = None):
+        """Check that all cameras grabbed the same number of frames, and
+        frame_count_px if given, without dropping frames.
+
+        :param frame_count_px: expected frames of the tile
+        :return: dict of camera id to grabbed and dropped frames
+        :raises RuntimeError: if frame counts differ or frames were dropped
+        """
+        counts = dict()
+        for camera_id, frame_count in self._frame_counts.items():
+            counts[camera_id] = {'grabbed': frame_count, 'dropped': self._dropped_frames(camera_id)}
+        grabbed = {count['grabbed'] for count in counts.values()}
+        expected = grabbed if frame_count_px is None else {frame_count_px}
+        if len(grabbed) > 1 or grabbed != expected or any(count['dropped'] for count in counts.values()):
+            self.log.error(f'inconsistent frame counts: {counts}')
+            raise RuntimeError(f'inconsistent frame counts: {counts}')
+        self.log.info(f'frame counts are consistent: {counts}')
+        return counts
+
+    def _dropped_frames(self, camera_id: str):
+        """Dropped frames a camera reports, 0 if it does not report them."""
+        try:
+            state = self.cameras[camera_id].signal_acquisition_state()
+        except Exception:
+            return 0
+        return state.get('Dropped Frames', 0) if isinstance(state, dict) else 0
+
+    def _close_camera(self, camera_id: str):
+        dispatcher = self._dispatchers.pop(camera_id, None)
+        if dispatcher is not None:
+            dispatcher.close()
+        ring = self._rings.pop(camera_id, None)
+        if ring is not None:
+            ring.close_and_unlink()
+
+    def close(self):
+        """Stop grabbing and free the rings once the consumers released them."""
+        self.stop()
+        for thread in self._threads.values():
+            thread.join()
+        for camera_id in list(self._rings):
+            self._close_camera(camera_id)
@@ -0,0 +1,252 @@
+import logging
+import numpy
+import sys
+from math import ceil
+from psutil import virtual_memory
+from voxel.acquisition.grab_engine import RING_DEPTH
+from voxel.acquisition.storage import pyramid_levels
+
+# Fraction of the available RAM the acquisition may use, the rest is left to
+# the operating system and the page cache of the writers.
+RAM_FRACTION = 0.8
+# Chunk counts tried for cameras whose writers all accept any chunk count.
+CHUNK_COUNT_CANDIDATES = [256, 128, 64, 32, 16]
+# Chunks per camera ring, one being filled while the others are written.
+RING_DEPTHS = [4, 3, 2]
+# Camera driver buffer sizes tried, the largest is the driver default.
+BUFFER_SIZE_MB_CANDIDATES = [2400, 1200, 600, 300]
+# Bytes of the accumulator of a voxel of mean pyramid levels.
+ACCUMULATOR_BYTES = 4
+# Items allocated once and reused by every tile.
+PERSISTENT_ITEMS = [
+    "camera buffer",
+    "chunk ring"
+]
+
+
+def _settable(device, name: str):
+    """True if name is a property of device with a setter."""
+    attribute = getattr(type(device), name, None)
+    return isinstance(attribute, property) and attribute.fset is not None
+
+
+class MemoryPlanner:
+    """Itemized RAM budget of an acquisition: camera driver buffers, the
+    chunk ring of every camera, chunks held by writers, pyramid temporaries,
+    projection arrays and routine stacks. Picks the chunk count, ring depth
+    and camera buffer sizes that fit into the available RAM, preferring
+    larger chunks, which are written in fewer and larger requests, then
+    deeper rings, which absorb writer stalls, then larger camera buffers.
+    """
+
+    def __init__(self, acquisition, free_bytes: int = None, ram_fraction: float = RAM_FRACTION, tiles: list = None):
+        """
+
+        :param acquisition: acquisition with its instrument and operations
+        :param free_bytes: available RAM, defaults to the available RAM now
+        :param ram_fraction: fraction of the available RAM that may be used
+        :param tiles: tile dicts, defaults to the tiles of the acquisition
+
+        .. code-block: python
+
+            planner = MemoryPlanner(acquisition)
+            plan = planner.plan()
+            planner.apply(plan)
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.acquisition = acquisition
+        self.instrument = acquisition.instrument
+        self.free_bytes = virtual_memory().available if free_bytes is None else free_bytes
+        self.ram_fraction = ram_fraction
+        self.tiles = acquisition.config['acquisition']['tiles'] if tiles is None else tiles
+
+    @property
+    def budget_bytes(self):
+        return int(self.free_bytes * self.ram_fraction)
+
+    def _operations(self, operation_type: str, camera_id: str):
+        return getattr(self.acquisition, operation_type, dict()).get(camera_id, dict())
+
+    def _frame_bytes(self, camera_id: str, data_type):
+        camera = self.instrument.cameras[camera_id]
+        return camera.height_px * camera.width_px * numpy.dtype(data_type).itemsize
+
+    def _data_type(self, camera_id: str):
+        """Data type of the frames of a camera, as written by its writers."""
+        for writer in self._operations('writers', camera_id).values():
+            return writer.data_type
+        return 'uint16'
+
+    def _frame_count_px(self, operation):
+        frame_count_px = getattr(operation, 'frame_count_px', None)
+        if frame_count_px:
+            return frame_count_px
+        return max((tile['steps'] for tile in self.tiles), default=0)
+
+    def chunk_candidates(self, camera_id: str):
+        """Chunk counts a camera can use. Writers without a chunk count
+        setter fix the chunk count of the camera, since all writers of a
+        camera share its chunk ring."""
+        fixed = {writer.chunk_count_px for writer in self._operations('writers', camera_id).values()
+                 if not _settable(writer, 'chunk_count_px')}
+        if len(fixed) > 1:
+            self.log.warning(f'writers of {camera_id} have different chunk counts {sorted(fixed)}, '
+                             f'budgeting the largest')
+        return [max(fixed)] if fixed else list(CHUNK_COUNT_CANDIDATES)
+
+    def _buffer_settable(self, camera_id: str):
+        return _settable(self.instrument.cameras[camera_id], 'buffer_size_mb')
+
+    def _camera_buffer_bytes(self, camera_id: str, buffer_size_mb: float):
+        """RAM buffer of the camera driver, buffer_size_mb for drivers that
+        accept a buffer size, otherwise the driver's own buffer."""
+        camera = self.instrument.cameras[camera_id]
+        if self._buffer_settable(camera_id):
+            return int(buffer_size_mb * 1e6)
+        module = sys.modules.get(type(camera).__module__)
+        if hasattr(module, 'BUFFER_SIZE_FRAMES'):
+            return module.BUFFER_SIZE_FRAMES * self._frame_bytes(camera_id, self._data_type(camera_id))
+        return int(getattr(module, 'BUFFER_SIZE_MB', 0) * 1e6)
+
+    def _pyramid_bytes(self, chunk_bytes: int, levels: int, itemsize: int):
+        """Levels > 0 of a chunk and their accumulators, while a chunk is
+        reduced."""
+        return int(sum(chunk_bytes / 8 ** level * (1 + ACCUMULATOR_BYTES / itemsize) for level in range(1, levels)))
+
+    def _projection_bytes(self, camera_id: str, process):
+        """Projection arrays of a max projection process, the yz and xz
+        projections are kept for all frames of a tile."""
+        camera = self.instrument.cameras[camera_id]
+        row_count_px = getattr(process, 'row_count_px', None) or camera.height_px
+        column_count_px = getattr(process, 'column_count_px', None) or camera.width_px
+        frame_count_px = self._frame_count_px(process)
+        itemsize = numpy.dtype(getattr(process, 'data_type', None) or self._data_type(camera_id)).itemsize
+        nbytes = 0
+        if getattr(process, 'x_projection_count_px', None):
+            nbytes += frame_count_px * row_count_px * (ceil(column_count_px / process.x_projection_count_px) + 1)
+        if getattr(process, 'y_projection_count_px', None):
+            nbytes += frame_count_px * column_count_px * (ceil(row_count_px / process.y_projection_count_px) + 1)
+        if getattr(process, 'z_projection_count_px', None):
+            # projection and the copy of each maximum
+            nbytes += 2 * row_count_px * column_count_px
+        return nbytes * itemsize
+
+    def items(self, chunk_count_px: dict, ring_depth: int, buffer_size_mb: dict):
+        """Itemized RAM use of the acquisition.
+
+        :param chunk_count_px: dict of camera id to chunk count
+        :param ring_depth: chunks in the ring of every camera
+        :param buffer_size_mb: dict of camera id to camera buffer size
+        :return: dict of item name to bytes
+        """
+        items = dict()
+        for camera_id in self.instrument.cameras:
+            data_type = self._data_type(camera_id)
+            chunk_bytes = chunk_count_px[camera_id] * self._frame_bytes(camera_id, data_type)
+            items[f'{camera_id} camera buffer'] = self._camera_buffer_bytes(camera_id, buffer_size_mb[camera_id])
+            items[f'{camera_id} chunk ring'] = ring_depth * chunk_bytes
+            for writer_id, writer in self._operations('writers', camera_id).items():
+                writer_chunk_bytes = chunk_count_px[camera_id] * self._frame_bytes(camera_id, writer.data_type)
+                # compressed or blank zeroed copy of the chunk being written
+                items[f'{camera_id} {writer_id} chunk'] = writer_chunk_bytes
+                levels = pyramid_levels(writer)
+                if levels > 1:
+                    items[f'{camera_id} {writer_id} pyramid'] = self._pyramid_bytes(
+                        writer_chunk_bytes, levels, numpy.dtype(writer.data_type).itemsize)
+            for process_id, process in self._operations('processes', camera_id).items():
+                if hasattr(process, 'x_projection_count_px'):
+                    items[f'{camera_id} {process_id} projections'] = self._projection_bytes(camera_id, process)
+                else:
+                    items[f'{camera_id} {process_id} chunk'] = chunk_bytes
+            for routine_id, routine in self._operations('routines', camera_id).items():
+                if hasattr(routine, 'frame_count_px'):
+                    frame_bytes = self._frame_bytes(camera_id, getattr(routine, 'data_type', None) or data_type)
+                    # stack, the copy median partitions and the float64 median
+                    items[f'{camera_id} {routine_id} stack'] = \
+                        2 * self._frame_count_px(routine) * frame_bytes + \
+                        self._frame_bytes(camera_id, numpy.float64)
+        return items
+
+    def settings(self):
+        """Chunk counts, ring depth and camera buffer sizes in effect, those
+        of the applied memory plan or else the current settings of the
+        writers and cameras.
+
+        :return: dict of chunk_count_px and buffer_size_mb per camera and ring_depth
+        """
+        memory_plan = getattr(self.acquisition, 'memory_plan', None)
+        if memory_plan is not None:
+            return {key: memory_plan[key] for key in ('chunk_count_px', 'ring_depth', 'buffer_size_mb')}
+        chunk_count_px = dict()
+        buffer_size_mb = dict()
+        for camera_id, camera in self.instrument.cameras.items():
+            chunk_counts = [writer.chunk_count_px for writer in self._operations('writers', camera_id).values()]
+            chunk_count_px[camera_id] = max(chunk_counts) if chunk_counts else min(self.chunk_candidates(camera_id))
+            buffer_size_mb[camera_id] = camera.buffer_size_mb if self._buffer_settable(camera_id) \
+                else BUFFER_SIZE_MB_CANDIDATES[0]
+        return {'chunk_count_px': chunk_count_px, 'ring_depth': RING_DEPTH, 'buffer_size_mb': buffer_size_mb}
+
+    def tile_items(self):
+        """RAM allocated for every tile with the settings in effect, i.e.
+        the items without camera buffers and chunk rings, which are kept
+        across tiles.
+
+        :return: dict of item name to bytes
+        """
+        return {name: nbytes for name, nbytes in self.items(**self.settings()).items()
+                if not any(name.endswith(f' {item}') for item in PERSISTENT_ITEMS)}
+
+    def plan(self):
+        """Largest chunk count, ring depth and camera buffers that fit.
+
+        :return: dict of chunk_count_px and buffer_size_mb per camera,
+            ring_depth, items, total_bytes and budget_bytes
+        :raises MemoryError: if the smallest settings do not fit
+        """
+        camera_ids = list(self.instrument.cameras)
+        candidates = {camera_id: self.chunk_candidates(camera_id) for camera_id in camera_ids}
+        # cameras step through their candidates together, from largest to smallest
+        step_count = max((len(chunk_counts) for chunk_counts in candidates.values()), default=1)
+        plan = None
+        for step in range(step_count):
+            chunk_count_px = {camera_id: chunk_counts[min(step, len(chunk_counts) - 1)]
+                              for camera_id, chunk_counts in candidates.items()}
+            for ring_depth in RING_DEPTHS:
+                for buffer_size_mb in BUFFER_SIZE_MB_CANDIDATES:
+                    buffer_sizes_mb = {camera_id: buffer_size_mb for camera_id in camera_ids}
+                    items = self.items(chunk_count_px, ring_depth, buffer_sizes_mb)
+                    plan = {
+                        'chunk_count_px': chunk_count_px,
+                        'ring_depth': ring_depth,
+                        'buffer_size_mb': buffer_sizes_mb,
+                        'items': items,
+                        'total_bytes': sum(items.values()),
+                        'budget_bytes': self.budget_bytes
+                    }
+                    if plan['total_bytes'] <= self.budget_bytes:
+                        self._log_plan(plan)
+                        return plan
+        self._log_plan(plan)
+        raise MemoryError(f"acquisition needs {plan['total_bytes'] / 1024 ** 3:.1f} [GB] of RAM with the "
+                          f"smallest chunks and buffers but only {self.budget_bytes / 1024 ** 3:.1f} [GB] is available.")
+
+    def apply(self, plan: dict):
+        """Set the planned chunk counts on writers and processes and the
+        planned buffer sizes on cameras that accept them."""
+        for camera_id, camera in self.instrument.cameras.items():
+            chunk_count_px = plan['chunk_count_px'][camera_id]
+            for operation_type in ('writers', 'processes'):
+                for operation in self._operations(operation_type, camera_id).values():
+                    if _settable(operation, 'chunk_count_px') and operation.chunk_count_px != chunk_count_px:
+                        operation.chunk_count_px = chunk_count_px
+            if self._buffer_settable(camera_id):
+                camera.buffer_size_mb = plan['buffer_size_mb'][camera_id]
+
+    def _log_plan(self, plan: dict):
+        for name, nbytes in plan['items'].items():
+            self.log.info(f'{name} = {nbytes / 1024 ** 3:.2f} [GB]')
+        self.log.info(f"required RAM = {plan['total_bytes'] / 1024 ** 3:.1f} [GB] with "
+                      f"chunk count {plan['chunk_count_px']}, ring depth {plan['ring_depth']}, "
+                      f"camera buffers {plan['buffer_size_mb']} [MB]")
+        self.log.info(f"available RAM = {plan['budget_bytes'] / 1024 ** 3:.1f} [GB]")
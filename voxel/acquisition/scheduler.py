@@ -0,0 +1,159 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds between resource checks while waiting for resources to free up.
+RESOURCE_POLL_S = 1.0
+
+
+class TileScheduler:
+    """Pipelines the tiles of an acquisition. Each tile is set up (stage
+    move, device configuration), acquired, drained (writers finish their
+    last chunks) and transferred. Tile N + 1 is set up while tile N drains,
+    and transfers run in the background while later tiles are acquired:
+
+        tile N - 1:  ... drain | transfer ------------------>
+        tile N:              acquire | drain | transfer ---->
+        tile N + 1:                  setup   | acquire | ...
+
+    A tile is acquired only once the previous tile finished draining, since
+    the writers are shared between tiles, and only once check_resources
+    admits it. Transfers run one at a time, in tile order."""
+
+    def __init__(self, setup, acquire, drain, transfer=None, check_resources=None,
+                 max_pending_transfers: int = 2):
+        """
+
+        :param setup: setup(tile), moves stages and configures devices
+        :param acquire: acquire(tile), returns once the last frame is grabbed
+        :param drain: drain(tile), returns once the writers wrote the tile
+        :param transfer: transfer(tile), copies the tile to external storage
+        :param check_resources: check_resources(tile), True if there is disk
+            space and memory to acquire the tile
+        :param max_pending_transfers: number of tiles waiting for or in
+            transfer before acquisition waits for transfers
+
+        .. code-block: python
+
+            scheduler = TileScheduler(setup, acquire, drain, transfer,
+                                      check_resources=acquisition.check_tile_resources)
+            scheduler.run(tiles)
+            scheduler.timeline
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._setup = setup
+        self._acquire = acquire
+        self._drain = drain
+        self._transfer = transfer
+        self._check_resources = check_resources
+        self.max_pending_transfers = max_pending_transfers
+        self._timeline = list()
+        self._start_time = None
+
+    @property
+    def max_pending_transfers(self):
+        return self._max_pending_transfers
+
+    @max_pending_transfers.setter
+    def max_pending_transfers(self, max_pending_transfers: int):
+        if max_pending_transfers < 1:
+            raise ValueError("max pending transfers must be >= 1.")
+        self.log.info(f'setting max pending transfers to: {max_pending_transfers}')
+        self._max_pending_transfers = max_pending_transfers
+
+    @property
+    def timeline(self):
+        """Phases of every tile as dicts of tile index, phase and start and
+        end time in seconds from the start of run()."""
+        return list(self._timeline)
+
+    def run(self, tiles: list):
+        """Acquire tiles in order, overlapping the phases of consecutive tiles.
+
+        :param tiles: tile dicts
+        :return: wall time in seconds
+        """
+        self._timeline = list()
+        self._start_time = time.perf_counter()
+        drain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile_drain')
+        transfer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile_transfer')
+        drain_future = None
+        transfers = deque()
+        try:
+            for tile_index, tile in enumerate(tiles):
+                # overlaps the drain of the previous tile
+                self._timed(tile_index, 'setup', self._setup, tile)
+                self._wait_for_resources(tile_index, tile, transfers, drain_future)
+                if drain_future is not None:
+                    drain_future.result()
+                self._timed(tile_index, 'acquire', self._acquire, tile)
+                drain_future = drain_pool.submit(self._drain_and_transfer, tile_index, tile,
+                                                 transfer_pool, transfers)
+            if drain_future is not None:
+                drain_future.result()
+            while transfers:
+                transfers.popleft().result()
+        finally:
+            drain_pool.shutdown(wait=True)
+            # cancel transfers not started yet if a tile failed
+            transfer_pool.shutdown(wait=True, cancel_futures=True)
+        wall_time_s = time.perf_counter() - self._start_time
+        self._log_summary(len(tiles), wall_time_s)
+        return wall_time_s
+
+    def _wait_for_resources(self, tile_index: int, tile: dict, transfers: deque, drain_future):
+        """Wait for transfers to free up disk space before a tile."""
+        wait_start = time.perf_counter()
+        waited = False
+        while True:
+            # drop finished transfers, raising their errors
+            while transfers and transfers[0].done():
+                transfers.popleft().result()
+            backlog = len(transfers) >= self._max_pending_transfers
+            admitted = self._check_resources is None or self._check_resources(tile)
+            if admitted and not backlog:
+                break
+            waited = True
+            if drain_future is not None and not drain_future.done():
+                # the previous tile queues its transfer once drained
+                drain_future.result()
+            elif transfers:
+                self.log.info(f'tile {tile_index}: waiting for {len(transfers)} transfers')
+                transfers[0].exception(timeout=RESOURCE_POLL_S)
+            else:
+                raise RuntimeError(f'not enough resources for tile {tile_index} and no transfers to wait for.')
+        if waited:
+            self._record(tile_index, 'wait', wait_start, time.perf_counter())
+
+    def _drain_and_transfer(self, tile_index: int, tile: dict, transfer_pool: ThreadPoolExecutor, transfers: deque):
+        self._timed(tile_index, 'drain', self._drain, tile)
+        if self._transfer is not None:
+            transfers.append(transfer_pool.submit(self._timed, tile_index, 'transfer', self._transfer, tile))
+        else:
+            self._log_tile(tile_index)
+
+    def _timed(self, tile_index: int, phase: str, function, tile: dict):
+        start = time.perf_counter()
+        try:
+            return function(tile)
+        finally:
+            self._record(tile_index, phase, start, time.perf_counter())
+            if phase == 'transfer':
+                self._log_tile(tile_index)
+
+    def _record(self, tile_index: int, phase: str, start: float, end: float):
+        self._timeline.append({'tile': tile_index, 'phase': phase,
+                               'start_s': start - self._start_time, 'end_s': end - self._start_time})
+
+    def _log_tile(self, tile_index: int):
+        phases = [entry for entry in self._timeline if entry['tile'] == tile_index]
+        self.log.info(f'tile {tile_index}: ' + ', '.join(f"{entry['phase']} {entry['start_s']:.1f}-{entry['end_s']:.1f}"
+                                                         for entry in phases) + ' [s]')
+
+    def _log_summary(self, tile_count: int, wall_time_s: float):
+        serial_time_s = sum(entry['end_s'] - entry['start_s'] for entry in self._timeline
+                            if entry['phase'] != 'wait')
+        self.log.info(f'{tile_count} tiles took {wall_time_s:.1f} [s], '
+                      f'{serial_time_s:.1f} [s] if run serially')
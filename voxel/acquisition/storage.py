@@ -0,0 +1,166 @@
+import logging
+import os
+import platform
+import psutil
+import shutil
+import threading
+
+# Free space kept on every volume for file system metadata and logs.
+MARGIN_BYTES = 1024 ** 3
+# Pyramid levels of writers that do not report their level count, by writer module.
+PYRAMID_LEVELS = {
+    "voxel.writers.imaris": 8
+}
+
+DECISIONS = [
+    "proceed",
+    "wait",
+    "insufficient"
+]
+
+
+def volume(path: str):
+    """Drive letter on Windows, mount point elsewhere, of a path."""
+    if platform.system() == 'Windows':
+        return os.path.splitdrive(os.path.abspath(path))[0]
+    path = os.path.realpath(path)
+    mount_points = [partition.mountpoint for partition in psutil.disk_partitions(all=True)]
+    return max((mount_point for mount_point in mount_points
+                if path == mount_point or path.startswith(mount_point.rstrip(os.sep) + os.sep)),
+               key=len, default=os.sep)
+
+
+def pyramid_factor(levels: int):
+    """Size of a pyramid of levels, each downsampled 2x in z, y and x,
+    relative to its first level."""
+    return sum((1 / (2 ** level)) ** 3 for level in range(levels))
+
+
+def pyramid_levels(writer):
+    """Number of pyramid levels a writer stores, 1 without a pyramid."""
+    level_count = getattr(writer, '_level_count', None)
+    if callable(level_count):
+        try:
+            return level_count()
+        except (AttributeError, TypeError):
+            # frame size not set yet
+            pass
+    # every writer class is named Writer, so look it up by its module
+    return PYRAMID_LEVELS.get(type(writer).__module__, 1)
+
+
+class StorageManager:
+    """Disk space of the volumes an acquisition writes to. Paths are
+    resolved to the volume they are on, so writers on the same disk share
+    its free space. Bytes promised to in-flight writers are reserved until
+    the writers finish, and bytes of tiles waiting for transfer are counted
+    as freed once the transfer moved them off the volume.
+
+    .. code-block: python
+
+        storage = StorageManager()
+        if storage.decide({writer.path: tile_bytes}) == 'proceed':
+            storage.reserve('tile 0', writer.path, tile_bytes)
+            ...
+            storage.release('tile 0')
+            storage.expect_freed('tile 0', writer.path, tile_bytes)
+            ...
+            storage.freed('tile 0')
+
+    """
+
+    def __init__(self, margin_bytes: int = MARGIN_BYTES):
+        """
+
+        :param margin_bytes: free space kept on every volume
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.margin_bytes = margin_bytes
+        self._volumes = dict()
+        self._reserved = dict()
+        self._freeable = dict()
+        self._lock = threading.Lock()
+
+    def volume(self, path: str):
+        """Volume of a path, resolved once per path."""
+        path = str(path)
+        if path not in self._volumes:
+            self._volumes[path] = volume(path)
+        return self._volumes[path]
+
+    def free_bytes(self, volume: str):
+        return shutil.disk_usage(volume).free
+
+    def reserve(self, key, path: str, nbytes: int, written_bytes=None):
+        """Reserve bytes for output that is about to be written.
+
+        :param key: hashable key of the reservation, e.g. tile and writer
+        :param path: path the output is written to
+        :param nbytes: predicted size of the output
+        :param written_bytes: written_bytes(), bytes of the output already
+            on disk, which are no longer reserved
+        """
+        with self._lock:
+            self._reserved[key] = (self.volume(path), int(nbytes), written_bytes)
+
+    def release(self, key):
+        """Release a reservation once its output is on disk."""
+        with self._lock:
+            self._reserved.pop(key, None)
+
+    def expect_freed(self, key, path: str, nbytes: int):
+        """Bytes on disk that a pending transfer will remove."""
+        with self._lock:
+            self._freeable[key] = (self.volume(path), int(nbytes))
+
+    def freed(self, key):
+        """The transfer of expect_freed bytes finished."""
+        with self._lock:
+            self._freeable.pop(key, None)
+
+    def reserved_bytes(self, volume: str):
+        """Bytes promised to in-flight output on a volume and not written yet."""
+        with self._lock:
+            reservations = [reservation for reservation in self._reserved.values() if reservation[0] == volume]
+        reserved_bytes = 0
+        for _, nbytes, written_bytes in reservations:
+            written = written_bytes() if written_bytes is not None else 0
+            reserved_bytes += max(nbytes - written, 0)
+        return reserved_bytes
+
+    def freeable_bytes(self, volume: str):
+        """Bytes on a volume that pending transfers will remove."""
+        with self._lock:
+            return sum(nbytes for freeable_volume, nbytes in self._freeable.values() if freeable_volume == volume)
+
+    def available_bytes(self, volume: str):
+        """Free bytes on a volume that are not reserved."""
+        return self.free_bytes(volume) - self.reserved_bytes(volume) - self.margin_bytes
+
+    def decide(self, required_bytes: dict):
+        """Whether output of required_bytes fits now, fits once pending
+        transfers finished, or does not fit.
+
+        :param required_bytes: dict of path to bytes, paths on the same
+            volume are added up
+        :return: one of DECISIONS
+        """
+        volumes = dict()
+        for path, nbytes in required_bytes.items():
+            volumes[self.volume(path)] = volumes.get(self.volume(path), 0) + nbytes
+        decision = 'proceed'
+        for volume, nbytes in volumes.items():
+            available_bytes = self.available_bytes(volume)
+            self.log.info(f'required disk space = {nbytes / 1024 ** 3:.1f} [GB], '
+                          f'available = {available_bytes / 1024 ** 3:.1f} [GB] on volume {volume}')
+            if nbytes <= available_bytes:
+                continue
+            freeable_bytes = self.freeable_bytes(volume)
+            if nbytes <= available_bytes + freeable_bytes:
+                self.log.info(f'waiting for transfers to free {freeable_bytes / 1024 ** 3:.1f} [GB] '
+                              f'on volume {volume}')
+                decision = 'wait'
+            else:
+                self.log.error(f'only {available_bytes / 1024 ** 3:.1f} [GB] available on volume {volume}')
+                return 'insufficient'
+        return decision
@@ -0,0 +1,295 @@
+import logging
+import sys
+from itertools import permutations
+
+# Laser switching time for laser drivers without a SWITCH_TIME_S constant.
+LASER_SWITCH_TIME_S = 0.5
+# Filter wheel switching time for drivers without a SWITCH_TIME_S constant.
+FILTER_SWITCH_TIME_S = 0.1
+# Stage speed for stages that do not report one.
+STAGE_SPEED_MM_S = 1.0
+# Channel orders are searched exhaustively up to this many channels.
+MAX_PERMUTED_CHANNELS = 6
+# Passes of 2-opt improvement of nearest neighbour orderings.
+TWO_OPT_PASS_COUNT = 4
+
+ORDERINGS = [
+    "file",
+    "serpentine",
+    "nearest_neighbour"
+]
+
+GROUPINGS = [
+    "channel",
+    "position",
+    "auto"
+]
+
+
+def _switch_time_s(device, default: float):
+    """SWITCH_TIME_S of the driver module of a device."""
+    return getattr(sys.modules.get(type(device).__module__), 'SWITCH_TIME_S', default)
+
+
+class TileCostModel:
+    """Estimated time between tiles from stage moves and channel switches.
+    Stage axes move concurrently, filter wheels and lasers are switched
+    one after the other, as in Acquisition."""
+
+    def __init__(self, stage_speed_mm_s: dict, channels: dict, filter_wheels: dict = dict(),
+                 filter_switch_time_s: dict = dict(), laser_switch_time_s: dict = dict(),
+                 acquisition_rate_hz: float = None):
+        """
+
+        :param stage_speed_mm_s: dict of instrument axis to stage speed
+        :param channels: instrument channels, dict of channel to lasers and filters
+        :param filter_wheels: dict of filter name to filter wheel name
+        :param filter_switch_time_s: dict of filter wheel name to switching time
+        :param laser_switch_time_s: dict of laser name to switching time
+        :param acquisition_rate_hz: frame rate, includes imaging time of the
+            tiles in the total time if given
+        """
+        self.stage_speed_mm_s = stage_speed_mm_s
+        self.channels = channels
+        self.filter_wheels = filter_wheels
+        self.filter_switch_time_s = filter_switch_time_s
+        self.laser_switch_time_s = laser_switch_time_s
+        self.acquisition_rate_hz = acquisition_rate_hz
+
+    @classmethod
+    def from_instrument(cls, instrument, acquisition_rate_hz: float = None):
+        """Cost model with the stage speeds, filter wheel and laser switching
+        times of an instrument."""
+        stage_speed_mm_s = dict()
+        for stage_type in ('tiling_stages', 'scanning_stages'):
+            for stage in getattr(instrument, stage_type, dict()).values():
+                speed_mm_s = stage.speed_mm_s
+                stage_speed_mm_s[stage.instrument_axis] = speed_mm_s if speed_mm_s else STAGE_SPEED_MM_S
+        filter_wheels = dict()
+        filter_switch_time_s = dict()
+        for wheel_name, wheel in getattr(instrument, 'filter_wheels', dict()).items():
+            filter_switch_time_s[wheel_name] = _switch_time_s(wheel, FILTER_SWITCH_TIME_S)
+            for filter_name in wheel.filters:
+                filter_wheels[filter_name] = wheel_name
+        laser_switch_time_s = {laser_name: _switch_time_s(laser, LASER_SWITCH_TIME_S)
+                               for laser_name, laser in getattr(instrument, 'lasers', dict()).items()}
+        return cls(stage_speed_mm_s, instrument.channels, filter_wheels, filter_switch_time_s,
+                   laser_switch_time_s, acquisition_rate_hz)
+
+    def move_time_s(self, start: dict, stop: dict):
+        """Time of a stage move between two tile positions."""
+        return max((abs(stop[axis] - start[axis])/self.stage_speed_mm_s.get(axis, STAGE_SPEED_MM_S)
+                    for axis in stop if axis in start), default=0.0)
+
+    def switch_time_s(self, start_channel: str, stop_channel: str):
+        """Time of switching filters and lasers between two channels."""
+        if start_channel == stop_channel:
+            return 0.0
+        start = self.channels.get(start_channel, dict())
+        stop = self.channels.get(stop_channel, dict())
+        switch_time_s = 0.0
+        start_wheels = {self.filter_wheels.get(name): name for name in start.get('filters', [])}
+        for name in stop.get('filters', []):
+            wheel_name = self.filter_wheels.get(name)
+            if start_wheels.get(wheel_name) != name:
+                switch_time_s += self.filter_switch_time_s.get(wheel_name, FILTER_SWITCH_TIME_S)
+        for name in set(start.get('lasers', [])) ^ set(stop.get('lasers', [])):
+            switch_time_s += self.laser_switch_time_s.get(name, LASER_SWITCH_TIME_S)
+        return switch_time_s
+
+    def transition_time_s(self, start_tile: dict, stop_tile: dict):
+        """Time from the end of one tile to the start of the next."""
+        return self.move_time_s(start_tile['position_mm'], stop_tile['position_mm']) + \
+            self.switch_time_s(start_tile['channel'], stop_tile['channel'])
+
+    def imaging_time_s(self, tile: dict):
+        if not self.acquisition_rate_hz:
+            return 0.0
+        return tile['steps']/self.acquisition_rate_hz
+
+    def total_time_s(self, tiles: list):
+        """Predicted time of acquiring tiles in order."""
+        total_time_s = sum(self.imaging_time_s(tile) for tile in tiles)
+        for start_tile, stop_tile in zip(tiles[:-1], tiles[1:]):
+            total_time_s += self.transition_time_s(start_tile, stop_tile)
+        return total_time_s
+
+
+class TilePlanner:
+    """Reorders tiles to minimize the predicted acquisition time. Positions
+    are ordered serpentine or nearest neighbour first, tiles are grouped by
+    channel, so filters and lasers switch once per channel, or by position,
+    so the stage moves once per position, or whichever of both is faster."""
+
+    def __init__(self, cost_model: TileCostModel, ordering: str = 'serpentine', grouping: str = 'auto'):
+        """
+
+        :param cost_model: cost model of the instrument
+        :param ordering: one of ORDERINGS
+        :param grouping: one of GROUPINGS
+
+        .. code-block: python
+
+            planner = TilePlanner(TileCostModel.from_instrument(instrument))
+            tiles = planner.plan(config['acquisition']['tiles'])
+            planner.predicted_time_s
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.cost_model = cost_model
+        self.ordering = ordering
+        self.grouping = grouping
+        self._predicted_time_s = None
+        self._file_order_time_s = None
+
+    @property
+    def ordering(self):
+        return self._ordering
+
+    @ordering.setter
+    def ordering(self, ordering: str):
+        if ordering not in ORDERINGS:
+            raise ValueError("ordering must be one of %r." % ORDERINGS)
+        self.log.info(f'setting ordering to: {ordering}')
+        self._ordering = ordering
+
+    @property
+    def grouping(self):
+        return self._grouping
+
+    @grouping.setter
+    def grouping(self, grouping: str):
+        if grouping not in GROUPINGS:
+            raise ValueError("grouping must be one of %r." % GROUPINGS)
+        self.log.info(f'setting grouping to: {grouping}')
+        self._grouping = grouping
+
+    @property
+    def predicted_time_s(self):
+        """Predicted total time of the last plan."""
+        return self._predicted_time_s
+
+    @property
+    def file_order_time_s(self):
+        """Predicted total time of the last planned tiles in file order."""
+        return self._file_order_time_s
+
+    def plan(self, tiles: list):
+        """Tiles in the order with the lowest predicted time.
+
+        :param tiles: tile dicts with position_mm, channel and steps
+        :return: reordered list of the same tile dicts
+        """
+        tiles = list(tiles)
+        self._file_order_time_s = self.cost_model.total_time_s(tiles)
+        if self._ordering == 'file' or len(tiles) < 3:
+            planned = tiles
+        else:
+            candidates = list()
+            if self._grouping in ('channel', 'auto'):
+                candidates.append(self._plan_by_channel(tiles))
+            if self._grouping in ('position', 'auto'):
+                candidates.append(self._plan_by_position(tiles))
+            # never predict worse than the file order
+            candidates.append(tiles)
+            planned = min(candidates, key=self.cost_model.total_time_s)
+        self._predicted_time_s = self.cost_model.total_time_s(planned)
+        self.log.info(f'predicted total time = {self._predicted_time_s:.1f} [s] for {len(tiles)} tiles, '
+                      f'{self._file_order_time_s:.1f} [s] in file order')
+        return planned
+
+    def _plan_by_channel(self, tiles: list):
+        """All tiles of a channel, then the next channel. Each channel's
+        positions run forward or reversed, whichever starts closer to where
+        the previous channel ended."""
+        groups = dict()
+        for tile in tiles:
+            groups.setdefault(tile['channel'], list()).append(tile)
+        ordered_groups = {channel: self._order_positions(group) for channel, group in groups.items()}
+        channel_orders = permutations(ordered_groups) if len(ordered_groups) <= MAX_PERMUTED_CHANNELS \
+            else [list(ordered_groups)]
+        best = None
+        for channel_order in channel_orders:
+            planned = list()
+            for channel in channel_order:
+                group = ordered_groups[channel]
+                if planned and self.cost_model.transition_time_s(planned[-1], group[-1]) < \
+                        self.cost_model.transition_time_s(planned[-1], group[0]):
+                    group = group[::-1]
+                planned.extend(group)
+            if best is None or self.cost_model.total_time_s(planned) < self.cost_model.total_time_s(best):
+                best = planned
+        return best
+
+    def _plan_by_position(self, tiles: list):
+        """All channels at a position, then the next position. Each position
+        starts with the channel the previous position ended with."""
+        groups = dict()
+        for tile in tiles:
+            groups.setdefault(self._position_key(tile), list()).append(tile)
+        positions = self._order_positions([group[0] for group in groups.values()])
+        planned = list()
+        for position_tile in positions:
+            group = list(groups[self._position_key(position_tile)])
+            if planned:
+                group.sort(key=lambda tile: tile['channel'] != planned[-1]['channel'])
+            planned.extend(group)
+        return planned
+
+    def _order_positions(self, tiles: list):
+        if self._ordering == 'serpentine':
+            return self._serpentine(tiles)
+        return self._nearest_neighbour(tiles)
+
+    @staticmethod
+    def _position_key(tile: dict):
+        return tuple(sorted((axis, round(position, 6)) for axis, position in tile['position_mm'].items()))
+
+    def _serpentine(self, tiles: list):
+        """Rows along one tiling axis, alternating direction. Every varying
+        axis is tried as the row axis and the fastest is kept."""
+        axes = sorted({axis for tile in tiles for axis in tile['position_mm']})
+        varying_axes = [axis for axis in axes if len({round(tile['position_mm'][axis], 6) for tile in tiles}) > 1]
+        if not varying_axes:
+            return list(tiles)
+        best = None
+        for fast_axis in varying_axes:
+            slow_axes = [axis for axis in varying_axes if axis != fast_axis]
+            rows = dict()
+            for tile in tiles:
+                row_key = tuple(round(tile['position_mm'][axis], 6) for axis in slow_axes)
+                rows.setdefault(row_key, list()).append(tile)
+            ordered = list()
+            for row_index, row_key in enumerate(sorted(rows)):
+                row = sorted(rows[row_key], key=lambda tile: tile['position_mm'][fast_axis],
+                             reverse=bool(row_index % 2))
+                ordered.extend(row)
+            if best is None or self.cost_model.total_time_s(ordered) < self.cost_model.total_time_s(best):
+                best = ordered
+        return best
+
+    def _nearest_neighbour(self, tiles: list):
+        """Greedy nearest neighbour tour from the first tile, improved with
+        2-opt moves."""
+        remaining = list(tiles[1:])
+        ordered = [tiles[0]]
+        while remaining:
+            nearest = min(range(len(remaining)),
+                          key=lambda index: self.cost_model.transition_time_s(ordered[-1], remaining[index]))
+            ordered.append(remaining.pop(nearest))
+        cost = self.cost_model.transition_time_s
+        for _ in range(TWO_OPT_PASS_COUNT):
+            improved = False
+            for i in range(len(ordered) - 2):
+                for j in range(i + 2, len(ordered)):
+                    # reverse ordered[i + 1:j + 1], the tour is open at the end
+                    before = cost(ordered[i], ordered[i + 1]) + \
+                        (cost(ordered[j], ordered[j + 1]) if j + 1 < len(ordered) else 0)
+                    after = cost(ordered[i], ordered[j]) + \
+                        (cost(ordered[i + 1], ordered[j + 1]) if j + 1 < len(ordered) else 0)
+                    if after < before - 1e-9:
+                        ordered[i + 1:j + 1] = ordered[i + 1:j + 1][::-1]
+                        improved = True
+            if not improved:
+                break
+        return ordered
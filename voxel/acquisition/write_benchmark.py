@@ -0,0 +1,164 @@
+import logging
+import mmap
+import numpy
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from voxel.acquisition.storage import volume
+
+# Bytes per write call, writers write chunks in blocks of this size.
+BLOCK_BYTES = 16 * 1024 ** 2
+# Alignment of buffers, offsets and sizes of unbuffered writes.
+ALIGNMENT_BYTES = 4096
+# Duration of a full benchmark of a volume.
+DURATION_S = 30.0
+# Duration of all volumes together in short mode.
+SHORT_DURATION_S = 8.0
+# Chunks are clipped to this size in short mode, so several chunks finish.
+SHORT_CHUNK_BYTES = 256 * 1024 ** 2
+# Test files wrap around at this size, so the disk does not fill up.
+MAX_FILE_BYTES = 4 * 1024 ** 3
+
+
+def _align(nbytes: int):
+    """nbytes rounded up to the alignment of unbuffered writes."""
+    return -(-int(nbytes) // ALIGNMENT_BYTES) * ALIGNMENT_BYTES
+
+
+class WriteBenchmark:
+    """Write speed of a volume under the write pattern of an acquisition:
+    one thread per writer, each writing chunks of its size to its own file,
+    unbuffered with O_DIRECT where the file system supports it. Without
+    O_DIRECT every chunk is synced to disk, so the page cache does not
+    inflate the speed. Reports the sustained rate and chunk latencies.
+    """
+
+    def __init__(self, path: str, chunk_bytes: list, direct: bool = True, short: bool = False):
+        """
+
+        :param path: directory on the volume to test
+        :param chunk_bytes: bytes of a chunk of every writer, e.g. chunk count
+            times frame size over compression ratio
+        :param direct: write unbuffered with O_DIRECT
+        :param short: clip chunks to SHORT_CHUNK_BYTES
+
+        .. code-block: python
+
+            benchmark = WriteBenchmark('D:/data', [64*2048*2048*2]*2, short=True)
+            benchmark.run(duration_s=4.0)
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.path = Path(path)
+        if not chunk_bytes:
+            raise ValueError("chunk bytes of at least one writer are needed.")
+        if short:
+            chunk_bytes = [min(nbytes, SHORT_CHUNK_BYTES) for nbytes in chunk_bytes]
+        self.chunk_bytes = [_align(nbytes) for nbytes in chunk_bytes]
+        self.direct = direct
+        self.short = short
+
+    @property
+    def volume(self):
+        return volume(self.path)
+
+    def _open(self, filename: Path):
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if self.direct and hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(filename, flags | os.O_DIRECT), True
+            except OSError:
+                # e.g. tmpfs does not support unbuffered writes
+                self.log.warning(f'unbuffered writes not supported on {self.volume}, syncing every chunk instead')
+        return os.open(filename, flags), False
+
+    def run(self, duration_s: float = DURATION_S):
+        """Write chunks from all writers at once for duration_s.
+
+        :param duration_s: seconds of writing, chunks in progress are finished
+        :return: dict of volume, writers, rate and chunk latencies
+        """
+        # files wrap around, leaving half of the free space
+        free_bytes = shutil.disk_usage(self.path).free
+        file_bytes = min(MAX_FILE_BYTES, free_bytes // (2 * len(self.chunk_bytes)))
+        file_bytes = max(file_bytes // ALIGNMENT_BYTES * ALIGNMENT_BYTES, ALIGNMENT_BYTES)
+        # page aligned, incompressible data
+        buffer = mmap.mmap(-1, min(BLOCK_BYTES, max(self.chunk_bytes)))
+        buffer[:] = numpy.random.default_rng().integers(0, 256, len(buffer), dtype=numpy.uint8).tobytes()
+        latencies = [list() for _ in self.chunk_bytes]
+        written_bytes = [0 for _ in self.chunk_bytes]
+        finish_times = [0.0 for _ in self.chunk_bytes]
+        unbuffered = [True for _ in self.chunk_bytes]
+        errors = list()
+        start = threading.Barrier(len(self.chunk_bytes) + 1)
+        stop_time = [None]
+
+        def write(index: int):
+            filename = Path(self.path, f'iotest_{index}')
+            try:
+                fd, unbuffered[index] = self._open(filename)
+            except OSError as e:
+                errors.append(e)
+                start.abort()
+                return
+            view = memoryview(buffer)
+            offset = 0
+            try:
+                start.wait()
+                while time.perf_counter() < stop_time[0]:
+                    chunk_start = time.perf_counter()
+                    remaining = self.chunk_bytes[index]
+                    while remaining:
+                        nbytes = min(remaining, len(buffer), file_bytes - offset)
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        os.write(fd, view[:nbytes])
+                        offset = (offset + nbytes) % file_bytes
+                        remaining -= nbytes
+                    if not unbuffered[index]:
+                        os.fsync(fd)
+                    latencies[index].append(time.perf_counter() - chunk_start)
+                    written_bytes[index] += self.chunk_bytes[index]
+                    finish_times[index] = time.perf_counter()
+            except (OSError, threading.BrokenBarrierError) as e:
+                errors.append(e)
+            finally:
+                view.release()
+                os.close(fd)
+                filename.unlink(missing_ok=True)
+
+        threads = [threading.Thread(target=write, args=(index,), name=f'write_benchmark_{index}')
+                   for index in range(len(self.chunk_bytes))]
+        for thread in threads:
+            thread.start()
+        stop_time[0] = time.perf_counter() + duration_s
+        try:
+            start.wait()
+        except threading.BrokenBarrierError:
+            pass
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        # excludes removing the test files
+        elapsed_s = max(max(finish_times) - start_time, 1e-9)
+        buffer.close()
+        if errors:
+            raise errors[0]
+        all_latencies = numpy.concatenate([numpy.array(chunk_latencies) for chunk_latencies in latencies])
+        p50, p99 = numpy.percentile(all_latencies, [50, 99]) if all_latencies.size else (0, 0)
+        result = {
+            'Volume': self.volume,
+            'Writers': len(self.chunk_bytes),
+            'Chunk size [MB]': max(self.chunk_bytes)/1e6,
+            'Unbuffered': all(unbuffered),
+            'Chunks written': int(all_latencies.size),
+            'Rate [MB/s]': sum(written_bytes)/1e6/elapsed_s,
+            'Latency p50 [s]': float(p50),
+            'Latency p99 [s]': float(p99),
+            'Duration [s]': elapsed_s
+        }
+        self.log.info(f'write benchmark of {self.volume}: ' +
+                      ', '.join(f'{key} = {value:.2f}' if isinstance(value, float) else f'{key} = {value}'
+                                for key, value in result.items()))
+        return result
@@ -0,0 +1,48 @@
+import argparse
+import logging
+import sys
+from ruamel.yaml import YAML
+from pathlib import Path
+from voxel.writers.convert import FORMATS, convert
+
+
+def _convert(args):
+    settings = dict()
+    if args.config is not None:
+        # writer section of a writer yaml, as used by the writer tests
+        config = YAML(typ='safe', pure=True).load(Path(args.config))
+        settings = {key: value for key, value in config.get('writer', config).items()
+                    if key not in ('driver', 'path')}
+    if args.compression is not None:
+        settings['compression'] = args.compression
+    converted = convert(args.inputs, args.to, args.output, settings=settings,
+                        worker_count=args.workers, resume=not args.restart)
+    print(f"converted {len(converted)} stacks to {args.output}")
+
+
+def main(argv: list = None):
+    """voxel command line entry point."""
+    parser = argparse.ArgumentParser(prog='voxel')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='convert stacks between raw, tiff, bdv, imaris and zarr')
+    convert_parser.add_argument('inputs', nargs='+', help='tiff, raw, bdv .h5, imaris .ims or .zarr inputs')
+    convert_parser.add_argument('--to', required=True, choices=list(FORMATS), help='output format')
+    convert_parser.add_argument('--output', required=True, help='output directory')
+    convert_parser.add_argument('--config', help='yaml with writer settings, e.g. compression')
+    convert_parser.add_argument('--compression', help='writer compression, overrides --config')
+    convert_parser.add_argument('--workers', type=int, default=None,
+                                help='number of stacks converted concurrently, defaults to the cpu count')
+    convert_parser.add_argument('--restart', action='store_true',
+                                help='convert all stacks again instead of resuming')
+    convert_parser.set_defaults(function=_convert)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+                        format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s',
+                        datefmt='%Y-%m-%d,%H:%M:%S')
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -126,6 +126,8 @@ class Camera(BaseCamera):
         self.id = str(id) # convert to string incase serial # is entered as int
 
         self._latest_frame = None
+        # RAM buffer of dcam, allocated in prepare
+        self._buffer_size_mb = BUFFER_SIZE_MB
 
         if DcamapiSingleton.init() is not False:
             num_cams = DcamapiSingleton.get_devicecount()
@@ -343,6 +345,17 @@ class Camera(BaseCamera):
         # refresh parameter values
         self._update_parameters()
 
+    @property
+    def buffer_size_mb(self):
+        return self._buffer_size_mb
+
+    @buffer_size_mb.setter
+    def buffer_size_mb(self, buffer_size_mb: float):
+        if buffer_size_mb <= 0:
+            raise ValueError("buffer size must be > 0 [MB].")
+        self.log.info(f"buffer size set to: {buffer_size_mb} [MB]")
+        self._buffer_size_mb = buffer_size_mb
+
     def prepare(self):
         # determine bits to bytes
         if self.pixel_type == 'mono8':
@@ -350,7 +363,7 @@ class Camera(BaseCamera):
         else:
             bit_to_byte = 2
         frame_size_mb = self.width_px*self.height_px/self.binning**2*bit_to_byte/1e6
-        self.buffer_size_frames = round(BUFFER_SIZE_MB / frame_size_mb)
+        self.buffer_size_frames = max(round(self._buffer_size_mb / frame_size_mb), 1)
         # realloc buffers appears to be allocating ram on the pc side, not camera side.
         self.dcam.buf_alloc(self.buffer_size_frames)
         self.log.info(f"buffer set to: {self.buffer_size_frames} frames")
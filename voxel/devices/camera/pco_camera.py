@@ -39,6 +39,8 @@ class Camera(BaseCamera):
     def __init__(self, id=str):
         self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.id = id
+        # RAM buffer of the pco api, allocated in prepare
+        self._buffer_size_mb = BUFFER_SIZE_MB
         # note self.id here is the interface, not a unique camera id
         # potential to do -> this could be hardcoded and changed in the pco sdk
         # error handling is taken care of within pco api
@@ -234,12 +236,23 @@ class Camera(BaseCamera):
         # refresh parameter values
         self._get_min_max_step_values()
 
+    @property
+    def buffer_size_mb(self):
+        return self._buffer_size_mb
+
+    @buffer_size_mb.setter
+    def buffer_size_mb(self, buffer_size_mb: float):
+        if buffer_size_mb <= 0:
+            raise ValueError("buffer size must be > 0 [MB].")
+        self.log.info(f"buffer size set to: {buffer_size_mb} [MB]")
+        self._buffer_size_mb = buffer_size_mb
+
     def prepare(self):
         # pco api prepares buffer and autostarts. api call is in start()
         # pco only 16-bit A/D
         bit_to_byte = 2
         frame_size_mb = self.width_px*self.height_px/self.binning**2*bit_to_byte/1e6
-        self.buffer_size_frames = round(BUFFER_SIZE_MB / frame_size_mb)
+        self.buffer_size_frames = max(round(self._buffer_size_mb / frame_size_mb), 1)
         self.log.info(f"buffer set to: {self.buffer_size_frames} frames")
         self.pco.record(number_of_images=self.buffer_size_frames, mode='fifo')
 
@@ -412,4 +425,4 @@ class Camera(BaseCamera):
             except:
                 self.log.debug(f"{key} not avaiable on this camera")
         # initialize as rolling in shutter
-        self.pco.sdk.set_interface_output_format(interface='edge', format=readout_mode_options['rolling in'])
\ No newline at end of file
+        self.pco.sdk.set_interface_output_format(interface='edge', format=readout_mode_options['rolling in'])
\ No newline at end of file
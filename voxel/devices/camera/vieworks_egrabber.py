@@ -68,6 +68,8 @@ class Camera(BaseCamera):
         self.id = str(id)  # convert to string incase serial # is entered as int
         self.gentl = EGenTLSingleton()
         self._latest_frame = None
+        # RAM buffer of the grabber, allocated in prepare
+        self._buffer_size_mb = BUFFER_SIZE_MB
 
         discovery = EGrabberDiscovery(self.gentl)
         discovery.discover()
@@ -286,6 +288,17 @@ class Camera(BaseCamera):
         state['Sensor Temperature [C]'] = self.grabber.remote.get("DeviceTemperature")
         return state
 
+    @property
+    def buffer_size_mb(self):
+        return self._buffer_size_mb
+
+    @buffer_size_mb.setter
+    def buffer_size_mb(self, buffer_size_mb: float):
+        if buffer_size_mb <= 0:
+            raise ValueError("buffer size must be > 0 [MB].")
+        self.log.info(f"buffer size set to: {buffer_size_mb} [MB]")
+        self._buffer_size_mb = buffer_size_mb
+
     def prepare(self):
         # determine bits to bytes
         if self.pixel_type == 'mono8':
@@ -294,7 +307,7 @@ class Camera(BaseCamera):
             bit_to_byte = 2
         # software binning, so frame size is independent of binning factor
         frame_size_mb = self.width_px*self.height_px*bit_to_byte/1e6
-        self.buffer_size_frames = round(BUFFER_SIZE_MB / frame_size_mb)
+        self.buffer_size_frames = max(round(self._buffer_size_mb / frame_size_mb), 1)
         # realloc buffers appears to be allocating ram on the pc side, not camera side.
         self.grabber.realloc_buffers(self.buffer_size_frames)  # allocate RAM buffer N frames
         self.log.info(f"buffer set to: {self.buffer_size_frames} frames")
@@ -5,9 +5,10 @@ import os
 import tifffile
 import math
 import time
-from multiprocessing import Process, Event
+from multiprocessing import Process, Event, Pipe
 from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
+from voxel.acquisition.affinity import format_cpu_list, pin_process
 
 
 class MaxProjection:
@@ -28,6 +29,24 @@ class MaxProjection:
         self._data_type = None
         self.new_image = Event()
         self.new_image.clear()
+        # Frames per chunk when chunks are handed off with submit_chunk().
+        self._chunk_count_px = None
+        # Chunk hand-off as done by writers, so that a chunk dispatcher can
+        # share one chunk between writers and projections.
+        self.done_reading = Event()
+        self.done_reading.set()
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
+        # Cpus the projection process is pinned to.
+        self._cpu_affinity = None
+
+    @property
+    def cpu_affinity(self):
+        return self._cpu_affinity
+
+    @cpu_affinity.setter
+    def cpu_affinity(self, cpu_affinity: list):
+        self.log.info(f'setting cpu affinity to: {cpu_affinity}')
+        self._cpu_affinity = None if cpu_affinity is None else list(cpu_affinity)
 
     @property
     def column_count_px(self):
@@ -120,18 +139,43 @@ class MaxProjection:
             if filename.endswith(".tiff") or filename.endswith(".tif") else f"{filename}"
         self.log.info(f'setting filename to: {filename}')
 
-    def prepare(self, shm_name):
+    @property
+    def chunk_count_px(self):
+        return self._chunk_count_px
+
+    @chunk_count_px.setter
+    def chunk_count_px(self, chunk_count_px: int):
+        self.log.info(f'setting chunk count to: {chunk_count_px} [px]')
+        self._chunk_count_px = chunk_count_px
+
+    def prepare(self, shm_name: str = None):
+        """Prepare projecting the latest image in shared memory, or without a
+        shared memory name, chunks handed off with submit_chunk()."""
         self.p = Process(target=self._run)
         self.shm_shape = (self._row_count_px, self._column_count_px)
+        self._chunked = shm_name is None
+        if self._chunked:
+            if self._chunk_count_px is None:
+                raise ValueError("chunk count must be set to project chunks.")
+            self.shm = None
+            return
         # create attributes to open shared memory in run function
         self.shm = SharedMemory(shm_name, create=False)
         self.latest_img = np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf)
 
+    def submit_chunk(self, shm_name: str):
+        """Hand a chunk of frames in shared memory to the projection process."""
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
+
     def start(self):
         self.log.info(f"{self._filename}: starting writer.")
         self.p.start()
 
     def _run(self):
+        if self._cpu_affinity is not None:
+            cpus = pin_process(self._cpu_affinity)
+            self.log.info(f"{self._filename}: process {os.getpid()} pinned to cpus {format_cpu_list(cpus)}")
 
         # check if projection counts were set
         # if not, set to max possible values based on tile
@@ -166,10 +210,11 @@ class MaxProjection:
         frame_index = 0
         start_index = 0
 
+        frames = self._chunk_frames() if self._chunked else self._latest_frames()
         while frame_index < self._frame_count_px_px:
             # max project latest image
-            if self.new_image.is_set():
-                self.latest_img = np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf)
+            self.latest_img = next(frames)
+            if self.latest_img is not None:
                 if z_projection:
                     self.mip_xy = np.maximum(self.mip_xy, self.latest_img).astype(np.uint16)
                     # if this projection thickness is complete or end of stack
@@ -192,6 +237,9 @@ class MaxProjection:
                         self.mip_xz[frame_index, :, i] = np.max(self.latest_img[y_index_list[i]:y_index_list[i+1], :], axis=0)
                 frame_index += 1
                 self.new_image.clear()
+        # release the last chunk
+        frames.close()
+        self.latest_img = None
         if x_projection:
             for i in range(0, len(x_index_list)-1):
                 start_index = x_index_list[i]
@@ -205,6 +253,35 @@ class MaxProjection:
                 self.log.info(f'saving {self.filename}_max_projection_xz_y_{start_index:06}_{end_index:06}.tiff')
                 tifffile.imwrite(Path(self.path, self._acquisition_name, f"{self.filename}_max_projection_xz_y_{start_index:06}_{end_index:06}.tiff"), self.mip_xz[:, :, i])
 
+    def _latest_frames(self):
+        """Latest image in shared memory whenever a new image is flagged,
+        else None."""
+        while True:
+            yield np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf) if self.new_image.is_set() else None
+
+    def _chunk_frames(self):
+        """Frames of the handed off chunks. A chunk is released once all of
+        its frames were projected."""
+        segments = dict()
+        frame_index = 0
+        while frame_index < self._frame_count_px_px:
+            shm_name = self._chunk_receiver.recv()
+            # segments of a ring buffer are attached only once
+            if shm_name not in segments:
+                segments[shm_name] = SharedMemory(shm_name, create=False)
+            chunk = np.ndarray((self._chunk_count_px, *self.shm_shape), self._data_type, buffer=segments[shm_name].buf)
+            frame_count = min(self._chunk_count_px, self._frame_count_px_px - frame_index)
+            try:
+                for frame in chunk[:frame_count]:
+                    yield frame
+                    frame_index += 1
+            finally:
+                frame = None
+                chunk = None
+                self.done_reading.set()
+        while True:
+            yield None
+
     def wait_to_finish(self):
         self.log.info(f"max projection {self.filename}: waiting to finish.")
         self.p.join()
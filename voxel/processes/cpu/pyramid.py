@@ -0,0 +1,199 @@
+import numpy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from math import ceil
+
+METHODS = [
+    "mean",
+    "max"
+]
+
+
+class Pyramid:
+    """Incremental multiscale pyramid built from consecutive z chunks of a
+    stack. Planes that do not fill a whole z block of the next level yet are
+    carried over to the next chunk, so chunk boundaries do not have to line
+    up with the downsampling factors."""
+
+    def __init__(self, factors: tuple = ((2, 2, 2),), method: str = 'mean', thread_count: int = os.cpu_count()):
+        """
+
+        :param factors: per level (z, y, x) downsampling factors relative to
+            the previous level, e.g. ((2, 2, 2), (2, 2, 2)) for 3 levels
+        :param method: reduction of each block, 'mean' or 'max'
+        :param thread_count: number of threads reducing each chunk
+
+        .. code-block: python
+
+            pyramid = Pyramid(factors=((2, 2, 2), (2, 2, 2)), method='mean')
+
+            for chunk in chunks:
+                # one (z_start, planes) tuple per level > 0
+                for level, (z_start, planes) in enumerate(pyramid.push(chunk), start=1):
+                    ...
+            # reduce the planes left over at the end of the stack
+            for level, (z_start, planes) in enumerate(pyramid.flush(), start=1):
+                ...
+
+        """
+        if method not in METHODS:
+            raise ValueError(f'method must be one of {METHODS}')
+        factors = [tuple(int(factor) for factor in level_factors) for level_factors in factors]
+        for level_factors in factors:
+            if len(level_factors) != 3 or any(factor < 1 for factor in level_factors):
+                raise ValueError(f'factors must be (z, y, x) integers >= 1 but are {level_factors}')
+        self._factors = factors
+        self._method = method
+        self._thread_count = thread_count
+        self._pool = ThreadPoolExecutor(max_workers=thread_count)
+        self.reset()
+
+    @property
+    def level_count(self):
+        """Number of levels including the full resolution level."""
+        return len(self._factors) + 1
+
+    @property
+    def factors(self):
+        return self._factors
+
+    @property
+    def method(self):
+        return self._method
+
+    def reset(self):
+        """Drop carried planes and start a new stack."""
+        # planes of each level waiting for a complete z block of the next level
+        self._carry = [None]*len(self._factors)
+        # planes produced so far for each level
+        self._plane_counts = [0]*self.level_count
+        self._plane_shape = None
+        self._dtype = None
+
+    def push(self, chunk: numpy.array):
+        """Add the next planes of the full resolution stack.
+
+        :param chunk: (z, y, x) planes following the previously pushed planes
+        :return: list with one (z_start, planes) tuple for every level > 0;
+            planes may be empty in z
+        """
+        self._plane_shape = chunk.shape[1:]
+        self._dtype = chunk.dtype
+        return self._cascade(chunk, final=False)
+
+    def flush(self):
+        """Reduce the planes carried at the end of the stack into partial z
+        blocks and reset the pyramid for the next stack.
+
+        :return: list with one (z_start, planes) tuple for every level > 0
+        """
+        if self._plane_shape is None:
+            return list()
+        levels = self._cascade(numpy.empty((0, *self._plane_shape), dtype=self._dtype), final=True)
+        self.reset()
+        return levels
+
+    def close(self):
+        self._pool.shutdown()
+
+    def _cascade(self, planes: numpy.array, final: bool):
+        levels = list()
+        self._plane_counts[0] += planes.shape[0]
+        for level, level_factors in enumerate(self._factors):
+            planes = self._consume(level, planes, level_factors, final)
+            levels.append((self._plane_counts[level + 1], planes))
+            self._plane_counts[level + 1] += planes.shape[0]
+        return levels
+
+    def _consume(self, level: int, planes: numpy.array, factors: tuple, final: bool):
+        """Reduce all complete z blocks of the carried and new planes of one
+        level and carry the remainder."""
+        z_factor = factors[0]
+        blocks = list()
+        carry = self._carry[level]
+        self._carry[level] = None
+        if carry is not None:
+            # complete the carried block with the first new planes
+            fill = z_factor - carry.shape[0]
+            carry = numpy.concatenate((carry, planes[:fill]))
+            planes = planes[fill:]
+            if carry.shape[0] == z_factor or final:
+                blocks.append(carry)
+            else:
+                self._carry[level] = carry
+        if final:
+            complete_count = planes.shape[0]
+        else:
+            complete_count = planes.shape[0] // z_factor * z_factor
+            if complete_count < planes.shape[0]:
+                # copy, the chunk memory is reused for the next chunk
+                self._carry[level] = planes[complete_count:].copy()
+        if complete_count:
+            blocks.append(planes[:complete_count])
+        out_shape = (sum(ceil(block.shape[0]/z_factor) for block in blocks),
+                     ceil(planes.shape[1]/factors[1]),
+                     ceil(planes.shape[2]/factors[2]))
+        out = numpy.empty(out_shape, dtype=planes.dtype)
+        z_start = 0
+        for block in blocks:
+            z_count = ceil(block.shape[0]/z_factor)
+            self._reduce(block, factors, out[z_start:z_start + z_count])
+            z_start += z_count
+        return out
+
+    def _reduce(self, block: numpy.array, factors: tuple, out: numpy.array):
+        """Reduce a block into out, split into bands of rows across threads."""
+        band_rows = ceil(out.shape[1]/self._thread_count)
+        futures = list()
+        for row_start in range(0, out.shape[1], band_rows):
+            row_end = min(row_start + band_rows, out.shape[1])
+            futures.append(self._pool.submit(self._reduce_band,
+                                             block[:, row_start*factors[1]:row_end*factors[1]],
+                                             factors,
+                                             out[:, row_start:row_end]))
+        for future in futures:
+            future.result()
+
+    def _reduce_band(self, block: numpy.array, factors: tuple, out: numpy.array):
+        """Reduce every factor sized block into one voxel. Edge blocks that
+        are cut off by the array bounds are reduced over the voxels they
+        contain."""
+        axis_regions = list()
+        for size, factor in zip(block.shape, factors):
+            complete = size // factor * factor
+            regions = list()
+            if complete:
+                regions.append((slice(0, complete), slice(0, complete // factor), factor))
+            if complete < size:
+                regions.append((slice(complete, size), slice(complete // factor, complete // factor + 1), size - complete))
+            axis_regions.append(regions)
+        for (z_in, z_out, z_factor), (y_in, y_out, y_factor), (x_in, x_out, x_factor) in product(*axis_regions):
+            region = block[z_in, y_in, x_in]
+            # accumulating strided views is much faster than reducing a
+            # reshaped 6d view over several axes
+            offsets = product(range(z_factor), range(y_factor), range(x_factor))
+            z_offset, y_offset, x_offset = next(offsets)
+            if self._method == 'max':
+                result = region[z_offset::z_factor, y_offset::y_factor, x_offset::x_factor].copy()
+                for z_offset, y_offset, x_offset in offsets:
+                    numpy.maximum(result, region[z_offset::z_factor, y_offset::y_factor, x_offset::x_factor], out=result)
+            else:
+                result = region[z_offset::z_factor, y_offset::y_factor, x_offset::x_factor].astype(
+                    self._accumulator_dtype(region.dtype))
+                for z_offset, y_offset, x_offset in offsets:
+                    result += region[z_offset::z_factor, y_offset::y_factor, x_offset::x_factor]
+                count = z_factor*y_factor*x_factor
+                if result.dtype.kind == 'f':
+                    result /= count
+                else:
+                    # integer mean rounded to the nearest value
+                    result += count // 2
+                    result //= count
+            out[z_out, y_out, x_out] = result
+
+    @staticmethod
+    def _accumulator_dtype(dtype: numpy.dtype):
+        if dtype.kind == 'f':
+            return numpy.float64
+        return numpy.uint32 if dtype.itemsize <= 2 else numpy.uint64
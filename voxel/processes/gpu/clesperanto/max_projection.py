@@ -8,6 +8,7 @@ import time
 from multiprocessing import Process, Value, Event, Array
 from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
+from voxel.acquisition.affinity import pin_process
 
 class MaxProjection:
 
@@ -24,6 +25,17 @@ class MaxProjection:
         self._data_type = None
         self.new_image = Event()
         self.new_image.clear()
+        # Cpus the projection process is pinned to.
+        self._cpu_affinity = None
+
+    @property
+    def cpu_affinity(self):
+        return self._cpu_affinity
+
+    @cpu_affinity.setter
+    def cpu_affinity(self, cpu_affinity: list):
+        self.log.info(f'setting cpu affinity to: {cpu_affinity}')
+        self._cpu_affinity = None if cpu_affinity is None else list(cpu_affinity)
 
     @property
     def column_count_px(self):
@@ -111,6 +123,8 @@ class MaxProjection:
         self.p.start()
 
     def _run(self):
+        if self._cpu_affinity is not None:
+            pin_process(self._cpu_affinity)
         # cannot pickle cle so import within run function()
         import pyclesperanto as cle
 
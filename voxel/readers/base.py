@@ -0,0 +1,231 @@
+import numpy as np
+import logging
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+from threading import Lock
+from voxel.readers.chunk_cache import CHUNK_CACHE, ChunkCache
+
+# Number of reads of the same size decoded ahead along z when a stack is
+# scanned in order.
+PREFETCH_READ_COUNT = 1
+# Number of threads decoding prefetched chunks, shared by all readers.
+PREFETCH_THREAD_COUNT = 4
+
+_prefetch_pool = None
+_prefetch_pool_lock = Lock()
+
+
+def _get_prefetch_pool():
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_THREAD_COUNT,
+                                                thread_name_prefix='reader_prefetch')
+        return _prefetch_pool
+
+
+class BaseReader:
+    """Lazy, read only (z, y, x) array over a chunked file. Slicing decodes
+    only the chunks that overlap the slice, keeps them in a chunk cache
+    shared between readers and, when reads walk along z, decodes the next
+    chunks in the background."""
+
+    def __init__(self, path: str, cache: ChunkCache = None, prefetch_read_count: int = PREFETCH_READ_COUNT):
+        """
+
+        :param path: path of the file
+        :param cache: chunk cache, defaults to the cache shared by all readers
+        :param prefetch_read_count: number of reads of the same size decoded
+            ahead along z, 0 disables prefetching
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._path = Path(path)
+        self._cache = CHUNK_CACHE if cache is None else cache
+        self._prefetch_read_count = prefetch_read_count
+        # futures of prefetched chunks by chunk index
+        self._pending = dict()
+        self._pending_lock = Lock()
+        self._last_z_chunk = -1
+        # set by readers
+        self._shape = None
+        self._dtype = None
+        self._chunk_shape = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def chunk_shape(self):
+        """(z, y, x) shape of the decoded chunks."""
+        return self._chunk_shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self._shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.size*self._dtype.itemsize
+
+    @property
+    def prefetch_read_count(self):
+        return self._prefetch_read_count
+
+    @prefetch_read_count.setter
+    def prefetch_read_count(self, prefetch_read_count: int):
+        self.log.info(f'setting prefetch read count to: {prefetch_read_count}')
+        self._prefetch_read_count = prefetch_read_count
+
+    @property
+    @abstractmethod
+    def _key(self):
+        """Identifies the array within the chunk cache, so readers of the
+        same array share cached chunks."""
+        pass
+
+    @abstractmethod
+    def _read_chunk(self, chunk_index: tuple):
+        """Decode one chunk from the file.
+
+        :param chunk_index: (z, y, x) index of the chunk
+        :return: chunk array, cropped at the array edges
+        """
+        pass
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        return array if dtype is None else array.astype(dtype)
+
+    def __repr__(self):
+        return f"{self.__class__.__module__}.Reader('{self._path}', shape={self._shape}, dtype={self._dtype})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key):
+        starts, stops, steps, squeezed = self._bounds(key)
+        bounding_shape = tuple(stop - start for start, stop in zip(starts, stops))
+        region = np.empty(bounding_shape, dtype=self._dtype)
+        if region.size:
+            chunk_ranges = [range(start // size, (stop - 1) // size + 1)
+                            for start, stop, size in zip(starts, stops, self._chunk_shape)]
+            for chunk_index in product(*chunk_ranges):
+                chunk = self._get_chunk(chunk_index)
+                chunk_starts = [index*size for index, size in zip(chunk_index, self._chunk_shape)]
+                region_slices = list()
+                chunk_slices = list()
+                for start, stop, chunk_start, chunk_size in zip(starts, stops, chunk_starts, chunk.shape):
+                    low = max(start, chunk_start)
+                    high = min(stop, chunk_start + chunk_size)
+                    region_slices.append(slice(low - start, high - start))
+                    chunk_slices.append(slice(low - chunk_start, high - chunk_start))
+                region[tuple(region_slices)] = chunk[tuple(chunk_slices)]
+            self._prefetch_after(chunk_ranges)
+        # negative steps start from the end of the bounding box
+        selection = tuple(0 if squeeze else slice(None, None, step) for squeeze, step in zip(squeezed, steps))
+        return region[selection]
+
+    def _bounds(self, key):
+        """Bounding box of an index expression, with the step of each axis
+        and whether the axis is indexed by an integer."""
+        key = key if isinstance(key, tuple) else (key,)
+        if any(item is Ellipsis for item in key):
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),)*(self.ndim - len(key) + 1) + key[position + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for a {self.ndim} dimensional reader.")
+        key = key + (slice(None),)*(self.ndim - len(key))
+        starts, stops, steps, squeezed = list(), list(), list(), list()
+        for item, size in zip(key, self._shape):
+            if isinstance(item, slice):
+                indices = range(*item.indices(size))
+                if len(indices):
+                    starts.append(min(indices[0], indices[-1]))
+                    stops.append(max(indices[0], indices[-1]) + 1)
+                else:
+                    starts.append(0)
+                    stops.append(0)
+                steps.append(indices.step)
+                squeezed.append(False)
+            elif isinstance(item, (int, np.integer)):
+                index = int(item) + size if item < 0 else int(item)
+                if not 0 <= index < size:
+                    raise IndexError(f"index {item} is out of bounds for axis with size {size}.")
+                starts.append(index)
+                stops.append(index + 1)
+                steps.append(1)
+                squeezed.append(True)
+            else:
+                raise TypeError(f"readers support integer and slice indices only, not {type(item).__name__}.")
+        return starts, stops, steps, squeezed
+
+    def _get_chunk(self, chunk_index: tuple):
+        key = (self._key, chunk_index)
+        chunk = self._cache.get(key)
+        if chunk is not None:
+            return chunk
+        with self._pending_lock:
+            future = self._pending.get(chunk_index)
+        if future is not None:
+            return future.result()
+        chunk = self._read_chunk(chunk_index)
+        self._cache.put(key, chunk)
+        return chunk
+
+    def _prefetch_after(self, chunk_ranges: list):
+        """Read ahead along z if this read continues the previous one."""
+        z_range = chunk_ranges[0]
+        sequential = z_range.start in (self._last_z_chunk, self._last_z_chunk + 1)
+        self._last_z_chunk = z_range.stop - 1
+        if not sequential or not self._prefetch_read_count:
+            return
+        z_chunk_total = -(-self._shape[0] // self._chunk_shape[0])
+        z_prefetch = range(z_range.stop, min(z_range.stop + len(z_range)*self._prefetch_read_count, z_chunk_total))
+        for chunk_index in product(z_prefetch, *chunk_ranges[1:]):
+            if (self._key, chunk_index) in self._cache:
+                continue
+            with self._pending_lock:
+                if chunk_index not in self._pending:
+                    self._pending[chunk_index] = _get_prefetch_pool().submit(self._prefetch_chunk, chunk_index)
+
+    def _prefetch_chunk(self, chunk_index: tuple):
+        try:
+            chunk = self._read_chunk(chunk_index)
+            self._cache.put((self._key, chunk_index), chunk)
+            return chunk
+        finally:
+            with self._pending_lock:
+                self._pending.pop(chunk_index, None)
+
+    def _wait_for_prefetch(self):
+        with self._pending_lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
+
+    def close(self):
+        self._wait_for_prefetch()
@@ -0,0 +1,67 @@
+import numpy as np
+import h5py
+from voxel.readers.base import BaseReader
+from voxel.readers.chunk_cache import ChunkCache
+from voxel.writers.noise_codec import HDF5_FILTER_ID, NoiseCodec
+
+
+class Reader(BaseReader):
+    """Lazy reader of one view of a BigDataViewer HDF5 file. Chunks follow
+    the HDF5 chunks of the dataset, so slicing a region decodes only the
+    HDF5 chunks that overlap it, unlike BdvEditor.read_view() and
+    crop_view() which load the whole view. Chunks of the noise codec, which
+    HDF5 cannot decode, are read raw and decoded here."""
+
+    def __init__(self, path: str, setup: int = 0, time: int = 0, level: int = 0,
+                 dtype: str = 'uint16', cache: ChunkCache = None, **kwargs):
+        """
+
+        :param path: path of the .h5 file
+        :param setup: view setup index
+        :param time: time point index
+        :param level: resolution level, 0 is full resolution
+        :param dtype: data type of the frames. BDV stores uint16 bit for bit
+            as int16, None keeps the stored data type.
+        :param cache: chunk cache, defaults to the cache shared by all readers
+
+        .. code-block: python
+
+            with Reader('tiles.h5', setup=3) as view:
+                plane = view[512, 1000:2000, 1000:2000]
+
+        """
+        super().__init__(path, cache, **kwargs)
+        self._dataset_name = f"t{time:05d}/s{setup:02d}/{level}/cells"
+        self._file = h5py.File(self._path, 'r')
+        if self._dataset_name not in self._file:
+            self._file.close()
+            raise ValueError(f"{path} has no view for setup {setup}, time point {time} and level {level}.")
+        self._dataset = self._file[self._dataset_name]
+        self._shape = tuple(self._dataset.shape)
+        self._dtype = self._dataset.dtype if dtype is None else np.dtype(dtype)
+        self._chunk_shape = tuple(self._dataset.chunks) if self._dataset.chunks else (1, *self._shape[1:])
+        create_plist = self._dataset.id.get_create_plist()
+        self._noise_coded = any(create_plist.get_filter(index)[0] == HDF5_FILTER_ID
+                                for index in range(create_plist.get_nfilters()))
+
+    @property
+    def _key(self):
+        return ('bdv', str(self._path.resolve()), self._dataset_name)
+
+    def _read_chunk(self, chunk_index: tuple):
+        selection = tuple(slice(index*size, min((index + 1)*size, shape))
+                          for index, size, shape in zip(chunk_index, self._chunk_shape, self._shape))
+        if not self._noise_coded:
+            return self._dataset[selection].view(self._dtype)
+        offset = tuple(index*size for index, size in zip(chunk_index, self._chunk_shape))
+        if self._dataset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+            # unwritten chunks are the fill value
+            chunk = np.zeros(self._chunk_shape, dtype=self._dataset.dtype)
+        else:
+            chunk = NoiseCodec.decode(self._dataset.id.read_direct_chunk(offset)[1])
+        # chunks are stored whole, also at the dataset edges
+        return chunk[tuple(slice(0, item.stop - item.start) for item in selection)].view(self._dtype)
+
+    def close(self):
+        super().close()
+        self._file.close()
@@ -0,0 +1,85 @@
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+
+# Default size of the cache shared by all readers.
+CACHE_SIZE_BYTES = 2*1024**3
+
+
+class ChunkCache:
+    """Thread safe least recently used cache of decoded chunks, bounded by
+    the total size of the cached arrays. One cache is shared by readers, so
+    QC scripts opening many stacks stay within one memory budget."""
+
+    def __init__(self, max_nbytes: int = CACHE_SIZE_BYTES):
+        """
+
+        :param max_nbytes: total size of the cached chunks in bytes
+
+        .. code-block: python
+
+            cache = ChunkCache(512*1024**2)
+            reader = TiffReader('tile.tiff', cache=cache)
+
+        """
+        self._max_nbytes = max_nbytes
+        self._chunks = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @property
+    def max_nbytes(self):
+        return self._max_nbytes
+
+    @max_nbytes.setter
+    def max_nbytes(self, max_nbytes: int):
+        with self._lock:
+            self._max_nbytes = max_nbytes
+            self._evict()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key):
+        """Cached chunk or None. Marks the chunk as recently used."""
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                self.miss_count += 1
+                return None
+            self._chunks.move_to_end(key)
+            self.hit_count += 1
+            return chunk
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._chunks
+
+    def put(self, key, chunk: np.ndarray):
+        # chunks are shared between readers and must not be modified
+        chunk.flags.writeable = False
+        with self._lock:
+            if key in self._chunks:
+                self._nbytes -= self._chunks.pop(key).nbytes
+            if chunk.nbytes > self._max_nbytes:
+                return
+            self._chunks[key] = chunk
+            self._nbytes += chunk.nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._nbytes = 0
+
+    def _evict(self):
+        while self._nbytes > self._max_nbytes:
+            _, chunk = self._chunks.popitem(last=False)
+            self._nbytes -= chunk.nbytes
+
+
+# Cache shared by all readers that are not given their own.
+CHUNK_CACHE = ChunkCache()
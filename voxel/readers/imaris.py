@@ -0,0 +1,60 @@
+import h5py
+from voxel.readers.base import BaseReader
+from voxel.readers.chunk_cache import ChunkCache
+
+
+def _attribute(attributes, name: str):
+    """Imaris stores attributes as arrays of single characters."""
+    return b''.join(attributes[name]).decode()
+
+
+class Reader(BaseReader):
+    """Lazy reader of one channel of an Imaris file. Chunks follow the HDF5
+    chunks of the channel data, cropped to the image size, since Imaris pads
+    the data to whole blocks."""
+
+    def __init__(self, path: str, channel: int = 0, time: int = 0, level: int = 0,
+                 cache: ChunkCache = None, **kwargs):
+        """
+
+        :param path: path of the .ims file
+        :param channel: channel index
+        :param time: time point index
+        :param level: resolution level, 0 is full resolution
+        :param cache: chunk cache, defaults to the cache shared by all readers
+
+        .. code-block: python
+
+            with Reader('tile.ims', channel=1) as frames:
+                frames[0:64]
+
+        """
+        super().__init__(path, cache, **kwargs)
+        self._group_name = f"DataSet/ResolutionLevel {level}/TimePoint {time}/Channel {channel}"
+        self._file = h5py.File(self._path, 'r')
+        if self._group_name not in self._file:
+            self._file.close()
+            raise ValueError(f"{path} has no data for channel {channel}, time point {time} and level {level}.")
+        group = self._file[self._group_name]
+        self._dataset = group['Data']
+        if 'ImageSizeZ' in group.attrs:
+            attributes = group.attrs
+            self._shape = tuple(int(_attribute(attributes, f'ImageSize{axis}')) for axis in 'ZYX')
+        else:
+            attributes = self._file['DataSetInfo/Image'].attrs
+            self._shape = tuple(int(_attribute(attributes, axis)) for axis in 'ZYX')
+        self._dtype = self._dataset.dtype
+        self._chunk_shape = tuple(self._dataset.chunks) if self._dataset.chunks else (1, *self._dataset.shape[1:])
+
+    @property
+    def _key(self):
+        return ('imaris', str(self._path.resolve()), self._group_name)
+
+    def _read_chunk(self, chunk_index: tuple):
+        selection = tuple(slice(index*size, min((index + 1)*size, shape))
+                          for index, size, shape in zip(chunk_index, self._chunk_shape, self._shape))
+        return self._dataset[selection]
+
+    def close(self):
+        super().close()
+        self._file.close()
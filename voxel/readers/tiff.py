@@ -0,0 +1,43 @@
+import tifffile
+from voxel.readers.base import BaseReader
+from voxel.readers.chunk_cache import ChunkCache
+
+
+class Reader(BaseReader):
+    """Lazy reader of the frames of a TIFF file. Each page is one chunk, so
+    slicing a few frames decodes those pages only."""
+
+    def __init__(self, path: str, cache: ChunkCache = None, **kwargs):
+        """
+
+        :param path: path of the TIFF file
+        :param cache: chunk cache, defaults to the cache shared by all readers
+
+        .. code-block: python
+
+            with Reader('tile.tiff') as frames:
+                frame = frames[100]
+
+        """
+        super().__init__(path, cache, **kwargs)
+        self._tiff = tifffile.TiffFile(self._path)
+        # prefetch threads share the file handle, so seeks and reads are
+        # locked, while decoding runs concurrently
+        self._tiff.filehandle.set_lock(True)
+        page = self._tiff.pages[0]
+        self._shape = (len(self._tiff.pages), *page.shape)
+        self._dtype = page.dtype
+        self._chunk_shape = (1, *page.shape)
+
+    @property
+    def _key(self):
+        return ('tiff', str(self._path.resolve()))
+
+    def _read_chunk(self, chunk_index: tuple):
+        with self._tiff.filehandle.lock:
+            page = self._tiff.pages[chunk_index[0]]
+        return page.asarray()[None]
+
+    def close(self):
+        super().close()
+        self._tiff.close()
@@ -0,0 +1,68 @@
+import numpy as np
+import json
+from pathlib import Path
+from threading import Lock
+from voxel.readers.base import BaseReader
+from voxel.readers.chunk_cache import ChunkCache
+
+
+class Reader(BaseReader):
+    """Lazy reader of one resolution level of an OME-Zarr v2 or v3 stack.
+    Chunks follow the zarr chunks, or the inner chunks of sharded v3
+    arrays, so slicing reads only the chunks that overlap the slice. The
+    array is opened on the first read, since tensorstore threads do not
+    survive the process being forked."""
+
+    def __init__(self, path: str, level: int = 0, cache: ChunkCache = None, **kwargs):
+        """
+
+        :param path: path of the .zarr directory
+        :param level: resolution level, 0 is full resolution
+        :param cache: chunk cache, defaults to the cache shared by all readers
+
+        .. code-block: python
+
+            with Reader('tile.zarr', level=2) as frames:
+                frames[:, 100, :]
+
+        """
+        super().__init__(path, cache, **kwargs)
+        self._level_path = Path(self._path, str(level))
+        if Path(self._level_path, 'zarr.json').exists():
+            self._driver = 'zarr3'
+            with open(Path(self._level_path, 'zarr.json'), 'r') as f:
+                metadata = json.load(f)
+            self._dtype = np.dtype(metadata['data_type'])
+            self._chunk_shape = tuple(metadata['chunk_grid']['configuration']['chunk_shape'])
+            for codec in metadata.get('codecs', list()):
+                if codec['name'] == 'sharding_indexed':
+                    self._chunk_shape = tuple(codec['configuration']['chunk_shape'])
+        elif Path(self._level_path, '.zarray').exists():
+            self._driver = 'zarr'
+            with open(Path(self._level_path, '.zarray'), 'r') as f:
+                metadata = json.load(f)
+            self._dtype = np.dtype(metadata['dtype'])
+            self._chunk_shape = tuple(metadata['chunks'])
+        else:
+            raise ValueError(f"{path} has no zarr array for level {level}.")
+        self._shape = tuple(metadata['shape'])
+        self._array = None
+        self._open_lock = Lock()
+
+    @property
+    def _key(self):
+        return ('zarr', str(self._level_path.resolve()))
+
+    def _open(self):
+        with self._open_lock:
+            if self._array is None:
+                import tensorstore as ts
+                self._array = ts.open({'driver': self._driver,
+                                       'kvstore': {'driver': 'file', 'path': str(self._level_path)}},
+                                      open=True).result()
+            return self._array
+
+    def _read_chunk(self, chunk_index: tuple):
+        selection = tuple(slice(index*size, min((index + 1)*size, shape))
+                          for index, size, shape in zip(chunk_index, self._chunk_shape, self._shape))
+        return self._open()[selection].read().result()
@@ -1,15 +1,55 @@
 import inspect
+import logging
+import os
+import sys
+from math import ceil
 import numpy as np
+from multiprocessing import Process, Queue, Event
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
+from voxel.acquisition.affinity import format_cpu_list, pin_process
+from voxel.writers.data_structures.write_state import WriteState
+
+# Attribute types copied from the writer into its process with every tile job.
+JOB_ATTRIBUTE_TYPES = (str, int, float, bool, Path, tuple, list, dict, np.ndarray, np.generic, type(None))
+# Seconds between checks for an aborted tile while waiting for chunks.
+CHUNK_POLL_S = 0.5
+# Seconds a closed writer process may take to finish before it is terminated.
+STOP_TIMEOUT_S = 60.0
 
 
 class BaseWriter():
 
+    def __init__(self):
+        # Write statistics in shared memory, updated by the writer process.
+        self._write_state = WriteState()
+        # Cpus the writer process and its compression threads are pinned to.
+        self._cpu_affinity = None
+
     @property
     def signal_progress_percent(self):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
         pass
 
+    @property
+    def signal_write_state(self):
+        """Chunks written, bytes in and out, rate, compression ratio, per
+        chunk write latency percentiles and time spent waiting for data
+        versus writing, accumulated over all tiles, and bytes out of the
+        current tile."""
+        return self._write_state.snapshot()
+
+    @property
+    def cpu_affinity(self):
+        return self._cpu_affinity
+
+    @cpu_affinity.setter
+    def cpu_affinity(self, cpu_affinity: list):
+        """Cpus of the writer process. Takes effect when the writer process
+        starts, None leaves the process unpinned."""
+        self.log.info(f'setting cpu affinity to: {cpu_affinity}')
+        self._cpu_affinity = None if cpu_affinity is None else list(cpu_affinity)
+
     @property
     def x_voxel_size_um(self):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
@@ -219,6 +259,10 @@ class BaseWriter():
     def shm_name(self, name: str):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
         pass
+
+    def submit_chunk(self, shm_name: str):
+        self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
+        pass
         
     def prepare(self):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
@@ -234,4 +278,165 @@ class BaseWriter():
 
     def wait_to_finish(self):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
-        pass
\ No newline at end of file
+        pass
+
+    def close(self):
+        self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
+        pass
+
+    def _sample_codec(self):
+        """Name and arguments of the codec in compression_estimator.CODECS
+        that matches the configured compression."""
+        self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
+        return 'none', dict()
+
+    def _start_service(self):
+        """Start the long lived writer process if it is not already running.
+        The process is reused across tiles and runs _run once per tile job."""
+        if getattr(self, '_service', None) is not None and self._service.is_alive():
+            return
+        # never pickle a process handle into the new process
+        self._service = None
+        self._jobs = Queue()
+        self._tile_finished = Event()
+        self._tile_finished.set()
+        # set by the writer process if writing the current tile failed
+        self._tile_failed = Event()
+        # set to stop waiting for the chunks of the current tile
+        self._tile_aborted = Event()
+        service = Process(target=self._serve, daemon=True)
+        service.start()
+        self._service = service
+
+    def _submit_job(self):
+        """Send a snapshot of the current tile settings to the writer process."""
+        job = {key: value for key, value in vars(self).items() if isinstance(value, JOB_ATTRIBUTE_TYPES)}
+        self._tile_finished.clear()
+        self._tile_failed.clear()
+        self._tile_aborted.clear()
+        self._jobs.put(job)
+
+    def abort(self):
+        """Abort the current tile, e.g. when grabbing stopped early. The
+        writer process stops waiting for chunks and the tile fails."""
+        if getattr(self, '_service', None) is not None:
+            self.log.info(f"{self._filename}: aborting tile.")
+            self._tile_aborted.set()
+
+    def _stop_service(self):
+        """Abort the current tile and ask the writer process to exit. The
+        process is terminated if it does not exit within STOP_TIMEOUT_S."""
+        if getattr(self, '_service', None) is not None:
+            self._tile_aborted.set()
+            self._jobs.put(None)
+            self._service.join(STOP_TIMEOUT_S)
+            if self._service.is_alive():
+                self.log.warning(f"{self._filename}: writer process did not exit, terminating it.")
+                self._service.terminate()
+                self._service.join()
+            self._service = None
+
+    def _serve(self):
+        """Writer process main loop. Libraries, logger and shared memory
+        attachments are set up once and reused for every tile."""
+        # internal logger for process
+        logger = logging.getLogger(f"{self.__module__}.{self.__class__.__name__}")
+        fmt = '%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s'
+        datefmt = '%Y-%m-%d,%H:%M:%S'
+        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
+        log_handler = logging.StreamHandler(sys.stdout)
+        log_handler.setFormatter(log_formatter)
+        logger.addHandler(log_handler)
+        # pin before libraries start their compression threads
+        if self._cpu_affinity is not None:
+            cpus = pin_process(self._cpu_affinity)
+            logger.info(f"writer process {os.getpid()} pinned to cpus {format_cpu_list(cpus)}")
+        self._shm_segments = dict()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            self.__dict__.update(job)
+            self._shm_segments_used = set()
+            self._chunks_received = 0
+            try:
+                self._write_state.start_tile(self._output_nbytes())
+                self._run()
+                self._write_state.finish_tile(self._output_nbytes())
+            except Exception:
+                logger.exception(f"{self._filename}: writing tile failed.")
+                self._tile_failed.set()
+                # release the producer so the acquisition does not hang
+                self.done_reading.set()
+                self._discard_chunks(logger)
+            finally:
+                self._prune_shm_segments()
+                self._tile_finished.set()
+        self._shutdown()
+        for shm in self._shm_segments.values():
+            shm.close()
+
+    def _receive_chunk(self):
+        """Block until the next chunk of the tile is handed off and return
+        the name of its shared memory segment. Raises RuntimeError if the
+        tile is aborted."""
+        while not self._chunk_receiver.poll(CHUNK_POLL_S):
+            if self._tile_aborted.is_set():
+                raise RuntimeError(f"{self._filename}: tile aborted after {self._chunks_received} chunks.")
+        shm_name = self._chunk_receiver.recv()
+        self._chunks_received += 1
+        return shm_name
+
+    def _discard_chunks(self, logger):
+        """Receive and release the remaining chunks of a failed tile, so
+        the producer is not blocked and the next tile does not read them.
+        Stops early if the tile is aborted or abandoned, i.e. the next tile
+        is started without waiting for this one."""
+        chunk_total = ceil(self.frame_count_px/self.chunk_count_px)
+        if self._chunks_received < chunk_total:
+            logger.warning(f"{self._filename}: discarding "
+                           f"{chunk_total - self._chunks_received} chunks of the failed tile.")
+        while self._chunks_received < chunk_total:
+            if self._chunk_receiver.poll(CHUNK_POLL_S):
+                self._receive_chunk()
+                self.done_reading.set()
+            elif self._tile_aborted.is_set() or not self._jobs.empty():
+                break
+        # chunks of an aborted producer that arrived meanwhile are stale
+        while self._chunk_receiver.poll(0):
+            self._chunk_receiver.recv()
+            self.done_reading.set()
+
+    def _wait_for_tile(self):
+        """Block until the writer process finished the current tile.
+        Raises RuntimeError if writing the tile failed."""
+        self._tile_finished.wait()
+        if self._tile_failed.is_set():
+            raise RuntimeError(f"{self._filename}: writing tile failed.")
+
+    def _shutdown(self):
+        """Release resources kept open across tiles by the writer process.
+        Runs in the writer process when it is closed."""
+        pass
+
+    def _output_nbytes(self):
+        """Size on disk of the current output file or directory."""
+        filepath = Path(self._path, self._acquisition_name or '', self._filename or '')
+        if filepath.is_file():
+            return filepath.stat().st_size
+        if filepath.is_dir():
+            return sum(path.stat().st_size for path in filepath.rglob('*') if path.is_file())
+        return 0
+
+    def _attach_shm(self, shm_name: str):
+        """Return the shared memory segment by name, attaching it only once."""
+        if shm_name not in self._shm_segments:
+            self._shm_segments[shm_name] = SharedMemory(shm_name, create=False, size=self.shm_nbytes)
+        self._shm_segments_used.add(shm_name)
+        return self._shm_segments[shm_name]
+
+    def _prune_shm_segments(self):
+        """Detach from segments that were not used by the last tile."""
+        for shm_name in list(self._shm_segments):
+            if shm_name not in self._shm_segments_used:
+                self._shm_segments.pop(shm_name).close()
@@ -5,8 +5,10 @@ import re
 import os
 import sys
 from voxel.writers.base import BaseWriter
+from voxel.writers.blank_blocks import elide_blank_blocks, threshold_image
 from voxel.writers.bdv_writer import npy2bdv
-from multiprocessing import Process, Array, Value, Event
+from voxel.writers.noise_codec import NoiseCodec
+from multiprocessing import Process, Array, Value, Event, Pipe
 from multiprocessing.shared_memory import SharedMemory
 from ctypes import c_wchar, c_int
 from pathlib import Path
@@ -21,20 +23,33 @@ B3D_COMPRESSION_MODE = 1
 B3D_BACKGROUND_OFFSET = 0 # ADU
 B3D_GAIN = 2.1845 # ADU/e-
 B3D_READ_NOISE = 1.5 # e-
+ZSTD_LEVEL = 1
+# pyramid subsampling factors xyz
+# TODO CALCULATE THESE AS WITH ZARRV3 WRITER
+SUBSAMP = (
+    (1, 1, 1),
+    (2, 2, 2),
+    (4, 4, 4),
+)
 
 COMPRESSION_TYPES = {
     "none":  None,
     "gzip": "gzip",
     "lzf": "lzf",
-    "b3d": "b3d"
+    "b3d": "b3d",
+    # noise adaptive quantization, a portable codec with the b3d parameters
+    "naq": "naq"
+}
+
+DOWNSAMPLE_METHODS = {
+    "mean": "mean",
+    "max": "max"
 }
 
 DATA_TYPES = [
     "uint16"
 ]
 
-# TODO ADD DOWNSAMPLE METHOD TO GET PASSED INTO NPY2BDV
-
 class Writer(BaseWriter):
 
     def __init__(self, path: str):
@@ -50,10 +65,19 @@ class Writer(BaseWriter):
         self._data_type = "uint16"
         self._compression = COMPRESSION_TYPES["none"]
         self.compression_opts = None
+        self._downsample_method = DOWNSAMPLE_METHODS["mean"]
+        # Number of threads compressing gzip chunks for direct chunk writes.
+        self._compression_thread_count = os.cpu_count()
+        # HDF5 chunks with no pixel above the blank threshold are not written
+        # and read back as 0. The threshold is in counts, or counts above the
+        # background image if a background path is set. None writes every chunk.
+        self._blank_threshold = None
+        self._blank_background_path = None
         self._row_count_px = None
         self._column_count_px = None
         self._frame_count_px_px = None
-        self.progress = Value(c_int, 0)
+        # Shared progress of the current tile, written by the writer process.
+        self.progress = Value('d', 0.0)
         self._x_voxel_size_um_um = 1
         self._y_voxel_size_um_um = 1
         self._z_voxel_size_um_um = 1
@@ -68,6 +92,9 @@ class Writer(BaseWriter):
         self.done_reading = Event()
         self.done_reading.set()  # Set after processing all data in shared mem.
         self.deallocating = Event()
+        # Pipe carrying the shared memory name of each filled chunk. The
+        # writer process blocks on it instead of polling done_reading.
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
         # Lists for storing all datasets in a single BDV file
         self.current_tile_num = 0
         self.current_channel_num = 0
@@ -212,6 +239,51 @@ class Writer(BaseWriter):
                 int(B3D_BACKGROUND_OFFSET), 
                 int(B3D_READ_NOISE*1000),
             )
+        elif compression == "naq":
+            self.compression_opts = self._noise_codec().filter_options
+
+    @property
+    def compression_thread_count(self):
+        return self._compression_thread_count
+
+    @compression_thread_count.setter
+    def compression_thread_count(self, compression_thread_count: int):
+        if compression_thread_count is not None and compression_thread_count < 1:
+            raise ValueError("compression thread count must be >= 1 or None.")
+        self.log.info(f'setting compression thread count to: {compression_thread_count}')
+        self._compression_thread_count = compression_thread_count
+
+    @property
+    def blank_threshold(self):
+        return self._blank_threshold
+
+    @blank_threshold.setter
+    def blank_threshold(self, blank_threshold: int):
+        if blank_threshold is not None and blank_threshold < 0:
+            raise ValueError("blank threshold must be >= 0.")
+        self.log.info(f'setting blank threshold to: {blank_threshold}')
+        self._blank_threshold = blank_threshold
+
+    @property
+    def blank_background_path(self):
+        return self._blank_background_path
+
+    @blank_background_path.setter
+    def blank_background_path(self, blank_background_path: str):
+        self._blank_background_path = None if blank_background_path is None else Path(blank_background_path)
+        self.log.info(f'setting blank background path to: {blank_background_path}')
+
+    @property
+    def downsample_method(self):
+        return next(key for key, value in DOWNSAMPLE_METHODS.items() if value == self._downsample_method)
+
+    @downsample_method.setter
+    def downsample_method(self, downsample_method: str):
+        valid = list(DOWNSAMPLE_METHODS.keys())
+        if downsample_method not in valid:
+            raise ValueError("downsample method must be one of %r." % valid)
+        self.log.info(f'setting downsample method to: {downsample_method}')
+        self._downsample_method = DOWNSAMPLE_METHODS[downsample_method]
 
     @property
     def data_type(self):
@@ -267,10 +339,17 @@ class Writer(BaseWriter):
             self._shm_name[i] = c
         self._shm_name[len(name)] = '\x00'  # Null terminate the string.
         self.log.info(f'setting shared memory to: {name}')
+
+    def submit_chunk(self, shm_name: str):
+        """Hand a filled chunk in shared memory to the writer process."""
+        self.shm_name = shm_name
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
         
     def prepare(self):
-        self.progress = multiprocessing.Value('d', 0.0)
-        self.p = Process(target=self._run, args=(self.progress,))
+        self.progress.value = 0.0
+        # the writer process is spawned once and reused for every tile
+        self._start_service()
         # Specs for reconstructing the shared memory object.
         self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
         # This is almost always going to be: (chunk_size, rows, columns).
@@ -280,6 +359,13 @@ class Writer(BaseWriter):
         self.shm_shape = [chunk_shape_map[x] for x in self.chunk_dim_order]
         self.shm_nbytes = \
             int(np.prod(self.shm_shape, dtype=np.int64)*np.dtype(self._data_type).itemsize)
+        self._blank_threshold_px = self._blank_threshold
+        if self._blank_threshold is not None and self._blank_background_path is not None:
+            self._blank_threshold_px = threshold_image(self._blank_background_path, self._blank_threshold,
+                                                       self._data_type)
+            if self._blank_threshold_px.shape != (self._row_count_px, self._column_count_px):
+                raise ValueError(f"background image shape {self._blank_threshold_px.shape} does not match "
+                                 f"the frame shape {(self._row_count_px, self._column_count_px)}.")
         
         # Check if tile position already exists
         tile_position = (self._x_position_mm, self._y_position_mm, self._z_position_mm)
@@ -343,33 +429,45 @@ class Writer(BaseWriter):
 
         self.log.info(f"{self._filename}: intializing writer.")
 
+    def _sample_codec(self):
+        """Name and arguments of the codec in compression_estimator.CODECS
+        that matches the configured compression."""
+        if self._compression == "gzip":
+            # h5py defaults to gzip level 4
+            return 'zlib', {'level': 4 if self.compression_opts is None else self.compression_opts}
+        if self._compression == "lzf":
+            return 'lzf', dict()
+        if self._compression == "b3d":
+            raise ValueError("b3d compression can not be estimated in memory.")
+        if self._compression == "naq":
+            codec = self._noise_codec()
+            return 'naq', {'gain': codec.gain, 'read_noise': codec.read_noise,
+                           'background_offset': codec.background_offset, 'quant_sigma': codec.quant_sigma}
+        return 'none', dict()
+
+    @staticmethod
+    def _noise_codec():
+        return NoiseCodec(gain=B3D_GAIN, read_noise=B3D_READ_NOISE, background_offset=B3D_BACKGROUND_OFFSET,
+                          quant_sigma=B3D_QUANT_SIGMA, level=ZSTD_LEVEL)
+
     def start(self):
         self.log.info(f"{self._filename}: starting writer.")
-        self.p.start()
+        self._submit_job()
 
-    def _run(self, shared_progress):
+    def _level_count(self):
+        """Number of pyramid levels, one per subsampling factor."""
+        return len(SUBSAMP)
+
+    def _run(self):
         """Loop to wait for data from a specified location and write it to disk
         as an Imaris file. Close up the file afterwards.
 
         This function executes when called with the start() method.
         """
-        # internal logger for process
+        # internal logger for process, configured once in _serve
         logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
-        fmt = '%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s'
-        datefmt = '%Y-%m-%d,%H:%M:%S'
-        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
-        log_handler = logging.StreamHandler(sys.stdout)
-        log_handler.setFormatter(log_formatter)
-        logger.addHandler(log_handler)
 
         # compute necessary inputs to BDV/XML files
-        # pyramid subsampling factors xyz
-        # TODO CALCULATE THESE AS WITH ZARRV3 WRITER
-        subsamp = (
-                    (1, 1, 1),
-                    (2, 2, 2),
-                    (4, 4, 4),
-                  )
         # chunksize xyz
         blockdim = (
                     (4, 256, 256),
@@ -380,115 +478,115 @@ class Writer(BaseWriter):
                   )
         # bdv requires input string not Path
         filepath = str(Path(self._path, self._acquisition_name, self._filename).absolute())
-        # re-initialize bdv writer for tile/channel list
-        # required to dump all datasets in a single bdv file
-        bdv_writer = npy2bdv.BdvWriter(
-                                filepath,
-                                subsamp = subsamp,
-                                blockdim = blockdim,
-                                compression = self._compression,
-                                compression_opts = self.compression_opts,
-                                ntiles = len(self.tile_list),
-                                nchannels = len(self.channel_list),
-                                overwrite = False)
-        try:
-            # check if tile position already exists
-            self.current_tile_num = self.tile_list.index(
-                    (self._x_position_mm,
-                     self._y_position_mm,
-                     self._z_position_mm,
-                    )
-                )
-        except:
-            # if does not exist, increment tile number by 1
-            self.current_tile_num = len(self.tile_list) + 1
-        try:
-            # check if tile channel already exists
-            self.current_channel_num = self.channel_list.index(self._channel)
-        except:
-            # if does not exist, increment tile channel by 1
-            self.current_channel_num = len(self.channel_list) + 1
-
-        # append all views based to bdv writer
-        # this is necessary for bdv writer to have the metadata to write the xml at the end
-        # if a view already exists in the bdv file, it will be skipped and not overwritten
+        # the bdv writer and its file stay open across tiles in this process,
+        # so every tile only adds its own view. it is never part of a job.
+        bdv_writer = getattr(self, '_bdv_writer', None)
+        if bdv_writer is None or bdv_writer.filename_h5 != filepath:
+            self._shutdown()
+            bdv_writer = npy2bdv.BdvWriter(
+                                    filepath,
+                                    subsamp = SUBSAMP,
+                                    blockdim = blockdim,
+                                    compression = self._compression,
+                                    compression_opts = self.compression_opts,
+                                    overwrite = False,
+                                    downsample_method = self._downsample_method,
+                                    compression_threads = self._compression_thread_count,
+                                    dynamic_setups = True)
+            self._bdv_writer = bdv_writer
+        # zeroed blank chunks are left unallocated
+        bdv_writer.skip_fill_chunks = self._blank_threshold_px is not None
+
+        # create the datasets of this tile's view only
+        view = (self.current_tile_num, self.current_channel_num)
         image_size_z = int(ceil(self._frame_count_px_px/CHUNK_COUNT_PX)*CHUNK_COUNT_PX)
-        for append_tile, append_channel in self.dataset_dict:
-            bdv_writer.append_view(
-                                    stack = None,
-                                    virtual_stack_dim = (image_size_z,
-                                                         self._row_count_px,
-                                                         self._column_count_px),
-                                    tile = append_tile,
-                                    channel = append_channel,
-                                    voxel_size_xyz = self.voxel_size_dict[(append_tile, append_channel)],
-                                    voxel_units = 'um')
+        bdv_writer.append_view(
+                                stack = None,
+                                virtual_stack_dim = (image_size_z,
+                                                     self._row_count_px,
+                                                     self._column_count_px),
+                                tile = self.current_tile_num,
+                                channel = self.current_channel_num,
+                                voxel_size_xyz = self.voxel_size_dict[view],
+                                voxel_units = 'um')
 
         chunk_total = ceil(self._frame_count_px_px/CHUNK_COUNT_PX)
         for chunk_num in range(chunk_total):
-            # Wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # Attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=self.shm_nbytes)
+            # Block until the next chunk is handed off.
+            wait_start_time = perf_counter()
+            shm_name = self._receive_chunk()
+            # Each shared memory segment is attached only once per process.
+            shm = self._attach_shm(shm_name)
             frames = np.ndarray(self.shm_shape, self._data_type, buffer=shm.buf)
             logger.warning(f"{self._filename}: writing chunk "
                   f"{chunk_num+1}/{chunk_total} of size {frames.shape}.")
             start_time = perf_counter()
+            # blank chunks are zeroed in a copy, also zeroing them in the pyramid
+            chunk_frames, elided_nbytes = elide_blank_blocks(frames, blockdim[0], self._blank_threshold_px)
             # Write substack of data to BDV file at correct z position
             # current_tile_num and current_channel_num ensure it writes to the correct location
             bdv_writer.append_substack(
-                                frames,
+                                chunk_frames,
                                 z_start = chunk_num*CHUNK_COUNT_PX,
                                 tile = self.current_tile_num,
                                 channel = self.current_channel_num)
             frames = None
+            chunk_frames = None
             logger.warning(f"{self._filename}: writing chunk took "
                   f"{perf_counter() - start_time:.3f} [s]")
-            shm.close()
             self.done_reading.set()
+            self._write_state.record_chunk(self.shm_nbytes, start_time - wait_start_time,
+                                           perf_counter() - start_time, self._output_nbytes(), elided_nbytes)
             # NEED TO USE SHARED VALUE HERE
-            shared_progress.value = (chunk_num+1)/chunk_total
+            self.progress.value = (chunk_num+1)/chunk_total
 
         # Wait for file writing to finish.
-        if shared_progress.value < 1.0:
+        if self.progress.value < 1.0:
             logger.warning(f"{self._filename}: waiting for data writing to complete for "
                   f"{self._filename}. "
-                  f"current progress is {100*shared_progress.value:.1f}%.")
-        while shared_progress.value < 1.0:
+                  f"current progress is {100*self.progress.value:.1f}%.")
+        while self.progress.value < 1.0:
             sleep(0.5)
             logger.warning(f"{self._filename}: waiting for data writing to complete for "
                   f"{self._filename}. "
-                  f"current progress is {100*shared_progress.value:.1f}%.")
-
-        ### write xml file
+                  f"current progress is {100*self.progress.value:.1f}%.")
+
+        # add this tile's transformations, last added is applied last
+        bdv_writer.add_affine(m_affine = self.affine_deskew_dict[view],
+                              name_affine = 'deskew',
+                              tile = self.current_tile_num,
+                              channel = self.current_channel_num)
+        bdv_writer.add_affine(m_affine = self.affine_scale_dict[view],
+                              name_affine = 'scale',
+                              tile = self.current_tile_num,
+                              channel = self.current_channel_num)
+        bdv_writer.add_affine(m_affine = self.affine_shift_dict[view],
+                              name_affine = 'shift',
+                              tile = self.current_tile_num,
+                              channel = self.current_channel_num)
+
+        ### write xml file in a single pass, keeping it readable between tiles
         bdv_writer.write_xml()
+        bdv_writer.flush()
 
-        for append_tile, append_channel in self.affine_deskew_dict:
-            bdv_writer.append_affine(m_affine = self.affine_deskew_dict[(append_tile, append_channel)],
-                                    name_affine = 'deskew',
-                                    tile = append_tile,
-                                    channel = append_channel)
-
-        for append_tile, append_channel in self.affine_scale_dict:
-            bdv_writer.append_affine(m_affine = self.affine_scale_dict[(append_tile, append_channel)],
-                                    name_affine = 'scale',
-                                    tile = append_tile,
-                                    channel = append_channel)
-
-        for append_tile, append_channel in self.affine_shift_dict:
-            bdv_writer.append_affine(m_affine = self.affine_shift_dict[(append_tile, append_channel)],
-                                    name_affine = 'shift',
-                                    tile = append_tile,
-                                    channel = append_channel)
-        bdv_writer.close()
+    def _shutdown(self):
+        """Close the bdv file kept open across tiles."""
+        bdv_writer = getattr(self, '_bdv_writer', None)
+        if bdv_writer is not None:
+            bdv_writer.write_xml()
+            bdv_writer.close()
+            self._bdv_writer = None
 
     def wait_to_finish(self):
         self.log.info(f"{self._filename}: waiting to finish.")
-        self.p.join()
+        self._wait_for_tile()
         # log the finished writer %
         self.signal_progress_percent
 
+    def close(self):
+        self.log.info(f"{self._filename}: closing writer process.")
+        self._stop_service()
+
     def delete_files(self):
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
         xmlpath = Path(self._path, self._acquisition_name, self._filename).absolute().replace('h5', 'xml')
@@ -8,9 +8,13 @@ import logging
 from xml.etree import ElementTree as ET
 import skimage.transform
 import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
 from pathlib import Path
 from tqdm import trange
-from voxel.processes.gpu.gputools.downsample_3d import DownSample3D
+from voxel.processes.cpu.pyramid import Pyramid
+from voxel.writers.noise_codec import HDF5_FILTER_ID, NoiseCodec
 
 # class SubSample:
 #     def __init__(self):
@@ -81,9 +85,9 @@ class BdvBase:
         self.nlevels = None
         self.ntimes = self.nilluminations = self.nchannels = self.ntiles = self.nangles = self.nsetups = 0
         self.compression = None
-        self.compressions_supported = (None, 'gzip', 'lzf', 'b3d')
-        # initialize the downsampling in 3d
-        self.gpu_binning = DownSample3D(binning=2)
+        self.compressions_supported = (None, 'gzip', 'lzf', 'b3d', 'naq')
+        # reduction used to build the pyramid levels, 'mean' or 'max'
+        self.downsample_method = 'mean'
 
     def _determine_setup_id(self, illumination=0, channel=0, tile=0, angle=0):
         """Takes the view attributes (illumination, channel, tile, angle) and converts them into unique setup_id.
@@ -205,7 +209,34 @@ class BdvBase:
             if level and (not elem.tail or not elem.tail.strip()):
                 elem.tail = i
 
-    # deprecate and do not use -> use GPU binning instead
+    def _level_factors(self):
+        """Subsampling factors (z,y,x) of each pyramid level relative to the level above it."""
+        factors = list()
+        for ilevel in range(1, len(self.subsamp)):
+            level_factors = np.asarray(self.subsamp[ilevel]) // np.asarray(self.subsamp[ilevel - 1])
+            assert all(level_factors * self.subsamp[ilevel - 1] == self.subsamp[ilevel]), \
+                f"Subsampling level {self.subsamp[ilevel]} must be a multiple of {self.subsamp[ilevel - 1]}."
+            factors.append(tuple(int(factor) for factor in level_factors))
+        return factors
+
+    def _build_levels(self, stack: np.array):
+        """Compute all pyramid levels of a complete 3d stack in one pass.
+
+        Returns:
+        --------
+            list of 3d arrays, one per level, the first being the stack itself.
+        """
+        levels = [stack]
+        if len(self.subsamp) > 1:
+            pyramid = Pyramid(self._level_factors(), method=self.downsample_method)
+            for (z_start, planes), (_, flushed_planes) in zip(pyramid.push(stack), pyramid.flush()):
+                levels.append(np.concatenate((planes, flushed_planes)))
+            pyramid.close()
+        # crop to the level dimensions used for the h5 datasets
+        return [level[tuple(slice(0, size) for size in np.asarray(stack.shape) // self.subsamp[ilevel])]
+                for ilevel, level in enumerate(levels)]
+
+    # deprecate and do not use -> use _build_levels instead
     def _subsample_stack(self, stack: np.array, subsamp_level: tuple):
         """Subsampling of a 3d stack.
 
@@ -273,15 +304,14 @@ class BdvBase:
         self._write_pyramids_header()
         for time in trange(self.ntimes, desc='time points'):
             for isetup in trange(self.nsetups, desc='views'):
-                for ilevel in range(1, self.nlevels):
-                    full_res_group_name = self._fmt.format(time, isetup, 0)
-                    if full_res_group_name in self._file_object_h5:
-                        raw_data = self._file_object_h5[full_res_group_name]['cells'][()].astype('uint16')
+                full_res_group_name = self._fmt.format(time, isetup, 0)
+                if full_res_group_name in self._file_object_h5:
+                    raw_data = self._file_object_h5[full_res_group_name]['cells'][()].astype('uint16')
+                    levels = self._build_levels(raw_data)
+                    for ilevel in range(1, self.nlevels):
                         pyramid_group_name = self._fmt.format(time, isetup, ilevel)
                         grp = self._file_object_h5.create_group(pyramid_group_name)
-                        if ilevel >0:
-                            raw_data = self.gpu_binning.run(raw_data).astype('int16')
-                        grp.create_dataset('cells', data=subdata, chunks=tuple(self.chunks[ilevel]),
+                        grp.create_dataset('cells', data=levels[ilevel].astype('int16'), chunks=tuple(self.chunks[ilevel]),
                                            maxshape=(None, None, None), compression=self.compression, compression_opts=self.compression_opts, dtype='int16')
 
 
@@ -293,7 +323,8 @@ class BdvWriter(BdvBase):
                  compression=None,
                  compression_opts=None,
                  nilluminations=1, nchannels=1, ntiles=1, nangles=1,
-                 overwrite=False):
+                 overwrite=False, downsample_method='mean', compression_threads=None,
+                 dynamic_setups=False, skip_fill_chunks=False):
         """Class for writing multiple numpy 3d-arrays into BigDataViewer/BigStitcher HDF5 file.
 
         Parameters:
@@ -305,7 +336,10 @@ class BdvWriter(BdvBase):
             blockdim: tuple of tuples
                 Block size for h5 storage, in pixels, in (z,y,x) order. Default ((4,256,256),), see notes.
             compression: None or str
-                (None, 'gzip', 'lzf'), HDF5 compression method. Default is None for high-speed writing.
+                (None, 'gzip', 'lzf', 'b3d', 'naq'), HDF5 compression method. Default is None for high-speed writing.
+                'naq' is the noise adaptive quantization codec, configured by the integer options
+                `NoiseCodec.filter_options` in `compression_opts`. It is supported for virtual stacks only
+                and its chunks are decoded by voxel.readers, not by HDF5.
             nilluminations: int
             nchannels: int
             ntiles: int
@@ -313,6 +347,18 @@ class BdvWriter(BdvBase):
                 Number of view attributes, >=1.
             overwrite: boolean
                 If True, overwrite existing file. Default False.
+            downsample_method: str
+                ('mean', 'max'), reduction used to compute the subsampling levels. Default 'mean'.
+            compression_threads: None or int
+                Number of threads compressing 'gzip' chunks of virtual stacks, which are then written
+                with direct chunk writes. Default None compresses in the h5py filter pipeline.
+            dynamic_setups: boolean
+                If True, setup ids are assigned in the order views are first appended and setups are
+                added one at a time, instead of being derived from the view attribute counts.
+                The attribute counts then only set the minimum number of attributes listed in the XML.
+            skip_fill_chunks: boolean
+                If True, chunks of virtual stacks whose pixels are all 0 are not written. HDF5 leaves them
+                unallocated and reads them back as the fill value 0.
 
         .. note::
         ------
@@ -353,21 +399,47 @@ class BdvWriter(BdvBase):
         self.exposure_time = {}
         self.exposure_units = {}
         self.attribute_labels = {}
+        # named affine transformations of each (time, setup), written by write_xml
+        self.view_affines = {}
+        # setup ids by (illumination, channel, tile, angle), grown as views are appended
+        self.setup_table = None
+        if dynamic_setups:
+            self.setup_table = {}
+            self.nsetups = 0
         if compression == 'b3d':
             self.compression = 32016
+        elif compression == 'naq':
+            self.compression = HDF5_FILTER_ID
         else:
             self.compression = compression
         self.compression_opts = compression_opts
+        self.downsample_method = downsample_method
+        self.skip_fill_chunks = skip_fill_chunks
+        # incremental pyramid builders of the virtual stacks, by setup id
+        self._pyramids = {}
+        # HDF5 can not run the noise codec, its chunks are always written directly
+        self._noise_codec = NoiseCodec.from_filter_options(compression_opts) if compression == 'naq' else None
+        # h5py compresses in a single thread, gzip chunks can be compressed
+        # in parallel with zlib and written directly instead
+        if (compression_threads is not None and self.compression == 'gzip') or self._noise_codec is not None:
+            self._compression_pool = ThreadPoolExecutor(max_workers=compression_threads)
+        else:
+            self._compression_pool = None
         if os.path.exists(self.filename_h5):
             if overwrite:
                 os.remove(self.filename_h5)
                 self.log.warning("Warning: H5 file already exists, overwriting.")
             else:
                 self.log.warning("Warning: H5 file already exists, appending.")
+        appending = os.path.exists(self.filename_h5)
         self._file_object_h5 = h5py.File(self.filename_h5, 'a')
-        self._write_setups_header()
         self.virtual_stacks = False
-        self.setup_id_present = [[False] * self.nsetups]
+        if self.setup_table is not None and appending:
+            # keep the setups of the file, new views get new setups
+            self._load_setups()
+        else:
+            self._write_setups_header()
+            self.setup_id_present = [[False] * self.nsetups]
 
     def set_attribute_labels(self, attribute: str, labels: tuple) -> None:
         """
@@ -406,14 +478,133 @@ class BdvWriter(BdvBase):
     def _write_setups_header(self):
         """Write resolutions and subdivisions for all setups into h5 file."""
         for isetup in range(self.nsetups):
-            group_name = 's{:02d}'.format(isetup)
-            if group_name in self._file_object_h5:
-                del self._file_object_h5[group_name]
-            grp = self._file_object_h5.create_group(group_name)
-            data_subsamp = np.flip(self.subsamp, 1)
-            data_chunks = np.flip(self.chunks, 1)
-            grp.create_dataset('resolutions', data=data_subsamp, dtype='<f8', maxshape=(None, 3))
-            grp.create_dataset('subdivisions', data=data_chunks, dtype='<i4', maxshape=(None, 3))
+            self._write_setup_header(isetup)
+
+    def _write_setup_header(self, isetup):
+        """Write resolutions and subdivisions of one setup into h5 file."""
+        group_name = 's{:02d}'.format(isetup)
+        if group_name in self._file_object_h5:
+            del self._file_object_h5[group_name]
+        grp = self._file_object_h5.create_group(group_name)
+        data_subsamp = np.flip(self.subsamp, 1)
+        data_chunks = np.flip(self.chunks, 1)
+        grp.create_dataset('resolutions', data=data_subsamp, dtype='<f8', maxshape=(None, 3))
+        grp.create_dataset('subdivisions', data=data_chunks, dtype='<i4', maxshape=(None, 3))
+
+    def _determine_setup_id(self, illumination=0, channel=0, tile=0, angle=0):
+        """Takes the view attributes (illumination, channel, tile, angle) and converts them into unique setup_id.
+        With dynamic setups, the id is looked up in the setup table."""
+        if self.setup_table is None:
+            return super()._determine_setup_id(illumination, channel, tile, angle)
+        view = (illumination, channel, tile, angle)
+        assert view in self.setup_table, f"View (illumination, channel, tile, angle) {view} was not appended."
+        return self.setup_table[view]
+
+    def _add_setup(self, illumination=0, channel=0, tile=0, angle=0):
+        """Add a setup for a new view to the setup table and the h5 file, without touching other setups."""
+        isetup = self.nsetups
+        self.setup_table[(illumination, channel, tile, angle)] = isetup
+        self.nsetups += 1
+        for present in self.setup_id_present:
+            present.append(False)
+        for attribute, index in zip(('illumination', 'channel', 'tile', 'angle'),
+                                    (illumination, channel, tile, angle)):
+            self.attribute_counts[attribute] = max(self.attribute_counts[attribute], index + 1)
+        self.nilluminations = self.attribute_counts['illumination']
+        self.nchannels = self.attribute_counts['channel']
+        self.ntiles = self.attribute_counts['tile']
+        self.nangles = self.attribute_counts['angle']
+        self._write_setup_header(isetup)
+        return isetup
+
+    def _load_setups(self):
+        """Rebuild the setup table and the view metadata of an existing file pair, so that appended views
+        get new setups and `write_xml` keeps the views written before. Setups in the h5 file but not in the
+        XML file, e.g. of a view that was being written when the writer stopped, are skipped."""
+        h5_setups = [int(name[1:]) for name in self._file_object_h5.keys()
+                     if name.startswith('s') and name[1:].isdigit()]
+        self.nsetups = max(h5_setups) + 1 if h5_setups else 0
+        self.setup_id_present = [[False] * self.nsetups]
+        if not os.path.exists(self.filename_xml):
+            if h5_setups:
+                raise ValueError(f"{self.filename_h5} has {len(h5_setups)} setups but no XML file "
+                                 f"{self.filename_xml}, can not append views with dynamic setups.")
+            return
+        root = ET.parse(self.filename_xml).getroot()
+        for vs in root.findall('./SequenceDescription/ViewSetups/ViewSetup'):
+            isetup = int(vs.find('id').text)
+            view = tuple(int(vs.find(f'attributes/{attribute}').text)
+                         for attribute in ('illumination', 'channel', 'tile', 'angle'))
+            self.setup_table[view] = isetup
+            self.nsetups = max(self.nsetups, isetup + 1)
+            nx, ny, nz = (int(size) for size in vs.find('size').text.split())
+            self.stack_shapes[isetup] = (nz, ny, nx)
+            self.voxel_units[isetup] = vs.find('voxelSize/unit').text
+            self.voxel_size_xyz[isetup] = tuple(float(size) for size in vs.find('voxelSize/size').text.split())
+            self.exposure_time[isetup] = float(vs.find('camera/exposureTime').text)
+            self.exposure_units[isetup] = vs.find('camera/exposureUnits').text
+            for attribute, index in zip(('illumination', 'channel', 'tile', 'angle'), view):
+                self.attribute_counts[attribute] = max(self.attribute_counts[attribute], index + 1)
+        for attrs in root.findall('./SequenceDescription/ViewSetups/Attributes'):
+            attribute = attrs.get('name')
+            labels = tuple(att.find('name').text for att in attrs)
+            self.attribute_counts[attribute] = max(self.attribute_counts[attribute], len(labels))
+            if any(label != str(i_attr) for i_attr, label in enumerate(labels)):
+                self.attribute_labels[attribute] = labels
+        self.nilluminations = self.attribute_counts['illumination']
+        self.nchannels = self.attribute_counts['channel']
+        self.ntiles = self.attribute_counts['tile']
+        self.nangles = self.attribute_counts['angle']
+        tpoints = root.find('./SequenceDescription/Timepoints')
+        self.ntimes = int(tpoints.find('last').text) + 1
+        self.setup_id_present = [[False] * self.nsetups for _ in range(self.ntimes)]
+        for vreg in root.findall('./ViewRegistrations/ViewRegistration'):
+            itime, isetup = int(vreg.get('timepoint')), int(vreg.get('setup'))
+            self.setup_id_present[itime][isetup] = True
+            # transformations are listed with the last added on top, the calibration at the bottom
+            for vt in reversed(vreg.findall('ViewTransform')):
+                name_affine = vt.find('Name').text
+                m_affine = np.array(vt.find('affine').text.split(), dtype=float).reshape(3, 4)
+                if name_affine == 'calibration':
+                    self.calibrations[isetup] = (m_affine[0, 0], m_affine[1, 1], m_affine[2, 2])
+                else:
+                    self.view_affines.setdefault((itime, isetup), {})[name_affine] = m_affine
+        self.log.info(f"appending to {len(self.setup_table)} setups of {self.filename_xml}.")
+
+    def _setup_attributes(self):
+        """List of (setup_id, illumination, channel, tile, angle) of all setups, ordered by setup_id."""
+        if self.setup_table is not None:
+            return sorted((isetup,) + view for view, isetup in self.setup_table.items())
+        return [(self._determine_setup_id(iillumination, ichannel, itile, iangle),
+                 iillumination, ichannel, itile, iangle)
+                for iillumination in range(self.nilluminations)
+                for ichannel in range(self.nchannels)
+                for itile in range(self.ntiles)
+                for iangle in range(self.nangles)]
+
+    def add_affine(self, m_affine, name_affine="Appended affine transformation using npy2bdv.",
+                   time=0, illumination=0, channel=0, tile=0, angle=0):
+        """Add an affine transformation to a view, placed on top of the transformations added before.
+        Unlike `append_affine`, the XML file is not rewritten; the transformation is written by the next
+        `write_xml` call. Adding a transformation with an existing name replaces it.
+
+        Parameters:
+        -----------
+            m_affine: numpy array of shape (3,4)
+                Coefficients of affine transformation matrix (m00, m01, ...)
+            name_affine: str, optional
+                Name of the affine transformation.
+            time: int
+                Time index, >=0.
+            illumination: int
+            channel: int
+            tile: int
+            angle: int
+                Indices of the view attributes, >= 0.
+        """
+        assert m_affine.shape == (3,4), "m_affine must be a numpy array of shape (3,4)"
+        isetup = self._determine_setup_id(illumination, channel, tile, angle)
+        self.view_affines.setdefault((time, isetup), {})[name_affine] = m_affine.copy()
 
     def append_plane(self, plane, z, time=0, illumination=0, channel=0, tile=0, angle=0):
         """Append a plane to a virtual stack. Requires stack initialization by calling e.g.
@@ -451,6 +642,8 @@ class BdvWriter(BdvBase):
                         time=0, illumination=0, channel=0, tile=0, angle=0):
         """Append a substack to a virtual stack. Requires stack initialization by calling e.g.
         `append_view(stack=None, virtual_stack_dim=(1000,2048,2048))` beforehand.
+        With subsampling levels, substacks must span whole planes and be appended in z order,
+        the pyramid levels are built incrementally as the substacks arrive.
 
         Parameters:
         -----------
@@ -479,18 +672,117 @@ class BdvWriter(BdvBase):
             f"Substack offset {y_start} + y-dim {substack.shape[1]} > virtual stack y-dim {self.stack_shapes[isetup][1]}."
         assert x_start + substack.shape[2] <= self.stack_shapes[isetup][2], \
             f"Substack offset {x_start} + x-dim {substack.shape[2]} > virtual stack x-dim {self.stack_shapes[isetup][2]}."
-        for ilevel in range(self.nlevels):
-            group_name = self._fmt.format(time, isetup, ilevel)
-            dataset = self._file_object_h5[group_name]["cells"]
-            # change subsampling to ingest the previous pyramid and not _subsample_stack function
-            if ilevel > 0:
-                substack = self.gpu_binning.run(substack).astype('int16')
-            sub_z_start = int(z_start/2**ilevel)
-            sub_y_start = int(y_start/2**ilevel)
-            sub_x_start = int(x_start/2**ilevel)
-            dataset[sub_z_start : sub_z_start + substack.shape[0],
-                    sub_y_start : sub_y_start + substack.shape[1],
-                    sub_x_start : sub_x_start + substack.shape[2]] = substack
+        dataset = self._file_object_h5[self._fmt.format(time, isetup, 0)]["cells"]
+        if self._compression_pool is not None and substack.shape[1:] == dataset.shape[1:]:
+            self._write_planes(dataset, z_start, substack)
+        else:
+            dataset[z_start : z_start + substack.shape[0],
+                    y_start : y_start + substack.shape[1],
+                    x_start : x_start + substack.shape[2]] = substack
+        if self.nlevels > 1:
+            assert substack.shape[1:] == tuple(self.stack_shapes[isetup][1:]), \
+                f"Substack (y,x) dimensions {substack.shape[1:]} must match the virtual stack " \
+                f"{self.stack_shapes[isetup][1:]} to build subsampling levels."
+            if isetup not in self._pyramids:
+                self._pyramids[isetup] = Pyramid(self._level_factors(), method=self.downsample_method)
+            pyramid = self._pyramids[isetup]
+            if z_start == 0:
+                pyramid.reset()
+            level_updates = list(enumerate(pyramid.push(substack), start=1))
+            # reduce the carried planes once the end of the stack is reached
+            if z_start + substack.shape[0] == self.stack_shapes[isetup][0]:
+                level_updates += list(enumerate(pyramid.flush(), start=1))
+            for ilevel, (sub_z_start, sub_substack) in level_updates:
+                dataset = self._file_object_h5[self._fmt.format(time, isetup, ilevel)]["cells"]
+                # levels are computed with partial edge blocks, the datasets are rounded down
+                sub_z_count = max(0, min(sub_substack.shape[0], dataset.shape[0] - sub_z_start))
+                if sub_z_count:
+                    self._write_planes(dataset, sub_z_start,
+                                       sub_substack[:sub_z_count, :dataset.shape[1], :dataset.shape[2]].astype('int16'))
+
+    def _write_planes(self, dataset, z_start, planes):
+        """Write whole planes into a dataset starting at plane z_start.
+
+        With compression threads, every chunk covered entirely by the planes (or cut off only by the
+        dataset bounds) is compressed on the thread pool and written with a direct chunk write.
+        Planes of chunks that are only partially covered go through the h5py filter pipeline, or with
+        the noise codec, the chunks are decoded, updated and encoded again. With skip_fill_chunks, covered chunks that are all 0 are not written.
+        """
+        z_end = z_start + planes.shape[0]
+        if self._compression_pool is None and not self.skip_fill_chunks:
+            dataset[z_start:z_end] = planes
+            return
+        if planes.dtype != dataset.dtype and planes.dtype.itemsize == dataset.dtype.itemsize:
+            # uint16 is stored bit for bit as int16, as BDV expects
+            planes = planes.view(dataset.dtype)
+        chunk_z = dataset.chunks[0]
+        direct_start = -(-z_start // chunk_z) * chunk_z
+        direct_end = z_end if z_end == dataset.shape[0] else z_end // chunk_z * chunk_z
+
+        def write_partial(z, partial_planes):
+            # planes of partially covered chunks
+            if self._noise_codec is not None:
+                self._write_encoded_partial(dataset, z, partial_planes)
+            else:
+                dataset[z:z + partial_planes.shape[0]] = partial_planes
+
+        if direct_end <= direct_start:
+            write_partial(z_start, planes)
+            return
+        if z_start < direct_start:
+            write_partial(z_start, planes[:direct_start - z_start])
+        if direct_end < z_end:
+            write_partial(direct_end, planes[direct_end - z_start:])
+        compression_level = dataset.compression_opts
+
+        def compress_chunk(offset):
+            z, y, x = offset
+            chunk = planes[z - z_start:z - z_start + chunk_z, y:y + dataset.chunks[1], x:x + dataset.chunks[2]]
+            chunk = np.ascontiguousarray(chunk, dtype=dataset.dtype)
+            if self.skip_fill_chunks and not chunk.any():
+                return offset, None
+            if self._compression_pool is None:
+                return offset, chunk
+            if chunk.shape != dataset.chunks:
+                # edge chunks are stored at full chunk size
+                padded_chunk = np.zeros(dataset.chunks, dtype=dataset.dtype)
+                padded_chunk[:chunk.shape[0], :chunk.shape[1], :chunk.shape[2]] = chunk
+                chunk = padded_chunk
+            if self._noise_codec is not None:
+                return offset, self._noise_codec.encode(chunk.view(np.uint16))
+            return offset, zlib.compress(chunk, compression_level)
+
+        offsets = product(range(direct_start, direct_end, chunk_z),
+                          range(0, dataset.shape[1], dataset.chunks[1]),
+                          range(0, dataset.shape[2], dataset.chunks[2]))
+        # h5py is not thread safe, so chunks are written from this thread in order
+        chunk_map = map if self._compression_pool is None else self._compression_pool.map
+        for offset, chunk in chunk_map(compress_chunk, offsets):
+            if chunk is None:
+                continue
+            if self._compression_pool is None:
+                z, y, x = offset
+                dataset[z:z + chunk.shape[0], y:y + chunk.shape[1], x:x + chunk.shape[2]] = chunk
+            else:
+                dataset.id.write_direct_chunk(offset, chunk)
+
+    def _write_encoded_partial(self, dataset, z_start, planes):
+        """Write planes that cover noise codec chunks only partially, by decoding, updating and
+        encoding every chunk they overlap, since HDF5 cannot run the codec itself."""
+        chunk_z = dataset.chunks[0]
+        z_end = z_start + planes.shape[0]
+        for offset in product(range(z_start // chunk_z * chunk_z, z_end, chunk_z),
+                              range(0, dataset.shape[1], dataset.chunks[1]),
+                              range(0, dataset.shape[2], dataset.chunks[2])):
+            z, y, x = offset
+            if dataset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+                chunk = np.zeros(dataset.chunks, dtype=dataset.dtype)
+            else:
+                chunk = NoiseCodec.decode(dataset.id.read_direct_chunk(offset)[1]).view(dataset.dtype)
+            low, high = max(z, z_start), min(z + chunk_z, z_end)
+            region = planes[low - z_start:high - z_start, y:y + dataset.chunks[1], x:x + dataset.chunks[2]]
+            chunk[low - z:high - z, :region.shape[1], :region.shape[2]] = region
+            dataset.id.write_direct_chunk(offset, self._noise_codec.encode(chunk.view(np.uint16)))
 
     def append_view(self, stack, virtual_stack_dim=None,
                     time=0, illumination=0, channel=0, tile=0, angle=0,
@@ -534,6 +826,8 @@ class BdvWriter(BdvBase):
         assert len(voxel_size_xyz) == 3, "Voxel size must be a tuple of 3 elements (x, y, z)."
         if time > self.ntimes - 1:
             self.ntimes = time + 1
+        if self.setup_table is not None and (illumination, channel, tile, angle) not in self.setup_table:
+            self._add_setup(illumination, channel, tile, angle)
         isetup = self._determine_setup_id(illumination, channel, tile, angle)
         self._update_setup_id_present(isetup, time)
         if stack is not None:
@@ -544,6 +838,9 @@ class BdvWriter(BdvBase):
             self.stack_shapes[isetup] = virtual_stack_dim
             self.virtual_stacks = True
 
+        if stack is not None:
+            assert self._noise_codec is None, "The noise codec supports virtual stacks only."
+            levels = self._build_levels(stack)
         for ilevel in range(self.nlevels):
             group_name = self._fmt.format(time, isetup, ilevel)
             if group_name in self._file_object_h5:
@@ -551,13 +848,13 @@ class BdvWriter(BdvBase):
             else:
                 grp = self._file_object_h5.create_group(group_name)
                 if stack is not None:
-                    stack = self.gpu_binning.run(stack).astype('int16')
-                    grp.create_dataset('cells', data=stack, chunks=self.chunks[ilevel],
+                    grp.create_dataset('cells', data=levels[ilevel].astype('int16'), chunks=self.chunks[ilevel],
                                        maxshape=(None, None, None), compression=self.compression, compression_opts=self.compression_opts, dtype='int16')
                 else:  # a virtual stack initialized
                     grp.create_dataset('cells', chunks=self.chunks[ilevel],
                                        shape=virtual_stack_dim // self.subsamp[ilevel],
-                                       compression=self.compression, compression_opts=self.compression_opts, dtype='int16')
+                                       compression=self.compression, compression_opts=self.compression_opts, dtype='int16',
+                                       allow_unknown_filter=self._noise_codec is not None)
         if m_affine is not None:
             self.affine_matrices[isetup] = m_affine.copy()
             self.affine_names[isetup] = name_affine
@@ -624,32 +921,28 @@ class BdvWriter(BdvBase):
         el.text = os.path.basename(self.filename_h5)
         # write ViewSetups
         viewsets = ET.SubElement(seqdesc, 'ViewSetups')
-        for iillumination in range(self.nilluminations):
-            for ichannel in range(self.nchannels):
-                for itile in range(self.ntiles):
-                    for iangle in range(self.nangles):
-                        isetup = self._determine_setup_id(iillumination, ichannel, itile, iangle)
-                        if any([self.setup_id_present[t][isetup] for t in range(len(self.setup_id_present))]):
-                            vs = ET.SubElement(viewsets, 'ViewSetup')
-                            ET.SubElement(vs, 'id').text = str(isetup)
-                            ET.SubElement(vs, 'name').text = 'setup ' + str(isetup)
-                            nz, ny, nx = tuple(self.stack_shapes[isetup])
-                            ET.SubElement(vs, 'size').text = '{} {} {}'.format(nx, ny, nz)
-                            vox = ET.SubElement(vs, 'voxelSize')
-                            ET.SubElement(vox, 'unit').text = self.voxel_units[isetup]
-                            dx, dy, dz = self.voxel_size_xyz[isetup]
-                            ET.SubElement(vox, 'size').text = '{} {} {}'.format(dx, dy, dz)
-                            # new XML data, added by @nvladimus
-                            cam = ET.SubElement(vs, 'camera')
-                            ET.SubElement(cam, 'name').text = camera_name
-                            ET.SubElement(cam, 'exposureTime').text = '{}'.format(self.exposure_time[isetup])
-                            ET.SubElement(cam, 'exposureUnits').text = self.exposure_units[isetup]
-                            # end of new XML data
-                            a = ET.SubElement(vs, 'attributes')
-                            ET.SubElement(a, 'illumination').text = str(iillumination)
-                            ET.SubElement(a, 'channel').text = str(ichannel)
-                            ET.SubElement(a, 'tile').text = str(itile)
-                            ET.SubElement(a, 'angle').text = str(iangle)
+        for isetup, iillumination, ichannel, itile, iangle in self._setup_attributes():
+            if any([self.setup_id_present[t][isetup] for t in range(len(self.setup_id_present))]):
+                vs = ET.SubElement(viewsets, 'ViewSetup')
+                ET.SubElement(vs, 'id').text = str(isetup)
+                ET.SubElement(vs, 'name').text = 'setup ' + str(isetup)
+                nz, ny, nx = tuple(self.stack_shapes[isetup])
+                ET.SubElement(vs, 'size').text = '{} {} {}'.format(nx, ny, nz)
+                vox = ET.SubElement(vs, 'voxelSize')
+                ET.SubElement(vox, 'unit').text = self.voxel_units[isetup]
+                dx, dy, dz = self.voxel_size_xyz[isetup]
+                ET.SubElement(vox, 'size').text = '{} {} {}'.format(dx, dy, dz)
+                # new XML data, added by @nvladimus
+                cam = ET.SubElement(vs, 'camera')
+                ET.SubElement(cam, 'name').text = camera_name
+                ET.SubElement(cam, 'exposureTime').text = '{}'.format(self.exposure_time[isetup])
+                ET.SubElement(cam, 'exposureUnits').text = self.exposure_units[isetup]
+                # end of new XML data
+                a = ET.SubElement(vs, 'attributes')
+                ET.SubElement(a, 'illumination').text = str(iillumination)
+                ET.SubElement(a, 'channel').text = str(ichannel)
+                ET.SubElement(a, 'tile').text = str(itile)
+                ET.SubElement(a, 'angle').text = str(iangle)
 
         # write Attributes
         for attribute in self.attribute_counts.keys():
@@ -673,9 +966,10 @@ class BdvWriter(BdvBase):
         # missing views
         if any(True in l for l in self.setup_id_present):
             miss_views = ET.SubElement(seqdesc, 'MissingViews')
+            listed_setups = {attributes[0] for attributes in self._setup_attributes()}
             for t in range(len(self.setup_id_present)):
                 for i in range(len(self.setup_id_present[t])):
-                    if not self.setup_id_present[t][i]:
+                    if not self.setup_id_present[t][i] and i in listed_setups:
                         miss_view = ET.SubElement(miss_views, 'MissingView')
                         miss_view.set('timepoint', str(t))
                         miss_view.set('setup', str(i))
@@ -688,6 +982,13 @@ class BdvWriter(BdvBase):
                     vreg = ET.SubElement(vregs, 'ViewRegistration')
                     vreg.set('timepoint', str(itime))
                     vreg.set('setup', str(isetup))
+                    # write the added transformations, the last added on top
+                    for name_affine, m_affine in reversed(list(self.view_affines.get((itime, isetup), {}).items())):
+                        vt = ET.SubElement(vreg, 'ViewTransform')
+                        vt.set('type', 'affine')
+                        ET.SubElement(vt, 'Name').text = name_affine
+                        mx_string = np.array2string(m_affine.flatten(), formatter={'float':lambda x: "%.6f" % x})
+                        ET.SubElement(vt, 'affine').text = mx_string[1:-1].strip()
                     # write arbitrary affine transformation, specific for each view
                     if isetup in self.affine_matrices.keys():
                         vt = ET.SubElement(vreg, 'ViewTransform')
@@ -714,8 +1015,17 @@ class BdvWriter(BdvBase):
             self.setup_id_present.append([False] * self.nsetups)
         self.setup_id_present[itime][isetup] = True
 
+    def flush(self):
+        """Save changes to the H5 file without closing it."""
+        self._file_object_h5.flush()
+
     def close(self):
         """Save changes and close the H5 file."""
+        for pyramid in self._pyramids.values():
+            pyramid.close()
+        self._pyramids = {}
+        if self._compression_pool is not None:
+            self._compression_pool.shutdown()
         self._file_object_h5.flush()
         self._file_object_h5.close()
 
@@ -760,6 +1070,7 @@ class BdvEditor(BdvBase):
 
     def read_view(self, time=0, illumination=0, channel=0, tile=0, angle=0, ilevel=0):
         """Read a view (stack) specified by its time, attributes, and downsampling level into numpy array (uint16).
+        The whole view is loaded, use voxel.readers.bdv.Reader to read parts of large views.
         Todo: implement detection of missing views using XML file, return None.
 
         Parameters:
@@ -0,0 +1,61 @@
+import numpy as np
+import tifffile
+
+
+def threshold_image(background_path: str, margin: int, data_type: str):
+    """Per pixel blank threshold from a BackgroundCollection image.
+
+    :param background_path: path of the background .tiff
+    :param margin: counts above the background still considered blank
+    :param data_type: data type of the frames
+    :return: (y, x) threshold image
+    """
+    background = tifffile.imread(background_path).astype(np.int64)
+    if background.ndim == 3:
+        background = np.median(background, axis=0)
+    return np.clip(background + margin, 0, np.iinfo(data_type).max).astype(data_type)
+
+
+def find_blank_blocks(frames: np.ndarray, block_shape: tuple, threshold):
+    """Classify the blocks of a chunk of frames as blank, i.e. no pixel of
+    the block is above the threshold. Reads every pixel once.
+
+    :param frames: (z, y, x) frames
+    :param block_shape: (z, y, x) block shape, edge blocks may be smaller
+    :param threshold: scalar or (y, x) threshold image
+    :return: boolean (z, y, x) array with one entry per block
+    """
+    starts = [np.arange(0, size, block_size) for size, block_size in zip(frames.shape, block_shape)]
+    # brightest pixel of every z block, then any pixel above threshold per y/x block
+    z_max = np.maximum.reduceat(frames, starts[0], axis=0)
+    above = z_max > threshold
+    above = np.logical_or.reduceat(above, starts[1], axis=1)
+    above = np.logical_or.reduceat(above, starts[2], axis=2)
+    return ~above
+
+
+def elide_blank_blocks(frames: np.ndarray, block_shape: tuple, threshold):
+    """Set blank blocks to the fill value 0, so that writers skip storing
+    them. The frames in shared memory are left untouched, blank blocks are
+    zeroed in a copy.
+
+    :param frames: (z, y, x) frames
+    :param block_shape: (z, y, x) storage block shape
+    :param threshold: scalar or (y, x) threshold image, None disables elision
+    :return: frames with blank blocks zeroed and the bytes of the blank blocks
+    """
+    if threshold is None or not frames.size:
+        return frames, 0
+    blank = find_blank_blocks(frames, block_shape, threshold)
+    if not blank.any():
+        return frames, 0
+    frames = frames.copy()
+    elided_nbytes = 0
+    for z, y, x in np.argwhere(blank):
+        block = frames[z*block_shape[0]:(z + 1)*block_shape[0],
+                       y*block_shape[1]:(y + 1)*block_shape[1],
+                       x*block_shape[2]:(x + 1)*block_shape[2]]
+        block[:] = 0
+        elided_nbytes += block.nbytes
+    return frames, elided_nbytes
+
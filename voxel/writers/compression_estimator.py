@@ -0,0 +1,149 @@
+import numpy as np
+import logging
+import imagecodecs
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from time import perf_counter, time
+from voxel.writers.noise_codec import NoiseCodec
+
+# (z, y, x) shape of every sampled block.
+BLOCK_SHAPE_PX = (8, 128, 128)
+# Number of blocks compressed per estimate.
+SAMPLE_COUNT = 64
+# Two sided 95% normal quantile for the confidence bounds.
+CONFIDENCE_Z = 1.96
+
+
+def _byte_shuffle(block: np.ndarray):
+    """Group the n-th bytes of all values, as done by shuffle filters."""
+    return np.ascontiguousarray(block.reshape(-1).view(np.uint8).reshape(-1, block.dtype.itemsize).T)
+
+
+@lru_cache(maxsize=4)
+def _noise_codec(gain: float, read_noise: float, background_offset: float, quant_sigma: float):
+    return NoiseCodec(gain=gain, read_noise=read_noise, background_offset=background_offset,
+                      quant_sigma=quant_sigma)
+
+
+# In memory encoders of the writer codecs, called with a sampled block and
+# the codec arguments returned by Writer._sample_codec(). A 'predictor'
+# argument differences each row before encoding, as TIFF predictors do.
+CODECS = {
+    "none": lambda block: block.tobytes(),
+    "zlib": lambda block, level=6: zlib.compress(block, level),
+    "zstd": lambda block, level=None: imagecodecs.zstd_encode(block, level=level),
+    "lzw": lambda block: imagecodecs.lzw_encode(block),
+    "lzf": lambda block: imagecodecs.lzf_encode(block),
+    "lz4shuffle": lambda block: imagecodecs.lz4_encode(_byte_shuffle(block)),
+    "blosc": lambda block, compressor, level, shuffle: imagecodecs.blosc_encode(
+        block, level=level, compressor=compressor, shuffle=shuffle,
+        typesize=block.dtype.itemsize, numthreads=1),
+    "naq": lambda block, **parameters: _noise_codec(**parameters).encode(block)
+}
+
+
+class CompressionEstimator:
+    """Estimate the compression ratio of a writer from a few frames, by
+    compressing randomly sampled blocks in memory with the writer's codec and
+    level. Estimates are cached by a caller defined key, e.g. channel and
+    exposure time, together with the codec settings."""
+
+    def __init__(self, thread_count: int = os.cpu_count(), sample_count: int = SAMPLE_COUNT,
+                 block_shape_px: tuple = BLOCK_SHAPE_PX, max_age_s: float = None):
+        """
+
+        :param thread_count: number of threads compressing blocks
+        :param sample_count: number of blocks compressed per estimate
+        :param block_shape_px: (z, y, x) shape of the sampled blocks
+        :param max_age_s: age after which cached estimates are recomputed,
+            None keeps them until clear_cache()
+
+        .. code-block: python
+
+            estimator = CompressionEstimator()
+            estimate = estimator.estimate(writer, frames, key=(channel, exposure_time_ms))
+            estimate['ratio'], estimate['lower'], estimate['upper']
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._sample_count = sample_count
+        self._block_shape_px = tuple(block_shape_px)
+        self._max_age_s = max_age_s
+        self._pool = ThreadPoolExecutor(max_workers=thread_count)
+        self._cache = dict()
+
+    def cached(self, writer, key):
+        """Cached estimate for the writer's codec and key, or None."""
+        estimate = self._cache.get(self._cache_key(writer, key))
+        if estimate is not None and self._max_age_s is not None and time() - estimate['time'] > self._max_age_s:
+            return None
+        return estimate
+
+    def estimate(self, writer, frames: np.ndarray, key=None):
+        """Estimate the compression ratio of frames written by a writer.
+
+        :param writer: writer whose codec and level are used
+        :param frames: (z, y, x) frames, a handful is enough
+        :param key: cache key of the imaging conditions, e.g. (channel,
+            exposure time). None does not cache.
+        :return: dict with the ratio of raw to compressed bytes, its lower and
+            upper 95% confidence bounds and the number of sampled blocks
+        """
+        if key is not None:
+            estimate = self.cached(writer, key)
+            if estimate is not None:
+                return estimate
+        start_time = perf_counter()
+        cache_key = self._cache_key(writer, key)
+        codec_name, codec_args = writer._sample_codec()
+        codec_args = dict(codec_args)
+        predictor = codec_args.pop('predictor', False)
+        codec = CODECS[codec_name]
+
+        def encode(block: np.ndarray):
+            if predictor:
+                block = imagecodecs.delta_encode(block, axis=-1)
+            return len(codec(block, **codec_args))
+
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        block_shape = tuple(min(size, frame_size) for size, frame_size in zip(self._block_shape_px, frames.shape))
+        rng = np.random.default_rng()
+        starts = [[rng.integers(0, frame_size - size + 1) for size, frame_size in zip(block_shape, frames.shape)]
+                  for _ in range(self._sample_count)]
+        blocks = [np.ascontiguousarray(frames[z:z + block_shape[0], y:y + block_shape[1], x:x + block_shape[2]])
+                  for z, y, x in starts]
+        compressed_nbytes = np.array(list(self._pool.map(encode, blocks)),
+                                     dtype=np.float64)
+        raw_nbytes = np.full(len(blocks), blocks[0].nbytes, dtype=np.float64)
+        # ratio of sums with its delta method standard error
+        ratio = raw_nbytes.sum()/compressed_nbytes.sum()
+        residuals = raw_nbytes - ratio*compressed_nbytes
+        standard_error = np.sqrt(np.sum(residuals**2)/max(len(blocks) - 1, 1)/len(blocks))/compressed_nbytes.mean()
+        estimate = {
+            'ratio': float(ratio),
+            'lower': float(max(ratio - CONFIDENCE_Z*standard_error, 0)),
+            'upper': float(ratio + CONFIDENCE_Z*standard_error),
+            'sample_count': len(blocks),
+            'time': time()
+        }
+        if key is not None:
+            self._cache[cache_key] = estimate
+        self.log.info(f"{codec_name} compression ratio ~ {ratio:.2f} "
+                      f"[{estimate['lower']:.2f}, {estimate['upper']:.2f}] "
+                      f"estimated in {perf_counter() - start_time:.3f} [s]")
+        return estimate
+
+    @staticmethod
+    def _cache_key(writer, key):
+        codec_name, codec_args = writer._sample_codec()
+        return (key, codec_name, tuple(sorted(codec_args.items())))
+
+    def clear_cache(self):
+        self._cache = dict()
+
+    def close(self):
+        self._pool.shutdown()
@@ -0,0 +1,241 @@
+import numpy as np
+import logging
+import json
+import multiprocessing
+import re
+import shutil
+import sys
+import h5py
+import tifffile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import ceil
+from pathlib import Path
+from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+from voxel.writers import firehose
+from voxel.readers import bdv, imaris, tiff, zarr
+
+# Writer modules of the output formats.
+FORMATS = {
+    "tiff": "voxel.writers.tiff",
+    "bdv": "voxel.writers.bdv",
+    "imaris": "voxel.writers.imaris",
+    "zarr": "voxel.writers.zarr",
+    "raw": "voxel.writers.firehose"
+}
+
+# Converted stacks, one json line each, so interrupted runs can resume.
+PROGRESS_FILENAME = 'convert_progress.jsonl'
+
+
+def _imaris_attribute(attributes, name: str):
+    return int(b''.join(attributes[name]).decode())
+
+
+def find_stacks(path: str):
+    """List the stacks stored in a TIFF, firehose raw, BDV, Imaris or Zarr
+    file.
+
+    :param path: path of the file or directory
+    :return: list of stack dicts with the input path and format, a key of
+        the stack within the file, a name and the channel, position and
+        voxel size metadata that is known
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    stack = {'path': str(path), 'key': None, 'name': path.stem, 'channel': path.stem,
+             'position_mm': [0, 0, 0], 'voxel_size_um': [1, 1, 1]}
+    if suffix in ('.tif', '.tiff'):
+        with tifffile.TiffFile(path) as tiff:
+            metadata = (tiff.shaped_metadata or [dict()])[0]
+        plane = metadata.get('Plane', dict())
+        channel = metadata.get('Channel', dict()).get('Name', [path.stem])[0]
+        return [dict(stack, format='tiff', channel=channel if channel is not None else path.stem,
+                     position_mm=[plane.get(f'Position{axis}', 0) for axis in 'XYZ'],
+                     voxel_size_um=[metadata.get(f'PhysicalSize{axis}', 1) for axis in 'XYZ'])]
+    if suffix == '.raw':
+        stacks = list()
+        for index, (tile, channel) in enumerate(firehose.stack_keys(path)):
+            entry = next(entry for entry in firehose.read_index(path)
+                         if tuple(entry['tile']) == tile and entry['channel'] == channel)
+            stacks.append(dict(stack, format='raw', key=[list(tile), channel], name=f"{path.stem}_{index}",
+                               channel=channel, position_mm=list(tile), voxel_size_um=entry['voxel_size_um']))
+        return stacks
+    if suffix == '.h5':
+        with h5py.File(path, 'r') as f:
+            setups = sorted(name for name in f.get('t00000', dict()) if re.fullmatch(r's\d+', name))
+        return [dict(stack, format='bdv', key=setup, name=f"{path.stem}_{setup}", channel=setup)
+                for setup in setups]
+    if suffix == '.ims':
+        with h5py.File(path, 'r') as f:
+            channels = sorted(f['DataSet/ResolutionLevel 0/TimePoint 0'], key=lambda name: int(name.split()[-1]))
+            image = f['DataSetInfo/Image'].attrs
+            voxel_size_um = [(float(b''.join(image[f'ExtMax{axis}']).decode()) -
+                              float(b''.join(image[f'ExtMin{axis}']).decode())) / _imaris_attribute(image, axis)
+                             for axis in 'XYZ']
+        return [dict(stack, format='imaris', key=channel,
+                     name=path.stem if len(channels) == 1 else f"{path.stem}_{index}",
+                     voxel_size_um=[abs(size) for size in voxel_size_um])
+                for index, channel in enumerate(channels)]
+    if suffix == '.zarr':
+        return [dict(stack, format='zarr')]
+    raise ValueError(f"{path} is not a tiff, raw, bdv, imaris or zarr file.")
+
+
+def open_stack(stack: dict):
+    """Open a stack from find_stacks for reading frames in chunks. Frames
+    are read from disk only when they are sliced, so reading a stack chunk
+    by chunk needs memory for one chunk only.
+
+    :return: object with shape, dtype and frame slicing
+    """
+    if stack['format'] == 'tiff':
+        return tiff.Reader(stack['path'])
+    if stack['format'] == 'raw':
+        tile, channel = stack['key']
+        return firehose.memmap_stack(stack['path'], tuple(tile), channel)
+    if stack['format'] == 'bdv':
+        return bdv.Reader(stack['path'], setup=int(stack['key'][1:]))
+    if stack['format'] == 'imaris':
+        return imaris.Reader(stack['path'], channel=int(stack['key'].split()[-1]))
+    if stack['format'] == 'zarr':
+        return zarr.Reader(stack['path'])
+    raise ValueError(f"unknown stack format {stack['format']}.")
+
+
+def write_stack(writer, frames, chunk_buffer: SharedDoubleBuffer = None):
+    """Feed a stack chunk by chunk through a prepared writer. The next
+    chunk is read while the writer process writes the previous one.
+
+    :param writer: writer with the stack settings applied
+    :param frames: (z, y, x) stack supporting frame slicing
+    :param chunk_buffer: double buffer of (chunk, y, x) frames, created if None
+    """
+    chunk_count_px = writer.chunk_count_px
+    chunk_shape = (chunk_count_px, frames.shape[1], frames.shape[2])
+    buffer = SharedDoubleBuffer(chunk_shape, dtype=str(np.dtype(frames.dtype))) \
+        if chunk_buffer is None else chunk_buffer
+    try:
+        writer.prepare()
+        writer.start()
+        # writers may pad the frame count, padded frames are zero
+        for chunk_num in range(ceil(writer.frame_count_px/chunk_count_px)):
+            z_start = min(chunk_num*chunk_count_px, frames.shape[0])
+            chunk = frames[z_start:min(z_start + chunk_count_px, frames.shape[0])]
+            buffer.write_buf[:chunk.shape[0]] = chunk
+            buffer.write_buf[chunk.shape[0]:] = 0
+            writer.done_reading.wait()
+            buffer.toggle_buffers()
+            writer.submit_chunk(buffer.read_buf_mem_name)
+        writer.wait_to_finish()
+    finally:
+        if chunk_buffer is None:
+            buffer.close_and_unlink()
+
+
+def _output_paths(output_path: Path, filename: str):
+    paths = [Path(output_path, filename)]
+    if filename.endswith('.h5'):
+        paths.append(Path(output_path, filename[:-3] + '.xml'))
+    if filename.endswith('.raw'):
+        paths.append(firehose.index_path(Path(output_path, filename)))
+    return paths
+
+
+def convert_stack(stack: dict, output_format: str, output_path: str, settings: dict = dict()):
+    """Convert one stack with a new writer of the output format. Runs in a
+    worker process of convert().
+
+    :param stack: stack dict from find_stacks
+    :param output_format: one of FORMATS
+    :param output_path: directory of the converted files
+    :param settings: writer attributes to set, e.g. compression
+    :return: the stack dict
+    """
+    module = FORMATS[output_format]
+    __import__(module)
+    writer = sys.modules[module].Writer(output_path)
+    try:
+        for key, value in settings.items():
+            setattr(writer, key, value)
+        frames = open_stack(stack)
+        writer.acquisition_name = '.'
+        writer.filename = stack['name']
+        # remove the output of an interrupted conversion
+        for path in _output_paths(Path(output_path), writer.filename):
+            if path.is_dir():
+                shutil.rmtree(path)
+            elif path.exists():
+                path.unlink()
+        writer.data_type = str(np.dtype(frames.dtype))
+        writer.frame_count_px = frames.shape[0]
+        writer.row_count_px = frames.shape[1]
+        writer.column_count_px = frames.shape[2]
+        writer.channel = stack['channel']
+        writer.x_position_mm, writer.y_position_mm, writer.z_position_mm = stack['position_mm']
+        writer.x_voxel_size_um, writer.y_voxel_size_um, writer.z_voxel_size_um = stack['voxel_size_um']
+        try:
+            write_stack(writer, frames)
+        finally:
+            if hasattr(frames, 'close'):
+                frames.close()
+    finally:
+        writer.close()
+    return stack
+
+
+def convert(paths: list, output_format: str, output_path: str, settings: dict = dict(),
+            worker_count: int = None, resume: bool = True):
+    """Convert the stacks of many files concurrently in a process pool.
+
+    Every stack is converted into its own output file by a writer of the
+    output format, reading one chunk at a time, so memory use does not
+    depend on the stack size. Converted stacks are recorded in
+    convert_progress.jsonl in the output directory, and a resumed run skips
+    them and redoes stacks that were interrupted.
+
+    :param paths: input files or directories
+    :param output_format: one of FORMATS
+    :param output_path: directory of the converted files
+    :param settings: writer attributes to set, e.g. compression
+    :param worker_count: number of worker processes, defaults to the cpu count
+    :param resume: skip stacks recorded as converted
+    :return: list of stack dicts converted by this run
+    """
+    log = logging.getLogger(f"{__name__}.convert")
+    if output_format not in FORMATS:
+        raise ValueError("output format must be one of %r." % list(FORMATS))
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    progress_path = Path(output_path, PROGRESS_FILENAME)
+    converted = set()
+    if resume and progress_path.exists():
+        with open(progress_path, 'r') as f:
+            converted = {json.dumps([entry['path'], entry['key']])
+                         for entry in (json.loads(line) for line in f if line.strip())}
+    elif progress_path.exists():
+        progress_path.unlink()
+    stacks = list()
+    for path in paths:
+        for stack in find_stacks(path):
+            if json.dumps([stack['path'], stack['key']]) in converted:
+                log.info(f"skipping converted stack {stack['name']}")
+            else:
+                stacks.append(stack)
+    log.info(f"converting {len(stacks)} stacks to {output_format} in {output_path}")
+    done = list()
+    # spawned workers do not inherit threads of the calling process
+    with ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context('spawn')) as pool, open(progress_path, 'a') as progress:
+        futures = [pool.submit(convert_stack, stack, output_format, str(output_path), settings)
+                   for stack in stacks]
+        for future in as_completed(futures):
+            try:
+                stack = future.result()
+            except Exception:
+                # the stack is redone by the next resumed run
+                log.exception(f"converting stack failed")
+                continue
+            progress.write(json.dumps({'path': stack['path'], 'key': stack['key'], 'name': stack['name']}) + '\n')
+            progress.flush()
+            done.append(stack)
+            log.info(f"converted {stack['name']} ({len(done)}/{len(stacks)})")
+    return done
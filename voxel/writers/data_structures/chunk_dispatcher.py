@@ -0,0 +1,101 @@
+import logging
+from queue import Queue
+from threading import Thread
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+
+class ChunkDispatcher:
+    """Publish every chunk of a shared ring buffer to several consumers,
+    e.g. writers and processes of the same camera. Consumers attach to the
+    slot's shared memory by name, so chunks are never copied. A slot is
+    recycled once every consumer is done reading it.
+
+    Consumers follow the writer hand-off: submit_chunk(shm_name) hands a
+    chunk over and clears the consumer's done_reading event, which the
+    consumer sets once it no longer reads the chunk. Each consumer gets its
+    own feeder thread and queue, so a slow consumer delays slot recycling
+    but not the other consumers."""
+
+    def __init__(self, ring_buffer: SharedRingBuffer, consumers: list):
+        """
+
+        :param ring_buffer: ring buffer the chunks are filled in
+        :param consumers: objects with submit_chunk() and done_reading
+
+        .. code-block: python
+
+            ring_buf = SharedRingBuffer((64, 2048, 2048), 'uint16', slot_count=4)
+            dispatcher = ChunkDispatcher(ring_buf, [tiff_writer, bdv_writer, max_projection])
+
+            ring_buf.add_image(frame)
+            ...
+            # publish the write slot to every consumer
+            dispatcher.publish()
+            ...
+            dispatcher.wait_to_finish()
+            dispatcher.close()
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        if not consumers:
+            raise ValueError("chunk dispatcher needs at least one consumer.")
+        self._ring_buffer = ring_buffer
+        self._consumers = list(consumers)
+        self._queues = [Queue() for _ in self._consumers]
+        self._threads = [Thread(target=self._feed, args=(consumer, queue), daemon=True)
+                         for consumer, queue in zip(self._consumers, self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def consumer_count(self):
+        return len(self._consumers)
+
+    @property
+    def backlog(self):
+        """Number of published chunks each consumer has not finished, in
+        consumer order."""
+        return [queue.unfinished_tasks for queue in self._queues]
+
+    def publish(self, timeout: float = None):
+        """Publish the write slot of the ring buffer to every consumer and
+        claim the next free slot for writing. Blocks only if every slot is
+        still in use by some consumer.
+
+        :param timeout: time to wait for a free slot, None waits forever
+        :return: index of the published slot
+        """
+        slot_index = self._ring_buffer.write_index
+        self._ring_buffer.toggle_buffers(timeout=timeout, consumer_count=len(self._consumers))
+        for queue in self._queues:
+            queue.put(slot_index)
+        return slot_index
+
+    def _feed(self, consumer, queue: Queue):
+        """Hand published slots to one consumer in order, releasing each
+        slot once the consumer is done reading it."""
+        while True:
+            slot_index = queue.get()
+            if slot_index is None:
+                queue.task_done()
+                break
+            try:
+                consumer.submit_chunk(self._ring_buffer.slot_mem_names[slot_index])
+                consumer.done_reading.wait()
+            except Exception:
+                self.log.exception(f"handing chunk to {consumer.__class__.__name__} failed.")
+            finally:
+                self._ring_buffer.release(slot_index)
+                queue.task_done()
+
+    def wait_to_finish(self):
+        """Block until every consumer is done reading every published chunk."""
+        for queue in self._queues:
+            queue.join()
+
+    def close(self):
+        """Stop the feeder threads after the published chunks are handed off."""
+        for queue in self._queues:
+            queue.put(None)
+        for thread in self._threads:
+            thread.join()
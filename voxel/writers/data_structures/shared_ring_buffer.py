@@ -0,0 +1,249 @@
+import numpy as np
+from multiprocessing import Array, Condition, Event, Value
+from multiprocessing.shared_memory import SharedMemory
+
+# Slot states. A slot cycles FREE -> FILLING -> READY -> CONSUMING -> FREE.
+# A slot published to several consumers is freed once all released it.
+SLOT_FREE = 0
+SLOT_FILLING = 1
+SLOT_READY = 2
+SLOT_CONSUMING = 3
+
+
+class SharedRingBuffer:
+    """A single-producer-multi-consumer multi-process ring buffer of chunk
+    slots implemented as numpy ndarrays."""
+
+    def __init__(self, shape: tuple, dtype: str, slot_count: int = 4):
+        """
+
+        :param shape: a tuple indicating the shape of one chunk slot
+        :param dtype: data type of the chunk slots
+        :param slot_count: number of chunk slots in the ring, >= 2
+
+        .. code-block: python
+
+            ring_buf = SharedRingBuffer((8, 320, 240), 'uint16', slot_count=4)
+
+            ring_buf.add_image(np.zeros((320, 240), dtype='uint16'))
+            ring_buf.add_image(np.zeros((320, 240), dtype='uint16'))
+
+            # As with SharedDoubleBuffer, publish the write slot as the read
+            # buffer. It is freed again on the next toggle.
+            ring_buf.toggle_buffers()
+            writer.submit_chunk(ring_buf.read_buf_mem_name)
+
+            # Publish the write slot to one consumer and move on to the next
+            # free slot. This only blocks if every slot is still in use.
+            ring_buf.toggle_buffers(consumer_count=1)
+
+            # In a consumer process, drain the oldest published slot.
+            slot_index = ring_buf.acquire_ready()
+            chunk = ring_buf.slot_bufs[slot_index]
+            ...
+            ring_buf.release(slot_index)
+
+            # A slot published to 3 consumers stays ready until each of them
+            # acquired it, and is free after 3 releases.
+            ring_buf.toggle_buffers(consumer_count=3)
+
+        """
+        if slot_count < 2:
+            raise ValueError(f'slot count must be >= 2 but is {slot_count}')
+        # Overflow errors without casting for large datasets
+        nbytes = int(np.prod(shape, dtype=np.int64)*np.dtype(dtype).itemsize)
+        self.mem_blocks = [SharedMemory(create=True, size=nbytes) for _ in range(slot_count)]
+        # Attach references to the names of the memory locations.
+        self.slot_mem_names = [mem.name for mem in self.mem_blocks]
+        # Save values for querying later.
+        self.dtype = dtype
+        self.shape = shape
+        self.nbytes = nbytes
+        self.slot_count = slot_count
+        # Attach numpy array references to shared memory.
+        self._attach_slots()
+        # Per slot state and publishing order, shared between processes. All
+        # state changes happen while holding the condition's lock.
+        self.slot_states = Array('b', [SLOT_FREE]*slot_count)
+        self.slot_sequence = Array('q', [0]*slot_count)
+        # Consumers that have not released each published slot yet.
+        self.slot_refcounts = Array('i', [0]*slot_count, lock=False)
+        # Consumers that have not acquired each published slot yet.
+        self.slot_pending_acquires = Array('i', [0]*slot_count, lock=False)
+        self.slot_changed = Condition(self.slot_states.get_lock())
+        self._sequence = Value('q', 0, lock=False)
+        self._high_water_mark = Value('i', 0, lock=False)
+        # Create flag to indicate if data has been read out from the read buf.
+        self.is_read = Event()
+        self.is_read.clear()
+        # Initialize buffer index
+        self.buffer_index = -1
+        # Claim the first write slot. The read slot starts out as an empty
+        # neighbouring slot, mirroring the zeroed read buffer of a double buffer.
+        self.write_index = self._claim_free_slot(timeout=0)
+        self.read_index = (self.write_index - 1) % slot_count
+        # Read slot published without consumer count, freed on the next toggle.
+        self._unreleased_index = None
+        # Sequence number of the slot last acquired through this copy of the
+        # ring, i.e. by the consumer process holding it.
+        self._acquired_sequence = 0
+
+    def _attach_slots(self):
+        self.slot_bufs = [np.ndarray(self.shape, dtype=self.dtype, buffer=mem.buf)
+                          for mem in self.mem_blocks]
+
+    def __getstate__(self):
+        # Never pickle the numpy views; they would be copied by value.
+        state = self.__dict__.copy()
+        del state['slot_bufs']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach_slots()
+
+    @property
+    def write_buf(self):
+        return self.slot_bufs[self.write_index]
+
+    @property
+    def read_buf(self):
+        return self.slot_bufs[self.read_index]
+
+    @property
+    def write_buf_mem_name(self):
+        return self.slot_mem_names[self.write_index]
+
+    @property
+    def read_buf_mem_name(self):
+        return self.slot_mem_names[self.read_index]
+
+    @property
+    def occupancy(self):
+        """Number of slots currently not free."""
+        with self.slot_changed:
+            return sum(1 for state in self.slot_states if state != SLOT_FREE)
+
+    @property
+    def high_water_mark(self):
+        """Largest number of slots simultaneously in use since the last reset."""
+        return self._high_water_mark.value
+
+    def reset_high_water_mark(self):
+        with self.slot_changed:
+            self._high_water_mark.value = self._occupancy()
+
+    def _occupancy(self):
+        return sum(1 for state in self.slot_states if state != SLOT_FREE)
+
+    def _claim_free_slot(self, timeout: float = None):
+        """Mark the next free slot after the current write slot as filling.
+        Blocks until a consumer releases a slot if none are free."""
+        with self.slot_changed:
+            start = getattr(self, 'write_index', -1) + 1
+            for offset in range(self.slot_count):
+                index = (start + offset) % self.slot_count
+                if self.slot_states[index] == SLOT_FREE:
+                    break
+            else:
+                index = None
+            if index is None:
+                found = self.slot_changed.wait_for(
+                    lambda: SLOT_FREE in self.slot_states[:], timeout=timeout)
+                if not found:
+                    raise TimeoutError(f'no free slot in ring buffer after {timeout} [s]')
+                index = self.slot_states[:].index(SLOT_FREE)
+            self.slot_states[index] = SLOT_FILLING
+            self._high_water_mark.value = max(self._high_water_mark.value, self._occupancy())
+        return index
+
+    def toggle_buffers(self, timeout: float = None, consumer_count: int = None):
+        """Publish the write slot to consumers and claim the next free slot for
+        writing. The published slot becomes the read buffer.
+
+        :param timeout: time to wait for a free slot, None waits forever
+        :param consumer_count: number of releases after which the published
+            slot is free again. If None, the slot is not released but freed
+            on the next toggle, as the read buffer of SharedDoubleBuffer.
+        """
+        if consumer_count is not None and consumer_count < 1:
+            raise ValueError(f'consumer count must be >= 1 but is {consumer_count}')
+        # Reset buffer index
+        self.buffer_index = -1
+        with self.slot_changed:
+            if self._unreleased_index is not None \
+                    and self.slot_states[self._unreleased_index] in (SLOT_READY, SLOT_CONSUMING):
+                self.slot_states[self._unreleased_index] = SLOT_FREE
+                self.slot_refcounts[self._unreleased_index] = 0
+            self._unreleased_index = self.write_index if consumer_count is None else None
+            self.slot_refcounts[self.write_index] = 0 if consumer_count is None else consumer_count
+            self.slot_pending_acquires[self.write_index] = 1 if consumer_count is None else consumer_count
+            self._sequence.value += 1
+            self.slot_sequence[self.write_index] = self._sequence.value
+            self.slot_states[self.write_index] = SLOT_READY
+            self.read_index = self.write_index
+            self.slot_changed.notify_all()
+        self.write_index = self._claim_free_slot(timeout=timeout)
+
+    def _ready_slots(self):
+        """Published slots this consumer has not acquired yet."""
+        return [index for index, state in enumerate(self.slot_states)
+                if state == SLOT_READY and self.slot_sequence[index] > self._acquired_sequence]
+
+    def acquire_ready(self, timeout: float = None):
+        """Claim the oldest published slot this consumer has not acquired yet
+        and return its index. Each consumer process holds its own copy of the
+        ring and acquires every slot once. A slot stays ready until every
+        consumer it was published to acquired it.
+        Returns None if no slot was published within the timeout."""
+        with self.slot_changed:
+            if not self.slot_changed.wait_for(self._ready_slots, timeout=timeout):
+                return None
+            index = min(self._ready_slots(), key=lambda i: self.slot_sequence[i])
+            self._acquired_sequence = self.slot_sequence[index]
+            self.slot_pending_acquires[index] -= 1
+            if self.slot_pending_acquires[index] <= 0:
+                self.slot_states[index] = SLOT_CONSUMING
+        return index
+
+    def release(self, slot):
+        """Release a consumed slot. The slot returns to the pool of free slots
+        once every consumer it was published to has released it.
+
+        :param slot: slot index or shared memory name of the slot
+        """
+        index = self.slot_mem_names.index(slot) if isinstance(slot, str) else slot
+        with self.slot_changed:
+            if self.slot_states[index] not in (SLOT_READY, SLOT_CONSUMING):
+                raise ValueError(f'slot {index} is not published')
+            self.slot_refcounts[index] -= 1
+            if self.slot_refcounts[index] <= 0:
+                self.slot_refcounts[index] = 0
+                self.slot_states[index] = SLOT_FREE
+                self.slot_changed.notify_all()
+
+    def add_image(self, image):
+        self.write_buf[self.buffer_index+1] = image
+        self.buffer_index += 1
+
+    def get_last_image(self):
+        if self.buffer_index == -1:
+            # buffer just switched, grab last image from read buffer
+            return self.read_buf[-1]
+        else:
+            # return the image from the write buffer
+            return self.write_buf[self.buffer_index]
+
+    def close_and_unlink(self):
+        """Shared memory cleanup; call when done using this object."""
+        self.slot_bufs = []
+        for mem in self.mem_blocks:
+            mem.close()
+            mem.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Cleanup called automatically if opened using a `with` statement."""
+        self.close_and_unlink()
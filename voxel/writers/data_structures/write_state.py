@@ -0,0 +1,92 @@
+import numpy as np
+from multiprocessing import Array
+
+# Number of most recent chunk latencies kept for the percentiles.
+LATENCY_WINDOW = 1024
+
+CHUNKS, BYTES_IN, BYTES_OUT, WAIT_TIME_S, WRITE_TIME_S, TILE_BYTES_OUT, TILE_OUTPUT_START, BYTES_ELIDED = range(8)
+
+
+class WriteState:
+    """Throughput and latency statistics of a writer process. The counters
+    live in shared memory, so the writer process updates them while the
+    acquisition process reads them."""
+
+    def __init__(self):
+        """
+
+        .. code-block: python
+
+            state = WriteState()
+
+            # in the writer process
+            state.start_tile(output_nbytes)
+            state.record_chunk(bytes_in, wait_time_s, write_time_s, output_nbytes, bytes_elided)
+            state.finish_tile(output_nbytes)
+
+            # in any process
+            state.snapshot()
+
+        """
+        self._counters = Array('d', 8)
+        self._latencies = Array('d', LATENCY_WINDOW)
+
+    def start_tile(self, output_nbytes: int):
+        """Mark the size of the output before the tile is written, so output
+        that already existed is not counted."""
+        with self._counters.get_lock():
+            self._counters[TILE_OUTPUT_START] = output_nbytes
+            self._counters[TILE_BYTES_OUT] = 0
+
+    def record_chunk(self, bytes_in: int, wait_time_s: float, write_time_s: float, output_nbytes: int,
+                     bytes_elided: int = 0):
+        """Add one written chunk.
+
+        :param bytes_in: bytes of frames in the chunk
+        :param wait_time_s: time spent waiting for the chunk
+        :param write_time_s: time spent writing the chunk
+        :param output_nbytes: current size of the output on disk, None if
+            it is only counted when the tile finishes
+        :param bytes_elided: bytes of blank blocks that were not stored
+        """
+        with self._counters.get_lock():
+            self._latencies[int(self._counters[CHUNKS]) % LATENCY_WINDOW] = write_time_s
+            self._counters[CHUNKS] += 1
+            self._counters[BYTES_IN] += bytes_in
+            self._counters[WAIT_TIME_S] += wait_time_s
+            self._counters[WRITE_TIME_S] += write_time_s
+            self._counters[BYTES_ELIDED] += bytes_elided
+            if output_nbytes is not None:
+                self._update_bytes_out(output_nbytes)
+
+    def finish_tile(self, output_nbytes: int):
+        """Count output that was flushed after the last chunk."""
+        with self._counters.get_lock():
+            self._update_bytes_out(output_nbytes)
+
+    def _update_bytes_out(self, output_nbytes: int):
+        tile_bytes_out = max(0, output_nbytes - self._counters[TILE_OUTPUT_START])
+        self._counters[BYTES_OUT] += tile_bytes_out - self._counters[TILE_BYTES_OUT]
+        self._counters[TILE_BYTES_OUT] = tile_bytes_out
+
+    def snapshot(self):
+        with self._counters.get_lock():
+            counters = self._counters[:]
+            latencies = np.array(self._latencies[:min(int(counters[CHUNKS]), LATENCY_WINDOW)])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (0, 0, 0)
+        busy_time_s = counters[WAIT_TIME_S] + counters[WRITE_TIME_S]
+        return {
+            'Chunks written': int(counters[CHUNKS]),
+            'Bytes in [MB]': counters[BYTES_IN]/1e6,
+            'Bytes out [MB]': counters[BYTES_OUT]/1e6,
+            'Tile bytes out [MB]': counters[TILE_BYTES_OUT]/1e6,
+            'Bytes elided [MB]': counters[BYTES_ELIDED]/1e6,
+            'Rate [MB/s]': counters[BYTES_IN]/1e6/counters[WRITE_TIME_S] if counters[WRITE_TIME_S] else 0,
+            'Compression ratio': counters[BYTES_IN]/counters[BYTES_OUT] if counters[BYTES_OUT] else 0,
+            'Latency p50 [s]': float(p50),
+            'Latency p95 [s]': float(p95),
+            'Latency p99 [s]': float(p99),
+            'Wait time [s]': counters[WAIT_TIME_S],
+            'Write time [s]': counters[WRITE_TIME_S],
+            'Writing [%]': 100*counters[WRITE_TIME_S]/busy_time_s if busy_time_s else 0
+        }
@@ -0,0 +1,595 @@
+import numpy as np
+import logging
+import json
+import mmap
+import os
+from voxel.writers.base import BaseWriter
+from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+from multiprocessing import Array, Value, Event, Pipe
+from ctypes import c_wchar
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from math import ceil
+
+CHUNK_COUNT_PX = 64
+
+# Every chunk starts on a block boundary of the file, as needed for O_DIRECT.
+ALIGNMENT_BYTES = 4096
+# Largest single write call.
+WRITE_SIZE_BYTES = 64*1024**2
+
+# Sidecar index next to the raw file, one json line per chunk.
+INDEX_SUFFIX = '.index.jsonl'
+
+COMPRESSION_TYPES = {
+    "none": None
+}
+
+DATA_TYPES = {
+    "uint8",
+    "uint16"
+}
+
+
+def index_path(filepath: str):
+    """Path of the sidecar index of a firehose file."""
+    filepath = Path(filepath)
+    return filepath.with_name(f"{filepath.stem}{INDEX_SUFFIX}")
+
+
+def read_index(filepath: str):
+    """Read the sidecar index of a firehose file.
+
+    :param filepath: path of the firehose .raw file
+    :return: list with one dict per chunk with the tile position, channel,
+        z range, byte offset, shape, data type and voxel size of the chunk
+    """
+    with open(index_path(filepath), 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def stack_keys(filepath: str):
+    """(tile, channel) keys of all stacks in a firehose file, in the order
+    they were written. tile is the (x, y, z) tile position in [mm]."""
+    keys = dict()
+    for entry in read_index(filepath):
+        keys[(tuple(entry['tile']), entry['channel'])] = None
+    return list(keys)
+
+
+def memmap_stack(filepath: str, tile: tuple, channel: str):
+    """Memory map one stack of a firehose file.
+
+    :param filepath: path of the firehose .raw file
+    :param tile: (x, y, z) tile position in [mm] of the stack
+    :param channel: channel name of the stack
+    :return: read only (z, y, x) array. Stacks whose chunks are not stored
+        back to back are copied into memory.
+    """
+    entries = sorted((entry for entry in read_index(filepath)
+                      if tuple(entry['tile']) == tuple(tile) and entry['channel'] == channel),
+                     key=lambda entry: entry['z_range'][0])
+    if not entries:
+        raise ValueError(f"no stack for tile {tile} and channel {channel} in {filepath}.")
+    chunks = [np.memmap(filepath, dtype=entry['dtype'], mode='r',
+                        offset=entry['offset'], shape=tuple(entry['shape']))
+              for entry in entries]
+    contiguous = all(entry['offset'] + chunk.nbytes == next_entry['offset']
+                     for entry, chunk, next_entry in zip(entries, chunks, entries[1:]))
+    if contiguous:
+        frame_count_px = sum(chunk.shape[0] for chunk in chunks)
+        return np.memmap(filepath, dtype=entries[0]['dtype'], mode='r', offset=entries[0]['offset'],
+                         shape=(frame_count_px, *entries[0]['shape'][1:]))
+    return np.concatenate(chunks)
+
+
+class Writer(BaseWriter):
+    """Uncompressed writer that appends every chunk to one preallocated raw
+    file with large block aligned writes, optionally bypassing the page cache
+    with O_DIRECT. All tiles of an acquisition go into the same file and a
+    sidecar index records where each chunk is stored, so stacks can be memory
+    mapped back with memmap_stack or converted with Converter."""
+
+    def __init__(self, path: str):
+
+        super().__init__()
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._path = Path(path)
+        self._color = None
+        self._channel = None
+        self._filename = None
+        self._acquisition_name = Path()
+        self._data_type = 'uint16'
+        self._compression = COMPRESSION_TYPES["none"]
+        # Bypass the page cache, falls back to buffered writes if the file
+        # system does not support it.
+        self._direct_io = False
+        # Size the file grows by whenever it is full.
+        self._preallocation_gb = 16
+        self._row_count_px = None
+        self._column_count_px = None
+        self._frame_count_px = None
+        self._x_voxel_size_um = 1
+        self._y_voxel_size_um = 1
+        self._z_voxel_size_um = 1
+        self._x_position_mm = 0
+        self._y_position_mm = 0
+        self._z_position_mm = 0
+        self._theta_deg = 0
+        # Opinioated decision on chunking dimension order
+        self.chunk_dim_order = ('z', 'y', 'x')
+        # Flow control attributes to synchronize inter-process communication.
+        self.done_reading = Event()
+        self.done_reading.set()  # Set after processing all data in shared mem.
+        self.deallocating = Event()
+        # Shared progress of the current tile, written by the writer process.
+        self.progress = Value('d', 0.0)
+        # Pipe carrying the shared memory name of each filled chunk. The
+        # writer process blocks on it instead of polling done_reading.
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
+
+    @property
+    def signal_progress_percent(self):
+        # convert to %
+        state = {'Progress [%]': self.progress.value*100}
+        return state
+
+    @property
+    def x_voxel_size_um(self):
+        return self._x_voxel_size_um
+
+    @x_voxel_size_um.setter
+    def x_voxel_size_um(self, x_voxel_size_um: float):
+        self.log.info(f'setting x voxel size to: {x_voxel_size_um} [um]')
+        self._x_voxel_size_um = x_voxel_size_um
+
+    @property
+    def y_voxel_size_um(self):
+        return self._y_voxel_size_um
+
+    @y_voxel_size_um.setter
+    def y_voxel_size_um(self, y_voxel_size_um: float):
+        self.log.info(f'setting y voxel size to: {y_voxel_size_um} [um]')
+        self._y_voxel_size_um = y_voxel_size_um
+
+    @property
+    def z_voxel_size_um(self):
+        return self._z_voxel_size_um
+
+    @z_voxel_size_um.setter
+    def z_voxel_size_um(self, z_voxel_size_um: float):
+        self.log.info(f'setting z voxel size to: {z_voxel_size_um} [um]')
+        self._z_voxel_size_um = z_voxel_size_um
+
+    @property
+    def x_position_mm(self):
+        return self._x_position_mm
+
+    @x_position_mm.setter
+    def x_position_mm(self, x_position_mm: float):
+        self.log.info(f'setting x position to: {x_position_mm} [mm]')
+        self._x_position_mm = x_position_mm
+
+    @property
+    def y_position_mm(self):
+        return self._y_position_mm
+
+    @y_position_mm.setter
+    def y_position_mm(self, y_position_mm: float):
+        self.log.info(f'setting y position to: {y_position_mm} [mm]')
+        self._y_position_mm = y_position_mm
+
+    @property
+    def z_position_mm(self):
+        return self._z_position_mm
+
+    @z_position_mm.setter
+    def z_position_mm(self, z_position_mm: float):
+        self.log.info(f'setting z position to: {z_position_mm} [mm]')
+        self._z_position_mm = z_position_mm
+
+    @property
+    def theta_deg(self):
+        return self._theta_deg
+
+    @theta_deg.setter
+    def theta_deg(self, theta_deg: float):
+        self.log.info(f'setting theta to: {theta_deg} [deg]')
+        self._theta_deg = theta_deg
+
+    @property
+    def frame_count_px(self):
+        return self._frame_count_px
+
+    @frame_count_px.setter
+    def frame_count_px(self, frame_count_px: int):
+        self.log.info(f'setting frame count to: {frame_count_px} [px]')
+        self._frame_count_px = frame_count_px
+
+    @property
+    def column_count_px(self):
+        return self._column_count_px
+
+    @column_count_px.setter
+    def column_count_px(self, column_count_px: int):
+        self.log.info(f'setting column count to: {column_count_px} [px]')
+        self._column_count_px = column_count_px
+
+    @property
+    def row_count_px(self):
+        return self._row_count_px
+
+    @row_count_px.setter
+    def row_count_px(self, row_count_px: int):
+        self.log.info(f'setting row count to: {row_count_px} [px]')
+        self._row_count_px = row_count_px
+
+    @property
+    def chunk_count_px(self):
+        return CHUNK_COUNT_PX
+
+    @property
+    def compression(self):
+        return next(key for key, value in COMPRESSION_TYPES.items() if value == self._compression)
+
+    @compression.setter
+    def compression(self, compression: str):
+        valid = list(COMPRESSION_TYPES.keys())
+        if compression not in valid:
+            raise ValueError("compression type must be one of %r." % valid)
+        self.log.info(f'setting compression mode to: {compression}')
+        self._compression = COMPRESSION_TYPES[compression]
+
+    @property
+    def direct_io(self):
+        return self._direct_io
+
+    @direct_io.setter
+    def direct_io(self, direct_io: bool):
+        self.log.info(f'setting direct io to: {direct_io}')
+        self._direct_io = bool(direct_io)
+
+    @property
+    def preallocation_gb(self):
+        return self._preallocation_gb
+
+    @preallocation_gb.setter
+    def preallocation_gb(self, preallocation_gb: float):
+        if preallocation_gb <= 0:
+            raise ValueError("preallocation must be > 0 [GB].")
+        self.log.info(f'setting preallocation to: {preallocation_gb} [GB]')
+        self._preallocation_gb = preallocation_gb
+
+    @property
+    def data_type(self):
+        return self._data_type
+
+    @data_type.setter
+    def data_type(self, data_type: np.unsignedinteger):
+        valid = list(DATA_TYPES)
+        if data_type not in valid:
+            raise ValueError("data type must be one of %r." % valid)
+        self.log.info(f'setting data type to: {data_type}')
+        self._data_type = data_type
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def acquisition_name(self):
+        return self._acquisition_name
+
+    @acquisition_name.setter
+    def acquisition_name(self, acquisition_name: str):
+        self._acquisition_name = Path(acquisition_name)
+        self.log.info(f'setting acquisition name to: {acquisition_name}')
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename: str):
+        self._filename = filename \
+            if filename.endswith(".raw") else f"{filename}.raw"
+        self.log.info(f'setting filename to: {filename}')
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @channel.setter
+    def channel(self, channel: str):
+        self.log.info(f'setting channel name to: {channel}')
+        self._channel = channel
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color: str):
+        self.log.info(f'setting color to: {color}')
+        self._color = color
+
+    @property
+    def shm_name(self):
+        """Convenience getter to extract the shared memory address (string)
+        from the c array."""
+        return str(self._shm_name[:]).split('\x00')[0]
+
+    @shm_name.setter
+    def shm_name(self, name: str):
+        """Convenience setter to set the string value within the c array."""
+        for i, c in enumerate(name):
+            self._shm_name[i] = c
+        self._shm_name[len(name)] = '\x00'  # Null terminate the string.
+        self.log.info(f'setting shared memory to: {name}')
+
+    def submit_chunk(self, shm_name: str):
+        """Hand a filled chunk in shared memory to the writer process."""
+        self.shm_name = shm_name
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
+
+    def prepare(self):
+        self.progress.value = 0.0
+        # the writer process is spawned once and reused for every tile
+        self._start_service()
+        # Specs for reconstructing the shared memory object.
+        self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
+        # This is almost always going to be: (chunk_size, rows, columns).
+        chunk_shape_map = {'x': self._column_count_px,
+           'y': self._row_count_px,
+           'z': CHUNK_COUNT_PX}
+        self.shm_shape = [chunk_shape_map[x] for x in self.chunk_dim_order]
+        self.shm_nbytes = \
+            int(np.prod(self.shm_shape, dtype=np.int64)*np.dtype(self._data_type).itemsize)
+        self.log.info(f"{self._filename}: intializing writer.")
+
+    def _sample_codec(self):
+        """Chunks are written uncompressed."""
+        return 'none', dict()
+
+    def start(self):
+        self.log.info(f"{self._filename}: starting writer.")
+        self._submit_job()
+
+    def _run(self):
+        """Loop to wait for data from a specified location and append it to
+        the raw file. The file stays open across tiles.
+
+        This function executes when called with the start() method.
+        """
+        # internal logger for process, configured once in _serve
+        logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        # the raw file is process state and never part of a job
+        if getattr(self, '_raw_file', None) is None or self._raw_file['path'] != filepath:
+            self._shutdown()
+            self._open_raw_file(filepath)
+        frame_nbytes = self._row_count_px*self._column_count_px*np.dtype(self._data_type).itemsize
+        chunk_total = ceil(self._frame_count_px/CHUNK_COUNT_PX)
+        for chunk_num in range(chunk_total):
+            # Block until the next chunk is handed off.
+            wait_start_time = perf_counter()
+            shm_name = self._receive_chunk()
+            # Each shared memory segment is attached only once per process.
+            shm = self._attach_shm(shm_name)
+            z_start = chunk_num*CHUNK_COUNT_PX
+            frame_count_px = min(CHUNK_COUNT_PX, self._frame_count_px - z_start)
+            nbytes = frame_count_px*frame_nbytes
+            logger.warning(f"{self._filename}: writing chunk "
+                  f"{chunk_num+1}/{chunk_total} of size {frame_count_px} frames.")
+            start_time = perf_counter()
+            offset = self._append(shm.buf[:nbytes])
+            entry = {
+                'tile': [self._x_position_mm, self._y_position_mm, self._z_position_mm],
+                'channel': self._channel,
+                'z_range': [z_start, z_start + frame_count_px],
+                'offset': offset,
+                'shape': [frame_count_px, self._row_count_px, self._column_count_px],
+                'dtype': self._data_type,
+                'voxel_size_um': [self._x_voxel_size_um, self._y_voxel_size_um, self._z_voxel_size_um]
+            }
+            self._raw_file['index'].write(json.dumps(entry) + '\n')
+            self._raw_file['index'].flush()
+            logger.warning(f"{self._filename}: writing chunk took "
+                  f"{perf_counter() - start_time:.3f} [s]")
+            self.done_reading.set()
+            self._write_state.record_chunk(nbytes, start_time - wait_start_time,
+                                           perf_counter() - start_time, self._output_nbytes())
+            self.progress.value = (chunk_num+1)/chunk_total
+
+    def _open_raw_file(self, filepath: Path):
+        """Open the raw file for appending, after the chunks already listed in
+        its index if it exists."""
+        logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        offset = 0
+        if index_path(filepath).exists():
+            for entry in read_index(filepath):
+                nbytes = int(np.prod(entry['shape'], dtype=np.int64)*np.dtype(entry['dtype']).itemsize)
+                offset = max(offset, entry['offset'] + ceil(nbytes/ALIGNMENT_BYTES)*ALIGNMENT_BYTES)
+        flags = os.O_WRONLY | os.O_CREAT
+        fd = None
+        if self._direct_io:
+            try:
+                fd = os.open(filepath, flags | getattr(os, 'O_DIRECT', 0))
+            except OSError as e:
+                logger.warning(f"{self._filename}: O_DIRECT not supported, using buffered writes. {e}")
+        if fd is None:
+            fd = os.open(filepath, flags)
+        # block aligned scratch buffer for padding the last block of a chunk
+        tail = mmap.mmap(-1, ALIGNMENT_BYTES)
+        self._raw_file = {
+            'path': filepath,
+            'fd': fd,
+            'offset': offset,
+            'capacity': os.fstat(fd).st_size,
+            'tail': tail,
+            'index': open(index_path(filepath), 'a')
+        }
+
+    def _append(self, buffer: memoryview):
+        """Write a buffer at the end of the raw file and return its offset.
+        The last partial block is zero padded so every write stays block
+        aligned."""
+        raw_file = self._raw_file
+        nbytes = len(buffer)
+        offset = raw_file['offset']
+        aligned_nbytes = ceil(nbytes/ALIGNMENT_BYTES)*ALIGNMENT_BYTES
+        if offset + aligned_nbytes > raw_file['capacity']:
+            # grow the file in large steps to keep it contiguous on disk
+            capacity = offset + aligned_nbytes + int(self._preallocation_gb*1024**3)
+            try:
+                os.posix_fallocate(raw_file['fd'], raw_file['capacity'], capacity - raw_file['capacity'])
+            except (AttributeError, OSError):
+                os.ftruncate(raw_file['fd'], capacity)
+            raw_file['capacity'] = capacity
+        head_nbytes = nbytes // ALIGNMENT_BYTES * ALIGNMENT_BYTES
+        for start in range(0, head_nbytes, WRITE_SIZE_BYTES):
+            self._pwrite(buffer[start:min(start + WRITE_SIZE_BYTES, head_nbytes)], offset + start)
+        if head_nbytes < nbytes:
+            tail = raw_file['tail']
+            tail[:] = bytes(ALIGNMENT_BYTES)
+            tail[:nbytes - head_nbytes] = buffer[head_nbytes:]
+            self._pwrite(memoryview(tail), offset + head_nbytes)
+        raw_file['offset'] = offset + aligned_nbytes
+        return offset
+
+    def _pwrite(self, buffer: memoryview, offset: int):
+        while len(buffer):
+            written = os.pwrite(self._raw_file['fd'], buffer, offset)
+            buffer = buffer[written:]
+            offset += written
+
+    def _output_nbytes(self):
+        """Bytes appended so far, the file itself is preallocated."""
+        raw_file = getattr(self, '_raw_file', None)
+        return 0 if raw_file is None else raw_file['offset']
+
+    def _shutdown(self):
+        """Trim the unused preallocated space and close the raw file."""
+        raw_file = getattr(self, '_raw_file', None)
+        if raw_file is not None:
+            os.ftruncate(raw_file['fd'], raw_file['offset'])
+            os.close(raw_file['fd'])
+            raw_file['tail'].close()
+            raw_file['index'].close()
+            self._raw_file = None
+
+    def wait_to_finish(self):
+        self.log.info(f"{self._filename}: waiting to finish.")
+        self._wait_for_tile()
+        # log the finished writer %
+        self.signal_progress_percent
+
+    def close(self):
+        self.log.info(f"{self._filename}: closing writer process.")
+        self._stop_service()
+
+    def delete_files(self):
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        os.remove(filepath)
+        os.remove(index_path(filepath))
+
+
+class Converter:
+    """Background converter of firehose stacks into another format. Stacks
+    are queued after their tile completes and fed chunk by chunk through a
+    regular writer on a thread, so compression runs in that writer's process
+    and stays off the acquisition's critical path."""
+
+    def __init__(self, writer: BaseWriter):
+        """
+
+        :param writer: configured TIFF, BDV, Zarr or Imaris writer the stacks
+            are written with
+
+        .. code-block: python
+
+            converter = Converter(tiff_writer)
+            # after each tile
+            converter.convert(raw_filepath, tile, channel, filename='tile_0_488')
+            ...
+            converter.wait_to_finish()
+            converter.close()
+
+        """
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.writer = writer
+        self._stacks = Queue()
+        self._buffer = None
+        self._thread = Thread(target=self._convert_stacks, daemon=True)
+        self._thread.start()
+
+    def convert(self, filepath: str, tile: tuple, channel: str, filename: str):
+        """Queue one stack of a firehose file for conversion.
+
+        :param filepath: path of the firehose .raw file
+        :param tile: (x, y, z) tile position in [mm] of the stack
+        :param channel: channel name of the stack
+        :param filename: filename of the converted stack
+        """
+        self.log.info(f"queueing conversion of tile {tile} channel {channel} to {filename}")
+        self._stacks.put((filepath, tuple(tile), channel, filename))
+
+    def wait_to_finish(self):
+        """Block until all queued stacks are converted."""
+        self._stacks.join()
+
+    def close(self):
+        self._stacks.put(None)
+        self._thread.join()
+        if self._buffer is not None:
+            self._buffer.close_and_unlink()
+            self._buffer = None
+        self.writer.close()
+
+    def _convert_stacks(self):
+        while True:
+            stack = self._stacks.get()
+            try:
+                if stack is None:
+                    break
+                self._convert_stack(*stack)
+            except Exception:
+                self.log.exception(f"converting {stack} failed.")
+            finally:
+                self._stacks.task_done()
+
+    def _convert_stack(self, filepath: str, tile: tuple, channel: str, filename: str):
+        start_time = perf_counter()
+        entry = next(entry for entry in read_index(filepath)
+                     if tuple(entry['tile']) == tile and entry['channel'] == channel)
+        stack = memmap_stack(filepath, tile, channel)
+        writer = self.writer
+        writer.row_count_px = stack.shape[1]
+        writer.column_count_px = stack.shape[2]
+        writer.frame_count_px = stack.shape[0]
+        writer.data_type = entry['dtype']
+        writer.channel = channel
+        writer.x_position_mm, writer.y_position_mm, writer.z_position_mm = tile
+        writer.x_voxel_size_um, writer.y_voxel_size_um, writer.z_voxel_size_um = entry['voxel_size_um']
+        writer.filename = filename
+        writer.prepare()
+        writer.start()
+        chunk_shape = (writer.chunk_count_px, stack.shape[1], stack.shape[2])
+        if self._buffer is None or self._buffer.shape != chunk_shape or self._buffer.dtype != entry['dtype']:
+            if self._buffer is not None:
+                self._buffer.close_and_unlink()
+            self._buffer = SharedDoubleBuffer(chunk_shape, dtype=entry['dtype'])
+        for z_start in range(0, stack.shape[0], writer.chunk_count_px):
+            frames = stack[z_start:z_start + writer.chunk_count_px]
+            self._buffer.write_buf[:frames.shape[0]] = frames
+            # the last chunk may be partial, zero the frames of the previous chunk
+            self._buffer.write_buf[frames.shape[0]:] = 0
+            writer.done_reading.wait()
+            self._buffer.toggle_buffers()
+            writer.submit_chunk(self._buffer.read_buf_mem_name)
+        writer.wait_to_finish()
+        self.log.info(f"converted tile {tile} channel {channel} to {filename} "
+                      f"in {perf_counter() - start_time:.3f} [s]")
@@ -4,8 +4,11 @@ import multiprocessing
 import re
 import os
 import sys
+import json
+import socket
+import tempfile
 from voxel.writers.base import BaseWriter
-from multiprocessing import Process, Array, Event
+from multiprocessing import Process, Array, Event, Pipe
 from multiprocessing.shared_memory import SharedMemory
 from ctypes import c_wchar
 from PyImarisWriter import PyImarisWriter as pw
@@ -14,6 +17,7 @@ from datetime import datetime
 from matplotlib.colors import hex2color
 from time import sleep, perf_counter
 from math import ceil
+from itertools import product
 from voxel.descriptors.deliminated_property import DeliminatedProperty
 
 CHUNK_COUNT_PX = 64
@@ -29,6 +33,18 @@ DATA_TYPES = [
     "uint16"
 ]
 
+# per host calibration profile with the fastest block shape and thread count
+PROFILE_PATH = Path.home() / '.voxel' / 'imaris_profile.json'
+
+# (z, y, x) block shapes tried during calibration, None is the full frame
+CALIBRATION_BLOCK_SHAPES_PX = [
+    (CHUNK_COUNT_PX, None, None),
+    (CHUNK_COUNT_PX, 1024, 1024),
+    (CHUNK_COUNT_PX, 512, 512),
+    (32, 512, 512),
+    (16, 256, 256)
+]
+
 class ImarisProgressChecker(pw.CallbackClass):
     """Class for tracking progress of an active ImarisWriter disk-writing
     operation."""
@@ -64,6 +80,11 @@ class Writer(BaseWriter):
         self._z_position_mm = 0
         self._theta_deg = 0
         self._channel = None
+        # (z, y, x) block shape and number of threads of the converter. None
+        # uses the calibration profile of this host or the defaults.
+        self._block_shape_px = None
+        self._thread_count = None
+        self._profile_path = PROFILE_PATH
         self.progress = 0
         # Opinioated decision on chunking dimension order
         self.chunk_dim_order = ('z', 'y', 'x')
@@ -71,6 +92,9 @@ class Writer(BaseWriter):
         self.done_reading = Event()
         self.done_reading.set()  # Set after processing all data in shared mem.
         self.deallocating = Event()
+        # Pipe carrying the shared memory name of each filled chunk. The
+        # writer process blocks on it instead of polling done_reading.
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
         # Internal flow control attributes to monitor compression progress.
         self.callback_class = ImarisProgressChecker()
 
@@ -186,6 +210,43 @@ class Writer(BaseWriter):
         self.log.info(f'setting compression mode to: {compression}')
         self._compression = COMPRESSION_TYPES[compression]
 
+    @property
+    def block_shape_px(self):
+        return self._block_shape_px
+
+    @block_shape_px.setter
+    def block_shape_px(self, block_shape_px: tuple):
+        if block_shape_px is not None:
+            block_shape_px = tuple(block_shape_px)
+            if len(block_shape_px) != 3:
+                raise ValueError("block shape must be (z, y, x) but is %r." % (block_shape_px,))
+            if CHUNK_COUNT_PX % block_shape_px[0]:
+                raise ValueError(f"block z size must divide the chunk size of {CHUNK_COUNT_PX} [px].")
+            if any(size is not None and size < 1 for size in block_shape_px):
+                raise ValueError("block sizes must be >= 1 but are %r." % (block_shape_px,))
+        self.log.info(f'setting block shape to: {block_shape_px} [px]')
+        self._block_shape_px = block_shape_px
+
+    @property
+    def thread_count(self):
+        return self._thread_count
+
+    @thread_count.setter
+    def thread_count(self, thread_count: int):
+        if thread_count is not None and thread_count < 1:
+            raise ValueError("thread count must be >= 1.")
+        self.log.info(f'setting thread count to: {thread_count}')
+        self._thread_count = thread_count
+
+    @property
+    def profile_path(self):
+        return self._profile_path
+
+    @profile_path.setter
+    def profile_path(self, profile_path: str):
+        self.log.info(f'setting calibration profile path to: {profile_path}')
+        self._profile_path = Path(profile_path)
+
     @property
     def data_type(self):
         return self._data_type
@@ -253,8 +314,15 @@ class Writer(BaseWriter):
         self._shm_name[len(name)] = '\x00'  # Null terminate the string.
         self.log.info(f'setting shared memory to: {name}')
 
+    def submit_chunk(self, shm_name: str):
+        """Hand a filled chunk in shared memory to the writer process."""
+        self.shm_name = shm_name
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
+
     def prepare(self):
-        self.p = Process(target=self._run)
+        # the writer process is spawned once and reused for every tile
+        self._start_service()
         # Specs for reconstructing the shared memory object.
         self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
         # This is almost always going to be: (chunk_size, rows, columns).
@@ -267,12 +335,34 @@ class Writer(BaseWriter):
         self.log.info(f"{self._filename}: intializing writer.")
         self.application_name = 'PyImarisWriter'
         self.application_version = '1.0.0'
+        # c = channel, t = time. These fields are unused for now.
+        # Note: ImarisWriter performs MUCH faster when the dimension sequence
+        #   is arranged: x, y, z, c, t.
+        #   It is more efficient to transpose/reshape the data into this
+        #   shape beforehand instead of defining an arbitrary
+        #   DimensionSequence and passing the chunk data in as-is.
+        self.chunk_dim_order = ('z', 'y', 'x')
+        # lookups for deducing order
+        self.dim_map = {'x': 0, 'y': 1, 'z': 2, 'c': 3, 't': 4}
+        # block shape and threads used for this tile
+        self.tile_block_shape_px, self.tile_thread_count = self._tuning()
+        self.log.info(f"{self._filename}: using block shape {self.tile_block_shape_px} [px] "
+                      f"and {self.tile_thread_count} threads.")
+        # color parameters
+        self.adjust_color_range = False
+        # date time parameters
+        self.time_infos = [datetime.today()]
+
+    def _create_converter_settings(self, frame_count_px: int, block_shape_px: tuple, thread_count: int):
+        """Build the PyImarisWriter settings objects for the current tile.
+        These are created inside the writer process from the plain tile
+        settings so they never have to be sent between processes."""
         # voxel size metadata to create the converter
-        image_size_z = int(ceil(self._frame_count_px_px/CHUNK_COUNT_PX)*CHUNK_COUNT_PX)
+        image_size_z = int(ceil(frame_count_px/CHUNK_COUNT_PX)*CHUNK_COUNT_PX)
         self.image_size = pw.ImageSize(x=self._column_count_px, y=self._row_count_px, z=image_size_z,
                           c=1, t=1)
-        self.block_size = pw.ImageSize(x=self._column_count_px, y=self._row_count_px, z=CHUNK_COUNT_PX,
-                                  c=1, t=1)
+        block_z, block_y, block_x = block_shape_px
+        self.block_size = pw.ImageSize(x=block_x, y=block_y, z=block_z, c=1, t=1)
         self.sample_size = pw.ImageSize(x=1, y=1, z=1, c=1, t=1)
         # compute the start/end extremes of the enclosed rectangular solid.
         # (x0, y0, z0) position (in [um]) of the beginning of the first voxel,
@@ -282,39 +372,153 @@ class Writer(BaseWriter):
         z0 = self._z_position_mm
         xf = self._x_position_mm + (self._x_voxel_size_um_um * 0.5 * self._column_count_px)
         yf = self._y_position_mm + (self._y_voxel_size_um_um * 0.5 * self._row_count_px)
-        zf = self._z_position_mm + self._frame_count_px_px * self._z_voxel_size_um_um
+        zf = self._z_position_mm + frame_count_px * self._z_voxel_size_um_um
         self.image_extents = pw.ImageExtents(-x0, -y0, -z0, -xf, -yf, -zf)
-        # c = channel, t = time. These fields are unused for now.
-        # Note: ImarisWriter performs MUCH faster when the dimension sequence
-        #   is arranged: x, y, z, c, t.
-        #   It is more efficient to transpose/reshape the data into this
-        #   shape beforehand instead of defining an arbitrary
-        #   DimensionSequence and passing the chunk data in as-is.
-        self.chunk_dim_order = ('z', 'y', 'x')
         self.dimension_sequence = pw.DimensionSequence('x', 'y', 'z', 'c', 't')
-        # lookups for deducing order
-        self.dim_map = {'x': 0, 'y': 1, 'z': 2, 'c': 3, 't': 4}
         # name parameters
         self.parameters = pw.Parameters()
         self.parameters.set_channel_name(0, self._channel)
         # create options object
         self.opts = pw.Options()
         self.opts.mEnableLogProgress = True
-        # set threads to double number of cores
-        self.thread_count = 2*multiprocessing.cpu_count()
-        self.opts.mNumberOfThreads = self.thread_count
+        self.opts.mNumberOfThreads = thread_count
         # set compression type
         self.opts.mCompressionAlgorithmType = self._compression
         # color parameters
-        self.adjust_color_range = False
         self.color_infos = [pw.ColorInfo()]
         self.color_infos[0].set_base_color(pw.Color(*(*hex2color(self._color), 1.0)))
-        # date time parameters
+        # fresh progress tracking for this tile
+        self.callback_class = ImarisProgressChecker()
+
+    def _tuning(self):
+        """Block shape and thread count for the current frame size. Settings
+        left at None are taken from the calibration profile of this host or
+        default to one full frame block per chunk and two threads per core."""
+        profile = self._load_profile().get(socket.gethostname(), dict()).get(self._profile_key(), dict())
+        block_shape_px = self._block_shape_px
+        if block_shape_px is None:
+            block_shape_px = profile.get('block_shape_px', (CHUNK_COUNT_PX, None, None))
+        thread_count = self._thread_count
+        if thread_count is None:
+            thread_count = profile.get('thread_count', 2*multiprocessing.cpu_count())
+        return self._frame_block_shape(block_shape_px), int(thread_count)
+
+    def _frame_block_shape(self, block_shape_px: tuple):
+        """Fill in full frame block sizes and clip blocks to the frame."""
+        block_z, block_y, block_x = block_shape_px
+        block_y = self._row_count_px if block_y is None else min(int(block_y), self._row_count_px)
+        block_x = self._column_count_px if block_x is None else min(int(block_x), self._column_count_px)
+        return (int(block_z), block_y, block_x)
+
+    def _profile_key(self):
+        return f"{self._row_count_px}x{self._column_count_px} {self._data_type} {self.compression}"
+
+    def _load_profile(self):
+        if not Path(self._profile_path).exists():
+            return dict()
+        with open(self._profile_path, 'r') as f:
+            return json.load(f)
+
+    def calibrate(self, block_shapes_px: list = CALIBRATION_BLOCK_SHAPES_PX,
+                  thread_counts: list = None, chunk_count: int = 2):
+        """Write synthetic chunks of the current frame size, data type and
+        compression with every block shape and thread count and store the
+        fastest combination in the calibration profile of this host. Tiles
+        then use it unless block_shape_px or thread_count are set.
+
+        :param block_shapes_px: (z, y, x) block shapes to try, None is the
+            full frame
+        :param thread_counts: thread counts to try, defaults to a quarter,
+            half, one and two threads per core
+        :param chunk_count: number of chunks written per combination
+        :return: list of (block shape, thread count, rate [MB/s]) tuples,
+            fastest first
+        """
+        cpu_count = multiprocessing.cpu_count()
+        if thread_counts is None:
+            thread_counts = sorted({max(1, cpu_count//4), max(1, cpu_count//2), cpu_count, 2*cpu_count})
+        chunk_shape = (CHUNK_COUNT_PX, self._row_count_px, self._column_count_px)
+        # noisy synthetic frames, reused for every combination
+        frames = np.random.default_rng(0).integers(0, 256, chunk_shape).astype(self._data_type)
+        frame_count_px = chunk_count*CHUNK_COUNT_PX
+        nbytes = chunk_count*frames.nbytes
+        self.dim_map = {'x': 0, 'y': 1, 'z': 2, 'c': 3, 't': 4}
         self.time_infos = [datetime.today()]
+        self.adjust_color_range = False
+        results = list()
+        with tempfile.TemporaryDirectory(dir=self._path) as calibration_dir:
+            for block_shape_px in block_shapes_px:
+                block_shape_px = self._frame_block_shape(block_shape_px)
+                for thread_count in thread_counts:
+                    filepath = Path(calibration_dir, f"calibration_{len(results)}.ims")
+                    start_time = perf_counter()
+                    self._create_converter_settings(frame_count_px, block_shape_px, thread_count)
+                    converter = \
+                        pw.ImageConverter(self._data_type, self.image_size, self.sample_size,
+                                          self.dimension_sequence, self.block_size, str(filepath),
+                                          self.opts, 'PyImarisWriter', '1.0.0', self.callback_class)
+                    for chunk_num in range(chunk_count):
+                        self._copy_chunk(converter, frames, chunk_num, block_shape_px)
+                    while self.callback_class.progress < 1.0:
+                        sleep(0.01)
+                    converter.Finish(self.image_extents, self.parameters, self.time_infos,
+                                     self.color_infos, self.adjust_color_range)
+                    converter.Destroy()
+                    rate_mb_s = nbytes/(perf_counter() - start_time)/1e6
+                    self.log.info(f"calibration: block shape {block_shape_px} [px], "
+                                  f"{thread_count} threads: {rate_mb_s:.1f} [MB/s]")
+                    results.append((block_shape_px, thread_count, rate_mb_s))
+                    os.remove(filepath)
+        results.sort(key=lambda result: result[2], reverse=True)
+        block_shape_px, thread_count, rate_mb_s = results[0]
+        profile = self._load_profile()
+        profile.setdefault(socket.gethostname(), dict())[self._profile_key()] = {
+            'block_shape_px': list(block_shape_px),
+            'thread_count': thread_count,
+            'rate_mb_s': rate_mb_s
+        }
+        Path(self._profile_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self._profile_path, 'w') as f:
+            json.dump(profile, f, indent=2)
+        self.log.info(f"calibration: fastest is block shape {block_shape_px} [px] with "
+                      f"{thread_count} threads at {rate_mb_s:.1f} [MB/s], saved to {self._profile_path}")
+        return results
+
+    def _copy_chunk(self, converter, frames: np.ndarray, chunk_num: int, block_shape_px: tuple):
+        """Copy one chunk of (z, y, x) frames into the converter block by
+        block. Blocks cut off by the frame edges are zero padded."""
+        block_z, block_y, block_x = block_shape_px
+        dim_order = [self.dim_map[x] for x in self.chunk_dim_order]
+        # Put the frames back into x, y, z, c, t order.
+        frames = frames.transpose(dim_order)
+        block_shape = (block_x, block_y, block_z)
+        if frames.shape == block_shape:
+            converter.CopyBlock(frames, pw.ImageSize(x=0, y=0, z=chunk_num, c=0, t=0))
+            return
+        z_block_count = CHUNK_COUNT_PX // block_z
+        for z_block, y_block, x_block in product(range(z_block_count),
+                                                 range(ceil(frames.shape[1]/block_y)),
+                                                 range(ceil(frames.shape[0]/block_x))):
+            block = frames[x_block*block_x:(x_block + 1)*block_x,
+                           y_block*block_y:(y_block + 1)*block_y,
+                           z_block*block_z:(z_block + 1)*block_z]
+            if block.shape != block_shape:
+                padded = np.zeros(block_shape, dtype=frames.dtype)
+                padded[:block.shape[0], :block.shape[1], :block.shape[2]] = block
+                block = padded
+            converter.CopyBlock(block, pw.ImageSize(x=x_block, y=y_block, z=chunk_num*z_block_count + z_block,
+                                                    c=0, t=0))
+
+    def _sample_codec(self):
+        """Name and arguments of the codec in compression_estimator.CODECS
+        that matches the configured compression."""
+        if self._compression == COMPRESSION_TYPES["lz4shuffle"]:
+            return 'lz4shuffle', dict()
+        return 'none', dict()
 
     def start(self):
         self.log.info(f"{self._filename}: starting writer.")
-        self.p.start()
+        self._submit_job()
 
     def _run(self):
         """Loop to wait for data from a specified location and write it to disk
@@ -322,14 +526,9 @@ class Writer(BaseWriter):
 
         This function executes when called with the start() method.
         """
-        # internal logger for process
+        # internal logger for process, configured once in _serve
         logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
-        fmt = '%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s'
-        datefmt = '%Y-%m-%d,%H:%M:%S'
-        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
-        log_handler = logging.StreamHandler(sys.stdout)
-        log_handler.setFormatter(log_formatter)
-        logger.addHandler(log_handler)
+        self._create_converter_settings(self._frame_count_px_px, self.tile_block_shape_px, self.tile_thread_count)
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
         converter = \
             pw.ImageConverter(self._data_type, self.image_size, self.sample_size,
@@ -338,24 +537,22 @@ class Writer(BaseWriter):
                               self.application_version, self.callback_class)
         chunk_total = ceil(self._frame_count_px_px/CHUNK_COUNT_PX)
         for chunk_num in range(chunk_total):
-            block_index = pw.ImageSize(x=0, y=0, z=chunk_num, c=0, t=0)
-            # Wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # Attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=self.shm_nbytes)
+            # Block until the next chunk is handed off.
+            wait_start_time = perf_counter()
+            shm_name = self._receive_chunk()
+            # Each shared memory segment is attached only once per process.
+            shm = self._attach_shm(shm_name)
             frames = np.ndarray(self.shm_shape, self._data_type, buffer=shm.buf)
             logger.warning(f"{self._filename}: writing chunk "
                   f"{chunk_num+1}/{chunk_total} of size {frames.shape}.")
             start_time = perf_counter()
-            dim_order = [self.dim_map[x] for x in self.chunk_dim_order]
-            # Put the frames back into x, y, z, c, t order.
-            converter.CopyBlock(frames.transpose(dim_order), block_index)
+            self._copy_chunk(converter, frames, chunk_num, self.tile_block_shape_px)
             frames = None
             logger.warning(f"{self._filename}: writing chunk took "
                   f"{perf_counter() - start_time:.3f} [s]")
-            shm.close()
             self.done_reading.set()
+            self._write_state.record_chunk(self.shm_nbytes, start_time - wait_start_time,
+                                           perf_counter() - start_time, self._output_nbytes())
 
         # Wait for file writing to finish.
         if self.callback_class.progress < 1.0:
@@ -374,10 +571,14 @@ class Writer(BaseWriter):
 
     def wait_to_finish(self):
         self.log.info(f"{self._filename}: waiting to finish.")
-        self.p.join()
+        self._wait_for_tile()
         # log the finished writer %
         self.signal_progress_percent
 
+    def close(self):
+        self.log.info(f"{self._filename}: closing writer process.")
+        self._stop_service()
+
     def delete_files(self):
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
         os.remove(filepath)
\ No newline at end of file
@@ -0,0 +1,157 @@
+import numpy as np
+import imagecodecs
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# HDF5 filter id of noise codec chunks, from the range HDF5 reserves for
+# unregistered filters. HDF5 itself cannot decode these chunks, they are
+# written with direct chunk writes and decoded by voxel.readers.
+HDF5_FILTER_ID = 511
+
+# HDF5 filter options are unsigned integers, parameters are stored in millionths.
+FILTER_OPTION_SCALE = 10**6
+
+# Chunk header: magic, data type, (z, y, x) shape and the codec parameters,
+# so every chunk decodes on its own.
+HEADER = struct.Struct('<4s8s3I4d')
+MAGIC = b'NAQ1'
+
+DATA_TYPES = [
+    "uint8",
+    "uint16"
+]
+
+
+@lru_cache(maxsize=16)
+def _lookup_tables(data_type: str, gain: float, read_noise: float, background_offset: float, quant_sigma: float):
+    """Encoding table from counts to quantized levels and decoding table
+    from levels back to counts. With the tables, encoding and decoding are
+    a single gather over the frames."""
+    counts = np.arange(np.iinfo(data_type).max + 1, dtype=np.float64)
+    # generalized Anscombe transform, the noise of the transformed values is ~1
+    electrons = (counts - background_offset)/gain
+    transformed = 2*np.sqrt(np.maximum(electrons + 3/8 + read_noise**2, 0))
+    encode_table = np.round(transformed/quant_sigma).astype(np.uint16)
+    levels = np.arange(int(encode_table.max()) + 1, dtype=np.float64)
+    # algebraic inverse of the transform at the center of each level
+    decoded_counts = ((levels*quant_sigma/2)**2 - 3/8 - read_noise**2)*gain + background_offset
+    decode_table = np.clip(np.round(decoded_counts), 0, np.iinfo(data_type).max).astype(data_type)
+    return encode_table, decode_table
+
+
+class NoiseCodec:
+    """Lossy codec that quantizes counts in units of their shot and read
+    noise. A variance stabilizing transform makes the noise independent of
+    the signal, the transformed values are quantized in steps of
+    quant_sigma noise standard deviations, rows are delta coded and the
+    result is compressed with zstd. The error is below the noise of the
+    camera, and dim, noisy data compresses well beyond lossless codecs."""
+
+    def __init__(self, gain: float, read_noise: float, background_offset: float = 0,
+                 quant_sigma: float = 1, level: int = 1, thread_count: int = None):
+        """
+
+        :param gain: camera gain in [ADU/e-]
+        :param read_noise: camera read noise in [e-]
+        :param background_offset: camera offset in [ADU]
+        :param quant_sigma: quantization step in noise standard deviations
+        :param level: zstd compression level
+        :param thread_count: number of threads encoding blocks in encode_blocks()
+
+        .. code-block: python
+
+            codec = NoiseCodec(gain=2.1845, read_noise=1.5)
+            data = codec.encode(block)
+            block = NoiseCodec.decode(data)
+
+        """
+        if gain <= 0 or quant_sigma <= 0:
+            raise ValueError("gain and quantization step must be > 0.")
+        # zigzag coded level differences must fit into 16 bits
+        if 2*np.sqrt(np.iinfo('uint16').max/gain + 3/8 + read_noise**2)/quant_sigma >= 2**14:
+            raise ValueError("quantization step is too small for the gain.")
+        self.gain = gain
+        self.read_noise = read_noise
+        self.background_offset = background_offset
+        self.quant_sigma = quant_sigma
+        self.level = level
+        self._thread_count = thread_count
+        self._pool = None
+
+    @classmethod
+    def from_filter_options(cls, filter_options: tuple, **kwargs):
+        """Codec from the integer HDF5 filter options of filter_options."""
+        quant_sigma, gain, background_offset, read_noise = (option/FILTER_OPTION_SCALE for option in filter_options)
+        return cls(gain=gain, read_noise=read_noise, background_offset=background_offset,
+                   quant_sigma=quant_sigma, **kwargs)
+
+    @property
+    def filter_options(self):
+        """Parameters as HDF5 filter options, which are unsigned integers."""
+        return tuple(int(round(parameter*FILTER_OPTION_SCALE))
+                     for parameter in (self.quant_sigma, self.gain, self.background_offset, self.read_noise))
+
+    def quantize(self, frames: np.ndarray):
+        """Frames as they decode after encoding, without entropy coding.
+        Lossless codecs of other writers compress these far better than the
+        original frames."""
+        encode_table, decode_table = self._tables(frames.dtype)
+        return np.take(decode_table, np.take(encode_table, frames))
+
+    def encode(self, block: np.ndarray):
+        """Encode a (z, y, x) block of uint8 or uint16 counts."""
+        block = np.asarray(block)
+        if block.dtype.name not in DATA_TYPES:
+            raise ValueError("data type must be one of %r." % DATA_TYPES)
+        if block.ndim != 3:
+            raise ValueError("block must be (z, y, x).")
+        encode_table, _ = self._tables(block.dtype)
+        levels = np.take(encode_table, block)
+        # delta along rows, zigzag coded so small differences stay small
+        deltas = np.empty(levels.shape, dtype=np.int16)
+        deltas[..., 0] = levels[..., 0]
+        np.subtract(levels[..., 1:], levels[..., :-1], out=deltas[..., 1:], casting='unsafe')
+        zigzag = ((deltas << 1) ^ (deltas >> 15)).view(np.uint16)
+        # group low and high bytes, the high bytes are almost all zero
+        shuffled = np.ascontiguousarray(zigzag.reshape(-1).view(np.uint8).reshape(-1, 2).T)
+        header = HEADER.pack(MAGIC, block.dtype.name.encode(), *block.shape,
+                             self.gain, self.read_noise, self.background_offset, self.quant_sigma)
+        return header + imagecodecs.zstd_encode(shuffled, level=self.level)
+
+    @staticmethod
+    def decode(data: bytes):
+        """Decode a block encoded by any NoiseCodec."""
+        magic, data_type, z, y, x, gain, read_noise, background_offset, quant_sigma = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("data is not a noise codec block.")
+        data_type = data_type.rstrip(b'\x00').decode()
+        _, decode_table = _lookup_tables(data_type, gain, read_noise, background_offset, quant_sigma)
+        shuffled = np.frombuffer(imagecodecs.zstd_decode(data[HEADER.size:]), dtype=np.uint8)
+        zigzag = np.ascontiguousarray(shuffled.reshape(2, -1).T).view(np.int16).reshape(z, y, x)
+        deltas = ((zigzag.view(np.uint16) >> 1).view(np.int16)) ^ -(zigzag & 1)
+        levels = np.cumsum(deltas, axis=-1, dtype=np.int16)
+        return np.take(decode_table, levels.view(np.uint16))
+
+    def encode_blocks(self, blocks):
+        """Encode blocks concurrently, in order."""
+        return list(self._get_pool().map(self.encode, blocks))
+
+    def decode_blocks(self, data_blocks):
+        """Decode blocks concurrently, in order."""
+        return list(self._get_pool().map(NoiseCodec.decode, data_blocks))
+
+    def _tables(self, data_type):
+        return _lookup_tables(np.dtype(data_type).name, self.gain, self.read_noise,
+                              self.background_offset, self.quant_sigma)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._thread_count)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
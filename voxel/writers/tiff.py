@@ -6,7 +6,7 @@ import os
 import sys
 import tifffile
 from voxel.writers.base import BaseWriter
-from multiprocessing import Process, Array, Value, Event
+from multiprocessing import Process, Array, Value, Event, Pipe
 from multiprocessing.shared_memory import SharedMemory
 from ctypes import c_wchar
 from pathlib import Path
@@ -17,9 +17,26 @@ from math import ceil
 CHUNK_COUNT_PX = 64
 
 COMPRESSION_TYPES = {
-    "none": "none"
+    "none": None,
+    "zstd": "zstd",
+    "deflate": "zlib",
+    "lzw": "lzw"
 }
 
+# Valid compression level range per compression type.
+COMPRESSION_LEVELS = {
+    "zstd": (1, 22),
+    "deflate": (0, 9)
+}
+
+PREDICTOR_TYPES = {
+    "none": None,
+    "horizontal": "horizontal"
+}
+
+# TIFF tile dimensions must be multiples of 16.
+TILE_MULTIPLE_PX = 16
+
 DATA_TYPES = {
     "uint8",
     "uint16"
@@ -37,7 +54,15 @@ class Writer(BaseWriter):
         self._filename = None
         self._acquisition_name = None
         self._data_type = 'uint16'
+        # Frames per chunk, pages are not tied to chunks so any count works.
+        self._chunk_count_px = CHUNK_COUNT_PX
         self._compression = COMPRESSION_TYPES["none"]
+        self._compression_level = None
+        self._predictor = PREDICTOR_TYPES["none"]
+        # None writes untiled pages as strips.
+        self._tile_shape_px = None
+        # Number of threads compressing tiles of a chunk in parallel.
+        self._compression_thread_count = os.cpu_count()
         self._row_count_px = None
         self._colum_count_px = None
         self._frame_count_px = None
@@ -53,6 +78,11 @@ class Writer(BaseWriter):
         self.done_reading = Event()
         self.done_reading.set()  # Set after processing all data in shared mem.
         self.deallocating = Event()
+        # Shared progress of the current tile, written by the writer process.
+        self.progress = Value('d', 0.0)
+        # Pipe carrying the shared memory name of each filled chunk. The
+        # writer process blocks on it instead of polling done_reading.
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
 
     @property
     def signal_progress_percent(self):
@@ -143,7 +173,83 @@ class Writer(BaseWriter):
 
     @property
     def chunk_count_px(self):
-        return CHUNK_COUNT_PX
+        return self._chunk_count_px
+
+    @chunk_count_px.setter
+    def chunk_count_px(self, chunk_count_px: int):
+        if chunk_count_px < 1:
+            raise ValueError("chunk count must be >= 1 [px].")
+        self.log.info(f'setting chunk count to: {chunk_count_px} [px]')
+        self._chunk_count_px = chunk_count_px
+
+    @property
+    def compression(self):
+        return next(key for key, value in COMPRESSION_TYPES.items() if value == self._compression)
+
+    @compression.setter
+    def compression(self, compression: str):
+        valid = list(COMPRESSION_TYPES.keys())
+        if compression not in valid:
+            raise ValueError("compression type must be one of %r." % valid)
+        self.log.info(f'setting compression mode to: {compression}')
+        self._compression = COMPRESSION_TYPES[compression]
+
+    @property
+    def compression_level(self):
+        return self._compression_level
+
+    @compression_level.setter
+    def compression_level(self, compression_level: int):
+        # checked against the compression type in prepare(), so both can be set in any order
+        self.log.info(f'setting compression level to: {compression_level}')
+        self._compression_level = compression_level
+
+    def _check_compression_level(self):
+        if self._compression_level is None:
+            return
+        level_range = COMPRESSION_LEVELS.get(self.compression)
+        if level_range is None:
+            raise ValueError(f"compression level is not supported for {self.compression} compression.")
+        if not level_range[0] <= self._compression_level <= level_range[1]:
+            raise ValueError(f"compression level must be between {level_range[0]} and {level_range[1]}.")
+
+    @property
+    def predictor(self):
+        return next(key for key, value in PREDICTOR_TYPES.items() if value == self._predictor)
+
+    @predictor.setter
+    def predictor(self, predictor: str):
+        valid = list(PREDICTOR_TYPES.keys())
+        if predictor not in valid:
+            raise ValueError("predictor type must be one of %r." % valid)
+        self.log.info(f'setting predictor to: {predictor}')
+        self._predictor = PREDICTOR_TYPES[predictor]
+
+    @property
+    def tile_shape_px(self):
+        return self._tile_shape_px
+
+    @tile_shape_px.setter
+    def tile_shape_px(self, tile_shape_px: tuple):
+        if tile_shape_px is not None:
+            tile_shape_px = tuple(int(size_px) for size_px in tile_shape_px)
+            if len(tile_shape_px) != 2 or any(size_px <= 0 or size_px % TILE_MULTIPLE_PX
+                                              for size_px in tile_shape_px):
+                raise ValueError(f"tile shape must be (rows, columns) "
+                                 f"in multiples of {TILE_MULTIPLE_PX} [px].")
+        self.log.info(f'setting tile shape to: {tile_shape_px} [px]')
+        self._tile_shape_px = tile_shape_px
+
+    @property
+    def compression_thread_count(self):
+        return self._compression_thread_count
+
+    @compression_thread_count.setter
+    def compression_thread_count(self, compression_thread_count: int):
+        if compression_thread_count < 1:
+            raise ValueError("compression thread count must be >= 1.")
+        self.log.info(f'setting compression thread count to: {compression_thread_count}')
+        self._compression_thread_count = compression_thread_count
 
     @property
     def data_type(self):
@@ -200,38 +306,51 @@ class Writer(BaseWriter):
         self._shm_name[len(name)] = '\x00'  # Null terminate the string.
         self.log.info(f'setting shared memory to: {name}')
 
+    def submit_chunk(self, shm_name: str):
+        """Hand a filled chunk in shared memory to the writer process."""
+        self.shm_name = shm_name
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
+
     def prepare(self):
-        self.progress = multiprocessing.Value('d', 0.0)
-        self.p = Process(target=self._run, args=(self.progress,))
+        self._check_compression_level()
+        self.progress.value = 0.0
+        # the writer process is spawned once and reused for every tile
+        self._start_service()
         # Specs for reconstructing the shared memory object.
         self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
         # This is almost always going to be: (chunk_size, rows, columns).
         chunk_shape_map = {'x': self._column_count_px,
            'y': self._row_count_px,
-           'z': CHUNK_COUNT_PX}
+           'z': self._chunk_count_px}
         self.shm_shape = [chunk_shape_map[x] for x in self.chunk_dim_order]
         self.shm_nbytes = \
             int(np.prod(self.shm_shape, dtype=np.int64)*np.dtype(self._data_type).itemsize)
         self.log.info(f"{self._filename}: intializing writer.")
 
+    def _sample_codec(self):
+        """Name and arguments of the codec in compression_estimator.CODECS
+        that matches the configured compression."""
+        if self._compression is None:
+            return 'none', dict()
+        self._check_compression_level()
+        codec_args = {'predictor': self._predictor is not None}
+        if self._compression_level is not None:
+            codec_args['level'] = self._compression_level
+        return self._compression, codec_args
+
     def start(self):
         self.log.info(f"{self._filename}: starting writer.")
-        self.p.start()
+        self._submit_job()
 
-    def _run(self, shared_progress):
+    def _run(self):
         """Loop to wait for data from a specified location and write it to disk
         as an Imaris file. Close up the file afterwards.
 
         This function executes when called with the start() method.
         """
-        # internal logger for process
+        # internal logger for process, configured once in _serve
         logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
-        fmt = '%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s'
-        datefmt = '%Y-%m-%d,%H:%M:%S'
-        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
-        log_handler = logging.StreamHandler(sys.stdout)
-        log_handler.setFormatter(log_formatter)
-        logger.addHandler(log_handler)
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
 
         writer = tifffile.TiffWriter(filepath,
@@ -257,44 +376,62 @@ class Writer(BaseWriter):
             }
         }
 
-        chunk_total = ceil(self._frame_count_px_px/CHUNK_COUNT_PX)
+        # Compression options. Each frame is one page, split into tiles if a
+        # tile shape is set. tifffile compresses the tiles or strips of every
+        # chunk on a pool of compression threads.
+        compression_args = {
+            'compression': self._compression,
+            'tile': self._tile_shape_px,
+            'maxworkers': self._compression_thread_count
+        }
+        if self._compression is not None:
+            compression_args['predictor'] = self._predictor
+            if self._compression_level is not None:
+                compression_args['compressionargs'] = {'level': self._compression_level}
+
+        chunk_total = ceil(self._frame_count_px_px/self._chunk_count_px)
         for chunk_num in range(chunk_total):
-            # Wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # Attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=self.shm_nbytes)
+            # Block until the next chunk is handed off.
+            wait_start_time = perf_counter()
+            shm_name = self._receive_chunk()
+            # Each shared memory segment is attached only once per process.
+            shm = self._attach_shm(shm_name)
             frames = np.ndarray(self.shm_shape, self._data_type, buffer=shm.buf)
             logger.warning(f"{self._filename}: writing chunk "
                   f"{chunk_num+1}/{chunk_total} of size {frames.shape}.")
             start_time = perf_counter()
-            writer.write(data=frames, metadata=metadata, compression=self._compression)
+            writer.write(data=frames, metadata=metadata, **compression_args)
             frames = None
             logger.warning(f"{self._filename}: writing chunk took "
                   f"{perf_counter() - start_time:.3f} [s]")
-            shm.close()
             self.done_reading.set()
-            shared_progress.value = (chunk_num+1)/chunk_total
+            self._write_state.record_chunk(self.shm_nbytes, start_time - wait_start_time,
+                                           perf_counter() - start_time, self._output_nbytes())
+            self.progress.value = (chunk_num+1)/chunk_total
 
         # Wait for file writing to finish.
-        if shared_progress.value < 1.0:
+        if self.progress.value < 1.0:
             logger.warning(f"{self._filename}: waiting for data writing to complete for "
                   f"{self._filename}. "
-                  f"current progress is {100*shared_progress.value:.1f}%.")
-        while shared_progress.value < 1.0:
+                  f"current progress is {100*self.progress.value:.1f}%.")
+        while self.progress.value < 1.0:
             sleep(0.5)
             logger.warning(f"{self._filename}: waiting for data writing to complete for "
                   f"{self._filename}. "
-                  f"current progress is {100*shared_progress.value:.1f}%.")
+                  f"current progress is {100*self.progress.value:.1f}%.")
 
         writer.close()
 
     def wait_to_finish(self):
         self.log.info(f"{self._filename}: waiting to finish.")
-        self.p.join()
+        self._wait_for_tile()
         # log the finished writer %
         self.signal_progress_percent
 
+    def close(self):
+        self.log.info(f"{self._filename}: closing writer process.")
+        self._stop_service()
+
     def delete_files(self):
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
         os.remove(filepath)
\ No newline at end of file
@@ -0,0 +1,585 @@
+import numpy as np
+import logging
+import json
+import os
+import shutil
+import tensorstore as ts
+from voxel.writers.base import BaseWriter
+from voxel.writers.blank_blocks import elide_blank_blocks, threshold_image
+from voxel.processes.cpu.pyramid import Pyramid
+from multiprocessing import Array, Value, Event, Pipe
+from ctypes import c_wchar
+from pathlib import Path
+from time import perf_counter
+from math import ceil
+
+CHUNK_COUNT_PX = 64
+# Smallest x/y size of the lowest pyramid level.
+MIN_LEVEL_SIZE_PX = 64
+# Chunks whose writes may still be committing before the next one is accepted.
+MAX_PENDING_CHUNK_COUNT = 2
+
+# Blosc compressors. Compressed chunks are stored as blosc frames.
+COMPRESSION_TYPES = {
+    "none": None,
+    "lz4": "lz4",
+    "lz4hc": "lz4hc",
+    "zstd": "zstd",
+    "blosclz": "blosclz",
+    "zlib": "zlib"
+}
+
+SHUFFLE_TYPES = {
+    "none": "noshuffle",
+    "shuffle": "shuffle",
+    "bitshuffle": "bitshuffle"
+}
+
+# Blosc shuffle ids used by the zarr v2 compressor metadata.
+V2_SHUFFLE_IDS = {
+    "noshuffle": 0,
+    "shuffle": 1,
+    "bitshuffle": 2
+}
+
+DOWNSAMPLE_METHODS = {
+    "mean": "mean",
+    "max": "max"
+}
+
+ZARR_VERSIONS = {
+    2: "zarr",
+    3: "zarr3"
+}
+
+DATA_TYPES = [
+    "uint8",
+    "uint16"
+]
+
+
+class Writer(BaseWriter):
+
+    def __init__(self, path: str):
+
+        super().__init__()
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._path = Path(path)
+        self._color = None
+        self._channel = None
+        self._filename = None
+        self._acquisition_name = None
+        self._data_type = 'uint16'
+        self._compression = COMPRESSION_TYPES["none"]
+        self._compression_level = 5
+        self._shuffle = SHUFFLE_TYPES["shuffle"]
+        self._downsample_method = DOWNSAMPLE_METHODS["mean"]
+        self._zarr_version = 3
+        # Inner chunk shape (z, y, x). In zarr v3 these chunks are packed into
+        # one shard per handed off chunk of frames.
+        self._chunk_shape_px = (CHUNK_COUNT_PX, 256, 256)
+        # Number of threads copying, compressing and writing chunks.
+        self._compression_thread_count = os.cpu_count()
+        # Inner chunks with no pixel above the blank threshold are stored as
+        # the fill value, which takes no space. The threshold is in counts, or
+        # counts above the background image if a background path is set.
+        # None stores every chunk.
+        self._blank_threshold = None
+        self._blank_background_path = None
+        self._row_count_px = None
+        self._column_count_px = None
+        self._frame_count_px = None
+        self._x_voxel_size_um = 1
+        self._y_voxel_size_um = 1
+        self._z_voxel_size_um = 1
+        self._x_position_mm = 0
+        self._y_position_mm = 0
+        self._z_position_mm = 0
+        # Opinioated decision on chunking dimension order
+        self.chunk_dim_order = ('z', 'y', 'x')
+        # Flow control attributes to synchronize inter-process communication.
+        self.done_reading = Event()
+        self.done_reading.set()  # Set after processing all data in shared mem.
+        self.deallocating = Event()
+        # Shared progress of the current tile, written by the writer process.
+        self.progress = Value('d', 0.0)
+        # Pipe carrying the shared memory name of each filled chunk. The
+        # writer process blocks on it instead of polling done_reading.
+        self._chunk_receiver, self._chunk_sender = Pipe(duplex=False)
+
+    @property
+    def signal_progress_percent(self):
+        # convert to %
+        state = {'Progress [%]': self.progress.value*100}
+        return state
+
+    @property
+    def x_voxel_size_um(self):
+        return self._x_voxel_size_um
+
+    @x_voxel_size_um.setter
+    def x_voxel_size_um(self, x_voxel_size_um: float):
+        self.log.info(f'setting x voxel size to: {x_voxel_size_um} [um]')
+        self._x_voxel_size_um = x_voxel_size_um
+
+    @property
+    def y_voxel_size_um(self):
+        return self._y_voxel_size_um
+
+    @y_voxel_size_um.setter
+    def y_voxel_size_um(self, y_voxel_size_um: float):
+        self.log.info(f'setting y voxel size to: {y_voxel_size_um} [um]')
+        self._y_voxel_size_um = y_voxel_size_um
+
+    @property
+    def z_voxel_size_um(self):
+        return self._z_voxel_size_um
+
+    @z_voxel_size_um.setter
+    def z_voxel_size_um(self, z_voxel_size_um: float):
+        self.log.info(f'setting z voxel size to: {z_voxel_size_um} [um]')
+        self._z_voxel_size_um = z_voxel_size_um
+
+    @property
+    def x_position_mm(self):
+        return self._x_position_mm
+
+    @x_position_mm.setter
+    def x_position_mm(self, x_position_mm: float):
+        self.log.info(f'setting x position to: {x_position_mm} [mm]')
+        self._x_position_mm = x_position_mm
+
+    @property
+    def y_position_mm(self):
+        return self._y_position_mm
+
+    @y_position_mm.setter
+    def y_position_mm(self, y_position_mm: float):
+        self.log.info(f'setting y position to: {y_position_mm} [mm]')
+        self._y_position_mm = y_position_mm
+
+    @property
+    def z_position_mm(self):
+        return self._z_position_mm
+
+    @z_position_mm.setter
+    def z_position_mm(self, z_position_mm: float):
+        self.log.info(f'setting z position to: {z_position_mm} [mm]')
+        self._z_position_mm = z_position_mm
+
+    @property
+    def frame_count_px(self):
+        return self._frame_count_px
+
+    @frame_count_px.setter
+    def frame_count_px(self, frame_count_px: int):
+        self.log.info(f'setting frame count to: {frame_count_px} [px]')
+        self._frame_count_px = frame_count_px
+
+    @property
+    def column_count_px(self):
+        return self._column_count_px
+
+    @column_count_px.setter
+    def column_count_px(self, column_count_px: int):
+        self.log.info(f'setting column count to: {column_count_px} [px]')
+        self._column_count_px = column_count_px
+
+    @property
+    def row_count_px(self):
+        return self._row_count_px
+
+    @row_count_px.setter
+    def row_count_px(self, row_count_px: int):
+        self.log.info(f'setting row count to: {row_count_px} [px]')
+        self._row_count_px = row_count_px
+
+    @property
+    def chunk_count_px(self):
+        return CHUNK_COUNT_PX
+
+    @property
+    def chunk_shape_px(self):
+        return self._chunk_shape_px
+
+    @chunk_shape_px.setter
+    def chunk_shape_px(self, chunk_shape_px: tuple):
+        chunk_shape_px = tuple(int(size_px) for size_px in chunk_shape_px)
+        if len(chunk_shape_px) != 3 or any(size_px <= 0 for size_px in chunk_shape_px):
+            raise ValueError("chunk shape must be positive (z, y, x) [px].")
+        if CHUNK_COUNT_PX % chunk_shape_px[0]:
+            raise ValueError(f"chunk z size must divide the chunk count of {CHUNK_COUNT_PX} [px].")
+        self.log.info(f'setting chunk shape to: {chunk_shape_px} [px]')
+        self._chunk_shape_px = chunk_shape_px
+
+    @property
+    def compression(self):
+        return next(key for key, value in COMPRESSION_TYPES.items() if value == self._compression)
+
+    @compression.setter
+    def compression(self, compression: str):
+        valid = list(COMPRESSION_TYPES.keys())
+        if compression not in valid:
+            raise ValueError("compression type must be one of %r." % valid)
+        self.log.info(f'setting compression mode to: {compression}')
+        self._compression = COMPRESSION_TYPES[compression]
+
+    @property
+    def compression_level(self):
+        return self._compression_level
+
+    @compression_level.setter
+    def compression_level(self, compression_level: int):
+        if not 0 <= compression_level <= 9:
+            raise ValueError("compression level must be between 0 and 9.")
+        self.log.info(f'setting compression level to: {compression_level}')
+        self._compression_level = compression_level
+
+    @property
+    def shuffle(self):
+        return next(key for key, value in SHUFFLE_TYPES.items() if value == self._shuffle)
+
+    @shuffle.setter
+    def shuffle(self, shuffle: str):
+        valid = list(SHUFFLE_TYPES.keys())
+        if shuffle not in valid:
+            raise ValueError("shuffle type must be one of %r." % valid)
+        self.log.info(f'setting shuffle mode to: {shuffle}')
+        self._shuffle = SHUFFLE_TYPES[shuffle]
+
+    @property
+    def downsample_method(self):
+        return next(key for key, value in DOWNSAMPLE_METHODS.items() if value == self._downsample_method)
+
+    @downsample_method.setter
+    def downsample_method(self, downsample_method: str):
+        valid = list(DOWNSAMPLE_METHODS.keys())
+        if downsample_method not in valid:
+            raise ValueError("downsample method must be one of %r." % valid)
+        self.log.info(f'setting downsample method to: {downsample_method}')
+        self._downsample_method = DOWNSAMPLE_METHODS[downsample_method]
+
+    @property
+    def zarr_version(self):
+        return self._zarr_version
+
+    @zarr_version.setter
+    def zarr_version(self, zarr_version: int):
+        valid = list(ZARR_VERSIONS.keys())
+        if zarr_version not in valid:
+            raise ValueError("zarr version must be one of %r." % valid)
+        self.log.info(f'setting zarr version to: {zarr_version}')
+        self._zarr_version = zarr_version
+
+    @property
+    def compression_thread_count(self):
+        return self._compression_thread_count
+
+    @compression_thread_count.setter
+    def compression_thread_count(self, compression_thread_count: int):
+        if compression_thread_count < 1:
+            raise ValueError("compression thread count must be >= 1.")
+        self.log.info(f'setting compression thread count to: {compression_thread_count}')
+        self._compression_thread_count = compression_thread_count
+
+    @property
+    def blank_threshold(self):
+        return self._blank_threshold
+
+    @blank_threshold.setter
+    def blank_threshold(self, blank_threshold: int):
+        if blank_threshold is not None and blank_threshold < 0:
+            raise ValueError("blank threshold must be >= 0.")
+        self.log.info(f'setting blank threshold to: {blank_threshold}')
+        self._blank_threshold = blank_threshold
+
+    @property
+    def blank_background_path(self):
+        return self._blank_background_path
+
+    @blank_background_path.setter
+    def blank_background_path(self, blank_background_path: str):
+        self._blank_background_path = None if blank_background_path is None else Path(blank_background_path)
+        self.log.info(f'setting blank background path to: {blank_background_path}')
+
+    @property
+    def data_type(self):
+        return self._data_type
+
+    @data_type.setter
+    def data_type(self, data_type: np.unsignedinteger):
+        self.log.info(f'setting data type to: {data_type}')
+        self._data_type = data_type
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def acquisition_name(self):
+        return self._acquisition_name
+
+    @acquisition_name.setter
+    def acquisition_name(self, acquisition_name: str):
+        self._acquisition_name = Path(acquisition_name)
+        self.log.info(f'setting acquisition name to: {acquisition_name}')
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename: str):
+        self._filename = filename \
+            if filename.endswith(".zarr") else f"{filename}.zarr"
+        self.log.info(f'setting filename to: {filename}')
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @channel.setter
+    def channel(self, channel: str):
+        self.log.info(f'setting channel name to: {channel}')
+        self._channel = channel
+
+    @property
+    def shm_name(self):
+        """Convenience getter to extract the shared memory address (string)
+        from the c array."""
+        return str(self._shm_name[:]).split('\x00')[0]
+
+    @shm_name.setter
+    def shm_name(self, name: str):
+        """Convenience setter to set the string value within the c array."""
+        for i, c in enumerate(name):
+            self._shm_name[i] = c
+        self._shm_name[len(name)] = '\x00'  # Null terminate the string.
+        self.log.info(f'setting shared memory to: {name}')
+
+    def submit_chunk(self, shm_name: str):
+        """Hand a filled chunk in shared memory to the writer process."""
+        self.shm_name = shm_name
+        self.done_reading.clear()
+        self._chunk_sender.send(shm_name)
+
+    def prepare(self):
+        self.progress.value = 0.0
+        # the writer process is spawned once and reused for every tile
+        self._start_service()
+        # Specs for reconstructing the shared memory object.
+        self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
+        # This is almost always going to be: (chunk_size, rows, columns).
+        chunk_shape_map = {'x': self._column_count_px,
+           'y': self._row_count_px,
+           'z': CHUNK_COUNT_PX}
+        self.shm_shape = [chunk_shape_map[x] for x in self.chunk_dim_order]
+        self.shm_nbytes = \
+            int(np.prod(self.shm_shape, dtype=np.int64)*np.dtype(self._data_type).itemsize)
+        self._blank_threshold_px = self._blank_threshold
+        if self._blank_threshold is not None and self._blank_background_path is not None:
+            self._blank_threshold_px = threshold_image(self._blank_background_path, self._blank_threshold,
+                                                       self._data_type)
+            if self._blank_threshold_px.shape != (self._row_count_px, self._column_count_px):
+                raise ValueError(f"background image shape {self._blank_threshold_px.shape} does not match "
+                                 f"the frame shape {(self._row_count_px, self._column_count_px)}.")
+        self.log.info(f"{self._filename}: intializing writer.")
+
+    def _sample_codec(self):
+        """Name and arguments of the codec in compression_estimator.CODECS
+        that matches the configured compression."""
+        if self._compression is None:
+            return 'none', dict()
+        return 'blosc', {'compressor': self._compression,
+                         'level': self._compression_level,
+                         'shuffle': V2_SHUFFLE_IDS[self._shuffle]}
+
+    def start(self):
+        self.log.info(f"{self._filename}: starting writer.")
+        self._submit_job()
+
+    def _level_count(self):
+        """Number of pyramid levels, each downsampled 2x in z, y and x. Every
+        level fits a whole number of planes into one chunk of frames, so each
+        chunk fills whole shards at every level."""
+        level_count = 1
+        while min(self._row_count_px, self._column_count_px) // 2**level_count >= MIN_LEVEL_SIZE_PX \
+                and 2**level_count <= CHUNK_COUNT_PX:
+            level_count += 1
+        return level_count
+
+    def _level_spec(self, level: int):
+        """tensorstore spec of one pyramid level."""
+        factor = 2**level
+        shape = [ceil(self._frame_count_px/factor),
+                 ceil(self._row_count_px/factor),
+                 ceil(self._column_count_px/factor)]
+        # one chunk of frames at this level, split into inner chunks
+        shard_z = CHUNK_COUNT_PX // factor
+        chunk_shape = [min(self._chunk_shape_px[0], shard_z),
+                       min(self._chunk_shape_px[1], shape[1]),
+                       min(self._chunk_shape_px[2], shape[2])]
+        kvstore = {'driver': 'file',
+                   'path': str(Path(self._path, self._acquisition_name, self._filename, str(level)).absolute())}
+        if self._zarr_version == 2:
+            compressor = None
+            if self._compression is not None:
+                compressor = {'id': 'blosc',
+                              'cname': self._compression,
+                              'clevel': self._compression_level,
+                              'shuffle': V2_SHUFFLE_IDS[self._shuffle]}
+            metadata = {'shape': shape,
+                        'chunks': chunk_shape,
+                        'dtype': np.dtype(self._data_type).str,
+                        'compressor': compressor,
+                        'dimension_separator': '/'}
+        else:
+            codecs = [{'name': 'bytes', 'configuration': {'endian': 'little'}}]
+            if self._compression is not None:
+                codecs.append({'name': 'blosc',
+                               'configuration': {'cname': self._compression,
+                                                 'clevel': self._compression_level,
+                                                 'shuffle': self._shuffle,
+                                                 'typesize': np.dtype(self._data_type).itemsize}})
+            # one shard holds a whole chunk of frames, so every handed off
+            # chunk is written as complete shards without read-modify-write
+            shard_shape = [shard_z,
+                           ceil(shape[1]/chunk_shape[1])*chunk_shape[1],
+                           ceil(shape[2]/chunk_shape[2])*chunk_shape[2]]
+            metadata = {'shape': shape,
+                        'data_type': np.dtype(self._data_type).name,
+                        'chunk_grid': {'name': 'regular',
+                                       'configuration': {'chunk_shape': shard_shape}},
+                        'codecs': [{'name': 'sharding_indexed',
+                                    'configuration': {'chunk_shape': chunk_shape,
+                                                      'codecs': codecs,
+                                                      'index_codecs': [
+                                                          {'name': 'bytes', 'configuration': {'endian': 'little'}},
+                                                          {'name': 'crc32c'}]}}],
+                        'dimension_names': list(self.chunk_dim_order)}
+        return {'driver': ZARR_VERSIONS[self._zarr_version],
+                'kvstore': kvstore,
+                'metadata': metadata,
+                'create': True,
+                'delete_existing': True}
+
+    def _write_multiscales(self, level_count: int):
+        """Write the OME-NGFF multiscales group metadata of the tile."""
+        voxel_size_um = [self._z_voxel_size_um, self._y_voxel_size_um, self._x_voxel_size_um]
+        position_um = [self._z_position_mm*1000, self._y_position_mm*1000, self._x_position_mm*1000]
+        datasets = list()
+        for level in range(level_count):
+            factor = 2**level
+            # mean downsampling moves voxel centers by half of the new voxel size
+            translation = [position + (factor - 1)*size/2 for position, size in zip(position_um, voxel_size_um)]
+            datasets.append({'path': str(level),
+                             'coordinateTransformations': [
+                                 {'type': 'scale', 'scale': [size*factor for size in voxel_size_um]},
+                                 {'type': 'translation', 'translation': translation}]})
+        multiscales = [{'axes': [{'name': axis, 'type': 'space', 'unit': 'micrometer'}
+                                 for axis in self.chunk_dim_order],
+                        'datasets': datasets,
+                        'name': str(self._channel),
+                        'type': self._downsample_method}]
+        group_path = Path(self._path, self._acquisition_name, self._filename).absolute()
+        if self._zarr_version == 2:
+            multiscales[0]['version'] = '0.4'
+            with open(Path(group_path, '.zgroup'), 'w') as f:
+                json.dump({'zarr_format': 2}, f, indent=2)
+            with open(Path(group_path, '.zattrs'), 'w') as f:
+                json.dump({'multiscales': multiscales}, f, indent=2)
+        else:
+            with open(Path(group_path, 'zarr.json'), 'w') as f:
+                json.dump({'zarr_format': 3,
+                           'node_type': 'group',
+                           'attributes': {'ome': {'version': '0.5', 'multiscales': multiscales}}}, f, indent=2)
+
+    def _run(self):
+        """Loop to wait for data from a specified location and write it to disk
+        as an OME-Zarr file. Close up the file afterwards.
+
+        This function executes when called with the start() method.
+        """
+        # internal logger for process, configured once in _serve
+        logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+        # copying, compressing and file writing run concurrently on these pools
+        context = ts.Context({'data_copy_concurrency': {'limit': self._compression_thread_count},
+                              'file_io_concurrency': {'limit': self._compression_thread_count}})
+        level_count = self._level_count()
+        levels = [ts.open(self._level_spec(level), context=context).result()
+                  for level in range(level_count)]
+        self._write_multiscales(level_count)
+        pyramid = Pyramid(factors=((2, 2, 2),)*(level_count - 1),
+                          method=self._downsample_method,
+                          thread_count=self._compression_thread_count)
+
+        # commit futures of the chunks that are still being written
+        pending_commits = list()
+        frame_nbytes = self._row_count_px*self._column_count_px*np.dtype(self._data_type).itemsize
+        inner_chunk_shape = tuple(levels[0].chunk_layout.read_chunk.shape)
+        chunk_total = ceil(self._frame_count_px/CHUNK_COUNT_PX)
+        for chunk_num in range(chunk_total):
+            # Block until the next chunk is handed off.
+            wait_start_time = perf_counter()
+            shm_name = self._receive_chunk()
+            # Each shared memory segment is attached only once per process.
+            shm = self._attach_shm(shm_name)
+            frames = np.ndarray(self.shm_shape, self._data_type, buffer=shm.buf)
+            # the last chunk may only be partially filled
+            frame_count = min(CHUNK_COUNT_PX, self._frame_count_px - chunk_num*CHUNK_COUNT_PX)
+            logger.warning(f"{self._filename}: writing chunk "
+                  f"{chunk_num+1}/{chunk_total} of size {frames.shape}.")
+            start_time = perf_counter()
+            # blank chunks equal the fill value, so tensorstore does not
+            # store them, at any level of the pyramid
+            chunk_frames, elided_nbytes = elide_blank_blocks(frames[:frame_count], inner_chunk_shape,
+                                                             self._blank_threshold_px)
+            level_updates = [(0, (chunk_num*CHUNK_COUNT_PX, chunk_frames))]
+            level_updates += list(enumerate(pyramid.push(chunk_frames), start=1))
+            if chunk_num == chunk_total - 1:
+                # the last planes of each level are reduced from partial blocks
+                level_updates += list(enumerate(pyramid.flush(), start=1))
+            writes = list()
+            for level, (z_start, level_frames) in level_updates:
+                if level_frames.shape[0]:
+                    writes.append(levels[level][z_start:z_start + level_frames.shape[0]].write(level_frames))
+            # the shared memory can be reused as soon as every level is copied
+            for write in writes:
+                write.copy.result()
+            frames = None
+            chunk_frames = None
+            level_updates = None
+            self.done_reading.set()
+            pending_commits.append([write.commit for write in writes])
+            # bound the number of chunks held in memory while committing
+            while len(pending_commits) > MAX_PENDING_CHUNK_COUNT:
+                for commit in pending_commits.pop(0):
+                    commit.result()
+            # sizing the directory tree costs more with every shard written,
+            # so the output is only counted when the tile finishes
+            self._write_state.record_chunk(frame_count*frame_nbytes, start_time - wait_start_time,
+                                           perf_counter() - start_time, None, elided_nbytes)
+            logger.warning(f"{self._filename}: writing chunk took "
+                  f"{perf_counter() - start_time:.3f} [s]")
+            self.progress.value = (chunk_num+1)/chunk_total
+
+        # Wait for file writing to finish.
+        for commits in pending_commits:
+            for commit in commits:
+                commit.result()
+        pyramid.close()
+
+    def wait_to_finish(self):
+        self.log.info(f"{self._filename}: waiting to finish.")
+        self._wait_for_tile()
+        # log the finished writer %
+        self.signal_progress_percent
+
+    def close(self):
+        self.log.info(f"{self._filename}: closing writer process.")
+        self._stop_service()
+
+    def delete_files(self):
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        shutil.rmtree(filepath)